@@ -0,0 +1,5 @@
+# -*- coding: UTF-8 -*-
+"""
+Benchmarks for the vLab Avamar worker, run against an in-process fake vCenter,
+and load tests for the API.
+"""
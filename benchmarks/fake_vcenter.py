@@ -0,0 +1,1104 @@
+# -*- coding: UTF-8 -*-
+"""
+An in-process fake of vCenter, for benchmarking the worker without a lab.
+
+The fake sits underneath pyVmomi: every method call and property read made on
+a ``vim`` object ends up in ``FakeStub.InvokeMethod`` or ``FakeStub.InvokeAccessor``,
+which is exactly where a real ``SoapStubAdapter`` would make an HTTP request.
+That means the worker code (and vlab_inf_common) runs unmodified, and every
+SOAP round trip it would make against a real vCenter gets counted.
+
+The inventory is modeled on a vLab deployment::
+
+    Datacenter
+      vm/<INF_VCENTER_TOP_LVL_DIR>/<username>/<VMs>
+      host/cluster/<ESXi hosts> + Resources
+      datastore/<datastores>
+      network/<username>_frontend
+
+Each call waits ``latency`` seconds (real time), and the PropertyCollector also
+waits ``object_latency`` per object returned. Tasks, import leases and booting
+VMs take "vCenter seconds" (see ``DURATIONS``), which are compressed by
+``time_scale``; ``Simulator.installed`` scales the ``time.sleep`` calls made by
+the worker to match, so a 300 second boot wait costs 300ms at the default scale.
+"""
+import os
+import re
+import ssl
+import time
+import random
+import shutil
+import datetime
+import tempfile
+import threading
+import itertools
+import importlib
+from collections import Counter, deque
+from contextlib import contextmanager, ExitStack
+from unittest.mock import patch
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import ujson
+from pyVmomi import vim, vmodl
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from vlab_inf_common.vmware import vCenter, virtual_machine
+
+from vlab_avamar_api.lib import const
+from vlab_avamar_api.lib.worker import vmware
+
+
+# How many vCenter seconds things take; scaled by Simulator.time_scale
+DURATIONS = {'PowerOnVM_Task': 5,
+             'PowerOffVM_Task': 3,
+             'ResetVM_Task': 5,
+             'Destroy_Task': 8,
+             'ReconfigVM_Task': 2,
+             'CustomizeVM_Task': 4,
+             'CreateSnapshot_Task': 20,
+             'RevertToSnapshot_Task': 15,
+             # A full clone within one datastore
+             'CloneVM_Task': 30,
+             'SuspendVM_Task': 10,
+             'lease': 5,
+             'boot': 60,
+             # Until the guest reports its IP again, after a suspend
+             'resume': 8}
+# Maps a vimtype to the prefix of its MoRef ID, like a real vCenter
+PREFIXES = {vim.Folder: 'group-',
+            vim.Datacenter: 'datacenter-',
+            vim.ClusterComputeResource: 'domain-c',
+            vim.ResourcePool: 'resgroup-',
+            vim.HostSystem: 'host-',
+            vim.Datastore: 'datastore-',
+            vim.Network: 'network-',
+            vim.VirtualMachine: 'vm-',
+            vim.vm.Snapshot: 'snapshot-',
+            vim.Task: 'task-',
+            vim.HttpNfcLease: 'lease-',
+            vim.view.ContainerView: 'view-',
+            vmodl.query.PropertyCollector: 'collector-',
+            vmodl.query.PropertyCollector.Filter: 'filter-'}
+# The objects behind ServiceInstanceContent; (vimtype, MoRef ID, attribute of the content)
+SINGLETONS = [(vim.ServiceInstance, 'ServiceInstance', None),
+              (vmodl.query.PropertyCollector, 'propertyCollector', 'propertyCollector'),
+              (vim.view.ViewManager, 'ViewManager', 'viewManager'),
+              (vim.SearchIndex, 'SearchIndex', 'searchIndex'),
+              (vim.OvfManager, 'OvfManager', 'ovfManager'),
+              (vim.SessionManager, 'SessionManager', 'sessionManager'),
+              (vim.option.OptionManager, 'VpxSettings', 'setting'),
+              (vim.CustomizationSpecManager, 'CustomizationSpecManager', 'customizationSpecManager'),
+              (vim.PerformanceManager, 'PerfMgr', 'perfManager')]
+# The key of the net.usage.average counter, like on a real vCenter
+NET_USAGE_COUNTER = 143
+GB = 1024**3
+
+
+class Entity(object):
+    """One managed object within the fake inventory.
+
+    :param vimtype: The kind of object, like vim.VirtualMachine
+    :type vimtype: pyVmomi.VmomiSupport.LazyType
+
+    :param moid: The MoRef ID of the object
+    :type moid: String
+
+    :param props: The state of the object
+    :type props: Dictionary
+    """
+    def __init__(self, vimtype, moid, **props):
+        self.vimtype = vimtype
+        self.moid = moid
+        self.props = props
+
+    def __repr__(self):
+        return '<Entity {}:{} {}>'.format(self.vimtype.__name__, self.moid, self.props.get('name'))
+
+
+class Inventory(object):
+    """The objects of one fake vCenter server"""
+    def __init__(self):
+        self.entities = {}
+        self._ids = itertools.count(1)
+        self.root = None
+        self.top_dir = None
+        for vimtype, moid, _ in SINGLETONS:
+            self.entities[moid] = Entity(vimtype, moid)
+
+    def add(self, vimtype, name=None, parent=None, **props):
+        """Create an object, and make it a child of ``parent`` if that's a folder.
+
+        :Returns: Entity
+        """
+        entity = Entity(vimtype, '{}{}'.format(PREFIXES[vimtype], next(self._ids)), name=name, parent=parent, **props)
+        self.entities[entity.moid] = entity
+        if parent is not None and parent.vimtype is vim.Folder:
+            parent.props['childEntity'].append(entity)
+        return entity
+
+    def folder(self, name, parent=None):
+        """Create a folder.
+
+        :Returns: Entity
+        """
+        return self.add(vim.Folder, name=name, parent=parent, childEntity=[])
+
+    def remove(self, entity):
+        """Delete an object, and every reference to it.
+
+        :Returns: None
+        """
+        self.entities.pop(entity.moid, None)
+        parent = entity.props.get('parent')
+        if parent is not None and entity in parent.props.get('childEntity', []):
+            parent.props['childEntity'].remove(entity)
+        for network in entity.props.get('network', []):
+            if entity in network.props['vm']:
+                network.props['vm'].remove(entity)
+        for snapshot in entity.props.get('snapshots', []):
+            self.entities.pop(snapshot.moid, None)
+
+    def children(self, entity):
+        """The objects directly below an object, as a ContainerView sees them.
+
+        :Returns: List
+        """
+        if entity.vimtype is vim.Folder:
+            return list(entity.props['childEntity'])
+        elif entity.vimtype is vim.Datacenter:
+            return [entity.props[x] for x in ('vmFolder', 'hostFolder', 'datastoreFolder', 'networkFolder')]
+        elif entity.vimtype is vim.ClusterComputeResource:
+            return entity.props['host'] + [entity.props['resourcePool']]
+        return []
+
+    def descendants(self, entity):
+        """Every object below an object.
+
+        :Returns: List
+        """
+        found = []
+        pending = deque(self.children(entity))
+        while pending:
+            child = pending.popleft()
+            found.append(child)
+            pending.extend(self.children(child))
+        return found
+
+
+def build_inventory(users, vms_per_user, hosts, datastores, seed):
+    """Create the inventory of a vLab vCenter.
+
+    Every user gets a folder with ``vms_per_user`` VMs, most of which are Avamar
+    servers (with a reset snapshot), plus an NDMP accelerator and some other
+    component. Creating the same inventory twice yields the same MoRef IDs.
+
+    :Returns: Inventory
+
+    :param users: The names of the users that have VMs on this vCenter
+    :type users: List
+
+    :param vms_per_user: How many VMs each user has
+    :type vms_per_user: Integer
+
+    :param hosts: How many ESXi hosts are in the cluster
+    :type hosts: Integer
+
+    :param datastores: The names of the datastores
+    :type datastores: List
+
+    :param seed: Makes the random parts of the inventory repeatable
+    :type seed: Integer
+    """
+    rng = random.Random(seed)
+    now = time.time()
+    inv = Inventory()
+    root = inv.folder('Datacenters')
+    inv.root = root
+    dc = inv.add(vim.Datacenter, name='Datacenter', parent=root,
+                 vmFolder=inv.folder('vm'), hostFolder=inv.folder('host'),
+                 datastoreFolder=inv.folder('datastore'), networkFolder=inv.folder('network'))
+    for sub_folder in ('vmFolder', 'hostFolder', 'datastoreFolder', 'networkFolder'):
+        dc.props[sub_folder].props['parent'] = dc
+    the_datastores = []
+    for name in datastores:
+        the_datastores.append(inv.add(vim.Datastore, name=name, parent=dc.props['datastoreFolder'],
+                                      freeSpace=rng.randint(2000, 20000) * GB, capacity=40000 * GB, accessible=True))
+    the_hosts = []
+    for index in range(hosts):
+        the_hosts.append(inv.add(vim.HostSystem, name='esxi-{}.vlab.local'.format(index + 1),
+                                 datastore=list(the_datastores), inMaintenanceMode=False,
+                                 connectionState='connected', memorySize=512 * GB,
+                                 memoryUsage=rng.randint(64, 384) * 1024))
+    cluster = inv.add(vim.ClusterComputeResource, name='cluster', parent=dc.props['hostFolder'], host=the_hosts)
+    pool = inv.add(vim.ResourcePool, name=const.INF_VCENTER_RESORUCE_POOL, parent=cluster)
+    cluster.props['resourcePool'] = pool
+    for host in the_hosts:
+        host.props['parent'] = cluster
+    top_dir = dc.props['vmFolder']
+    for name in const.INF_VCENTER_TOP_LVL_DIR.strip('/').split('/'):
+        top_dir = inv.folder(name, parent=top_dir)
+    inv.top_dir = top_dir
+    for username in users:
+        folder = inv.folder(username, parent=top_dir)
+        network = inv.add(vim.Network, name='{}_frontend'.format(username), parent=dc.props['networkFolder'], vm=[])
+        for index in range(vms_per_user):
+            if index == 1:
+                component, prefix = 'AvamarNDMP', 'ndmp'
+            elif index == 2:
+                component, prefix = 'OneFS', 'isi'
+            else:
+                component, prefix = 'Avamar', 'ave'
+            meta = {'component': component,
+                    'created': now - rng.randint(3600, 30 * 24 * 3600),
+                    'version': '19.{}'.format(rng.randint(1, 4)),
+                    'configured': True,
+                    'generation': 1}
+            powered_on = rng.random() < 0.8
+            the_vm = inv.add(vim.VirtualMachine, name='{}-{}{}'.format(username, prefix, index), parent=folder,
+                             powerState='poweredOn' if powered_on else 'poweredOff', bootedAt=0,
+                             ip='10.{}.{}.{}'.format(rng.randint(0, 255), rng.randint(0, 255), rng.randint(2, 254)),
+                             annotation=ujson.dumps(meta), committed=rng.randint(20, 300) * GB,
+                             cpuUsage=rng.randint(0, 4000) if powered_on else 0, disks=3,
+                             network=[network], snapshots=[], datastore=rng.choice(the_datastores))
+            # Derived, so the random inventory is the same as before network usage was simulated
+            the_vm.props['netUsage'] = the_vm.props['cpuUsage'] // 8
+            network.props['vm'].append(the_vm)
+            if component == 'Avamar':
+                timings = {'create_seconds': rng.randint(1800, 3600), 'boot_seconds': rng.randint(600, 1200)}
+                the_vm.props['snapshots'].append(inv.add(vim.vm.Snapshot, name=vmware.RESET_SNAPSHOT, vm=the_vm,
+                                                         description=ujson.dumps(timings), memory=True))
+    return inv
+
+
+class Server(object):
+    """One fake vCenter server: its inventory, plus the in-flight tasks and sessions.
+
+    :param name: The host name of the vCenter server
+    :type name: String
+
+    :param users: The users whose VMs live on this server
+    :type users: List
+    """
+    def __init__(self, name, users):
+        self.name = name
+        self.users = users
+        self.lock = threading.RLock()
+        self.inventory = None
+        self.tasks = []
+        self.tokens = {}
+        self.imports = {}
+
+
+class Simulator(object):
+    """A set of fake vCenter servers (one per shard), plus the HTTPS server the
+    OVA disks get uploaded to.
+
+    :param servers: The host names of the vCenter servers
+    :type servers: List
+
+    :param users: How many users have VMs; they're named user0, user1, etc.
+    :type users: Integer
+
+    :param vms_per_user: How many VMs each user has
+    :type vms_per_user: Integer
+
+    :param hosts: How many ESXi hosts each vCenter has
+    :type hosts: Integer
+
+    :param home: Maps a username to the vCenter server their VMs live on.
+                 Defaults to the first server.
+    :type home: Function
+
+    :param latency: How many seconds each SOAP call takes
+    :type latency: Float
+
+    :param object_latency: How many extra seconds per object returned by the PropertyCollector
+    :type object_latency: Float
+
+    :param time_scale: How many real seconds a vCenter second takes
+    :type time_scale: Float
+
+    :param durations: Overrides how long tasks take; see ``DURATIONS``
+    :type durations: Dictionary
+
+    :param faults: Maps a SOAP method (like ``PowerOffVM_Task``) or property (like
+                   ``VirtualMachine.runtime``) to the chance that calling it raises
+                   a vmodl.fault.SystemError
+    :type faults: Dictionary
+
+    :param drop_rate: The chance any call fails with a dropped connection
+    :type drop_rate: Float
+
+    :param task_failure: The chance a task completes with an error
+    :type task_failure: Float
+
+    :param page_size: The max number of objects per RetrievePropertiesEx page
+    :type page_size: Integer
+
+    :param upload_mbps: Limits how fast each OVA disk upload can be. None means no limit.
+    :type upload_mbps: Float
+
+    :param seed: Makes the inventory, and injected failures, repeatable
+    :type seed: Integer
+    """
+    def __init__(self, servers, users, vms_per_user=5, hosts=4, home=None, latency=0.001,
+                 object_latency=0.00002, time_scale=0.001, durations=None, faults=None,
+                 drop_rate=0.0, task_failure=0.0, page_size=100, upload_mbps=None, seed=0):
+        self.usernames = ['user{}'.format(x) for x in range(users)]
+        self.vms_per_user = vms_per_user
+        self.hosts = hosts
+        self.latency = latency
+        self.object_latency = object_latency
+        self.time_scale = time_scale
+        self.durations = dict(DURATIONS, **(durations or {}))
+        self.faults = faults or {}
+        self.drop_rate = drop_rate
+        self.task_failure = task_failure
+        self.page_size = page_size
+        self.upload_mbps = upload_mbps
+        self.seed = seed
+        home = home or (lambda username: servers[0])
+        self.servers = {x: Server(x, [y for y in self.usernames if home(y) == x]) for x in servers}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._tmp_dir = tempfile.mkdtemp(prefix='fake-vcenter-')
+        self.cert_pem = _self_signed_cert(self._tmp_dir)
+        self._uploads = _UploadServer(self)
+        self.reset()
+
+    def reset(self):
+        """Put every server back to its original inventory, and zero the counters.
+        Because the MoRef IDs are the same as before, objects cached by the
+        worker stay valid.
+
+        :Returns: None
+        """
+        for index, server in enumerate(sorted(self.servers.values(), key=lambda x: x.name)):
+            with server.lock:
+                server.inventory = build_inventory(server.users, self.vms_per_user, self.hosts,
+                                                   const.INF_VCENTER_DATASTORES, self.seed + index)
+                server.tasks = []
+                server.tokens = {}
+                server.imports = {}
+        with self._lock:
+            self.calls = Counter()
+            self._rng = random.Random(self.seed)
+            self._uploads.received = 0
+
+    def vcenter(self, host, user, password, port=443, base_dir=None):
+        """Connect to a fake vCenter server; a drop-in for ``vCenter``.
+
+        :Returns: FakeVCenter
+        """
+        return FakeVCenter(self, self.servers[host], base_dir=base_dir)
+
+    def machines(self, username, kind='Avamar'):
+        """The names of a user's VMs of a given component type.
+
+        :Returns: List
+        """
+        found = []
+        for server in self.servers.values():
+            for entity in list(server.inventory.entities.values()):
+                if entity.vimtype is vim.VirtualMachine and entity.props['parent'].props['name'] == username:
+                    if vmware._parse_meta(entity.props['annotation']).get('component') == kind:
+                        found.append(entity.props['name'])
+        return sorted(found)
+
+    def stats(self):
+        """Obtain what the worker did to vCenter since the last ``reset``.
+
+        :Returns: Dictionary
+        """
+        open_views = 0
+        for server in self.servers.values():
+            with server.lock:
+                open_views += len([x for x in server.inventory.entities.values() if x.vimtype is vim.view.ContainerView])
+        with self._lock:
+            return {'round_trips': sum(self.calls.values()),
+                    'calls': dict(sorted(self.calls.items())),
+                    'open_views': open_views,
+                    'uploaded_bytes': self._uploads.received}
+
+    @contextmanager
+    def installed(self):
+        """Point the worker at the fake vCenter servers for the duration of a
+        ``with`` statement. The worker's ``time.sleep`` calls are compressed by
+        ``time_scale``, and fetching the vCenter TLS certificate is faked.
+
+        :Returns: Simulator
+        """
+        scaled = _ScaledTime(self.time_scale)
+        tasks = importlib.import_module('vlab_inf_common.vmware.tasks')
+        with ExitStack() as stack:
+            stack.enter_context(patch.object(vmware, 'vCenter', self.vcenter))
+            stack.enter_context(patch.object(virtual_machine, 'ssl', _FakeSSL(self)))
+            for module in (vmware, tasks, virtual_machine):
+                stack.enter_context(patch.object(module, 'time', scaled))
+            yield self
+
+    def close(self):
+        """Stop the upload server, and delete the temporary files.
+
+        :Returns: None
+        """
+        self._uploads.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def count(self, name):
+        """Record one round trip to vCenter, and wait out the latency.
+
+        :Returns: None
+
+        :Raises: vmodl.fault.SystemError, ConnectionResetError
+        """
+        with self._lock:
+            self.calls[name] += 1
+            fault = self._rng.random() < self.faults.get(name.split(':', 1)[-1], 0)
+            dropped = self._rng.random() < self.drop_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if dropped:
+            raise ConnectionResetError('Injected dropped connection during {}'.format(name))
+        if fault:
+            raise vmodl.fault.SystemError(reason='Injected fault', msg='Injected fault in {}'.format(name))
+
+    def task_fails(self):
+        """Decide if a new task should fail.
+
+        :Returns: Boolean
+        """
+        with self._lock:
+            return self._rng.random() < self.task_failure
+
+    def seconds(self, name):
+        """How many real seconds something takes; see ``DURATIONS``.
+
+        :Returns: Float
+        """
+        return self.durations[name] * self.time_scale
+
+    @property
+    def upload_url(self):
+        """The base URL that OVA disks get uploaded to"""
+        return 'https://127.0.0.1:{}/nfc'.format(self._uploads.port)
+
+
+class FakeVCenter(vCenter):
+    """A ``vCenter`` connected to a fake server, instead of via ``SmartConnect``.
+    Logging in costs the same round trips as the real thing.
+
+    :param simulator: The simulator the server belongs to
+    :type simulator: Simulator
+
+    :param server: The fake vCenter server
+    :type server: Server
+    """
+    def __init__(self, simulator, server, base_dir=None):
+        stub = FakeStub(simulator, server)
+        self._conn = vim.ServiceInstance('ServiceInstance', stub)
+        self._base_dir = base_dir if base_dir else const.INF_VCENTER_TOP_LVL_DIR
+        self._net_cache = None
+        self._conn.content.sessionManager.Login(userName=const.INF_VCENTER_USER, password=const.INF_VCENTER_PASSWORD)
+
+    def close(self):
+        self._conn.content.sessionManager.Logout()
+
+
+class FakeStub(object):
+    """Serves the SOAP calls that pyVmomi makes, from a Server's inventory.
+
+    :param simulator: The simulator the server belongs to
+    :type simulator: Simulator
+
+    :param server: The fake vCenter server
+    :type server: Server
+    """
+    def __init__(self, simulator, server):
+        self.host = server.name
+        self.cookie = 'vmware_soap_session="fake-{}"; Path=/'.format(id(self))
+        self._sim = simulator
+        self._server = server
+
+    def InvokeMethod(self, mo, info, args):
+        self._sim.count('method:{}'.format(info.wsdlName))
+        if info.wsdlName == 'WaitForUpdatesEx':
+            # Blocks until something changes, so it can't hold the server lock
+            return self._wait_for_updates(mo, *args)
+        handler = getattr(self, '_do_{}'.format(info.wsdlName), None)
+        if handler is None:
+            raise vmodl.fault.NotImplemented(msg='{} is not simulated'.format(info.wsdlName))
+        with self._server.lock:
+            self._tick()
+            entity = self._entity(mo)
+            result = handler(entity, *args)
+        if info.wsdlName.startswith('Retrieve') or info.wsdlName.startswith('Continue'):
+            objects = result if isinstance(result, list) else getattr(result, 'objects', [])
+            time.sleep(len(objects) * self._sim.object_latency)
+        return result
+
+    def InvokeAccessor(self, mo, info):
+        self._sim.count('property:{}.{}'.format(mo.__class__.__name__.split('.')[-1], info.name))
+        with self._server.lock:
+            self._tick()
+            return self._property(self._entity(mo), info.name)
+
+    # -- Plumbing ------------------------------------------------------------
+    @property
+    def _inv(self):
+        return self._server.inventory
+
+    def _entity(self, mo):
+        entity = self._inv.entities.get(mo._moId)
+        if entity is None:
+            raise vmodl.fault.ManagedObjectNotFound(obj=mo, msg='The object {} has been deleted'.format(mo._moId))
+        return entity
+
+    def _bind(self, value):
+        """Convert entities into ManagedObjects that make calls via this stub"""
+        if isinstance(value, Entity):
+            return value.vimtype(value.moid, self)
+        elif isinstance(value, list):
+            return [self._bind(x) for x in value]
+        return value
+
+    def _tick(self):
+        """Complete the tasks that are due"""
+        now = time.time()
+        pending = []
+        for task in self._server.tasks:
+            if task.props['dueAt'] > now:
+                pending.append(task)
+                continue
+            if task.props['state'] == 'failing':
+                task.props['state'] = 'error'
+            elif task.props['state'] == 'running':
+                try:
+                    task.props['result'] = task.props['effect']()
+                    task.props['state'] = 'success'
+                except vmodl.MethodFault as doh:
+                    task.props['error'] = doh
+                    task.props['state'] = 'error'
+            task.props['completeTime'] = datetime.datetime.now(datetime.timezone.utc)
+        self._server.tasks = pending
+
+    def _task(self, name, effect, target):
+        """Start a task; ``effect`` runs once the task completes"""
+        task = self._inv.add(vim.Task, name=name, state='running', effect=effect, result=None, error=None,
+                             completeTime=None, target=target, dueAt=time.time() + self._sim.seconds(name))
+        if self._sim.task_fails():
+            task.props['state'] = 'failing'
+            task.props['error'] = vmodl.fault.SystemError(reason='Injected task failure',
+                                                          msg='Injected failure of {}'.format(name))
+        self._server.tasks.append(task)
+        return self._bind(task)
+
+    # -- Properties ----------------------------------------------------------
+    def _property(self, entity, name):
+        builder = getattr(self, '_get_{}'.format(name), None)
+        if builder is not None:
+            value = builder(entity)
+            if value is not NotImplemented:
+                return value
+        return self._bind(entity.props.get(name))
+
+    def _get_path(self, entity, path):
+        """Resolve a property path like ``summary.storage.committed``"""
+        first, _, rest = path.partition('.')
+        value = self._property(entity, first)
+        for attr in rest.split('.') if rest else []:
+            if value is None:
+                break
+            value = getattr(value, attr)
+        return value
+
+    def _get_runtime(self, entity):
+        if entity.vimtype is vim.VirtualMachine:
+            return vim.vm.RuntimeInfo(powerState=entity.props['powerState'])
+        elif entity.vimtype is vim.HostSystem:
+            return vim.host.RuntimeInfo(inMaintenanceMode=entity.props['inMaintenanceMode'],
+                                        connectionState=entity.props['connectionState'])
+        return NotImplemented
+
+    def _get_summary(self, entity):
+        if entity.vimtype is vim.VirtualMachine:
+            return vim.vm.Summary(storage=vim.vm.Summary.StorageSummary(committed=entity.props['committed']),
+                                  quickStats=vim.vm.Summary.QuickStats(overallCpuUsage=entity.props['cpuUsage']))
+        elif entity.vimtype is vim.Datastore:
+            return vim.Datastore.Summary(name=entity.props['name'],
+                                         freeSpace=entity.props['freeSpace'],
+                                         capacity=entity.props['capacity'],
+                                         accessible=entity.props['accessible'],
+                                         type='VMFS')
+        elif entity.vimtype is vim.HostSystem:
+            hardware = vim.host.Summary.HardwareSummary(memorySize=entity.props['memorySize'])
+            stats = vim.host.Summary.QuickStats(overallMemoryUsage=entity.props['memoryUsage'])
+            return vim.host.Summary(hardware=hardware, quickStats=stats)
+        return NotImplemented
+
+    def _get_guest(self, entity):
+        if entity.vimtype is not vim.VirtualMachine:
+            return NotImplemented
+        booted = entity.props['powerState'] == 'poweredOn' and entity.props['bootedAt'] <= time.time()
+        if booted:
+            return vim.vm.GuestInfo(toolsStatus='toolsOk',
+                                    net=[vim.vm.GuestInfo.NicInfo(ipAddress=[entity.props['ip'], 'fe80::1'])])
+        return vim.vm.GuestInfo(toolsStatus='toolsNotRunning', net=[])
+
+    def _get_config(self, entity):
+        if entity.vimtype is not vim.VirtualMachine:
+            return NotImplemented
+        devices = []
+        for index in range(entity.props['disks']):
+            backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo(fileName='[ds] {0}/{0}_{1}.vmdk'.format(entity.props['name'], index),
+                                                                    diskMode='persistent')
+            devices.append(vim.vm.device.VirtualDisk(key=2000 + index, unitNumber=index, controllerKey=1000,
+                                                     capacityInKB=50 * 1024**2, backing=backing))
+        backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(deviceName='VM Network')
+        devices.append(vim.vm.device.VirtualVmxnet3(key=4000, unitNumber=7, backing=backing,
+                                                    deviceInfo=vim.Description(label='Network adapter 1', summary='VM Network')))
+        return vim.vm.ConfigInfo(name=entity.props['name'], annotation=entity.props['annotation'],
+                                 hardware=vim.vm.VirtualHardware(device=devices))
+
+    def _get_snapshot(self, entity):
+        if entity.vimtype is not vim.VirtualMachine:
+            return NotImplemented
+        if not entity.props['snapshots']:
+            return None
+        trees = [vim.vm.SnapshotTree(name=x.props['name'], description=x.props['description'],
+                                     snapshot=self._bind(x), vm=self._bind(entity), childSnapshotList=[])
+                 for x in entity.props['snapshots']]
+        return vim.vm.SnapshotInfo(rootSnapshotList=trees)
+
+    def _get_info(self, entity):
+        if entity.vimtype is vim.Task:
+            return vim.TaskInfo(key=entity.moid, task=self._bind(entity), descriptionId=entity.props['name'],
+                                state='running' if entity.props['state'] == 'failing' else entity.props['state'],
+                                completeTime=entity.props['completeTime'], error=entity.props['error'],
+                                result=self._bind(entity.props['result']))
+        elif entity.vimtype is vim.HttpNfcLease:
+            urls = [vim.HttpNfcLease.DeviceUrl(key=x, importKey=x, url=y, sslThumbprint='', disk=True)
+                    for x, y in entity.props['urls'].items()]
+            return vim.HttpNfcLease.Info(lease=self._bind(entity), entity=self._bind(entity.props['vm']), deviceUrl=urls)
+        return NotImplemented
+
+    def _get_state(self, entity):
+        if entity.vimtype is not vim.HttpNfcLease:
+            return NotImplemented
+        if entity.props['state'] == 'initializing' and entity.props['readyAt'] <= time.time():
+            entity.props['state'] = 'error' if entity.props['failing'] else 'ready'
+        return entity.props['state']
+
+    # -- Methods -------------------------------------------------------------
+    def _do_RetrieveServiceContent(self, entity):
+        refs = {x: self._bind(self._inv.entities[y]) for _, y, x in SINGLETONS if x}
+        return vim.ServiceInstanceContent(rootFolder=self._bind(self._inv.root),
+                                          about=vim.AboutInfo(instanceUuid='fake-{}'.format(self.host)),
+                                          **refs)
+
+    def _get_content(self, entity):
+        if entity.vimtype is not vim.ServiceInstance:
+            return NotImplemented
+        return self._do_RetrieveServiceContent(entity)
+
+    def _do_Login(self, entity, userName, password, locale=None):
+        return vim.UserSession(key='session-{}'.format(id(self)), userName=userName)
+
+    def _do_Logout(self, entity):
+        pass
+
+    def _do_AcquireCloneTicket(self, entity):
+        return 'cst-{}'.format(id(self))
+
+    def _get_setting(self, entity):
+        if entity.vimtype is not vim.option.OptionManager:
+            return NotImplemented
+        return [vim.option.OptionValue(key='VirtualCenter.FQDN', value=self.host)]
+
+    def _do_CreateContainerView(self, entity, container, type, recursive):
+        root = self._entity(container)
+        found = self._inv.descendants(root) if recursive else self._inv.children(root)
+        view = self._inv.add(vim.view.ContainerView, view=[x for x in found if issubclass(x.vimtype, tuple(type))])
+        return self._bind(view)
+
+    def _do_DestroyView(self, entity):
+        self._inv.remove(entity)
+
+    def _do_FindChild(self, entity, parent, name):
+        for child in self._inv.children(self._entity(parent)):
+            if child.props.get('name') == name:
+                return self._bind(child)
+        return None
+
+    def _do_CreateFolder(self, entity, name):
+        return self._bind(self._inv.folder(name, parent=entity))
+
+    def _do_RetrieveProperties(self, entity, specSet):
+        return self._collect(specSet)
+
+    def _do_RetrievePropertiesEx(self, entity, specSet, options):
+        return self._page(self._collect(specSet), options.maxObjects or self._sim.page_size)
+
+    def _do_ContinueRetrievePropertiesEx(self, entity, token):
+        if token not in self._server.tokens:
+            raise vmodl.fault.InvalidArgument(invalidProperty='token')
+        return self._page(*self._server.tokens.pop(token))
+
+    def _do_CreateImportSpec(self, entity, ovfDescriptor, resourcePool, datastore, cisp):
+        disks = re.findall(r'ovf:href="([^"]+\.vmdk)"', ovfDescriptor)
+        items = [vim.OvfManager.FileItem(deviceId='/{}/VirtualLsiLogicController0:{}'.format(cisp.entityName, x),
+                                         path=y, size=0, create=False) for x, y in enumerate(disks)]
+        self._server.imports[cisp.entityName] = (self._entity(datastore), len(disks))
+        spec = vim.vm.VmImportSpec(configSpec=vim.vm.ConfigSpec(name=cisp.entityName))
+        return vim.OvfManager.CreateImportSpecResult(importSpec=spec, fileItem=items, error=[])
+
+    def _do_ImportVApp(self, entity, spec, folder, host):
+        the_folder = self._entity(folder)
+        name = spec.configSpec.name
+        if any(x.props.get('name') == name for x in the_folder.props['childEntity']):
+            raise vim.fault.DuplicateName(name=name, object=folder)
+        datastore, disks = self._server.imports.pop(name, (None, 1))
+        the_vm = self._inv.add(vim.VirtualMachine, name=name, parent=the_folder, powerState='poweredOff', bootedAt=0,
+                               ip='10.255.0.{}'.format(len(the_folder.props['childEntity'])), annotation=None,
+                               committed=0, cpuUsage=0, disks=0, network=[], snapshots=[], datastore=datastore)
+        lease = self._inv.add(vim.HttpNfcLease, vm=the_vm, disks=disks, state='initializing', failing=self._sim.task_fails(),
+                              readyAt=time.time() + self._sim.seconds('lease'), urls={}, progress=0)
+        for index in range(disks):
+            device = '/{}/VirtualLsiLogicController0:{}'.format(name, index)
+            lease.props['urls'][device] = '{}/{}/disk-{}.vmdk'.format(self._sim.upload_url, lease.moid, index)
+        return self._bind(lease)
+
+    def _get_error(self, entity):
+        if entity.vimtype is not vim.HttpNfcLease:
+            return NotImplemented
+        if entity.props['state'] == 'error':
+            return vmodl.fault.SystemError(reason='Injected lease failure', msg='Injected lease failure')
+        return None
+
+    def _do_HttpNfcLeaseProgress(self, entity, percent):
+        entity.props['progress'] = percent
+
+    def _do_HttpNfcLeaseComplete(self, entity):
+        entity.props['vm'].props['disks'] = entity.props['disks']
+        self._inv.remove(entity)
+
+    def _do_HttpNfcLeaseAbort(self, entity, fault=None):
+        self._inv.remove(entity.props['vm'])
+        self._inv.remove(entity)
+
+    def _do_PowerOnVM_Task(self, entity, host=None):
+        def effect():
+            if entity.props['powerState'] != 'poweredOn':
+                # A suspended VM picks up where it left off, instead of booting
+                boot = 'resume' if entity.props['powerState'] == 'suspended' else 'boot'
+                entity.props['powerState'] = 'poweredOn'
+                entity.props['bootedAt'] = time.time() + self._sim.seconds(boot)
+        return self._task('PowerOnVM_Task', effect, entity)
+
+    def _do_PowerOffVM_Task(self, entity):
+        def effect():
+            entity.props['powerState'] = 'poweredOff'
+            entity.props['cpuUsage'] = 0
+        return self._task('PowerOffVM_Task', effect, entity)
+
+    def _do_SuspendVM_Task(self, entity):
+        def effect():
+            if entity.props['powerState'] != 'poweredOn':
+                raise vim.fault.InvalidPowerState(requestedState='poweredOn', existingState=entity.props['powerState'],
+                                                  msg='The attempted operation cannot be performed in the current state.')
+            entity.props['powerState'] = 'suspended'
+            entity.props['cpuUsage'] = 0
+            entity.props['netUsage'] = 0
+        return self._task('SuspendVM_Task', effect, entity)
+
+    def _do_ResetVM_Task(self, entity):
+        def effect():
+            entity.props['bootedAt'] = time.time() + self._sim.seconds('boot')
+        return self._task('ResetVM_Task', effect, entity)
+
+    def _do_Destroy_Task(self, entity):
+        def effect():
+            if entity.props['powerState'] == 'poweredOn':
+                raise vim.fault.InvalidPowerState(requestedState='poweredOff', existingState='poweredOn',
+                                                  msg='The attempted operation cannot be performed in the current state (Powered on).')
+            self._inv.remove(entity)
+        return self._task('Destroy_Task', effect, entity)
+
+    def _do_ReconfigVM_Task(self, entity, spec):
+        def effect():
+            if spec.annotation is not None:
+                entity.props['annotation'] = spec.annotation
+            entity.props['disks'] += len([x for x in spec.deviceChange if x.operation == 'add'])
+        return self._task('ReconfigVM_Task', effect, entity)
+
+    def _do_CloneVM_Task(self, entity, folder, name, spec):
+        the_folder = self._entity(folder)
+        if any(x.props.get('name') == name for x in the_folder.props['childEntity']):
+            raise vim.fault.DuplicateName(name=name, object=folder)
+
+        def effect():
+            datastore = self._entity(spec.location.datastore) if spec.location.datastore else entity.props['datastore']
+            the_vm = self._inv.add(vim.VirtualMachine, name=name, parent=the_folder, powerState='poweredOff', bootedAt=0,
+                                   ip='10.255.0.{}'.format(len(the_folder.props['childEntity'])), annotation=None,
+                                   committed=0, cpuUsage=0, disks=entity.props['disks'], network=[], snapshots=[],
+                                   datastore=datastore)
+            if spec.powerOn:
+                the_vm.props['powerState'] = 'poweredOn'
+                the_vm.props['bootedAt'] = time.time() + self._sim.seconds('boot')
+            return self._bind(the_vm)
+        return self._task('CloneVM_Task', effect, entity)
+
+    def _do_MarkAsTemplate(self, entity):
+        entity.props['template'] = True
+
+    def _get_perfCounter(self, entity):
+        if entity.vimtype is not vim.PerformanceManager:
+            return NotImplemented
+        return [vim.PerformanceManager.CounterInfo(key=NET_USAGE_COUNTER, rollupType='average',
+                                                   groupInfo=vim.ElementDescription(key='net', label='Network', summary='Network'),
+                                                   nameInfo=vim.ElementDescription(key='usage', label='Usage', summary='Usage'),
+                                                   unitInfo=vim.ElementDescription(key='kiloBytesPerSecond', label='KBps',
+                                                                                   summary='KBps'),
+                                                   statsType='rate')]
+
+    def _do_QueryPerf(self, entity, querySpec):
+        found = []
+        for spec in querySpec:
+            the_vm = self._entity(spec.entity)
+            if the_vm.props.get('powerState') != 'poweredOn':
+                continue
+            series = [vim.PerformanceManager.IntSeries(id=x, value=[the_vm.props.get('netUsage', 0)] * (spec.maxSample or 1))
+                      for x in spec.metricId if x.counterId == NET_USAGE_COUNTER]
+            found.append(vim.PerformanceManager.EntityMetric(entity=self._bind(the_vm), value=series, sampleInfo=[]))
+        return found
+
+    def _do_DoesCustomizationSpecExist(self, entity, name):
+        return name in entity.props.setdefault('specs', {})
+
+    def _do_GetCustomizationSpec(self, entity, name):
+        try:
+            return entity.props.setdefault('specs', {})[name]
+        except KeyError:
+            raise vim.fault.NotFound(msg='The customization spec {} does not exist'.format(name))
+
+    def _do_CreateCustomizationSpec(self, entity, item):
+        specs = entity.props.setdefault('specs', {})
+        if item.info.name in specs:
+            raise vim.fault.AlreadyExists(name=item.info.name)
+        specs[item.info.name] = item
+
+    def _do_CustomizeVM_Task(self, entity, spec):
+        def effect():
+            entity.props['ip'] = spec.nicSettingMap[0].adapter.ip.ipAddress
+        return self._task('CustomizeVM_Task', effect, entity)
+
+    def _do_CreateSnapshot_Task(self, entity, name, description, memory, quiesce):
+        def effect():
+            snapshot = self._inv.add(vim.vm.Snapshot, name=name, vm=entity, description=description, memory=memory)
+            entity.props['snapshots'].append(snapshot)
+            return snapshot
+        return self._task('CreateSnapshot_Task', effect, entity)
+
+    def _do_RevertToSnapshot_Task(self, entity, host=None, suppressPowerOn=None):
+        def effect():
+            the_vm = entity.props['vm']
+            the_vm.props['powerState'] = 'poweredOn' if entity.props['memory'] else 'poweredOff'
+            the_vm.props['bootedAt'] = 0
+        return self._task('RevertToSnapshot_Task', effect, entity)
+
+    # -- PropertyCollector ---------------------------------------------------
+    def _do_CreatePropertyCollector(self, entity):
+        return self._bind(self._inv.add(vmodl.query.PropertyCollector, filters=[], reported={}))
+
+    def _do_DestroyPropertyCollector(self, entity):
+        for the_filter in entity.props['filters']:
+            self._inv.remove(the_filter)
+        self._inv.remove(entity)
+
+    def _do_CreateFilter(self, entity, spec, partialUpdates):
+        the_filter = self._inv.add(vmodl.query.PropertyCollector.Filter, spec=spec)
+        entity.props['filters'].append(the_filter)
+        return self._bind(the_filter)
+
+    def _wait_for_updates(self, mo, version, options=None):
+        max_wait = options.maxWaitSeconds if options is not None and options.maxWaitSeconds is not None else 60
+        deadline = time.time() + max_wait * self._sim.time_scale
+        while True:
+            with self._server.lock:
+                self._tick()
+                collector = self._entity(mo)
+                if not version:
+                    collector.props['reported'] = {}
+                update = self._updates(collector)
+            if update is not None or time.time() >= deadline:
+                return update
+            time.sleep(0.001)
+
+    def _updates(self, collector):
+        """The properties that changed since they were last reported, as an UpdateSet"""
+        reported = collector.props['reported']
+        filter_sets = []
+        for the_filter in collector.props['filters']:
+            objects = []
+            for content in self._collect([the_filter.props['spec']]):
+                changes = {x.name: x.val for x in content.propSet}
+                for path in [y for x in the_filter.props['spec'].propSet for y in x.pathSet]:
+                    changes.setdefault(path, None)
+                known = reported.setdefault(content.obj._moId, {})
+                kind = 'modify' if known else 'enter'
+                changed = [vmodl.query.PropertyCollector.Change(name=x, op='assign', val=y)
+                           for x, y in changes.items() if known.get(x, 'unset') != repr(y)]
+                if changed:
+                    known.update({x.name: repr(x.val) for x in changed})
+                    objects.append(vmodl.query.PropertyCollector.ObjectUpdate(kind=kind, obj=content.obj,
+                                                                              changeSet=changed))
+            if objects:
+                filter_sets.append(vmodl.query.PropertyCollector.FilterUpdate(filter=self._bind(the_filter),
+                                                                              objectSet=objects))
+        if not filter_sets:
+            return None
+        collector.props['version'] = collector.props.get('version', 0) + 1
+        return vmodl.query.PropertyCollector.UpdateSet(version=str(collector.props['version']), filterSet=filter_sets)
+
+    def _collect(self, spec_set):
+        found = []
+        for spec in spec_set:
+            for obj_spec in spec.objectSet:
+                root = self._entity(obj_spec.obj)
+                targets = [] if obj_spec.skip else [root]
+                for select in obj_spec.selectSet:
+                    targets.extend(self._traverse(root, select))
+                for target in targets:
+                    prop_specs = [x for x in spec.propSet if issubclass(target.vimtype, x.type)]
+                    if not prop_specs:
+                        continue
+                    props = []
+                    for path in [y for x in prop_specs for y in x.pathSet]:
+                        value = self._get_path(target, path)
+                        if value is None:
+                            # Unset properties are left out, just like vCenter does
+                            continue
+                        if isinstance(value, list):
+                            value = vim.ManagedEntity.Array(value)
+                        props.append(vmodl.DynamicProperty(name=path, val=value))
+                    found.append(vmodl.query.PropertyCollector.ObjectContent(obj=self._bind(target), propSet=props))
+        return found
+
+    def _traverse(self, entity, select):
+        if not issubclass(entity.vimtype, select.type):
+            return []
+        found = []
+        for child in entity.props.get(select.path, []):
+            if not select.skip:
+                found.append(child)
+            for nested in select.selectSet:
+                found.extend(self._traverse(child, nested))
+        return found
+
+    def _page(self, objects, size):
+        if not objects:
+            return None
+        token = None
+        if len(objects) > size:
+            token = 'token-{}'.format(next(self._inv._ids))
+            self._server.tokens[token] = (objects[size:], size)
+        return vmodl.query.PropertyCollector.RetrieveResult(objects=objects[:size], token=token)
+
+
+class _ScaledTime(object):
+    """Stands in for the ``time`` module, with a compressed ``sleep``"""
+    def __init__(self, scale):
+        self._scale = scale
+
+    def sleep(self, seconds):
+        time.sleep(seconds * self._scale)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class _FakeSSL(object):
+    """Stands in for the ``ssl`` module, so obtaining the vCenter certificate
+    does not require a real server (but still counts as a round trip)."""
+    def __init__(self, simulator):
+        self._sim = simulator
+
+    def get_server_certificate(self, addr, *args, **kwargs):
+        self._sim.count('tls:get_server_certificate')
+        return self._sim.cert_pem
+
+    def __getattr__(self, name):
+        return getattr(ssl, name)
+
+
+class _UploadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        limit = self.server.simulator.upload_mbps
+        while remaining:
+            started = time.time()
+            chunk = self.rfile.read(min(remaining, 1024**2))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            with self.server.lock:
+                self.server.received += len(chunk)
+            if limit:
+                time.sleep(max(0, len(chunk) / (limit * 1024**2) - (time.time() - started)))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class _UploadServer(ThreadingHTTPServer):
+    """The HTTPS server that plays the part of ESXi, receiving OVA disk uploads"""
+    daemon_threads = True
+
+    def __init__(self, simulator):
+        super(_UploadServer, self).__init__(('127.0.0.1', 0), _UploadHandler)
+        self.simulator = simulator
+        self.lock = threading.Lock()
+        self.received = 0
+        self.port = self.server_address[1]
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(os.path.join(simulator._tmp_dir, 'cert.pem'), os.path.join(simulator._tmp_dir, 'key.pem'))
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-esxi-upload', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _self_signed_cert(directory):
+    """Create a TLS certificate and key for the fake servers.
+
+    :Returns: String - The certificate, PEM encoded
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'fake-vcenter.vlab.local')])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name) \
+                                    .issuer_name(name) \
+                                    .public_key(key.public_key()) \
+                                    .serial_number(x509.random_serial_number()) \
+                                    .not_valid_before(now) \
+                                    .not_valid_after(now + datetime.timedelta(days=1)) \
+                                    .sign(key, hashes.SHA256())
+    cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+    with open(os.path.join(directory, 'cert.pem'), 'wb') as the_file:
+        the_file.write(cert_pem)
+    with open(os.path.join(directory, 'key.pem'), 'wb') as the_file:
+        the_file.write(key.private_bytes(serialization.Encoding.PEM,
+                                         serialization.PrivateFormat.TraditionalOpenSSL,
+                                         serialization.NoEncryption()))
+    return cert_pem.decode()
@@ -0,0 +1,173 @@
+# -*- coding: UTF-8 -*-
+"""
+The API app, instrumented for load testing.
+
+Celery publishes to kombu's in-memory transport instead of RabbitMQ, and a
+background thread drains the queue like a worker would (admitting, then
+releasing, each deploy so the admission queue does not grow without bound).
+The cost of each stage of handling a request is timed, and sent back to the
+load generator via the ``X-Stage-Timings`` response header, so the breakdown
+works the same whether the app runs in-process, under werkzeug or under uwsgi.
+
+Run it under uwsgi via the ``app`` callable of ``benchmarks.load_wsgi``, or with
+werkzeug's threaded server via::
+
+    python -m benchmarks.load_app --port 5000
+"""
+import os
+import time
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from functools import wraps
+
+import ujson
+from flask import g
+from vlab_api_common import http_auth, flask_common
+
+from vlab_avamar_api.lib import auth, validation
+from vlab_avamar_api.lib.views import avamar
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.producer import PooledCelery
+from vlab_avamar_api.lib.readiness import readiness
+from vlab_avamar_api.lib.admission import Admission
+from vlab_avamar_api.lib.generations import Generations, inventory_key
+
+
+# The order the stages happen in while handling a request
+STAGES = ('auth', 'validate', 'etag', 'admission', 'publish', 'encode', 'after_request')
+_local = threading.local()
+# The ETag of the empty inventory the load test user starts with
+EMPTY_ETAG = hashlib.sha1(ujson.dumps({}, sort_keys=True).encode()).hexdigest()
+
+
+def make_app(publish_latency=0.0, state_dir=None, token_cache=None):
+    """Create the API app, backed by an in-memory broker.
+
+    :Returns: flask.Flask
+
+    :param publish_latency: Extra seconds each publish to the broker takes,
+                            to stand in for the round trip to RabbitMQ.
+    :type publish_latency: Float
+
+    :param state_dir: Where the admission queue is stored. Defaults to a new temporary directory.
+    :type state_dir: String
+
+    :param token_cache: How many auth tokens to cache; zero disables the cache.
+                        Defaults to VLAB_AVAMAR_TOKEN_CACHE.
+    :type token_cache: Integer
+    """
+    # Deferred, so the instrumentation is in place before the views are registered
+    from vlab_avamar_api.app import app
+    state_dir = state_dir or tempfile.mkdtemp(prefix='vlab-avamar-load-')
+    app.celery_app = PooledCelery('avamar', backend='rpc://', broker='memory://', pool_size=4)
+    app.celery_app.conf.broker_heartbeat = 0
+    app.celery_app.warm()
+    app.readiness = readiness(app.celery_app)
+    app.celery_app.send_task = _timed('publish', _delayed(app.celery_app.send_task, publish_latency))
+    admission = Admission(state=SharedState(os.path.join(state_dir, 'admission.json')),
+                          user_cap=10**6, global_cap=10**6, lease=3600)
+    admission.enqueue = _timed('admission', admission.enqueue)
+    avamar.ADMISSION = admission
+    generations = Generations(state=SharedState(os.path.join(state_dir, 'generations.json')), ttl=10**6)
+    generations.observe(inventory_key('Avamar', 'loadtest'), {}, 0)
+    generations.etag = _timed('etag', generations.etag)
+    avamar.GENERATIONS = generations
+    if token_cache is not None:
+        auth.TOKENS = auth.TokenCache(size=token_cache)
+    _instrument(app)
+    _start_drain(app.celery_app, admission)
+    return app
+
+
+def _instrument(app):
+    """Time each stage of handling a request"""
+    http_auth.get_token_from_header = _timed('auth', http_auth.get_token_from_header)
+    auth.TOKENS.get = _timed('auth', auth.TOKENS.get)
+    validation.DefaultingValidator.validate = _timed('validate', validation.DefaultingValidator.validate)
+    avamar.ujson = _TimedJson()
+    avamar.AvamarView.after_request = _timed('after_request', avamar.AvamarView.after_request)
+    # The per-request access log is part of the cost, but not the output
+    devnull = open(os.devnull, 'w')
+    for handler in logging.getLogger(flask_common.__name__).handlers:
+        handler.setStream(devnull)
+
+    @app.before_request
+    def reset_timings():
+        _local.timings = {}
+        g.started = time.perf_counter()
+
+    @app.after_request
+    def add_timings(response):
+        timings = getattr(_local, 'timings', {})
+        timings['total'] = time.perf_counter() - g.started
+        response.headers['X-Stage-Timings'] = ujson.dumps(timings)
+        return response
+
+
+def _start_drain(celery_app, admission):
+    """Consume the published tasks, like a worker would"""
+    def drain():
+        with celery_app.connection_for_read() as conn:
+            queue = conn.SimpleQueue('celery', no_ack=True)
+            while True:
+                try:
+                    message = queue.get(block=True, timeout=1)
+                except queue.Empty:
+                    continue
+                if message.headers['task'].startswith('avamar.create_'):
+                    username = message.payload[0][0]
+                    admission.admit(username, message.headers['id'])
+                    admission.release(username, message.headers['id'])
+    thread = threading.Thread(target=drain, name='load-test-drain', daemon=True)
+    thread.start()
+    return thread
+
+
+def _timed(stage, func):
+    @wraps(func)
+    def inner(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings = getattr(_local, 'timings', None)
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0) + time.perf_counter() - started
+    return inner
+
+
+def _delayed(func, seconds):
+    if not seconds:
+        return func
+    @wraps(func)
+    def inner(*args, **kwargs):
+        time.sleep(seconds)
+        return func(*args, **kwargs)
+    return inner
+
+
+class _TimedJson(object):
+    """Stands in for the ``ujson`` module within the views"""
+    dumps = staticmethod(_timed('encode', ujson.dumps))
+
+    def __getattr__(self, name):
+        return getattr(ujson, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the instrumented API app with werkzeug')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--publish-latency', type=float, default=0.0)
+    parser.add_argument('--token-cache', type=int, default=None)
+    args = parser.parse_args()
+    from werkzeug.serving import make_server
+    app = make_app(publish_latency=args.publish_latency, token_cache=args.token_cache)
+    server = make_server('127.0.0.1', args.port, app, threaded=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
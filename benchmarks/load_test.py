@@ -0,0 +1,440 @@
+# -*- coding: UTF-8 -*-
+"""
+Load tests the API tier, one end point at a time, and saves the results as JSON.
+
+For each end point this reports the requests per second, the latency
+percentiles and where the time went (``requires``, ``validate_input``, the
+admission queue, the publish to the broker, ``ujson`` encoding, and the
+``after_request`` hook). The app is backed by an in-memory broker; see
+``benchmarks.load_app``.
+
+The app can be run several ways, so the results of different worker, thread
+and async configurations can be compared::
+
+    # Call the WSGI app directly; no HTTP server at all
+    python -m benchmarks.load_test --concurrency 8 --output inprocess.json
+    # werkzeug's threaded server
+    python -m benchmarks.load_test --server werkzeug --output werkzeug.json
+    # uwsgi, like production (see app.ini), or with more processes/threads
+    python -m benchmarks.load_test --server uwsgi --processes 4 --threads 1 --output uwsgi-4x1.json
+    python -m benchmarks.load_test --server uwsgi --processes 1 --gevent 100 --output uwsgi-gevent.json
+    # A server that's already running, like from docker-compose
+    python -m benchmarks.load_test --url http://localhost:5000
+    # Then compare any two of them
+    python -m benchmarks.load_test compare uwsgi-4x1.json uwsgi-gevent.json
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import ujson
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from benchmarks.load_app import STAGES, EMPTY_ETAG
+from benchmarks.run import _commit
+
+
+CREATE_BODY = {'name': 'myAvamar',
+               'image': '19.4',
+               'network': 'frontend',
+               'ip-config': {'static-ip': '10.241.80.10'}}
+# The ETag of an empty inventory; see ``benchmarks.load_app.make_app``
+NOTHING_CHANGED = {'If-None-Match': '"{}"'.format(EMPTY_ETAG)}
+# name -> (HTTP method, URL path, JSON body[, extra headers])
+ENDPOINTS = OrderedDict([
+    ('GET server', ('GET', '/api/2/inf/avamar/server', None)),
+    ('GET server (304)', ('GET', '/api/2/inf/avamar/server', None, NOTHING_CHANGED)),
+    ('POST server', ('POST', '/api/2/inf/avamar/server', CREATE_BODY)),
+    ('DELETE server', ('DELETE', '/api/2/inf/avamar/server', {'name': 'myAvamar'})),
+    ('POST server/reset', ('POST', '/api/2/inf/avamar/server/reset', {'name': 'myAvamar'})),
+    ('GET server/image', ('GET', '/api/2/inf/avamar/server/image', None)),
+    ('GET server/task', ('GET', '/api/2/inf/avamar/server/task/a5b3c0b4-1b6e-4f8c-9a7e-25a1f0f2b1a9', None)),
+    ('GET server?describe', ('GET', '/api/2/inf/avamar/server?describe=true', None)),
+    ('GET ndmp', ('GET', '/api/2/inf/avamar/ndmp-accelerator', None)),
+    ('POST ndmp', ('POST', '/api/2/inf/avamar/ndmp-accelerator', CREATE_BODY)),
+])
+HEALTHCHECK = '/api/1/inf/avamar/healthcheck'
+
+
+class InProcessTarget(object):
+    """Sends requests straight to the WSGI app, with one test client per thread.
+
+    :param publish_latency: Extra seconds each publish to the broker takes
+    :type publish_latency: Float
+
+    :param token_cache: How many auth tokens to cache, or None for the default
+    :type token_cache: Integer
+    """
+    def __init__(self, publish_latency, token_cache=None):
+        from benchmarks.load_app import make_app
+        self._app = make_app(publish_latency=publish_latency, token_cache=token_cache)
+        self._local = threading.local()
+
+    def request(self, method, path, body, headers):
+        """Send one request.
+
+        :Returns: Tuple (HTTP status, response headers)
+        """
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        data = ujson.dumps(body) if body is not None else None
+        resp = client.open(path, method=method, data=data, headers=headers)
+        resp.get_data()
+        return resp.status_code, resp.headers
+
+    def close(self):
+        pass
+
+
+class HttpTarget(object):
+    """Sends requests to an HTTP server, with one keep-alive connection per thread.
+
+    :param url: The base URL of the server, like http://localhost:5000
+    :type url: String
+
+    :param process: The server, if it was spawned by the load test
+    :type process: subprocess.Popen
+    """
+    def __init__(self, url, process=None):
+        parsed = urlparse(url)
+        self._host = parsed.hostname
+        self._port = parsed.port or 80
+        self._process = process
+        self._local = threading.local()
+
+    def request(self, method, path, body, headers):
+        """Send one request.
+
+        :Returns: Tuple (HTTP status, response headers)
+        """
+        data = ujson.dumps(body) if body is not None else None
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(self._host, self._port, timeout=30)
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+            except (http.client.HTTPException, OSError):
+                # The server closed the keep-alive connection; try once more on a new one
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+            else:
+                return resp.status, resp.headers
+
+    def wait_until_up(self, timeout=30):
+        """Block until the server answers its healthcheck.
+
+        :Returns: None
+
+        :Raises: RuntimeError
+        """
+        give_up = time.time() + timeout
+        while time.time() < give_up:
+            if self._process is not None and self._process.poll() is not None:
+                raise RuntimeError('The API server exited with {}'.format(self._process.returncode))
+            try:
+                conn = http.client.HTTPConnection(self._host, self._port, timeout=1)
+                conn.request('GET', HEALTHCHECK)
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError('The API server did not start within {} seconds'.format(timeout))
+
+    def close(self):
+        if self._process is not None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+
+
+def spawn(server, processes, threads, gevent, publish_latency, token_cache=None):
+    """Start the instrumented app in an HTTP server, on a free local port.
+
+    :Returns: HttpTarget
+
+    :param server: Either "uwsgi" or "werkzeug"
+    :type server: String
+
+    :param processes: How many uwsgi worker processes
+    :type processes: Integer
+
+    :param threads: How many threads per uwsgi worker
+    :type threads: Integer
+
+    :param gevent: How many gevent async cores per uwsgi worker; zero to disable
+    :type gevent: Integer
+
+    :param publish_latency: Extra seconds each publish to the broker takes
+    :type publish_latency: Float
+
+    :param token_cache: How many auth tokens to cache, or None for the default
+    :type token_cache: Integer
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, LOAD_PUBLISH_LATENCY=str(publish_latency))
+    if token_cache is not None:
+        env['VLAB_AVAMAR_TOKEN_CACHE'] = str(token_cache)
+    if server == 'uwsgi':
+        # Mirrors app.ini, apart from the concurrency settings
+        cmd = ['uwsgi', '--http-socket', '127.0.0.1:{}'.format(port), '--module', 'benchmarks.load_wsgi:app',
+               '--master', '--lazy-apps', '--die-on-term', '--disable-logging', '--enable-threads',
+               '--buffer-size', '32768', '--processes', str(processes), '--threads', str(threads)]
+        if gevent:
+            cmd += ['--gevent', str(gevent)]
+    else:
+        cmd = [sys.executable, '-m', 'benchmarks.load_app', '--port', str(port),
+               '--publish-latency', str(publish_latency)]
+    process = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    target = HttpTarget('http://127.0.0.1:{}'.format(port), process=process)
+    try:
+        target.wait_until_up()
+    except RuntimeError:
+        target.close()
+        raise
+    return target
+
+
+def load(target, name, concurrency, duration, warmup):
+    """Hammer one end point from several threads.
+
+    :Returns: Dictionary
+
+    :param target: Where to send the requests
+    :type target: InProcessTarget or HttpTarget
+
+    :param name: The end point to test; see ``ENDPOINTS``
+    :type name: String
+
+    :param concurrency: How many requests to have in flight at once
+    :type concurrency: Integer
+
+    :param duration: How many seconds to send requests for
+    :type duration: Float
+
+    :param warmup: How many seconds to send requests for before measuring
+    :type warmup: Float
+    """
+    method, path, body = ENDPOINTS[name][:3]
+    headers = {'X-Auth': generate_v2_test_token(username='loadtest').decode(),
+               'Content-Type': 'application/json',
+               'X-REQUEST-ID': 'load-test'}
+    headers.update(ENDPOINTS[name][3] if len(ENDPOINTS[name]) > 3 else {})
+    samples = []
+    lock = threading.Lock()
+    start_at = time.perf_counter() + warmup
+    stop_at = start_at + duration
+
+    def worker():
+        mine = []
+        while True:
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            try:
+                status, resp_headers = target.request(method, path, body, headers)
+            except Exception:
+                status, resp_headers = 0, {}
+            took = time.perf_counter() - started
+            if started >= start_at:
+                mine.append((took, status, resp_headers.get('X-Stage-Timings')))
+        with lock:
+            samples.extend(mine)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return _summarize(name, samples, duration)
+
+
+def _summarize(name, samples, duration):
+    latencies = sorted(x[0] for x in samples)
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    stages = OrderedDict((x, 0.0) for x in STAGES)
+    server_total = 0.0
+    timed = 0
+    for took, _, raw in samples:
+        if not raw:
+            continue
+        timings = ujson.loads(raw)
+        timed += 1
+        server_total += timings.pop('total', 0)
+        for stage, seconds in timings.items():
+            stages[stage] = stages.get(stage, 0) + seconds
+    breakdown = OrderedDict()
+    if timed:
+        for stage, seconds in stages.items():
+            breakdown[stage] = _ms(seconds / timed)
+        # Flask routing, request parsing, etc.
+        breakdown['other'] = _ms((server_total - sum(stages.values())) / timed)
+        # The HTTP server, network and client; everything outside of Flask
+        breakdown['outside_app'] = _ms((sum(x[0] for x in samples if x[2]) - server_total) / timed)
+    return {'endpoint': name,
+            'requests': len(samples),
+            'errors': len([x for x in samples if not 200 <= x[1] < 400]),
+            'statuses': statuses,
+            'rps': round(len(samples) / duration, 1),
+            'mean_ms': _ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50_ms': _percentile(latencies, 50),
+            'p90_ms': _percentile(latencies, 90),
+            'p99_ms': _percentile(latencies, 99),
+            'max_ms': _ms(latencies[-1]) if latencies else None,
+            'stages_ms': breakdown}
+
+
+def compare(old, new, threshold):
+    """Find the end points that got slower.
+
+    :Returns: List - The regressions, as strings
+
+    :param old: The baseline results
+    :type old: Dictionary
+
+    :param new: The results to check against the baseline
+    :type new: Dictionary
+
+    :param threshold: How much worse (as a fraction) counts as a regression
+    :type threshold: Float
+    """
+    baseline = {x['endpoint']: x for x in old['results']}
+    regressions = []
+    print('{:<22} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'endpoint', 'old rps', 'new rps', 'old p50', 'new p50', 'old p99', 'new p99'))
+    for result in new['results']:
+        before = baseline.get(result['endpoint'])
+        if before is None:
+            continue
+        print('{:<22} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+            result['endpoint'], before['rps'], result['rps'], before['p50_ms'], result['p50_ms'],
+            before['p99_ms'], result['p99_ms']))
+        if result['rps'] < before['rps'] * (1 - threshold):
+            regressions.append('{}: req/s went from {} to {}'.format(result['endpoint'], before['rps'], result['rps']))
+        if before['p99_ms'] and result['p99_ms'] > before['p99_ms'] * (1 + threshold):
+            regressions.append('{}: p99 went from {}ms to {}ms'.format(result['endpoint'], before['p99_ms'], result['p99_ms']))
+    return regressions
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    return _ms(values[int(round(percent / 100 * (len(values) - 1)))])
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def _print_result(result):
+    print('{endpoint:<22} {rps:>8} req/s  p50 {p50_ms}ms  p99 {p99_ms}ms  errors {errors}'.format(**result), file=sys.stderr)
+    stages = '  '.join('{} {}'.format(x, y) for x, y in result['stages_ms'].items())
+    if stages:
+        print('    ms/request: {}'.format(stages), file=sys.stderr)
+
+
+def main(argv=None):
+    """Command line entry point
+
+    :Returns: Integer - The exit code
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'compare':
+        parser = argparse.ArgumentParser(prog='python -m benchmarks.load_test compare',
+                                         description='Compare two load test results')
+        parser.add_argument('old', help='The baseline results JSON file')
+        parser.add_argument('new', help='The results JSON file to check')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='How much worse (as a fraction) counts as a regression. Default 0.2')
+        args = parser.parse_args(argv[1:])
+        with open(args.old) as the_file:
+            old = ujson.load(the_file)
+        with open(args.new) as the_file:
+            new = ujson.load(the_file)
+        regressions = compare(old, new, args.threshold)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression))
+        return 1 if regressions else 0
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load_test',
+                                     description='Load test the API against an in-memory broker')
+    parser.add_argument('--server', choices=['inprocess', 'werkzeug', 'uwsgi'], default='inprocess',
+                        help='How to run the app. Default inprocess')
+    parser.add_argument('--url', default=None, help='Test an already running server instead')
+    parser.add_argument('--processes', type=int, default=1, help='uwsgi worker processes. Default 1')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per uwsgi worker. Default 1, like app.ini')
+    parser.add_argument('--gevent', type=int, default=0, help='gevent async cores per uwsgi worker. Default 0 (off)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once. Default 8')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds to test each end point. Default 5')
+    parser.add_argument('--warmup', type=float, default=1, help='Seconds to warm up each end point. Default 1')
+    parser.add_argument('--publish-latency', type=float, default=0.0,
+                        help='Extra seconds per publish, to stand in for the broker round trip. Default 0')
+    parser.add_argument('--token-cache', type=int, default=None,
+                        help='How many auth tokens the API caches; 0 disables the cache. Default VLAB_AVAMAR_TOKEN_CACHE')
+    parser.add_argument('--endpoints', nargs='+', default=list(ENDPOINTS.keys()), choices=list(ENDPOINTS.keys()),
+                        metavar='ENDPOINT', help='Which end points to test. Default all')
+    parser.add_argument('--output', '-o', default=None, help='Where to save the results. Default stdout')
+    args = parser.parse_args(argv)
+    if args.url:
+        target = HttpTarget(args.url)
+        server = 'external'
+    elif args.server == 'inprocess':
+        target = InProcessTarget(args.publish_latency, token_cache=args.token_cache)
+        server = 'inprocess'
+    else:
+        target = spawn(args.server, args.processes, args.threads, args.gevent, args.publish_latency,
+                       token_cache=args.token_cache)
+        server = args.server
+    results = []
+    try:
+        for name in args.endpoints:
+            result = load(target, name, args.concurrency, args.duration, args.warmup)
+            _print_result(result)
+            results.append(result)
+    finally:
+        target.close()
+    meta = {'commit': _commit(),
+            'created': time.time(),
+            'hostname': socket.gethostname(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'server': server,
+            'url': args.url,
+            'processes': args.processes,
+            'threads': args.threads,
+            'gevent': args.gevent,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'publish_latency': args.publish_latency,
+            'token_cache': args.token_cache}
+    output = ujson.dumps({'meta': meta, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as the_file:
+            the_file.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,13 @@
+# -*- coding: UTF-8 -*-
+"""
+The instrumented API app, for load testing under uwsgi (with ``--lazy-apps``, so
+every uwsgi worker gets its own in-memory broker)::
+
+    uwsgi --http-socket 127.0.0.1:5000 --module benchmarks.load_wsgi:app --lazy-apps
+"""
+import os
+
+from benchmarks.load_app import make_app
+
+
+app = make_app(publish_latency=float(os.environ.get('LOAD_PUBLISH_LATENCY', 0)))
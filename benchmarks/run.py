@@ -0,0 +1,415 @@
+# -*- coding: UTF-8 -*-
+"""
+Benchmarks the worker's vCenter operations against the fake vCenter, across
+several inventory sizes, and saves the results as JSON.
+
+Every operation is run twice per inventory size; ``cold`` is a freshly started
+worker (empty MoRef cache, no pooled sessions, no placement stats) and ``warm``
+is the same worker running the operation again. Each result records the wall
+time, the number of round trips to vCenter (broken down by SOAP method and
+property), and the peak memory allocated while the operation ran.
+
+Usage::
+
+    python -m benchmarks.run --sizes 10 100 1000 --output before.json
+    # make some changes...
+    python -m benchmarks.run --sizes 10 100 1000 --output after.json
+    python -m benchmarks.run compare before.json after.json
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import tarfile
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from collections import OrderedDict
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import ujson
+
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.worker import vmware
+from vlab_avamar_api.lib.worker.idle import IdleTracker
+from vlab_avamar_api.lib.worker.placement import Placement
+from vlab_avamar_api.lib.worker.sharding import HashRing
+from benchmarks.fake_vcenter import Simulator
+
+
+IMAGE = '19.4'
+NEW_VM = 'bench-ave'
+# Changes this small are ignored by ``compare``, no matter the threshold
+NOISE = OrderedDict([('wall_seconds', 0.01), ('round_trips', 0), ('peak_kb', 64)])
+IP_CONFIG = {'static-ip': '10.241.80.10',
+             'default-gateway': '10.241.80.1',
+             'netmask': '255.255.255.0',
+             'dns': ['10.241.80.1'],
+             'domain': 'vlab.local'}
+
+
+def _show_avamar(bench):
+    return vmware.show_avamar(bench.username)
+
+
+def _show_fleet(bench):
+    return vmware.show_fleet()
+
+
+def _reap_expired(bench):
+    return vmware.reap_expired(bench.logger, dry_run=True)
+
+
+def _suspend_idle(bench):
+    return vmware.suspend_idle(bench.logger)
+
+
+def _refresh_placement(bench):
+    for server in vmware.RING.servers:
+        with vmware._session(server) as vcenter:
+            vmware.refresh_placement(vcenter, server)
+
+
+def _delete_avamar(bench):
+    return vmware.delete_avamar(bench.username, bench.sim.machines(bench.username)[0], bench.logger)
+
+
+def _reset_avamar(bench):
+    return vmware.reset_avamar(bench.username, bench.sim.machines(bench.username)[0], bench.logger)
+
+
+def _create_avamar(bench):
+    return vmware.create_avamar(bench.username, NEW_VM, IMAGE, '{}_frontend'.format(bench.username),
+                                IP_CONFIG, bench.logger)
+
+
+OPERATIONS = OrderedDict([('show_avamar', _show_avamar),
+                          ('show_fleet', _show_fleet),
+                          ('reap_expired', _reap_expired),
+                          ('suspend_idle', _suspend_idle),
+                          ('refresh_placement', _refresh_placement),
+                          ('delete_avamar', _delete_avamar),
+                          ('reset_avamar', _reset_avamar),
+                          ('create_avamar', _create_avamar)])
+
+
+class Bench(object):
+    """Runs the operations against one inventory size.
+
+    :param sim: The fake vCenter servers
+    :type sim: benchmarks.fake_vcenter.Simulator
+
+    :param servers: The names of the vCenter servers (shards)
+    :type servers: List
+
+    :param work_dir: Where the OVA and the shared state go
+    :type work_dir: String
+    """
+    def __init__(self, sim, servers, work_dir):
+        self.sim = sim
+        self.servers = servers
+        self.work_dir = work_dir
+        self.username = sim.usernames[0]
+        self.logger = logging.getLogger('benchmarks')
+
+    def measure(self, name, phase):
+        """Run an operation, and record what it cost.
+
+        :Returns: Dictionary
+
+        :param name: The operation to run; see ``OPERATIONS``
+        :type name: String
+
+        :param phase: Either "cold" or "warm"
+        :type phase: String
+        """
+        func = OPERATIONS[name]
+        self.sim.reset()
+        if phase == 'cold':
+            self.restart_worker()
+        error = None
+        started = time.perf_counter()
+        try:
+            func(self)
+        except Exception as doh:
+            error = '{}: {}'.format(type(doh).__name__, getattr(doh, 'msg', None) or doh)
+        wall = time.perf_counter() - started
+        stats = self.sim.stats()
+        result = {'operation': name,
+                  'phase': phase,
+                  'users': len(self.sim.usernames),
+                  'vms': len(self.sim.usernames) * self.sim.vms_per_user,
+                  'wall_seconds': round(wall, 4),
+                  'round_trips': stats['round_trips'],
+                  'calls': stats['calls'],
+                  'leaked_views': stats['open_views'],
+                  'uploaded_bytes': stats['uploaded_bytes'],
+                  'error': error}
+        result['peak_kb'] = self.peak_memory(name, phase)
+        return result
+
+    def peak_memory(self, name, phase):
+        """Run an operation again, under tracemalloc. This is kept separate from
+        timing the operation, because tracemalloc slows everything down.
+
+        :Returns: Integer - Kilobytes
+        """
+        self.sim.reset()
+        if phase == 'cold':
+            self.restart_worker()
+        tracemalloc.start()
+        try:
+            OPERATIONS[name](self)
+        except Exception:
+            pass
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return round(peak / 1024)
+
+    def restart_worker(self):
+        """Forget everything the worker process has cached"""
+        vmware.MOREF_CACHE.invalidate()
+        vmware.POOLS.clear()
+        vmware.THROTTLES.clear()
+        for server in self.servers:
+            vmware.PLACEMENTS[server] = Placement(datastores=vmware.const.INF_VCENTER_DATASTORES,
+                                                  hosts=vmware.const.INF_VCENTER_HOSTS,
+                                                  max_age=vmware.const.VLAB_AVAMAR_PLACEMENT_REFRESH * 2,
+                                                  state=SharedState(os.path.join(self.work_dir, 'placement.json')),
+                                                  name=server,
+                                                  lease=vmware.const.VLAB_AVAMAR_DEPLOY_LEASE)
+
+
+def run(sizes, operations, shards, vms_per_user, ova_mb, sim_args, throttled=False):
+    """Benchmark the operations across the inventory sizes.
+
+    :Returns: Dictionary
+
+    :param sizes: The number of users to put in the inventory, per run
+    :type sizes: List
+
+    :param operations: The names of the operations to run; see ``OPERATIONS``
+    :type operations: List
+
+    :param shards: How many vCenter servers to spread the users across
+    :type shards: Integer
+
+    :param vms_per_user: How many VMs each user has
+    :type vms_per_user: Integer
+
+    :param ova_mb: How big the OVA deployed by ``create_avamar`` is
+    :type ova_mb: Integer
+
+    :param sim_args: Passed along to the Simulator
+    :type sim_args: Dictionary
+
+    :param throttled: Set to True to apply the default rate limit on normal calls
+    :type throttled: Boolean
+    """
+    servers = ['vcenter{}.vlab.local'.format(x) for x in range(shards)]
+    ring = HashRing(servers)
+    work_dir = tempfile.mkdtemp(prefix='vlab-avamar-bench-')
+    results = []
+    try:
+        _make_ova(os.path.join(work_dir, vmware.convert_name(IMAGE, 'Avamar')), ova_mb)
+        # Never wait on the rate limit; the cost of checking it is still measured
+        fake_const = vmware.const._replace(VLAB_AVAMAR_IMAGES_DIR=work_dir,
+                                           VLAB_AVAMAR_HEAVY_RATE=1e9,
+                                           VLAB_AVAMAR_HEAVY_BURST=1e9)
+        if not throttled:
+            fake_const = fake_const._replace(VLAB_AVAMAR_CALL_RATE=1e9, VLAB_AVAMAR_CALL_BURST=1e9)
+        with ExitStack() as stack:
+            stack.enter_context(patch.object(vmware, 'const', fake_const))
+            stack.enter_context(patch.object(vmware, 'RING', ring))
+            stack.enter_context(patch.object(vmware, 'PLACEMENTS', {}))
+            stack.enter_context(patch.object(vmware, 'THROTTLE_STATE',
+                                             SharedState(os.path.join(work_dir, 'throttle.json'))))
+            stack.enter_context(patch.object(vmware, 'IDLE',
+                                             IdleTracker(SharedState(os.path.join(work_dir, 'idle.json')))))
+            stack.enter_context(patch.object(vmware, 'REAPER_IDLE',
+                                             IdleTracker(SharedState(os.path.join(work_dir, 'reaper-idle.json')))))
+            for users in sizes:
+                sim = Simulator(servers, users, vms_per_user=vms_per_user, home=ring.get, **sim_args)
+                bench = Bench(sim, servers, work_dir)
+                try:
+                    with sim.installed():
+                        for name in operations:
+                            for phase in ('cold', 'warm'):
+                                result = bench.measure(name, phase)
+                                _print_result(result)
+                                results.append(result)
+                finally:
+                    sim.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    meta = {'commit': _commit(),
+            'created': time.time(),
+            'hostname': socket.gethostname(),
+            'python': platform.python_version(),
+            'shards': shards,
+            'vms_per_user': vms_per_user,
+            'ova_mb': ova_mb}
+    meta.update(sim_args)
+    return {'meta': meta, 'results': results}
+
+
+def compare(old, new, threshold):
+    """Find the operations that got slower, or make more round trips to vCenter.
+
+    :Returns: List - The regressions, as strings
+
+    :param old: The baseline results
+    :type old: Dictionary
+
+    :param new: The results to check against the baseline
+    :type new: Dictionary
+
+    :param threshold: How much worse (as a fraction) counts as a regression
+    :type threshold: Float
+    """
+    baseline = {(x['operation'], x['users'], x['phase']): x for x in old['results']}
+    regressions = []
+    print('{:<18} {:>6} {:<5} {:>10} {:>10} {:>8} {:>8} {:>9} {:>9}'.format(
+        'operation', 'users', 'phase', 'old wall', 'new wall', 'old RTs', 'new RTs', 'old KB', 'new KB'))
+    for result in new['results']:
+        key = (result['operation'], result['users'], result['phase'])
+        before = baseline.get(key)
+        if before is None:
+            continue
+        print('{:<18} {:>6} {:<5} {:>10} {:>10} {:>8} {:>8} {:>9} {:>9}'.format(
+            key[0], key[1], key[2], before['wall_seconds'], result['wall_seconds'],
+            before['round_trips'], result['round_trips'], before['peak_kb'], result['peak_kb']))
+        for metric, noise in NOISE.items():
+            if result[metric] > before[metric] * (1 + threshold) and result[metric] - before[metric] > noise:
+                regressions.append('{} {} users ({}): {} went from {} to {}'.format(
+                    key[0], key[1], key[2], metric, before[metric], result[metric]))
+        if result['error'] and not before['error']:
+            regressions.append('{} {} users ({}): now fails with {}'.format(key[0], key[1], key[2], result['error']))
+    return regressions
+
+
+def _make_ova(path, size_mb):
+    """Create an OVA with two (empty) disks"""
+    disks = ['disk-0.vmdk', 'disk-1.vmdk']
+    ovf = ['<?xml version="1.0" encoding="UTF-8"?>',
+           '<Envelope xmlns:ovf="http://schemas.dmtf.org/ovf/envelope/1">',
+           '<References>']
+    ovf += ['<File ovf:href="{}" ovf:id="file{}"/>'.format(x, y) for y, x in enumerate(disks)]
+    ovf += ['</References>',
+            '<NetworkSection><Network ovf:name="VM Network"/></NetworkSection>',
+            '</Envelope>']
+    work_dir = os.path.dirname(path)
+    ovf_path = os.path.join(work_dir, 'avamar.ovf')
+    with open(ovf_path, 'w') as the_file:
+        the_file.write('\n'.join(ovf))
+    chunk = b'\0' * 1024**2
+    with tarfile.open(path, 'w') as tar:
+        tar.add(ovf_path, arcname='avamar.ovf')
+        for disk in disks:
+            disk_path = os.path.join(work_dir, disk)
+            with open(disk_path, 'wb') as the_file:
+                for _ in range(max(1, size_mb // len(disks))):
+                    the_file.write(chunk)
+            tar.add(disk_path, arcname=disk)
+            os.remove(disk_path)
+    os.remove(ovf_path)
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _print_result(result):
+    print('{operation:<18} {users:>6} users {phase:<5} {wall_seconds:>9}s {round_trips:>7} round trips {peak_kb:>8} KB'.format(**result),
+          file=sys.stderr)
+    if result['error']:
+        print('    failed: {}'.format(result['error']), file=sys.stderr)
+
+
+def _parse_faults(values):
+    faults = {}
+    for value in values:
+        name, rate = value.split('=')
+        faults[name] = float(rate)
+    return faults
+
+
+def main(argv=None):
+    """Command line entry point
+
+    :Returns: Integer - The exit code
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'compare':
+        parser = argparse.ArgumentParser(prog='python -m benchmarks.run compare',
+                                         description='Compare two benchmark results')
+        parser.add_argument('old', help='The baseline results JSON file')
+        parser.add_argument('new', help='The results JSON file to check')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='How much worse (as a fraction) counts as a regression. Default 0.2')
+        args = parser.parse_args(argv[1:])
+        with open(args.old) as the_file:
+            old = ujson.load(the_file)
+        with open(args.new) as the_file:
+            new = ujson.load(the_file)
+        regressions = compare(old, new, args.threshold)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression))
+        return 1 if regressions else 0
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description='Benchmark the worker against a fake vCenter')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='The number of users in the inventory. Default 10 100 1000')
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS.keys()), choices=list(OPERATIONS.keys()),
+                        help='Which operations to benchmark. Default all')
+    parser.add_argument('--vms-per-user', type=int, default=5, help='Default 5')
+    parser.add_argument('--shards', type=int, default=1, help='The number of vCenter servers. Default 1')
+    parser.add_argument('--latency', type=float, default=0.001, help='Seconds per SOAP call. Default 0.001')
+    parser.add_argument('--object-latency', type=float, default=0.00002,
+                        help='Extra seconds per object returned by the PropertyCollector. Default 0.00002')
+    parser.add_argument('--time-scale', type=float, default=0.001,
+                        help='Real seconds per vCenter second, for tasks and sleeps. Default 0.001')
+    parser.add_argument('--fault', action='append', default=[], metavar='NAME=RATE',
+                        help='Make a SOAP method or property (i.e. VirtualMachine.runtime) fail at a given rate')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='The rate SOAP calls fail with a dropped connection')
+    parser.add_argument('--task-failure', type=float, default=0.0, help='The rate tasks fail')
+    parser.add_argument('--page-size', type=int, default=100, help='Objects per RetrievePropertiesEx page. Default 100')
+    parser.add_argument('--ova-mb', type=int, default=64, help='The size of the OVA to deploy. Default 64')
+    parser.add_argument('--upload-mbps', type=float, default=None, help='Limit the upload speed of each disk')
+    parser.add_argument('--seed', type=int, default=0, help='Makes the inventory and failures repeatable')
+    parser.add_argument('--throttled', action='store_true',
+                        help='Apply the default rate limit to normal SOAP calls, instead of disabling it')
+    parser.add_argument('--output', '-o', default=None, help='Where to save the results. Default stdout')
+    args = parser.parse_args(argv)
+    sim_args = {'latency': args.latency,
+                'object_latency': args.object_latency,
+                'time_scale': args.time_scale,
+                'faults': _parse_faults(args.fault),
+                'drop_rate': args.drop_rate,
+                'task_failure': args.task_failure,
+                'page_size': args.page_size,
+                'upload_mbps': args.upload_mbps,
+                'seed': args.seed}
+    results = run(args.sizes, args.operations, args.shards, args.vms_per_user, args.ova_mb, sim_args,
+                  throttled=args.throttled)
+    if args.output:
+        with open(args.output, 'w') as the_file:
+            ujson.dump(results, the_file, indent=2)
+    else:
+        print(ujson.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+"""
+Times validating request bodies against the view schemas. It compares the
+per-request ``jsonschema.validate`` done by vlab_api_common's ``validate_input``
+(plus merging in the ip-config defaults by hand, like the views used to) with
+the validators that ``vlab_avamar_api.lib.validation`` compiles once::
+
+    python -m benchmarks.validation --number 20000
+"""
+import sys
+import copy
+import timeit
+import argparse
+
+import ujson
+from jsonschema import validate, draft4_format_checker
+
+from vlab_avamar_api.lib.validation import compile_schema
+from vlab_avamar_api.lib.views.avamar import AvamarView
+
+
+BODIES = {
+    'POST': (AvamarView.POST_SCHEMA, {'name': 'myAvamar', 'image': '19.4', 'network': 'frontend',
+                                      'ip-config': {'static-ip': '10.241.80.10'}}),
+    'DELETE': (AvamarView.DELETE_SCHEMA, {'name': 'myAvamar'}),
+    'DELETE many': (AvamarView.DELETE_SCHEMA, {'name': ['myAvamar{}'.format(x) for x in range(20)], 'background': True}),
+    'reset': (AvamarView.RESET_SCHEMA, {'name': 'myAvamar'}),
+}
+
+
+def per_request(schema, body):
+    """How vlab_api_common validates, plus the hand-written defaults"""
+    body = copy.deepcopy(body)
+    validate(instance=body, schema=schema, format_checker=draft4_format_checker)
+    if 'ip-config' in body:
+        ip_config = {'default-gateway': '192.168.1.1',
+                     'netmask': '255.255.255.0',
+                     'dns': ['192.168.1.1'],
+                     'domain': "vlab.local"}
+        ip_config.update(body['ip-config'])
+
+
+def compiled(validator, body):
+    """How vlab_avamar_api validates, defaults included"""
+    body = copy.deepcopy(body)
+    validator.validate(body)
+
+
+def main(argv=None):
+    """Command line entry point
+
+    :Returns: Integer - The exit code
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.validation',
+                                     description='Time validating request bodies, per request vs precompiled')
+    parser.add_argument('--number', type=int, default=5000, help='How many times to validate each body. Default 5000')
+    parser.add_argument('--output', '-o', default=None, help='Where to save the results as JSON')
+    args = parser.parse_args(argv)
+    results = []
+    for name, (schema, body) in BODIES.items():
+        validator = compile_schema(schema)
+        # The deepcopy stands in for parsing the body; it's the same for both
+        baseline = timeit.timeit(lambda: copy.deepcopy(body), number=args.number)
+        before = timeit.timeit(lambda: per_request(schema, body), number=args.number) - baseline
+        after = timeit.timeit(lambda: compiled(validator, body), number=args.number) - baseline
+        result = {'body': name,
+                  'before_us': round(before / args.number * 10**6, 2),
+                  'after_us': round(after / args.number * 10**6, 2)}
+        result['speedup'] = round(result['before_us'] / result['after_us'], 1)
+        results.append(result)
+        print('{body:<12} before {before_us:>8}us  after {after_us:>8}us  {speedup}x'.format(**result), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as the_file:
+            the_file.write(ujson.dumps({'number': args.number, 'results': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,7 +10,7 @@ setup(name="vlab-avamar-api",
       author="Nicholas Willhite,",
       author_email='willnx84@gmail.com',
       version='2021.01.21',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks']),
       include_package_data=True,
       package_files={'vlab_avamar_api' : ['app.ini']},
       description="avamar",
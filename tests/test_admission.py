@@ -0,0 +1,118 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the admission.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_avamar_api.lib import admission
+from vlab_avamar_api.lib.state import SharedState
+
+
+class TestAdmission(unittest.TestCase):
+    """A set of test cases for the Admission object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        state = SharedState(os.path.join(self.tmp_dir, 'admission.json'))
+        self.admission = admission.Admission(state=state, user_cap=1, global_cap=2, lease=60)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_admit(self):
+        """``Admission.admit`` lets a deploy start when nothing else is running"""
+        self.assertTrue(self.admission.admit('alice', 'task1'))
+
+    def test_admit_user_cap(self):
+        """``Admission.admit`` enforces the per-user cap"""
+        self.admission.admit('alice', 'task1')
+
+        self.assertFalse(self.admission.admit('alice', 'task2'))
+
+    def test_admit_global_cap(self):
+        """``Admission.admit`` enforces the global cap"""
+        self.admission.admit('alice', 'task1')
+        self.admission.admit('bob', 'task2')
+
+        self.assertFalse(self.admission.admit('carol', 'task3'))
+
+    def test_admit_redelivered(self):
+        """``Admission.admit`` admits a task that's already running"""
+        self.admission.admit('alice', 'task1')
+
+        self.assertTrue(self.admission.admit('alice', 'task1'))
+
+    def test_release(self):
+        """``Admission.release`` frees up the slot for the next deploy"""
+        self.admission.admit('alice', 'task1')
+        self.admission.enqueue('alice', 'task2')
+        self.admission.release('alice', 'task1')
+
+        self.assertTrue(self.admission.admit('alice', 'task2'))
+
+    def test_release_queued(self):
+        """``Admission.release`` removes a deploy that was queued, but never sent"""
+        self.admission.admit('alice', 'task1')
+        self.admission.enqueue('bob', 'task2')
+        self.admission.enqueue('carol', 'task3')
+        self.admission.release('bob', 'task2')
+
+        self.assertEqual(self.admission.stats()['queued'], {'carol': 1})
+        self.assertEqual(self.admission.position('task3'), 0)
+
+    def test_round_robin(self):
+        """``Admission`` serves queued deploys round-robin across users, not FIFO"""
+        self.admission.admit('alice', 'task0')
+        self.admission.admit('bob', 'task00')
+        for index in range(3):
+            self.admission.enqueue('alice', 'alice{}'.format(index))
+        self.admission.enqueue('bob', 'bob0')
+
+        self.assertEqual(self.admission.position('alice0'), 0)
+        self.assertEqual(self.admission.position('bob0'), 1)
+        self.assertEqual(self.admission.position('alice1'), 2)
+
+    def test_round_robin_skips_capped_user(self):
+        """``Admission.admit`` skips over users that are at their own cap"""
+        self.admission.admit('alice', 'task0')
+        self.admission.enqueue('alice', 'alice1')
+        self.admission.enqueue('bob', 'bob1')
+
+        self.assertFalse(self.admission.admit('alice', 'alice1'))
+        self.assertTrue(self.admission.admit('bob', 'bob1'))
+
+    def test_enqueue_position(self):
+        """``Admission.enqueue`` returns how many deploys are ahead in the queue"""
+        self.assertEqual(self.admission.enqueue('alice', 'task1'), 0)
+        self.assertEqual(self.admission.enqueue('alice', 'task2'), 1)
+
+    def test_position_not_queued(self):
+        """``Admission.position`` returns None for a deploy that is not queued"""
+        self.assertTrue(self.admission.position('task1') is None)
+
+    @patch.object(admission.time, 'time')
+    def test_lease(self, fake_time):
+        """``Admission`` drops running deploys that outlived the lease"""
+        fake_time.return_value = 100
+        self.admission.admit('alice', 'task1')
+        fake_time.return_value = 200
+
+        self.assertTrue(self.admission.admit('alice', 'task2'))
+
+    def test_stats(self):
+        """``Admission.stats`` counts the running and queued deploys per user"""
+        self.admission.admit('alice', 'task1')
+        self.admission.enqueue('alice', 'task2')
+
+        expected = {'running': {'alice': 1}, 'queued': {'alice': 1}}
+
+        self.assertEqual(self.admission.stats(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
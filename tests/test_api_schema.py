@@ -52,6 +52,56 @@ class TestAvamarViewSchema(unittest.TestCase):
 
         self.assertTrue(schema_valid)
 
+    def test_fleet_schema(self):
+        """The schema defined for GET on /fleet is valid"""
+        try:
+            Draft4Validator.check_schema(avamar.AvamarView.FLEET_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
+    def test_reset_schema(self):
+        """The schema defined for POST on /reset is valid"""
+        try:
+            Draft4Validator.check_schema(avamar.AvamarView.RESET_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
+    def test_suspend_schema(self):
+        """The schema defined for POST on /suspend is valid"""
+        try:
+            Draft4Validator.check_schema(avamar.AvamarView.SUSPEND_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
+    def test_resume_schema(self):
+        """The schema defined for POST on /resume is valid"""
+        try:
+            Draft4Validator.check_schema(avamar.AvamarView.RESUME_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
+    def test_reaper_schema(self):
+        """The schema defined for GET on /reaper is valid"""
+        try:
+            Draft4Validator.check_schema(avamar.AvamarView.REAPER_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
 
 if __name__ == '__main__':
     unittest.main()
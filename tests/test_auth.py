@@ -0,0 +1,169 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the auth.py module
+"""
+import time
+import unittest
+from unittest.mock import patch
+
+import ujson
+from flask import Flask
+from flask_classy import FlaskView
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from vlab_avamar_api.lib import auth
+
+
+class TestTokenCache(unittest.TestCase):
+    """A set of test cases for the TokenCache object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache = auth.TokenCache(size=2)
+        self.claims = {'username': 'bob', 'exp': time.time() + 60}
+
+    def test_get(self):
+        """``TokenCache.get`` returns the claims and whether the token was verified"""
+        self.cache.put('token1', self.claims, True)
+
+        claims, verified = self.cache.get('token1')
+
+        self.assertEqual(claims, self.claims)
+        self.assertTrue(verified)
+
+    def test_get_copy(self):
+        """``TokenCache.get`` returns a copy, so one request cannot change the claims another sees"""
+        self.cache.put('token1', self.claims, True)
+        claims, _ = self.cache.get('token1')
+        claims['username'] = 'alice'
+
+        claims, _ = self.cache.get('token1')
+
+        self.assertEqual(claims['username'], 'bob')
+
+    def test_get_miss(self):
+        """``TokenCache.get`` returns (None, False) for unknown tokens"""
+        self.assertEqual(self.cache.get('token1'), (None, False))
+
+    def test_get_expired(self):
+        """``TokenCache.get`` does not return tokens that are past their ``exp``"""
+        self.claims['exp'] = time.time() - 1
+        self.cache.put('token1', self.claims, True)
+
+        self.assertEqual(self.cache.get('token1'), (None, False))
+
+    def test_lru(self):
+        """``TokenCache`` evicts the least recently used token once full"""
+        self.cache.put('token1', self.claims, True)
+        self.cache.put('token2', self.claims, True)
+        self.cache.get('token1')
+        self.cache.put('token3', self.claims, True)
+
+        self.assertEqual(self.cache.get('token2'), (None, False))
+        self.assertEqual(self.cache.get('token1')[0], self.claims)
+
+    def test_disabled(self):
+        """``TokenCache`` with a size of zero never caches"""
+        cache = auth.TokenCache(size=0)
+        cache.put('token1', self.claims, True)
+
+        self.assertEqual(cache.get('token1'), (None, False))
+
+    def test_hashed(self):
+        """``TokenCache`` does not keep the token itself"""
+        self.cache.put('token1', self.claims, True)
+
+        self.assertFalse('token1' in self.cache._tokens)
+
+
+class FakeView(FlaskView):
+    route_base = '/fake'
+
+    @auth.requires(verify=False, version=2)
+    def get(self, *args, **kwargs):
+        return ujson.dumps({'user': kwargs['token']['username'], 'cached': 'cached' in kwargs})
+
+    @auth.requires(verify=True, version=2)
+    def post(self, *args, **kwargs):
+        return ujson.dumps({'user': kwargs['token']['username']})
+
+    @auth.requires(username=['alice'], version=None, verify=False)
+    def delete(self, *args, **kwargs):
+        return ujson.dumps({'user': kwargs['token']['username']})
+
+
+class TestRequires(unittest.TestCase):
+    """A set of test cases for the ``requires`` decorator"""
+    def setUp(self):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        FakeView.register(app)
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        self.token = generate_v2_test_token(username='bob', expires_at=time.time() + 60)
+        self.tokens_patcher = patch.object(auth, 'TOKENS', auth.TokenCache(size=10))
+        self.tokens_patcher.start()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tokens_patcher.stop()
+
+    @patch.object(auth.http_auth, 'get_token_from_header')
+    def test_cached(self, fake_get_token_from_header):
+        """``requires`` only decodes a token once"""
+        fake_get_token_from_header.return_value = {'username': 'bob', 'version': 2,
+                                                   'client_ip': '127.0.0.1', 'exp': time.time() + 60}
+        self.app.get('/fake/', headers={'X-Auth': self.token})
+        resp = self.app.get('/fake/', headers={'X-Auth': self.token})
+
+        self.assertEqual(fake_get_token_from_header.call_count, 1)
+        self.assertEqual(ujson.loads(resp.data), {'user': 'bob', 'cached': False})
+
+    def test_not_cached_invalid(self):
+        """``requires`` does not cache tokens that fail to decode"""
+        resp = self.app.get('/fake/', headers={'X-Auth': 'not a token'})
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(auth.TOKENS.get('not a token'), (None, False))
+
+    def test_not_cached_forbidden(self):
+        """``requires`` does not cache tokens that fail the ACL"""
+        resp = self.app.delete('/fake/', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(auth.TOKENS.get(self.token), (None, False))
+
+    def test_forbidden_cached(self):
+        """``requires`` still applies the ACL to cached tokens"""
+        self.app.get('/fake/', headers={'X-Auth': self.token})
+        resp = self.app.delete('/fake/', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 403)
+
+    def test_client_ip(self):
+        """``requires`` does not use a cached token sent from a different IP"""
+        self.app.get('/fake/', headers={'X-Auth': self.token})
+        resp = self.app.get('/fake/', headers={'X-Auth': self.token, 'X-Forwarded-For': '10.1.1.1'})
+
+        self.assertEqual(resp.status_code, 401)
+
+    @patch.object(auth.http_auth, 'requests')
+    def test_verified(self, fake_requests):
+        """``requires`` only calls the auth server once per token"""
+        self.app.post('/fake/', headers={'X-Auth': self.token})
+        self.app.post('/fake/', headers={'X-Auth': self.token})
+
+        self.assertEqual(fake_requests.get.call_count, 1)
+
+    @patch.object(auth.http_auth, 'requests')
+    def test_verified_upgrade(self, fake_requests):
+        """``requires`` verifies a cached token that was decoded without verification"""
+        self.app.get('/fake/', headers={'X-Auth': self.token})
+        self.app.post('/fake/', headers={'X-Auth': self.token})
+        self.app.post('/fake/', headers={'X-Auth': self.token})
+
+        self.assertEqual(fake_requests.get.call_count, 1)
+        self.assertTrue(auth.TOKENS.get(self.token)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
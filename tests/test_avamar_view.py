@@ -38,6 +38,20 @@ class TestAvamarView(unittest.TestCase):
         cls.fake_task = MagicMock()
         cls.fake_task.id = 'asdf-asdf-asdf'
         app.celery_app.send_task.return_value = cls.fake_task
+        # Mock the shared admission control queue
+        cls.admission_patcher = patch.object(avamar, 'ADMISSION')
+        cls.fake_admission = cls.admission_patcher.start()
+        cls.fake_admission.enqueue.return_value = 3
+        # Mock the shared ETag state
+        cls.generations_patcher = patch.object(avamar, 'GENERATIONS')
+        cls.fake_generations = cls.generations_patcher.start()
+        cls.fake_generations.etag.return_value = (None, False)
+
+    @classmethod
+    def tearDown(cls):
+        """Runs after every test case"""
+        cls.admission_patcher.stop()
+        cls.generations_patcher.stop()
 
     def test_v1_deprecated(self):
         """AvamarView - GET on /api/1/inf/avamar/server returns an HTTP 404"""
@@ -83,6 +97,76 @@ class TestAvamarView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_post_queue_position(self):
+        """AvamarView - POST on /api/2/inf/avamar/server says where the deploy sits in the queue"""
+        resp = self.app.post('/api/2/inf/avamar/server',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'name': "myAvamarBox",
+                                   'image': "someVersion",
+                                   'ip-config': self.ip_config})
+
+        position = resp.json['content']['queue-position']
+        expected = 3
+
+        self.assertEqual(position, expected)
+
+    def test_post_enqueues_first(self):
+        """AvamarView - POST on /api/2/inf/avamar/server enqueues the deploy under the ID of the task it sends"""
+        self.app.post('/api/2/inf/avamar/server',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN",
+                            'name': "myAvamarBox",
+                            'image': "someVersion",
+                            'ip-config': self.ip_config})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+        queued_id = self.fake_admission.enqueue.call_args[0][1]
+
+        self.assertEqual(the_kwargs['task_id'], queued_id)
+
+    def test_post_send_fails(self):
+        """AvamarView - POST on /api/2/inf/avamar/server returns an HTTP 503 if the task cannot be sent"""
+        self.app.application.celery_app.send_task.side_effect = RuntimeError('testing')
+        resp = self.app.post('/api/2/inf/avamar/server',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'name': "myAvamarBox",
+                                   'image': "someVersion",
+                                   'ip-config': self.ip_config})
+
+        self.assertEqual(resp.status_code, 503)
+
+    def test_post_send_fails_releases(self):
+        """AvamarView - POST on /api/2/inf/avamar/server removes the deploy from the queue if the task cannot be sent"""
+        self.app.application.celery_app.send_task.side_effect = RuntimeError('testing')
+        self.app.post('/api/2/inf/avamar/server',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN",
+                            'name': "myAvamarBox",
+                            'image': "someVersion",
+                            'ip-config': self.ip_config})
+
+        queued_id = self.fake_admission.enqueue.call_args[0][1]
+
+        self.fake_admission.release.assert_called_with('bob', queued_id)
+
+    def test_profile_header(self):
+        """AvamarView - The X-Profile header asks the worker to profile the task"""
+        self.app.get('/api/2/inf/avamar/server', headers={'X-Auth': self.token, 'X-Profile': 'true'})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(the_kwargs['headers'], {'vlab_profile': True})
+
+    def test_no_profile_header(self):
+        """AvamarView - Tasks are not profiled by default"""
+        self.app.get('/api/2/inf/avamar/server', headers={'X-Auth': self.token})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(the_kwargs['headers'], {})
+
     def test_post_task_link(self):
         """AvamarView - POST on /api/2/inf/avamar/server sets the Link header"""
         resp = self.app.post('/api/2/inf/avamar/server',
@@ -108,6 +192,35 @@ class TestAvamarView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_post_ip_config_defaults(self):
+        """AvamarView - POST on /api/2/inf/avamar/server fills in the ip-config defaults from the POST_SCHEMA"""
+        self.app.post('/api/2/inf/avamar/server',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN",
+                            'name': "myAvamarBox",
+                            'image': "someVersion",
+                            'ip-config': {'static-ip': '1.2.3.4'}})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        ip_config = the_args[1][4]
+        expected = {'static-ip': '1.2.3.4',
+                    'default-gateway': '192.168.1.1',
+                    'netmask': '255.255.255.0',
+                    'dns': ['192.168.1.1'],
+                    'domain': 'vlab.local'}
+
+        self.assertEqual(ip_config, expected)
+
+    def test_delete_background_default(self):
+        """AvamarView - DELETE on /api/2/inf/avamar/server does not delete in the background by default"""
+        self.app.delete('/api/2/inf/avamar/server',
+                        headers={'X-Auth': self.token},
+                        json={'name' : 'myAvamarBox'})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+
+        self.assertFalse(the_args[1][3])
+
     def test_delete_task_link(self):
         """AvamarView - DELETE on /api/2/inf/avamar/server sets the Link header"""
         resp = self.app.delete('/api/2/inf/avamar/server',
@@ -119,6 +232,17 @@ class TestAvamarView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_delete_many(self):
+        """AvamarView - DELETE on /api/2/inf/avamar/server accepts a list of names"""
+        resp = self.app.delete('/api/2/inf/avamar/server',
+                               headers={'X-Auth': self.token},
+                               json={'name' : ['box1', 'box2'], 'background': True})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        expected = ['bob', ['box1', 'box2'], 'noId', True]
+
+        self.assertEqual(the_args[1], expected)
+
     def test_image(self):
         """AvamarView - GET on the ./image end point returns the a task-id"""
         resp = self.app.get('/api/2/inf/avamar/server/image',
@@ -139,6 +263,189 @@ class TestAvamarView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_fleet_non_admin(self):
+        """AvamarView - GET on the ./fleet end point is forbidden for non-admins"""
+        resp = self.app.get('/api/2/inf/avamar/server/fleet',
+                            headers={'X-Auth': self.token})
+
+        status = resp.status_code
+        expected = 403
+
+        self.assertEqual(status, expected)
+
+    def test_fleet_no_blank_admin(self):
+        """AvamarView - An empty username never matches the admin ACL of the ./fleet end point"""
+        self.assertFalse('' in avamar.const.VLAB_AVAMAR_ADMINS)
+
+    def test_fleet(self):
+        """AvamarView - GET on the ./fleet end point returns a task-id for admins"""
+        avamar.const.VLAB_AVAMAR_ADMINS.append('bob')
+        try:
+            resp = self.app.get('/api/2/inf/avamar/server/fleet',
+                                headers={'X-Auth': self.token})
+        finally:
+            avamar.const.VLAB_AVAMAR_ADMINS.remove('bob')
+
+        task_id = resp.json['content']['task-id']
+        expected = 'asdf-asdf-asdf'
+
+        self.assertEqual(task_id, expected)
+
+    @patch.object(avamar, 'const', avamar.const._replace(VLAB_AVAMAR_RESET_SNAPSHOT=True))
+    def test_reset(self):
+        """AvamarView - POST on the ./reset end point returns a task-id"""
+        resp = self.app.post('/api/2/inf/avamar/server/reset',
+                             headers={'X-Auth': self.token},
+                             json={'name': 'myAvamarBox'})
+
+        task_id = resp.json['content']['task-id']
+        expected = 'asdf-asdf-asdf'
+
+        self.assertEqual(task_id, expected)
+
+    def test_reset_disabled(self):
+        """AvamarView - POST on the ./reset end point returns an HTTP 400 when reset snapshots are not taken"""
+        resp = self.app.post('/api/2/inf/avamar/server/reset',
+                             headers={'X-Auth': self.token},
+                             json={'name': 'myAvamarBox'})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    @patch.object(avamar, 'const', avamar.const._replace(VLAB_AVAMAR_RESET_SNAPSHOT=True))
+    def test_reset_task_name(self):
+        """AvamarView - POST on the ./reset end point calls the avamar.reset_server task"""
+        self.app.post('/api/2/inf/avamar/server/reset',
+                      headers={'X-Auth': self.token},
+                      json={'name': 'myAvamarBox'})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        expected = 'avamar.reset_server'
+
+        self.assertEqual(the_args[0], expected)
+
+    def test_suspend(self):
+        """AvamarView - POST on the ./suspend end point returns a task-id"""
+        resp = self.app.post('/api/2/inf/avamar/server/suspend',
+                             headers={'X-Auth': self.token},
+                             json={'name': 'myAvamarBox'})
+
+        task_id = resp.json['content']['task-id']
+        expected = 'asdf-asdf-asdf'
+
+        self.assertEqual(task_id, expected)
+
+    def test_suspend_bad_body(self):
+        """AvamarView - POST on the ./suspend end point returns HTTP 400 without a name"""
+        resp = self.app.post('/api/2/inf/avamar/server/suspend',
+                             headers={'X-Auth': self.token},
+                             json={})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_resume(self):
+        """AvamarView - POST on the ./resume end point returns a task-id"""
+        resp = self.app.post('/api/2/inf/avamar/server/resume',
+                             headers={'X-Auth': self.token},
+                             json={'name': 'myAvamarBox'})
+
+        task_id = resp.json['content']['task-id']
+        expected = 'asdf-asdf-asdf'
+
+        self.assertEqual(task_id, expected)
+
+    def test_suspend_task_name(self):
+        """AvamarView - POST on the ./suspend end point calls the avamar.suspend_server task"""
+        self.app.post('/api/2/inf/avamar/server/suspend',
+                      headers={'X-Auth': self.token},
+                      json={'name': 'myAvamarBox'})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        expected = 'avamar.suspend_server'
+
+        self.assertEqual(the_args[0], expected)
+
+    def test_resume_task_name(self):
+        """AvamarView - POST on the ./resume end point calls the avamar.resume_server task"""
+        self.app.post('/api/2/inf/avamar/server/resume',
+                      headers={'X-Auth': self.token},
+                      json={'name': 'myAvamarBox'})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        expected = 'avamar.resume_server'
+
+        self.assertEqual(the_args[0], expected)
+
+    def test_reaper_non_admin(self):
+        """AvamarView - GET on the ./reaper end point is forbidden for non-admins"""
+        resp = self.app.get('/api/2/inf/avamar/server/reaper',
+                            headers={'X-Auth': self.token})
+
+        status = resp.status_code
+        expected = 403
+
+        self.assertEqual(status, expected)
+
+    def test_reaper_dry_run(self):
+        """AvamarView - GET on the ./reaper end point only ever does a dry-run"""
+        avamar.const.VLAB_AVAMAR_ADMINS.append('bob')
+        try:
+            self.app.get('/api/2/inf/avamar/server/reaper',
+                         headers={'X-Auth': self.token})
+        finally:
+            avamar.const.VLAB_AVAMAR_ADMINS.remove('bob')
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        expected = ('avamar.reap_expired', [True, 'noId'])
+
+        self.assertEqual(the_args, expected)
+
+    def test_task_status(self):
+        """AvamarView - GET on the ./task end point returns the task status"""
+        self.app.application.celery_app.AsyncResult.return_value.status = 'PENDING'
+        resp = self.app.get('/api/2/inf/avamar/server/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        status = resp.json['content']['status']
+        expected = 'PENDING'
+
+        self.assertEqual(status, expected)
+
+    def test_get_not_modified(self):
+        """AvamarView - GET on /api/2/inf/avamar/server returns an HTTP 304 when the inventory has not changed"""
+        self.fake_generations.etag.return_value = ('abc123', True)
+        resp = self.app.get('/api/2/inf/avamar/server',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"abc123"'})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    def test_get_modified(self):
+        """AvamarView - GET on /api/2/inf/avamar/server sends a task when the ETag does not match"""
+        self.fake_generations.etag.return_value = ('abc123', True)
+        resp = self.app.get('/api/2/inf/avamar/server',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"def456"'})
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.headers['ETag'], '"abc123"')
+
+    def test_get_stale(self):
+        """AvamarView - GET on /api/2/inf/avamar/server sends a task when the ETag is too old to trust"""
+        self.fake_generations.etag.return_value = ('abc123', False)
+        resp = self.app.get('/api/2/inf/avamar/server',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"abc123"'})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_image_not_modified(self):
+        """AvamarView - GET on the ./image end point returns an HTTP 304 when the images have not changed"""
+        self.fake_generations.etag.return_value = ('abc123', True)
+        resp = self.app.get('/api/2/inf/avamar/server/image',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"abc123"'})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
 
 if __name__ == '__main__':
     unittest.main()
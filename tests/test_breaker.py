@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the breaker.py module
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from vlab_avamar_api.lib import breaker
+from vlab_avamar_api.lib.state import SharedState
+
+
+class TestBreaker(unittest.TestCase):
+    """A set of test cases for the breaker.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state = SharedState(os.path.join(self.tmp_dir, 'throttle.json'))
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_open_for(self):
+        """``open_for`` returns how many seconds are left before calls are tried again"""
+        output = breaker.open_for({'failures': 2, 'opened': 100}, failures=2, reset=30, now=110)
+
+        self.assertEqual(output, 20)
+
+    def test_open_for_closed(self):
+        """``open_for`` returns zero while there are fewer failures than the threshold"""
+        output = breaker.open_for({'failures': 1, 'opened': 100}, failures=2, reset=30, now=110)
+
+        self.assertEqual(output, 0)
+
+    def test_open_for_reset(self):
+        """``open_for`` returns zero once the breaker has been open long enough"""
+        output = breaker.open_for({'failures': 2, 'opened': 100}, failures=2, reset=30, now=131)
+
+        self.assertEqual(output, 0)
+
+    def test_check(self):
+        """``check`` raises Overloaded while the breaker of the vCenter is open"""
+        with self.state.locked() as data:
+            data['vcenter'] = {'breaker': {'failures': 2, 'opened': time.time()}}
+
+        with self.assertRaises(breaker.Overloaded):
+            breaker.check(self.state, 'vcenter', failures=2, reset=30)
+
+    def test_check_other_server(self):
+        """``check`` only looks at the breaker of the supplied vCenter"""
+        with self.state.locked() as data:
+            data['vcenter'] = {'breaker': {'failures': 2, 'opened': time.time()}}
+
+        breaker.check(self.state, 'vcenter2', failures=2, reset=30)
+
+    def test_check_no_state(self):
+        """``check`` does nothing before any worker has recorded a breaker"""
+        breaker.check(self.state, 'vcenter', failures=2, reset=30)
+
+
+if __name__ == '__main__':
+    unittest.main()
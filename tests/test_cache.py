@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in cache.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from pyVmomi import vim, vmodl
+
+from vlab_avamar_api.lib.worker import cache
+
+
+class TestMoRefCache(unittest.TestCase):
+    """A set of test cases for the MoRefCache object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache = cache.MoRefCache(ttl=60)
+        self.vcenter = MagicMock()
+
+    def test_get_miss(self):
+        """``MoRefCache.get`` calls the loader on a cache miss"""
+        loader = MagicMock()
+        loader.return_value = vim.Folder('group-v1')
+
+        output = self.cache.get(self.vcenter, vim.Folder, 'bob', loader)
+
+        self.assertTrue(loader.called)
+        self.assertEqual(output._moId, 'group-v1')
+
+    def test_get_hit(self):
+        """``MoRefCache.get`` does not call the loader on a cache hit"""
+        loader = MagicMock()
+        self.cache.put(self.vcenter, vim.Folder, 'bob', vim.Folder('group-v1'))
+
+        output = self.cache.get(self.vcenter, vim.Folder, 'bob', loader)
+
+        self.assertFalse(loader.called)
+        self.assertEqual(output._moId, 'group-v1')
+
+    def test_get_keeps_type(self):
+        """``MoRefCache.get`` rebinds the MoRef with the concrete type that was cached"""
+        self.cache.put(self.vcenter, vim.Network, 'bob_lan', vim.dvs.DistributedVirtualPortgroup('dvportgroup-1'))
+
+        output = self.cache.get(self.vcenter, vim.Network, 'bob_lan', MagicMock())
+
+        self.assertTrue(isinstance(output, vim.dvs.DistributedVirtualPortgroup))
+
+    @patch.object(cache.time, 'time')
+    def test_get_expired(self, fake_time):
+        """``MoRefCache.get`` calls the loader once an entry exceeds the TTL"""
+        fake_time.side_effect = [100, 200, 200]
+        loader = MagicMock()
+        loader.return_value = vim.Folder('group-v1')
+        self.cache.put(self.vcenter, vim.Folder, 'bob', vim.Folder('group-v1'))
+
+        self.cache.get(self.vcenter, vim.Folder, 'bob', loader)
+
+        self.assertTrue(loader.called)
+
+    def test_invalidate(self):
+        """``MoRefCache.invalidate`` only removes the matching entries"""
+        self.cache.put(self.vcenter, vim.Folder, 'bob', vim.Folder('group-v1'))
+        self.cache.put(self.vcenter, vim.Folder, 'alice', vim.Folder('group-v2'))
+
+        self.cache.invalidate(vim.Folder, 'bob')
+
+        self.assertEqual(self.cache.stats()['size'], 1)
+
+    def test_invalidate_all(self):
+        """``MoRefCache.invalidate`` clears the whole cache when not supplied params"""
+        self.cache.put(self.vcenter, vim.Folder, 'bob', vim.Folder('group-v1'))
+        self.cache.put(self.vcenter, vim.Network, 'bob_lan', vim.Network('network-1'))
+
+        self.cache.invalidate()
+
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_call_retries(self):
+        """``MoRefCache.call`` invalidates and retries when the object no longer exists"""
+        self.cache.put(self.vcenter, vim.Folder, 'bob', vim.Folder('group-v1'))
+        loader = MagicMock()
+        loader.return_value = vim.Folder('group-v2')
+        func = MagicMock()
+        func.side_effect = [vmodl.fault.ManagedObjectNotFound(), 'worked']
+
+        output = self.cache.call(self.vcenter, vim.Folder, 'bob', loader, func)
+
+        self.assertEqual(output, 'worked')
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def test_get_per_server(self):
+        """``MoRefCache.get`` does not share entries between different vCenter servers"""
+        self.vcenter._conn._stub.host = 'vcenter1:443'
+        other_vcenter = MagicMock()
+        other_vcenter._conn._stub.host = 'vcenter2:443'
+        loader = MagicMock()
+        loader.return_value = vim.Folder('group-v2')
+        self.cache.put(self.vcenter, vim.Folder, 'bob', vim.Folder('group-v1'))
+
+        output = self.cache.get(other_vcenter, vim.Folder, 'bob', loader)
+
+        self.assertTrue(loader.called)
+        self.assertEqual(output._moId, 'group-v2')
+
+    def test_stats(self):
+        """``MoRefCache.stats`` reports the hit-rate"""
+        loader = MagicMock()
+        loader.return_value = vim.Folder('group-v1')
+        self.cache.get(self.vcenter, vim.Folder, 'bob', loader)
+        self.cache.get(self.vcenter, vim.Folder, 'bob', loader)
+
+        output = self.cache.stats()
+        expected = {'hits': 1, 'misses': 1, 'invalidations': 0, 'hit_rate': 0.5, 'size': 1}
+
+        self.assertEqual(output, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the compressed.py module
+"""
+import io
+import os
+import gzip
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_avamar_api.lib.worker import compressed
+
+
+def make_ova(path, members, compress):
+    """Write a tarball of the members, then compress it with ``compress``"""
+    raw = io.BytesIO()
+    with tarfile.open(fileobj=raw, mode='w') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    with open(path, 'wb') as the_file:
+        the_file.write(compress(raw.getvalue()))
+
+
+class TestCompressed(unittest.TestCase):
+    """A set of test cases for the compressed.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ovf = '<Envelope><NetworkSection><Network ovf:name="VM Network"/></NetworkSection></Envelope>'
+        self.members = [('avamar.ovf', self.ovf.encode()), ('disk1.vmdk', os.urandom(50000))]
+        self.gz_path = os.path.join(self.tmp_dir, 'AVE-1.0.0.ova.gz')
+        make_ova(self.gz_path, self.members, gzip.compress)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_compression(self):
+        """``compression`` returns the suffix of a compressed OVA"""
+        self.assertEqual(compressed.compression('AVE-1.0.0.ova.zst'), '.zst')
+        self.assertEqual(compressed.compression('AVE-1.0.0.ova.gz'), '.gz')
+
+    def test_compression_none(self):
+        """``compression`` returns None for an uncompressed OVA"""
+        self.assertEqual(compressed.compression('AVE-1.0.0.ova'), None)
+
+    @patch.object(compressed, 'zstandard', None)
+    def test_readable(self):
+        """``readable`` is False for zstd images when the zstandard package is missing"""
+        self.assertFalse(compressed.readable('AVE-1.0.0.ova.zst'))
+        self.assertTrue(compressed.readable('AVE-1.0.0.ova.gz'))
+        self.assertTrue(compressed.readable('AVE-1.0.0.ova'))
+
+    @patch.object(compressed, 'zstandard', None)
+    def test_decompressed_stream_no_zstandard(self):
+        """``DecompressedStream`` raises RuntimeError for zstd images when the zstandard package is missing"""
+        path = os.path.join(self.tmp_dir, 'AVE-1.0.0.ova.zst')
+        with open(path, 'wb') as the_file:
+            the_file.write(b'stuff')
+
+        with self.assertRaises(RuntimeError):
+            compressed.DecompressedStream(path, [0])
+
+    @patch.object(compressed, 'READ_SIZE', 1000)
+    def test_decompressed_stream(self):
+        """``DecompressedStream`` returns the decompressed image, and counts the compressed bytes read"""
+        read = [0]
+        with compressed.DecompressedStream(self.gz_path, read, depth=2) as stream:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                found = {x.name: tar.extractfile(x).read() for x in tar}
+
+        self.assertEqual(found, dict(self.members))
+        self.assertEqual(read[0], os.path.getsize(self.gz_path))
+
+    @patch.object(compressed, 'READ_SIZE', 1000)
+    def test_decompressed_stream_close(self):
+        """``DecompressedStream`` can be closed before the image is read"""
+        stream = compressed.DecompressedStream(self.gz_path, [0], depth=1)
+        stream.read(10)
+
+        stream.close()
+
+        self.assertFalse(stream._thread.is_alive())
+
+    def test_decompressed_stream_corrupt(self):
+        """``DecompressedStream`` raises the error of decompressing a corrupt image"""
+        with open(self.gz_path, 'r+b') as the_file:
+            the_file.seek(20)
+            the_file.write(b'\xff' * 100)
+
+        with compressed.DecompressedStream(self.gz_path, [0]) as stream:
+            with self.assertRaises(Exception):
+                stream.read()
+
+    @unittest.skipIf(compressed.zstandard is None, 'zstandard is not installed')
+    def test_decompressed_stream_zstd(self):
+        """``DecompressedStream`` reads zstd images"""
+        path = os.path.join(self.tmp_dir, 'AVE-1.0.0.ova.zst')
+        make_ova(path, self.members, compressed.zstandard.ZstdCompressor().compress)
+
+        with compressed.DecompressedStream(path, [0]) as stream:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                found = {x.name: tar.extractfile(x).read() for x in tar}
+
+        self.assertEqual(found, dict(self.members))
+
+    def test_compressed_ova(self):
+        """``CompressedOva`` reads the OVF descriptor, and the networks in it"""
+        ova = compressed.CompressedOva(self.gz_path)
+
+        self.assertEqual(ova.ovf, self.ovf)
+        self.assertEqual(ova.networks, ['VM Network'])
+
+    def test_compressed_ova_no_ovf(self):
+        """``CompressedOva`` raises RuntimeError if the image has no OVF descriptor"""
+        make_ova(self.gz_path, self.members[1:], gzip.compress)
+
+        with self.assertRaises(RuntimeError):
+            compressed.CompressedOva(self.gz_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
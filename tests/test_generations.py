@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the generations.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_avamar_api.lib import generations
+from vlab_avamar_api.lib.state import SharedState
+
+
+class TestGenerations(unittest.TestCase):
+    """A set of test cases for the Generations object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        state = SharedState(os.path.join(self.tmp_dir, 'generations.json'))
+        self.generations = generations.Generations(state=state, ttl=60)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_etag_unknown(self):
+        """``Generations.etag`` returns (None, False) for content never observed"""
+        self.assertEqual(self.generations.etag('inventory:Avamar:bob'), (None, False))
+
+    def test_etag(self):
+        """``Generations.etag`` returns a fresh ETag for content just observed"""
+        self.generations.observe('inventory:Avamar:bob', {'box1': {}}, 0)
+
+        etag, fresh = self.generations.etag('inventory:Avamar:bob')
+
+        self.assertTrue(etag)
+        self.assertTrue(fresh)
+
+    def test_etag_same_content(self):
+        """``Generations.etag`` is the same when the content is the same, regardless of key order"""
+        self.generations.observe('inventory:Avamar:bob', {'a': 1, 'b': 2}, 0)
+        etag1, _ = self.generations.etag('inventory:Avamar:bob')
+        self.generations.observe('inventory:Avamar:bob', {'b': 2, 'a': 1}, 0)
+        etag2, _ = self.generations.etag('inventory:Avamar:bob')
+
+        self.assertEqual(etag1, etag2)
+
+    def test_etag_changed_content(self):
+        """``Generations.etag`` changes when the content changes"""
+        self.generations.observe('inventory:Avamar:bob', {'box1': {}}, 0)
+        etag1, _ = self.generations.etag('inventory:Avamar:bob')
+        self.generations.observe('inventory:Avamar:bob', {'box2': {}}, 0)
+        etag2, _ = self.generations.etag('inventory:Avamar:bob')
+
+        self.assertNotEqual(etag1, etag2)
+
+    @patch.object(generations.time, 'time')
+    def test_etag_stale(self, fake_time):
+        """``Generations.etag`` says the ETag is not fresh once it's older than the TTL"""
+        fake_time.return_value = 1000
+        self.generations.observe('inventory:Avamar:bob', {'box1': {}}, 0)
+        fake_time.return_value = 1061
+
+        _, fresh = self.generations.etag('inventory:Avamar:bob')
+
+        self.assertFalse(fresh)
+
+    def test_bump(self):
+        """``Generations.bump`` discards the ETag"""
+        self.generations.observe('inventory:Avamar:bob', {'box1': {}}, 0)
+        self.generations.bump('inventory:Avamar:bob')
+
+        self.assertEqual(self.generations.etag('inventory:Avamar:bob'), (None, False))
+
+    def test_bump_generation(self):
+        """``Generations.bump`` increments the generation"""
+        self.generations.bump('inventory:Avamar:bob')
+        self.generations.bump('inventory:Avamar:bob')
+
+        self.assertEqual(self.generations.generation('inventory:Avamar:bob'), 2)
+
+    def test_observe_after_bump(self):
+        """``Generations.observe`` ignores what a task found if the key was bumped while it ran"""
+        generation = self.generations.generation('inventory:Avamar:bob')
+        self.generations.bump('inventory:Avamar:bob')
+        self.generations.observe('inventory:Avamar:bob', {'box1': {}}, generation)
+
+        self.assertEqual(self.generations.etag('inventory:Avamar:bob'), (None, False))
+
+    def test_keys(self):
+        """``inventory_key`` and ``images_key`` never collide"""
+        self.assertNotEqual(generations.inventory_key('Avamar', 'images'), generations.images_key('Avamar'))
+
+
+if __name__ == '__main__':
+    unittest.main()
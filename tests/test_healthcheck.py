@@ -3,6 +3,7 @@
 A suite of tests for the healthcheck API end point
 """
 import unittest
+from unittest.mock import patch, MagicMock
 
 from flask import Flask
 
@@ -28,6 +29,61 @@ class TestHealthView(unittest.TestCase):
 
         self.assertEqual(expected, resp.status_code)
 
+    def test_health_check_version(self):
+        """The /api/1/inf/avamar/healthcheck end point returns the version resolved at import"""
+        resp = self.app.get('/api/1/inf/avamar/healthcheck')
+
+        self.assertEqual(resp.json['version'], healthcheck.VERSION)
+
+
+class TestResolveVersion(unittest.TestCase):
+    """A set of test cases for the ``_resolve_version`` function"""
+
+    @patch.object(healthcheck, 'metadata')
+    def test_resolve_version(self, fake_metadata):
+        """``_resolve_version`` uses importlib.metadata when it exists"""
+        fake_metadata.version.return_value = '2021.01.21'
+
+        self.assertEqual(healthcheck._resolve_version(), '2021.01.21')
+
+    @patch.object(healthcheck, 'metadata', None)
+    def test_resolve_version_old_python(self):
+        """``_resolve_version`` falls back to pkg_resources before Python 3.8"""
+        fake_pkg_resources = MagicMock()
+        fake_pkg_resources.get_distribution.return_value.version = '2021.01.21'
+        with patch.object(healthcheck, 'pkg_resources', fake_pkg_resources, create=True):
+            version = healthcheck._resolve_version()
+
+        self.assertEqual(version, '2021.01.21')
+
+
+class TestReadyView(unittest.TestCase):
+    """A set of test cases for the ReadyView object"""
+
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        healthcheck.ReadyView.register(app)
+        app.config['TESTING'] = True
+        app.readiness = MagicMock()
+        cls.readiness = app.readiness
+        cls.app = app.test_client()
+
+    def test_ready(self):
+        """The /api/1/inf/avamar/ready end point returns an HTTP 200 when every check is OK"""
+        self.readiness.report.return_value = {'ready': True, 'checks': {}}
+        resp = self.app.get('/api/1/inf/avamar/ready')
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_not_ready(self):
+        """The /api/1/inf/avamar/ready end point returns an HTTP 503 when a check failed"""
+        self.readiness.report.return_value = {'ready': False, 'checks': {'broker': {'ok': False}}}
+        resp = self.app.get('/api/1/inf/avamar/ready')
+
+        self.assertEqual(resp.status_code, 503)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the idle.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.worker import idle
+
+
+class TestIdleTracker(unittest.TestCase):
+    """A set of test cases for the IdleTracker object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tracker = idle.IdleTracker(state=SharedState(os.path.join(self.tmp_dir, 'idle.json')))
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_observe(self):
+        """``IdleTracker.observe`` returns how long each VM has been idle"""
+        self.tracker.observe('vc1', {'vm-1': True, 'vm-2': True}, now=100)
+
+        output = self.tracker.observe('vc1', {'vm-1': True, 'vm-2': True}, now=400)
+        expected = {'vm-1': 300, 'vm-2': 300}
+
+        self.assertEqual(output, expected)
+
+    def test_observe_busy(self):
+        """``IdleTracker.observe`` restarts the clock of a VM once it's busy"""
+        self.tracker.observe('vc1', {'vm-1': True}, now=100)
+        self.tracker.observe('vc1', {'vm-1': False}, now=200)
+
+        output = self.tracker.observe('vc1', {'vm-1': True}, now=400)
+
+        self.assertEqual(output, {'vm-1': 0})
+
+    def test_observe_gone(self):
+        """``IdleTracker.observe`` forgets VMs that are no longer sampled"""
+        self.tracker.observe('vc1', {'vm-1': True}, now=100)
+
+        output = self.tracker.observe('vc1', {}, now=400)
+
+        self.assertEqual(output, {})
+
+    def test_observe_servers(self):
+        """``IdleTracker.observe`` tracks the VMs of each vCenter separately"""
+        self.tracker.observe('vc1', {'vm-1': True}, now=100)
+
+        output = self.tracker.observe('vc2', {'vm-1': True}, now=400)
+
+        self.assertEqual(output, {'vm-1': 0})
+        self.assertEqual(self.tracker.observe('vc1', {'vm-1': True}, now=400), {'vm-1': 300})
+
+    def test_forget(self):
+        """``IdleTracker.forget`` restarts the clock of a VM"""
+        self.tracker.observe('vc1', {'vm-1': True}, now=100)
+        self.tracker.forget('vc1', ['vm-1', 'vm-2'])
+
+        output = self.tracker.observe('vc1', {'vm-1': True}, now=400)
+
+        self.assertEqual(output, {'vm-1': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
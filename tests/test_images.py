@@ -0,0 +1,218 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the images.py module
+"""
+import io
+import os
+import gzip
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.worker import images
+
+
+def make_ova(path, members, compress=None):
+    """Write an OVA of the members, optionally compressed"""
+    raw = io.BytesIO()
+    with tarfile.open(fileobj=raw, mode='w') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    data = raw.getvalue()
+    if compress:
+        data = compress(data)
+    with open(path, 'wb') as the_file:
+        the_file.write(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+class TestImageIndex(unittest.TestCase):
+    """A set of test cases for the ImageIndex object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.images_dir = os.path.join(self.tmp_dir, 'images')
+        os.mkdir(self.images_dir)
+        self.index = images.ImageIndex(state=SharedState(os.path.join(self.tmp_dir, 'images.json')),
+                                       directory=self.images_dir,
+                                       parallel=2)
+        self.disk = os.urandom(20000)
+        manifest = 'SHA256(avamar.ovf)= {}\nSHA1(disk1.vmdk)= {}\n'.format(hashlib.sha256(b'<xml/>').hexdigest(),
+                                                                         hashlib.sha1(self.disk).hexdigest())
+        self.members = [('avamar.ovf', b'<xml/>'), ('avamar.mf', manifest.encode()), ('disk1.vmdk', self.disk)]
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_refresh(self):
+        """``ImageIndex.refresh`` records the SHA-256 of every image"""
+        sha256 = make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), self.members)
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['images']['AVE-1.0.0.ova']['sha256'], sha256)
+        self.assertEqual(output['images']['AVE-1.0.0.ova']['error'], None)
+
+    def test_refresh_compressed(self):
+        """``ImageIndex.refresh`` hashes a compressed image as stored, and checks what's inside it"""
+        sha256 = make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova.gz'), self.members, gzip.compress)
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['images']['AVE-1.0.0.ova.gz']['sha256'], sha256)
+
+    def test_refresh_cached(self):
+        """``ImageIndex.refresh`` does not read an image again, unless it changed"""
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), self.members)
+        self.index.refresh(MagicMock())
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['verified'], [])
+
+    def test_refresh_changed(self):
+        """``ImageIndex.refresh`` reads an image again once it changes"""
+        path = os.path.join(self.images_dir, 'AVE-1.0.0.ova')
+        make_ova(path, self.members)
+        self.index.refresh(MagicMock())
+        sha256 = make_ova(path, self.members[:1])
+        os.utime(path, ns=(1, 1))
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['verified'], ['AVE-1.0.0.ova'])
+        self.assertEqual(output['images']['AVE-1.0.0.ova']['sha256'], sha256)
+
+    def test_refresh_removed(self):
+        """``ImageIndex.refresh`` forgets about removed images"""
+        path = os.path.join(self.images_dir, 'AVE-1.0.0.ova')
+        make_ova(path, self.members)
+        self.index.refresh(MagicMock())
+        os.remove(path)
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['images'], {})
+
+    def test_refresh_ignores(self):
+        """``ImageIndex.refresh`` ignores files that are not images"""
+        with open(os.path.join(self.images_dir, 'README'), 'w') as the_file:
+            the_file.write('hello')
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['images'], {})
+
+    def test_refresh_duplicates(self):
+        """``ImageIndex.refresh`` reports images with the same content"""
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), self.members)
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.1.ova'), self.members)
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['duplicates'], [['AVE-1.0.0.ova', 'AVE-1.0.1.ova']])
+
+    def test_refresh_truncated(self):
+        """``ImageIndex.refresh`` fails an image that was only partially copied"""
+        path = os.path.join(self.images_dir, 'AVE-1.0.0.ova')
+        make_ova(path, self.members)
+        with open(path, 'r+b') as the_file:
+            the_file.truncate(5000)
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['failed'], ['AVE-1.0.0.ova'])
+        self.assertEqual(output['images']['AVE-1.0.0.ova']['sha256'], None)
+
+    def test_refresh_checksum(self):
+        """``ImageIndex.refresh`` fails an image whose files do not match the manifest"""
+        members = self.members[:2] + [('disk1.vmdk', b'x' + self.disk[1:])]
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), members)
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['images']['AVE-1.0.0.ova']['error'],
+                         'The checksum of disk1.vmdk does not match the manifest')
+
+    def test_refresh_manifest_last(self):
+        """``ImageIndex.refresh`` checks files that come before the manifest"""
+        manifest = 'SHA256(disk1.vmdk)= {}\n'.format(hashlib.sha256(b'nope').hexdigest())
+        members = [self.members[0], self.members[2], ('avamar.mf', manifest.encode())]
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), members)
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['failed'], ['AVE-1.0.0.ova'])
+
+    def test_refresh_missing_file(self):
+        """``ImageIndex.refresh`` fails an image that lacks a file in its manifest"""
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), self.members[:2])
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['failed'], ['AVE-1.0.0.ova'])
+
+    def test_refresh_no_ovf(self):
+        """``ImageIndex.refresh`` fails an image without an OVF descriptor"""
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), self.members[2:])
+
+        output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['images']['AVE-1.0.0.ova']['error'], 'No OVF descriptor found')
+
+    def test_refresh_changing(self):
+        """``ImageIndex.refresh`` skips an image that changes while it's read, i.e. still being copied"""
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), self.members)
+
+        with patch.object(images, '_stat', side_effect=[[1, 1], [1, 1], [2, 2]]):
+            output = self.index.refresh(MagicMock())
+
+        self.assertEqual(output['verified'], [])
+        self.assertEqual(output['images'], {})
+
+    def test_check(self):
+        """``ImageIndex.check`` allows a verified image"""
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), self.members)
+        self.index.refresh(MagicMock())
+
+        self.index.check('AVE-1.0.0.ova')
+
+    def test_check_unknown(self):
+        """``ImageIndex.check`` allows an image that has not been verified yet"""
+        self.index.check('AVE-1.0.0.ova')
+
+    def test_check_failed(self):
+        """``ImageIndex.check`` raises ValueError for an image that failed verification"""
+        make_ova(os.path.join(self.images_dir, 'AVE-1.0.0.ova'), self.members[2:])
+        self.index.refresh(MagicMock())
+
+        with self.assertRaises(ValueError):
+            self.index.check('AVE-1.0.0.ova')
+
+    def test_check_fixed(self):
+        """``ImageIndex.check`` allows a failed image that was replaced since"""
+        path = os.path.join(self.images_dir, 'AVE-1.0.0.ova')
+        make_ova(path, self.members[2:])
+        self.index.refresh(MagicMock())
+        make_ova(path, self.members)
+        os.utime(path, ns=(1, 1))
+
+        self.index.check('AVE-1.0.0.ova')
+
+    def test_parse_manifest(self):
+        """``_parse_manifest`` maps each file to its algorithm and checksum"""
+        output = images._parse_manifest('SHA1(disk1.vmdk)= ABC123\nnonsense\nSHA256(a.ovf)=def456\n')
+        expected = {'disk1.vmdk': ('sha1', 'abc123'), 'a.ovf': ('sha256', 'def456')}
+
+        self.assertEqual(output, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the library.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.worker import library
+
+
+class TestLibrary(unittest.TestCase):
+    """A set of test cases for the Library object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.library = library.Library(state=SharedState(os.path.join(self.tmp_dir, 'library.json')))
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_current(self):
+        """``Library.current`` is True once an image is published with the same SHA-256"""
+        self.library.started('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+        self.library.finished('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+
+        self.assertTrue(self.library.current('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc'))
+
+    def test_current_other_datastore(self):
+        """``Library.current`` is only True for the datastore the image was published to"""
+        self.library.finished('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+
+        self.assertFalse(self.library.current('vc1', 'AVE-1.0.0.ova', 'ds2', 'abc'))
+        self.assertFalse(self.library.current('vc2', 'AVE-1.0.0.ova', 'ds1', 'abc'))
+
+    def test_current_changed(self):
+        """``Library.current`` is False once the image has a different SHA-256"""
+        self.library.finished('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+
+        self.assertFalse(self.library.current('vc1', 'AVE-1.0.0.ova', 'ds1', 'def'))
+
+    def test_current_unverified(self):
+        """``Library.current`` is False when the image has not been verified"""
+        self.library.finished('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+
+        self.assertFalse(self.library.current('vc1', 'AVE-1.0.0.ova', 'ds1', None))
+
+    def test_current_syncing(self):
+        """``Library.current`` is False while the image is being republished"""
+        self.library.finished('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+        self.library.started('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+
+        self.assertFalse(self.library.current('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc'))
+
+    def test_current_failed(self):
+        """``Library.current`` is False when publishing the image failed"""
+        self.library.started('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+        self.library.finished('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc', error='testing')
+
+        self.assertFalse(self.library.current('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc'))
+
+    def test_report(self):
+        """``Library.report`` returns the status of every image on every datastore"""
+        self.library.finished('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+        self.library.started('vc1', 'AVE-1.0.0.ova', 'ds2', 'abc')
+
+        output = self.library.report({'AVE-1.0.0.ova': 'abc'}, ['vc1:ds1', 'vc1:ds2'])
+        expected = {'progress': {'total': 2, 'current': 1, 'syncing': 1, 'failed': 0, 'percent': 50.0},
+                    'images': {'AVE-1.0.0.ova': {'sha256': 'abc',
+                                                 'stale': True,
+                                                 'locations': {'vc1:ds1': 'current', 'vc1:ds2': 'syncing'}}}}
+
+        self.assertEqual(output, expected)
+
+    def test_report_stale(self):
+        """``Library.report`` marks the datastores with an old version of an image as stale"""
+        self.library.finished('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+
+        output = self.library.report({'AVE-1.0.0.ova': 'def', 'NDMP-1.0.0.ova': None}, ['vc1:ds1'])
+
+        self.assertEqual(output['images']['AVE-1.0.0.ova']['locations'], {'vc1:ds1': 'stale'})
+        self.assertEqual(output['images']['NDMP-1.0.0.ova']['locations'], {'vc1:ds1': 'missing'})
+        self.assertEqual(output['progress']['percent'], 0.0)
+
+    def test_report_empty(self):
+        """``Library.report`` is 100% done when there's nothing to publish"""
+        output = self.library.report({}, ['vc1:ds1'])
+
+        self.assertEqual(output['progress']['percent'], 100.0)
+
+    def test_location(self):
+        """``location`` identifies a datastore on a vCenter"""
+        self.assertEqual(library.location('vc1', 'ds1'), 'vc1:ds1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the metrics API end point
+"""
+import unittest
+from unittest.mock import MagicMock
+
+from flask import Flask
+
+from vlab_avamar_api.lib.views import metrics
+
+
+class TestMetricsView(unittest.TestCase):
+    """A set of test cases for the MetricsView object"""
+
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        metrics.MetricsView.register(app)
+        app.config['TESTING'] = True
+        app.celery_app = MagicMock()
+        app.celery_app.publish_metrics.snapshot.return_value = {'avamar.show_server': {'count': 1}}
+        cls.app = app.test_client()
+
+    def test_metrics(self):
+        """GET on /api/1/inf/avamar/metrics returns the publish latency stats"""
+        resp = self.app.get('/api/1/inf/avamar/metrics')
+
+        expected = {'avamar.show_server': {'count': 1}}
+
+        self.assertEqual(resp.json['publish'], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -39,6 +39,20 @@ class TestAvamarView(unittest.TestCase):
         cls.fake_task = MagicMock()
         cls.fake_task.id = 'asdf-asdf-asdf'
         app.celery_app.send_task.return_value = cls.fake_task
+        # Mock the shared admission control queue
+        cls.admission_patcher = patch.object(avamar, 'ADMISSION')
+        cls.fake_admission = cls.admission_patcher.start()
+        cls.fake_admission.enqueue.return_value = 3
+        # Mock the shared ETag state
+        cls.generations_patcher = patch.object(avamar, 'GENERATIONS')
+        cls.fake_generations = cls.generations_patcher.start()
+        cls.fake_generations.etag.return_value = (None, False)
+
+    @classmethod
+    def tearDown(cls):
+        """Runs after every test case"""
+        cls.admission_patcher.stop()
+        cls.generations_patcher.stop()
 
     def test_v1_deprecated(self):
         """AvamarView - GET on /api/1/inf/avamar/ndmp-accelerator returns an HTTP 404"""
@@ -84,6 +98,34 @@ class TestAvamarView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_post_queue_position(self):
+        """AvamarView - POST on /api/2/inf/avamar/ndmp-accelerator says where the deploy sits in the queue"""
+        resp = self.app.post('/api/2/inf/avamar/ndmp-accelerator',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'name': "myAvamarBox",
+                                   'image': "someVersion",
+                                   'ip-config': self.ip_config})
+
+        position = resp.json['content']['queue-position']
+        expected = 3
+
+        self.assertEqual(position, expected)
+
+    def test_post_enqueues_first(self):
+        """AvamarView - POST on /api/2/inf/avamar/ndmp-accelerator enqueues the deploy under the ID of the task it sends"""
+        self.app.post('/api/2/inf/avamar/ndmp-accelerator',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN",
+                            'name': "myAvamarBox",
+                            'image': "someVersion",
+                            'ip-config': self.ip_config})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+        queued_id = self.fake_admission.enqueue.call_args[0][1]
+
+        self.assertEqual(the_kwargs['task_id'], queued_id)
+
     def test_post_task_link(self):
         """AvamarView - POST on /api/2/inf/avamar/ndmp-accelerator sets the Link header"""
         resp = self.app.post('/api/2/inf/avamar/ndmp-accelerator',
@@ -140,6 +182,84 @@ class TestAvamarView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_reset_disabled(self):
+        """AvamarNDMPView - POST on the ./reset end point returns an HTTP 400 when reset snapshots are not taken"""
+        resp = self.app.post('/api/2/inf/avamar/ndmp-accelerator/reset',
+                             headers={'X-Auth': self.token},
+                             json={'name': 'myNDMPBox'})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    @patch.object(avamar, 'const', avamar.const._replace(VLAB_AVAMAR_RESET_SNAPSHOT=True))
+    def test_reset_task_name(self):
+        """AvamarNDMPView - POST on the ./reset end point calls the avamar.reset_ndmp task"""
+        self.app.post('/api/2/inf/avamar/ndmp-accelerator/reset',
+                      headers={'X-Auth': self.token},
+                      json={'name': 'myNDMPBox'})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        expected = 'avamar.reset_ndmp'
+
+        self.assertEqual(the_args[0], expected)
+
+    def test_suspend_task_name(self):
+        """AvamarNDMPView - POST on the ./suspend end point calls the avamar.suspend_ndmp task"""
+        self.app.post('/api/2/inf/avamar/ndmp-accelerator/suspend',
+                      headers={'X-Auth': self.token},
+                      json={'name': 'myNDMPBox'})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        expected = 'avamar.suspend_ndmp'
+
+        self.assertEqual(the_args[0], expected)
+
+    def test_resume_task_name(self):
+        """AvamarNDMPView - POST on the ./resume end point calls the avamar.resume_ndmp task"""
+        self.app.post('/api/2/inf/avamar/ndmp-accelerator/resume',
+                      headers={'X-Auth': self.token},
+                      json={'name': 'myNDMPBox'})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        expected = 'avamar.resume_ndmp'
+
+        self.assertEqual(the_args[0], expected)
+
+    def test_get_not_modified(self):
+        """AvamarNDMPView - GET on /api/2/inf/avamar/ndmp-accelerator returns an HTTP 304 when the inventory has not changed"""
+        self.fake_generations.etag.return_value = ('abc123', True)
+        resp = self.app.get('/api/2/inf/avamar/ndmp-accelerator',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"abc123"'})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    def test_get_modified(self):
+        """AvamarNDMPView - GET on /api/2/inf/avamar/ndmp-accelerator sends a task when the ETag does not match"""
+        self.fake_generations.etag.return_value = ('abc123', True)
+        resp = self.app.get('/api/2/inf/avamar/ndmp-accelerator',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"def456"'})
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.headers['ETag'], '"abc123"')
+
+    def test_get_stale(self):
+        """AvamarNDMPView - GET on /api/2/inf/avamar/ndmp-accelerator sends a task when the ETag is too old to trust"""
+        self.fake_generations.etag.return_value = ('abc123', False)
+        resp = self.app.get('/api/2/inf/avamar/ndmp-accelerator',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"abc123"'})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_image_not_modified(self):
+        """AvamarNDMPView - GET on the ./image end point returns an HTTP 304 when the images have not changed"""
+        self.fake_generations.etag.return_value = ('abc123', True)
+        resp = self.app.get('/api/2/inf/avamar/ndmp-accelerator/image',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"abc123"'})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
 
 if __name__ == '__main__':
     unittest.main()
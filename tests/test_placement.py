@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the placement.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.worker import placement
+
+
+class TestPlacement(unittest.TestCase):
+    """A set of test cases for the Placement object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.work_dir = tempfile.mkdtemp()
+        self.state = SharedState(os.path.join(self.work_dir, 'placement.json'))
+        self.placement = placement.Placement(datastores=['ds1', 'ds2'], hosts=[], max_age=60,
+                                             state=self.state, name='vc1', lease=300)
+        self.placement.update(datastores={'ds1': {'free': 100 * 1024**3, 'accessible': True},
+                                          'ds2': {'free': 80 * 1024**3, 'accessible': True},
+                                          'ds3': {'free': 900 * 1024**3, 'accessible': True}},
+                              hosts={'esx1': {'free_mb': 1000, 'usable': True, 'datastores': ['ds1', 'ds2']},
+                                     'esx2': {'free_mb': 9000, 'usable': False, 'datastores': ['ds1', 'ds2']},
+                                     'esx3': {'free_mb': 500, 'usable': True, 'datastores': ['ds2']}})
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.work_dir)
+
+    def _another_worker(self):
+        """Make a Placement like a different worker process has, sharing the same state"""
+        the_placement = placement.Placement(datastores=['ds1', 'ds2'], hosts=[], max_age=60,
+                                            state=self.state, name='vc1', lease=300)
+        the_placement.update(datastores={'ds1': {'free': 100 * 1024**3, 'accessible': True},
+                                         'ds2': {'free': 80 * 1024**3, 'accessible': True}},
+                             hosts={'esx1': {'free_mb': 1000, 'usable': True, 'datastores': ['ds1', 'ds2']}})
+        return the_placement
+
+    def test_choose(self):
+        """``Placement.choose`` picks the datastore with the most free space, and a usable host"""
+        self.assertEqual(self.placement.choose(), ('ds1', 'esx1'))
+
+    def test_choose_inflight(self):
+        """``Placement.choose`` spreads concurrent deploys across datastores"""
+        self.placement.started('ds1', 'esx1')
+
+        self.assertEqual(self.placement.choose(), ('ds2', 'esx1'))
+
+    def test_choose_host_inflight(self):
+        """``Placement.choose`` spreads concurrent deploys across hosts"""
+        self.placement.started('ds1', 'esx1')
+        self.placement.started('ds1', 'esx1')
+        self.placement.started('ds1', 'esx1')
+
+        self.assertEqual(self.placement.choose(), ('ds2', 'esx3'))
+
+    def test_choose_shared(self):
+        """``Placement.choose`` sees the deploys other worker processes have in-flight"""
+        self._another_worker().started('ds1', 'esx1')
+
+        self.assertEqual(self.placement.choose(), ('ds2', 'esx1'))
+
+    def test_finished_shared(self):
+        """``Placement.finished`` only ends the deploy this worker process started"""
+        other = self._another_worker()
+        other.started('ds1', 'esx1')
+        self.placement.started('ds1', 'esx1')
+        self.placement.finished('ds1', 'esx1', seconds_per_gb=10)
+
+        self.assertEqual(other.report()['inflight'], {'ds1': 1})
+
+    def test_choose_other_server(self):
+        """``Placement.choose`` ignores the deploys in-flight on other vCenter servers"""
+        the_placement = placement.Placement(datastores=['ds1', 'ds2'], hosts=[], max_age=60,
+                                            state=self.state, name='vc2', lease=300)
+        the_placement.started('ds1', 'esx1')
+
+        self.assertEqual(self.placement.choose(), ('ds1', 'esx1'))
+
+    @patch.object(placement.time, 'time')
+    def test_reservation_expires(self, fake_time):
+        """``Placement`` forgets an in-flight deploy once its lease expires, so a dead worker cannot leak it"""
+        fake_time.return_value = 100
+        self._another_worker().started('ds1', 'esx1')
+        fake_time.return_value = 401
+
+        self.assertEqual(self.placement.choose(), ('ds1', 'esx1'))
+
+    def test_choose_slow(self):
+        """``Placement.choose`` avoids datastores that recent deploys were slow on"""
+        self.placement.started('ds1', 'esx1')
+        self.placement.finished('ds1', 'esx1', seconds_per_gb=20)
+        self.placement.started('ds2', 'esx1')
+        self.placement.finished('ds2', 'esx1', seconds_per_gb=10)
+
+        self.assertEqual(self.placement.choose(), ('ds2', 'esx1'))
+
+    def test_finished_failed(self):
+        """``Placement.finished`` does not record the latency of a failed deploy"""
+        self.placement.started('ds1', 'esx1')
+        self.placement.finished('ds1', 'esx1')
+
+        self.assertEqual(self.placement.report()['seconds_per_gb'], {})
+        self.assertEqual(self.placement.report()['inflight'], {})
+
+    def test_choose_inaccessible(self):
+        """``Placement.choose`` raises RuntimeError if no datastore is accessible"""
+        self.placement.update(datastores={'ds1': {'free': 100, 'accessible': False}}, hosts={})
+
+        with self.assertRaises(RuntimeError):
+            self.placement.choose()
+
+    def test_choose_no_host(self):
+        """``Placement.choose`` raises RuntimeError if no usable host can access the datastore"""
+        self.placement.update(datastores={'ds1': {'free': 100, 'accessible': True}},
+                              hosts={'esx1': {'free_mb': 1000, 'usable': True, 'datastores': ['ds2']}})
+
+        with self.assertRaises(RuntimeError):
+            self.placement.choose()
+
+    def test_hosts_filtered(self):
+        """``Placement`` only considers the configured hosts"""
+        the_placement = placement.Placement(datastores=['ds1'], hosts=['esx3'], max_age=60,
+                                            state=self.state, name='vc1', lease=300)
+        the_placement.update(datastores={'ds1': {'free': 100, 'accessible': True}},
+                             hosts={'esx1': {'free_mb': 1000, 'usable': True, 'datastores': ['ds1']},
+                                    'esx3': {'free_mb': 10, 'usable': True, 'datastores': ['ds1']}})
+
+        self.assertEqual(the_placement.choose(), ('ds1', 'esx3'))
+
+    @patch.object(placement.time, 'time')
+    def test_stale(self, fake_time):
+        """``Placement.stale`` is True once the stats are older than max_age"""
+        fake_time.return_value = 100
+        self.placement.update(datastores={}, hosts={})
+        fake_time.return_value = 161
+
+        self.assertTrue(self.placement.stale)
+
+    def test_not_stale(self):
+        """``Placement.stale`` is False right after an update"""
+        self.assertFalse(self.placement.stale)
+
+
+if __name__ == '__main__':
+    unittest.main()
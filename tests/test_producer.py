@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the producer.py module
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_avamar_api.lib import producer
+
+
+class TestPublishMetrics(unittest.TestCase):
+    """A set of test cases for the PublishMetrics object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.metrics = producer.PublishMetrics()
+
+    def test_snapshot(self):
+        """``PublishMetrics.snapshot`` reports the count, errors, mean and max per task"""
+        self.metrics.record('avamar.show_server', 0.002)
+        self.metrics.record('avamar.show_server', 0.004, failed=True)
+
+        stats = self.metrics.snapshot()['avamar.show_server']
+
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['mean_ms'], 3.0)
+        self.assertEqual(stats['max_ms'], 4.0)
+
+    def test_snapshot_buckets(self):
+        """``PublishMetrics.snapshot`` reports a cumulative histogram"""
+        self.metrics.record('avamar.show_server', 0.001)
+        self.metrics.record('avamar.show_server', 0.003)
+        self.metrics.record('avamar.show_server', 5)
+
+        buckets = self.metrics.snapshot()['avamar.show_server']['buckets_ms']
+
+        self.assertEqual(buckets['1'], 1)
+        self.assertEqual(buckets['5'], 2)
+        self.assertEqual(buckets['1000'], 2)
+        self.assertEqual(buckets['+Inf'], 3)
+
+    def test_snapshot_empty(self):
+        """``PublishMetrics.snapshot`` returns an empty dictionary when nothing was sent"""
+        self.assertEqual(self.metrics.snapshot(), {})
+
+
+class TestPooledCelery(unittest.TestCase):
+    """A set of test cases for the PooledCelery object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.app = producer.PooledCelery('avamar', backend='rpc://', broker='memory://', pool_size=2)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.app.close()
+
+    def test_pool_size(self):
+        """``PooledCelery`` limits the producer pool to ``pool_size``"""
+        self.assertEqual(self.app.conf.broker_pool_limit, 2)
+
+    def test_confirm(self):
+        """``PooledCelery`` has the broker confirm publishes when ``confirm`` is True"""
+        app = producer.PooledCelery('avamar', broker='memory://', confirm=True)
+
+        self.assertEqual(app.conf.broker_transport_options, {'confirm_publish': True})
+
+    def test_send_task(self):
+        """``PooledCelery.send_task`` records how long the publish took"""
+        self.app.send_task('avamar.show_server', ['bob', 'someTxnId'])
+
+        stats = self.app.publish_metrics.snapshot()
+
+        self.assertEqual(stats['avamar.show_server']['count'], 1)
+
+    def test_send_task_error(self):
+        """``PooledCelery.send_task`` records failed publishes"""
+        with patch.object(producer.Celery, 'send_task', side_effect=RuntimeError('testing')):
+            with self.assertRaises(RuntimeError):
+                self.app.send_task('avamar.show_server', ['bob', 'someTxnId'])
+
+        stats = self.app.publish_metrics.snapshot()
+
+        self.assertEqual(stats['avamar.show_server']['errors'], 1)
+
+    def test_warm(self):
+        """``PooledCelery.warm`` opens ``pool_size`` connections to the broker"""
+        self.app.warm()
+
+        self.assertEqual(len(self.app.pool._dirty) + self.app.pool._resource.qsize(), 2)
+        self.assertTrue(all(x.connected for x in self.app.pool._resource.queue))
+
+    def test_warm_after_fork(self):
+        """``PooledCelery.warm`` discards the connections inherited from the parent process"""
+        inherited = self.app.pool
+        self.app.warm()
+
+        self.assertFalse(self.app.pool is inherited)
+
+    @patch.object(producer, 'logger')
+    def test_warm_broker_down(self, fake_logger):
+        """``PooledCelery.warm`` logs, rather than raises, when the broker is down"""
+        with patch.object(producer.PooledCelery, 'backend') as fake_backend:
+            fake_backend.on_task_call.side_effect = OSError('testing')
+            self.app.warm()
+
+        self.assertTrue(fake_logger.error.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the profiler.py module
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import ujson
+
+from vlab_avamar_api.lib.worker import profiler
+
+
+class TestTaskProfile(unittest.TestCase):
+    """A set of test cases for the TaskProfile object"""
+    def test_stop(self):
+        """``TaskProfile.stop`` returns the wall and CPU time of the task"""
+        profile = profiler.TaskProfile(task_name='avamar.show_server', task_id='some-task', txn_id='myId', interval=0.001)
+        profile.start()
+        time.sleep(0.05)
+
+        output = profile.stop()
+
+        self.assertTrue(output['wall_seconds'] >= 0.05)
+        self.assertTrue(output['cpu_seconds'] < output['wall_seconds'])
+
+    def test_stop_txn_id(self):
+        """``TaskProfile.stop`` links the profile to the txn_id"""
+        profile = profiler.TaskProfile(task_name='avamar.show_server', task_id='some-task', txn_id='myId', interval=1)
+        profile.start()
+
+        output = profile.stop()
+
+        self.assertEqual(output['txn_id'], 'myId')
+
+    def test_sample(self):
+        """``TaskProfile.sample`` records the stack of the profiled thread"""
+        profile = profiler.TaskProfile(task_name='avamar.show_server', task_id='some-task', txn_id='myId', interval=1)
+        profile.start()
+        profile.sample()
+
+        output = profile.stop()
+
+        self.assertEqual(output['samples'], 1)
+        self.assertTrue(any('test_sample' in x for x in output['stacks'].keys()))
+
+    def test_breakdown(self):
+        """``TaskProfile.stop`` spreads the wall time across the categories"""
+        profile = profiler.TaskProfile(task_name='avamar.show_server', task_id='some-task', txn_id='myId', interval=1)
+        profile.start()
+        profile.sample()
+
+        output = profile.stop()
+
+        self.assertEqual(output['seconds']['local'], output['wall_seconds'])
+
+
+class TestCategory(unittest.TestCase):
+    """A set of test cases for attributing samples"""
+    def test_vcenter(self):
+        """``_category`` attributes time reading from a socket to vCenter"""
+        inner = type('Frame', (), {'f_globals': {'__name__': 'ssl'}})()
+        outer = type('Frame', (), {'f_globals': {'__name__': 'pyVmomi.SoapAdapter'}})()
+
+        self.assertEqual(profiler._category([inner, outer]), 'vcenter')
+
+    def test_serialization(self):
+        """``_category`` attributes time parsing SOAP messages to serialization"""
+        inner = type('Frame', (), {'f_globals': {'__name__': 'vlab_avamar_api.lib.worker.vmware'}})()
+        outer = type('Frame', (), {'f_globals': {'__name__': 'pyVmomi.SoapAdapter'}})()
+
+        self.assertEqual(profiler._category([inner, outer]), 'serialization')
+
+    def test_waiting(self):
+        """``_category`` attributes time blocked on other threads to waiting"""
+        frame = type('Frame', (), {'f_globals': {'__name__': 'concurrent.futures._base'}})()
+
+        self.assertEqual(profiler._category([frame]), 'waiting')
+
+    def test_local(self):
+        """``_category`` attributes everything else to local"""
+        frame = type('Frame', (), {'f_globals': {'__name__': 'jsonschema.validators'}})()
+
+        self.assertEqual(profiler._category([frame]), 'local')
+
+
+class TestWanted(unittest.TestCase):
+    """A set of test cases for the ``wanted`` function"""
+    def test_asked(self):
+        """``wanted`` is True when the API request asked for a profile"""
+        self.assertTrue(profiler.wanted({'vlab_profile': True}, sample=0))
+
+    def test_not_asked(self):
+        """``wanted`` is False when not asked, and nothing is sampled"""
+        self.assertFalse(profiler.wanted({}, sample=0))
+
+    def test_sampled(self):
+        """``wanted`` is True for every task when sampling 100 percent"""
+        self.assertTrue(profiler.wanted({}, sample=100))
+
+
+class TestSave(unittest.TestCase):
+    """A set of test cases for the ``save`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save(self):
+        """``save`` writes the profile as JSON, named after the txn_id"""
+        path = profiler.save({'txn_id': 'myId', 'task_id': 'some-task'}, self.tmp_dir, keep=10)
+
+        with open(path) as the_file:
+            saved = ujson.load(the_file)
+
+        self.assertEqual(os.path.basename(path), 'myId-some-task.json')
+        self.assertEqual(saved['txn_id'], 'myId')
+
+    def test_save_sanitizes(self):
+        """``save`` does not let the txn_id escape the directory"""
+        path = profiler.save({'txn_id': '../../etc/passwd', 'task_id': 'some-task'}, self.tmp_dir, keep=10)
+
+        self.assertEqual(os.path.dirname(path), self.tmp_dir)
+
+    def test_save_keep(self):
+        """``save`` removes the oldest profiles beyond ``keep``"""
+        for idx in range(3):
+            profiler.save({'txn_id': 'myId', 'task_id': 'task{}'.format(idx)}, self.tmp_dir, keep=2)
+            os.utime(os.path.join(self.tmp_dir, 'myId-task{}.json'.format(idx)), (idx, idx))
+
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['myId-task1.json', 'myId-task2.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
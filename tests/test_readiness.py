@@ -0,0 +1,142 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the readiness.py module
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest.mock import patch, MagicMock
+
+from vlab_avamar_api.lib import readiness
+from vlab_avamar_api.lib.state import SharedState
+
+
+class TestReadiness(unittest.TestCase):
+    """A set of test cases for the Readiness object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.throttle_state = SharedState(os.path.join(self.tmp_dir, 'throttle.json'))
+        self.celery_app = MagicMock()
+        self.celery_app.control.broadcast.return_value = [{'celery@worker1': {'ready': True, 'seconds': 1.5}}]
+        self.readiness = readiness.Readiness(celery_app=self.celery_app, interval=10,
+                                             throttle_state=self.throttle_state)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    @patch.object(readiness.Readiness, 'start')
+    def test_report_ready(self, fake_start):
+        """``Readiness.report`` is ready when every check passed"""
+        self.readiness.check()
+
+        self.assertTrue(self.readiness.report()['ready'])
+
+    @patch.object(readiness.Readiness, 'start')
+    def test_report_not_checked(self, fake_start):
+        """``Readiness.report`` is not ready before the checks have run"""
+        report = self.readiness.report()
+
+        self.assertFalse(report['ready'])
+        self.assertEqual(sorted(report['checks'].keys()), ['broker', 'vcenter', 'workers'])
+
+    @patch.object(readiness.Readiness, 'start')
+    def test_report_stale(self, fake_start):
+        """``Readiness.report`` is not ready when the checks stopped running"""
+        self.readiness.check()
+        with patch.object(readiness.time, 'time', return_value=time.time() + 31):
+            report = self.readiness.report()
+
+        self.assertFalse(report['ready'])
+
+    @patch.object(readiness.Readiness, 'start')
+    def test_broker_down(self, fake_start):
+        """``Readiness.check`` reports a broker that refuses connections"""
+        self.celery_app.connection_for_write.return_value.__enter__.return_value.ensure_connection.side_effect = OSError('testing')
+        self.readiness.check()
+
+        report = self.readiness.report()
+
+        self.assertFalse(report['checks']['broker']['ok'])
+        self.assertEqual(report['checks']['broker']['detail'], 'testing')
+
+    @patch.object(readiness.Readiness, 'start')
+    def test_no_workers(self, fake_start):
+        """``Readiness.check`` reports when no worker answers"""
+        self.celery_app.control.broadcast.return_value = []
+        self.readiness.check()
+
+        self.assertFalse(self.readiness.report()['checks']['workers']['ok'])
+
+    @patch.object(readiness.Readiness, 'start')
+    def test_workers_warming_up(self, fake_start):
+        """``Readiness.check`` is not ready until a worker has warmed up"""
+        self.celery_app.control.broadcast.return_value = [{'celery@worker1': {'ready': False, 'seconds': None}}]
+        self.readiness.check()
+
+        self.assertFalse(self.readiness.report()['checks']['workers']['ok'])
+
+    @patch.object(readiness.Readiness, 'start')
+    def test_workers_warm_up_failed(self, fake_start):
+        """``Readiness.check`` is not ready when the workers failed to warm up, and says why"""
+        self.celery_app.control.broadcast.return_value = [{'celery@worker1': {'ready': False, 'seconds': None,
+                                                                             'statuses': {'failed': 1},
+                                                                             'errors': ['Unable to preload vcenter1: doh']}}]
+        self.readiness.check()
+        result = self.readiness.report()['checks']['workers']
+
+        self.assertFalse(result['ok'])
+        self.assertTrue('Unable to preload vcenter1: doh' in result['detail'])
+
+    @patch.object(readiness.Readiness, 'start')
+    def test_old_workers(self, fake_start):
+        """``Readiness.check`` is not ready when workers do not know the warm up status command"""
+        self.celery_app.control.broadcast.return_value = [{'celery@worker1': {'error': "No such command"}}]
+        self.readiness.check()
+
+        self.assertFalse(self.readiness.report()['checks']['workers']['ok'])
+
+    @patch.object(readiness.Readiness, 'start')
+    def test_vcenter_breaker_open(self, fake_start):
+        """``Readiness.check`` reports a vCenter with an open circuit breaker"""
+        with self.throttle_state.locked() as data:
+            data[readiness.const.INF_VCENTER_SERVERS[0]] = {'breaker': {'failures': 100, 'opened': time.time()}}
+        self.readiness.check()
+
+        self.assertFalse(self.readiness.report()['checks']['vcenter']['ok'])
+
+    def test_no_worker_imports(self):
+        """The readiness checks do not import the worker, or pyVmomi"""
+        script = ('import sys; import vlab_avamar_api.lib.readiness; '
+                  'print(any(x.startswith(("pyVmomi", "vlab_avamar_api.lib.worker")) for x in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', script], stderr=subprocess.DEVNULL).decode().strip()
+
+        self.assertEqual(output, 'False')
+
+    @patch.object(readiness.Readiness, '_run')
+    def test_start_once(self, fake_run):
+        """``Readiness.start`` only starts one background thread per process"""
+        self.readiness.start()
+        thread = self.readiness._thread
+        self.readiness.start()
+
+        self.assertTrue(self.readiness._thread is thread)
+
+    @patch.object(readiness.Readiness, '_run')
+    def test_start_after_fork(self, fake_run):
+        """``Readiness.start`` starts a new thread in a forked process"""
+        self.readiness.start()
+        thread = self.readiness._thread
+        with patch.object(readiness.os, 'getpid', return_value=-1):
+            self.readiness.start()
+
+        self.assertFalse(self.readiness._thread is thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
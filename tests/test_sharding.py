@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the sharding.py module
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_avamar_api.lib.worker import sharding
+
+
+class TestHashRing(unittest.TestCase):
+    """A set of test cases for the HashRing object"""
+    def test_get(self):
+        """``HashRing.get`` always maps a user to the same server"""
+        ring = sharding.HashRing(['vc1', 'vc2', 'vc3'])
+
+        self.assertEqual(ring.get('alice'), ring.get('alice'))
+
+    def test_get_spreads(self):
+        """``HashRing.get`` spreads users across every server"""
+        ring = sharding.HashRing(['vc1', 'vc2', 'vc3'])
+
+        found = {ring.get('user{}'.format(x)) for x in range(100)}
+
+        self.assertEqual(found, {'vc1', 'vc2', 'vc3'})
+
+    def test_weights(self):
+        """``HashRing`` gives servers with a larger weight more users"""
+        ring = sharding.HashRing(['vc1', 'vc2'], weights={'vc1': '4'})
+
+        found = [ring.get('user{}'.format(x)) for x in range(1000)]
+
+        self.assertTrue(found.count('vc1') > found.count('vc2'))
+
+    def test_overrides(self):
+        """``HashRing.get`` honors the overrides"""
+        ring = sharding.HashRing(['vc1', 'vc2'], overrides={'alice': 'vc2', 'bob': 'vc2'})
+
+        self.assertEqual(ring.get('alice'), 'vc2')
+        self.assertEqual(ring.get('bob'), 'vc2')
+
+    def test_overrides_unknown_server(self):
+        """``HashRing`` ignores overrides to servers that are not on the ring"""
+        ring = sharding.HashRing(['vc1'], overrides={'alice': 'vc9'})
+
+        self.assertEqual(ring.get('alice'), 'vc1')
+
+    def test_candidates(self):
+        """``HashRing.candidates`` returns every server once, starting with the home server"""
+        ring = sharding.HashRing(['vc1', 'vc2', 'vc3'])
+
+        output = ring.candidates('alice')
+
+        self.assertEqual(output[0], ring.get('alice'))
+        self.assertEqual(sorted(output), ['vc1', 'vc2', 'vc3'])
+
+    def test_stable(self):
+        """``HashRing`` only moves the users of a removed server"""
+        users = ['user{}'.format(x) for x in range(100)]
+        before = sharding.HashRing(['vc1', 'vc2', 'vc3'])
+        after = sharding.HashRing(['vc1', 'vc2'])
+
+        moved = [x for x in users if before.get(x) != after.get(x)]
+
+        self.assertTrue(all(before.get(x) == 'vc3' for x in moved))
+
+    def test_no_servers(self):
+        """``HashRing`` raises ValueError if no servers are supplied"""
+        with self.assertRaises(ValueError):
+            sharding.HashRing([])
+
+
+class TestSessionPool(unittest.TestCase):
+    """A set of test cases for the SessionPool object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.factory = MagicMock()
+        self.factory.side_effect = lambda: MagicMock()
+        self.pool = sharding.SessionPool(self.factory, size=2, max_idle=60)
+
+    def test_reuse(self):
+        """``SessionPool.session`` reuses an idle session"""
+        with self.pool.session() as first:
+            pass
+        with self.pool.session() as second:
+            pass
+
+        self.assertTrue(first is second)
+        self.assertEqual(self.pool.stats(), {'idle': 1, 'created': 1, 'reused': 1})
+
+    def test_concurrent(self):
+        """``SessionPool.session`` creates a new session if all are in use"""
+        with self.pool.session() as first:
+            with self.pool.session() as second:
+                pass
+
+        self.assertFalse(first is second)
+
+    def test_size(self):
+        """``SessionPool`` closes sessions beyond the max number of idle sessions"""
+        with self.pool.session() as first:
+            with self.pool.session():
+                with self.pool.session():
+                    pass
+
+        # The first session is the last one returned, so it's the odd one out
+        self.assertTrue(first.__exit__.called)
+        self.assertEqual(self.pool.stats()['idle'], 2)
+
+    def test_error(self):
+        """``SessionPool.session`` closes the session upon an unexpected error"""
+        with self.assertRaises(RuntimeError):
+            with self.pool.session() as vcenter:
+                raise RuntimeError('testing')
+
+        self.assertTrue(vcenter.__exit__.called)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_value_error(self):
+        """``SessionPool.session`` keeps the session after a ValueError"""
+        with self.assertRaises(ValueError):
+            with self.pool.session():
+                raise ValueError('testing')
+
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    def test_overloaded(self):
+        """``SessionPool.session`` keeps the session when vCenter is shedding load"""
+        with self.assertRaises(sharding.Overloaded):
+            with self.pool.session():
+                raise sharding.Overloaded('testing')
+
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    @patch.object(sharding.time, 'time')
+    def test_max_idle(self, fake_time):
+        """``SessionPool.session`` closes sessions that have been idle too long"""
+        fake_time.return_value = 100
+        with self.pool.session() as first:
+            pass
+        fake_time.return_value = 200
+        with self.pool.session() as second:
+            pass
+
+        self.assertFalse(first is second)
+        self.assertTrue(first.__exit__.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the state.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from vlab_avamar_api.lib import state
+
+
+class TestSharedState(unittest.TestCase):
+    """A set of test cases for the SharedState object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state = state.SharedState(os.path.join(self.tmp_dir, 'state.json'))
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_locked_saves(self):
+        """``SharedState.locked`` saves changes made to the state"""
+        with self.state.locked() as data:
+            data['foo'] = 1
+
+        self.assertEqual(self.state.read(), {'foo': 1})
+
+    def test_locked_error(self):
+        """``SharedState.locked`` does not save changes if an error occurs"""
+        with self.assertRaises(RuntimeError):
+            with self.state.locked() as data:
+                data['foo'] = 1
+                raise RuntimeError('testing')
+
+        self.assertEqual(self.state.read(), {})
+
+    def test_locked_corrupt(self):
+        """``SharedState.locked`` starts over if the file is not valid JSON"""
+        with open(self.state.path, 'w') as the_file:
+            the_file.write('{"foo": ')
+
+        with self.state.locked() as data:
+            self.assertEqual(data, {})
+
+    def test_read_missing(self):
+        """``SharedState.read`` returns an empty dictionary if the file does not exist"""
+        self.assertEqual(self.state.read(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
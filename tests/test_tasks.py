@@ -5,15 +5,27 @@ A suite of tests for the functions in tasks.py
 import unittest
 from unittest.mock import patch, MagicMock
 
+from celery.exceptions import Retry
+
 from vlab_avamar_api.lib.worker import tasks
 
 
 class TestTasks(unittest.TestCase):
     """A set of test cases for tasks.py"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.generations_patcher = patch.object(tasks, 'GENERATIONS')
+        self.fake_generations = self.generations_patcher.start()
+        self.fake_generations.generation.return_value = 7
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.generations_patcher.stop()
+
     @patch.object(tasks, 'vmware')
     def test_show_ok(self, fake_vmware):
         """``show`` returns a dictionary when everything works as expected"""
-        fake_vmware.show_avamar.return_value = {'worked': True}
+        fake_vmware.show_avamar.return_value = ({'worked': True}, [])
 
         output = tasks.show(username='bob', txn_id='myId')
         expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
@@ -30,8 +42,9 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'ADMISSION')
     @patch.object(tasks, 'vmware')
-    def test_create_ok(self, fake_vmware):
+    def test_create_ok(self, fake_vmware, fake_ADMISSION):
         """``create`` returns a dictionary when everything works as expected"""
         fake_vmware.create_avamar.return_value = {'worked': True}
         ip_config = {'static-ip': '1.2.3.4',
@@ -50,8 +63,41 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'ADMISSION')
+    @patch.object(tasks, 'vmware')
+    def test_create_not_admitted(self, fake_vmware, fake_ADMISSION):
+        """``create`` retries the task later if the deploy is not admitted"""
+        fake_ADMISSION.admit.return_value = False
+
+        with self.assertRaises(Retry):
+            tasks.create(username='bob',
+                         machine_name='avamarBox',
+                         image='0.0.1',
+                         network='someLAN',
+                         ip_config={},
+                         txn_id='myId')
+
+        self.assertFalse(fake_vmware.create_avamar.called)
+
+    @patch.object(tasks, 'ADMISSION')
     @patch.object(tasks, 'vmware')
-    def test_create_value_error(self, fake_vmware):
+    def test_create_releases(self, fake_vmware, fake_ADMISSION):
+        """``create`` frees up the admission slot even if the deploy fails"""
+        fake_vmware.create_avamar.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            tasks.create(username='bob',
+                         machine_name='avamarBox',
+                         image='0.0.1',
+                         network='someLAN',
+                         ip_config={},
+                         txn_id='myId')
+
+        self.assertEqual(fake_ADMISSION.release.call_args[0][0], 'bob')
+
+    @patch.object(tasks, 'ADMISSION')
+    @patch.object(tasks, 'vmware')
+    def test_create_value_error(self, fake_vmware, fake_ADMISSION):
         """``create`` sets the error in the dictionary to the ValueError message"""
         fake_vmware.create_avamar.side_effect = [ValueError("testing")]
         ip_config = {'static-ip': '1.2.3.4',
@@ -90,6 +136,32 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_delete_overloaded(self, fake_vmware):
+        """``delete`` sets the error in the dictionary when vCenter is shedding load"""
+        fake_vmware.delete_avamar.side_effect = [tasks.Overloaded("testing")]
+
+        output = tasks.delete(username='bob', machine_name='avamarBox', txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'ADMISSION')
+    @patch.object(tasks, 'vmware')
+    def test_create_overloaded(self, fake_vmware, fake_ADMISSION):
+        """``create`` sets the error in the dictionary when vCenter is shedding load"""
+        fake_vmware.create_avamar.side_effect = [tasks.Overloaded("testing")]
+
+        output = tasks.create(username='bob',
+                              machine_name='avamarBox',
+                              image='0.0.1',
+                              network='someLAN',
+                              ip_config={'static-ip': '1.2.3.4'},
+                              txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
     @patch.object(tasks, 'vmware')
     def test_image(self, fake_vmware):
         """``image`` returns a dictionary when everything works as expected"""
@@ -104,7 +176,7 @@ class TestTasks(unittest.TestCase):
     @patch.object(tasks, 'vmware')
     def test_show_ndmp_ok(self, fake_vmware):
         """``show_ndmp`` returns a dictionary when everything works as expected"""
-        fake_vmware.show_avamar.return_value = {'worked': True}
+        fake_vmware.show_avamar.return_value = ({'worked': True}, [])
 
         output = tasks.show_ndmp(username='bob', txn_id='myId')
         expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
@@ -121,8 +193,9 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'ADMISSION')
     @patch.object(tasks, 'vmware')
-    def test_create_ndmp_ok(self, fake_vmware):
+    def test_create_ndmp_ok(self, fake_vmware, fake_ADMISSION):
         """``create_ndmp`` returns a dictionary when everything works as expected"""
         fake_vmware.create_avamar.return_value = {'worked': True}
         ip_config = {'static-ip': '1.2.3.4',
@@ -141,8 +214,9 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'ADMISSION')
     @patch.object(tasks, 'vmware')
-    def test_create_ndmp_value_error(self, fake_vmware):
+    def test_create_ndmp_value_error(self, fake_vmware, fake_ADMISSION):
         """``create_ndmp`` sets the error in the dictionary to the ValueError message"""
         fake_vmware.create_avamar.side_effect = [ValueError("testing")]
         ip_config = {'static-ip': '1.2.3.4',
@@ -191,6 +265,408 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_fleet(self, fake_vmware):
+        """``fleet`` returns a dictionary when everything works as expected"""
+        fake_vmware.show_fleet.return_value = {'worked': True}
+
+        output = tasks.fleet(txn_id='myId')
+        expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_fleet_value_error(self, fake_vmware):
+        """``fleet`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.show_fleet.side_effect = [ValueError("testing")]
+
+        output = tasks.fleet(txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_fleet_ndmp(self, fake_vmware):
+        """``fleet_ndmp`` looks up Avamar NDMP Accelerators"""
+        fake_vmware.show_fleet.return_value = {'worked': True}
+
+        tasks.fleet_ndmp(txn_id='myId')
+        the_args, the_kwargs = fake_vmware.show_fleet.call_args
+
+        self.assertEqual(the_kwargs['kind'], 'AvamarNDMP')
+
+    @patch.object(tasks, 'IMAGE_INDEX')
+    @patch.object(tasks, 'ADMISSION')
+    @patch.object(tasks, 'vmware')
+    def test_stats(self, fake_vmware, fake_ADMISSION, fake_IMAGE_INDEX):
+        """``stats`` returns the counters of the worker process"""
+        fake_vmware.worker_stats.return_value = {'moref_cache': {}}
+        fake_ADMISSION.stats.return_value = {'running': {}, 'queued': {}}
+        fake_IMAGE_INDEX.report.return_value = {'images': {}, 'failed': [], 'duplicates': []}
+
+        output = tasks.stats(txn_id='myId')
+        expected = {'content' : {'moref_cache': {},
+                                 'admission': {'running': {}, 'queued': {}},
+                                 'images': {'images': {}, 'failed': [], 'duplicates': []}},
+                    'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'IMAGE_INDEX')
+    def test_verify_images(self, fake_IMAGE_INDEX):
+        """``verify_images`` returns the report of the image index"""
+        fake_IMAGE_INDEX.refresh.return_value = {'verified': ['AVE-1.0.0.ova']}
+
+        output = tasks.verify_images(txn_id='myId')
+        expected = {'content' : {'verified': ['AVE-1.0.0.ova']}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'IMAGE_INDEX')
+    def test_verify_images_error(self, fake_IMAGE_INDEX):
+        """``verify_images`` sets the error in the response when the images cannot be listed"""
+        fake_IMAGE_INDEX.refresh.side_effect = FileNotFoundError('no such dir')
+
+        output = tasks.verify_images(txn_id='myId')
+
+        self.assertEqual(output['error'], 'no such dir')
+
+    @patch.object(tasks, 'vmware')
+    def test_sync_library(self, fake_vmware):
+        """``sync_library`` returns the sync progress of the library"""
+        fake_vmware.sync_library.return_value = {'progress': {'percent': 100.0}, 'images': {}}
+
+        output = tasks.sync_library(txn_id='myId')
+        expected = {'content' : {'progress': {'percent': 100.0}, 'images': {}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_sync_library_error(self, fake_vmware):
+        """``sync_library`` sets the error in the response when the images cannot be listed"""
+        fake_vmware.sync_library.side_effect = FileNotFoundError('no such dir')
+
+        output = tasks.sync_library(txn_id='myId')
+
+        self.assertEqual(output['error'], 'no such dir')
+
+    @patch.object(tasks, 'WARM_UPS')
+    @patch.object(tasks, 'vmware')
+    def test_warm_up(self, fake_vmware, fake_WARM_UPS):
+        """``warm_up`` records how long the worker process took to warm up, and whether it worked"""
+        fake_vmware.warm_up.side_effect = lambda timeout, record: record({'seconds': 2.5, 'errors': [], 'status': 'ok'})
+
+        tasks.warm_up()
+        the_args, _ = fake_WARM_UPS.record.call_args
+
+        self.assertEqual(the_args[1:], (2.5, [], 'ok'))
+
+    @patch.object(tasks, 'WARM_UPS')
+    def test_warm_up_status(self, fake_WARM_UPS):
+        """``warm_up_status`` summarizes the warm up of the worker's current processes"""
+        fake_state = MagicMock()
+        fake_state.consumer.pool.info = {'processes': [123, 456]}
+
+        tasks.warm_up_status(fake_state)
+        the_args, _ = fake_WARM_UPS.report.call_args
+
+        self.assertEqual(the_args, ([123, 456],))
+
+    @patch.object(tasks.profiler, 'TaskProfile')
+    def test_start_profile(self, fake_TaskProfile):
+        """``start_profile`` profiles a task when the API request asked for it"""
+        fake_task = MagicMock()
+        fake_task.request = {'vlab_profile': True}
+        fake_task.run = tasks.show.run
+
+        tasks.start_profile(task_id='some-task', task=fake_task, args=['bob', 'myId'], kwargs={})
+        tasks.PROFILES.clear()
+        _, the_kwargs = fake_TaskProfile.call_args
+
+        self.assertEqual(the_kwargs['txn_id'], 'myId')
+
+    @patch.object(tasks.profiler, 'TaskProfile')
+    def test_start_profile_not_wanted(self, fake_TaskProfile):
+        """``start_profile`` does not profile tasks by default"""
+        fake_task = MagicMock()
+        fake_task.request = {}
+
+        tasks.start_profile(task_id='some-task', task=fake_task, args=['bob', 'myId'], kwargs={})
+
+        self.assertFalse(fake_TaskProfile.called)
+
+    @patch.object(tasks.profiler, 'save')
+    def test_stop_profile(self, fake_save):
+        """``stop_profile`` saves the profile of the task"""
+        fake_profile = MagicMock()
+        tasks.PROFILES['some-task'] = fake_profile
+
+        tasks.stop_profile(task_id='some-task')
+
+        self.assertTrue(fake_save.called)
+        self.assertFalse('some-task' in tasks.PROFILES)
+
+    @patch.object(tasks.profiler, 'save')
+    def test_stop_profile_save_error(self, fake_save):
+        """``stop_profile`` does not raise if the profile cannot be saved"""
+        fake_save.side_effect = PermissionError('testing')
+        tasks.PROFILES['some-task'] = MagicMock()
+
+        tasks.stop_profile(task_id='some-task')
+
+    @patch.object(tasks.profiler, 'save')
+    def test_stop_profile_not_profiled(self, fake_save):
+        """``stop_profile`` ignores tasks that were not profiled"""
+        tasks.stop_profile(task_id='some-task')
+
+        self.assertFalse(fake_save.called)
+
+    @patch.object(tasks, 'reap')
+    @patch.object(tasks, 'vmware')
+    def test_delete_background(self, fake_vmware, fake_reap):
+        """``delete`` hands off destroying the VMs to the ``reap`` task when ``background=True``"""
+        fake_vmware.delete_avamar.return_value = ['avamarBox']
+        fake_reap.delay.return_value.id = 'some-task-id'
+
+        output = tasks.delete(username='bob', machine_name='avamarBox', txn_id='myId', background=True)
+        expected = {'content' : {'reaper': 'some-task-id'}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'reap')
+    @patch.object(tasks, 'vmware')
+    def test_delete_ndmp_background(self, fake_vmware, fake_reap):
+        """``delete_ndmp`` hands off destroying the VMs to the ``reap`` task when ``background=True``"""
+        fake_vmware.delete_avamar.return_value = ['ndmpBox']
+
+        tasks.delete_ndmp(username='bob', machine_name='ndmpBox', txn_id='myId', background=True)
+        the_args, _ = fake_reap.delay.call_args
+
+        self.assertEqual(the_args, ('bob', ['ndmpBox'], 'AvamarNDMP', 'myId'))
+
+    @patch.object(tasks, 'vmware')
+    def test_reap(self, fake_vmware):
+        """``reap`` destroys the supplied VMs"""
+        output = tasks.reap(username='bob', machine_names=['avamarBox'], kind='Avamar', txn_id='myId')
+        expected = {'content' : {}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_reap_value_error(self, fake_vmware):
+        """``reap`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.delete_avamar.side_effect = [ValueError("testing")]
+
+        output = tasks.reap(username='bob', machine_names=['avamarBox'], kind='Avamar', txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_reset(self, fake_vmware):
+        """``reset`` returns a dictionary when everything works as expected"""
+        fake_vmware.reset_avamar.return_value = {'worked': True}
+
+        output = tasks.reset(username='bob', machine_name='avamarBox', txn_id='myId')
+        expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_reset_value_error(self, fake_vmware):
+        """``reset`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.reset_avamar.side_effect = [ValueError("testing")]
+
+        output = tasks.reset(username='bob', machine_name='avamarBox', txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_reset_ndmp(self, fake_vmware):
+        """``reset_ndmp`` resets an Avamar NDMP Accelerator"""
+        fake_vmware.reset_avamar.return_value = {'worked': True}
+
+        tasks.reset_ndmp(username='bob', machine_name='ndmpBox', txn_id='myId')
+        _, the_kwargs = fake_vmware.reset_avamar.call_args
+
+        self.assertEqual(the_kwargs['kind'], 'AvamarNDMP')
+
+    @patch.object(tasks, 'vmware')
+    def test_suspend(self, fake_vmware):
+        """``suspend`` returns a dictionary when everything works as expected"""
+        fake_vmware.suspend_avamar.return_value = {'worked': True}
+
+        output = tasks.suspend(username='bob', machine_name='avamarBox', txn_id='myId')
+        expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_suspend_value_error(self, fake_vmware):
+        """``suspend`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.suspend_avamar.side_effect = [ValueError("testing")]
+
+        output = tasks.suspend(username='bob', machine_name='avamarBox', txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_suspend_bumps(self, fake_vmware):
+        """``suspend`` bumps the generation of the owner's inventory"""
+        tasks.suspend(username='bob', machine_name='avamarBox', txn_id='myId')
+
+        self.fake_generations.bump.assert_called_with('inventory:Avamar:bob')
+
+    @patch.object(tasks, 'vmware')
+    def test_suspend_ndmp(self, fake_vmware):
+        """``suspend_ndmp`` suspends an Avamar NDMP Accelerator"""
+        tasks.suspend_ndmp(username='bob', machine_name='ndmpBox', txn_id='myId')
+        _, the_kwargs = fake_vmware.suspend_avamar.call_args
+
+        self.assertEqual(the_kwargs['kind'], 'AvamarNDMP')
+
+    @patch.object(tasks, 'vmware')
+    def test_resume(self, fake_vmware):
+        """``resume`` returns a dictionary when everything works as expected"""
+        fake_vmware.resume_avamar.return_value = {'worked': True}
+
+        output = tasks.resume(username='bob', machine_name='avamarBox', txn_id='myId')
+        expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_resume_value_error(self, fake_vmware):
+        """``resume`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.resume_avamar.side_effect = [ValueError("testing")]
+
+        output = tasks.resume(username='bob', machine_name='avamarBox', txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_resume_ndmp(self, fake_vmware):
+        """``resume_ndmp`` resumes an Avamar NDMP Accelerator"""
+        tasks.resume_ndmp(username='bob', machine_name='ndmpBox', txn_id='myId')
+        _, the_kwargs = fake_vmware.resume_avamar.call_args
+
+        self.assertEqual(the_kwargs['kind'], 'AvamarNDMP')
+
+    @patch.object(tasks, 'vmware')
+    def test_suspend_idle(self, fake_vmware):
+        """``suspend_idle`` returns the report of the idle policy, and bumps the inventory of the owners"""
+        fake_vmware.suspend_idle.return_value = {'suspended': {'bob': ['avamarBox']}, 'idle': {}}
+
+        output = tasks.suspend_idle(txn_id='myId')
+        expected = {'content' : {'suspended': {'bob': ['avamarBox']}, 'idle': {}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+        self.fake_generations.bump.assert_any_call('inventory:Avamar:bob')
+        self.fake_generations.bump.assert_any_call('inventory:AvamarNDMP:bob')
+
+    @patch.object(tasks, 'vmware')
+    def test_reap_expired(self, fake_vmware):
+        """``reap_expired`` returns the report of the reaper"""
+        fake_vmware.reap_expired.return_value = {'expired': {}}
+
+        output = tasks.reap_expired(dry_run=True, txn_id='myId')
+        expected = {'content' : {'expired': {}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    def test_reap_expired_scheduled(self):
+        """``reap_expired`` is ran periodically by Celery beat"""
+        scheduled = [x['task'] for x in tasks.app.conf.beat_schedule.values()]
+
+        self.assertTrue('avamar.reap_expired' in scheduled)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_observes(self, fake_vmware):
+        """``show`` records what it found, with the generation from before it looked"""
+        fake_vmware.show_avamar.return_value = ({'worked': True}, [])
+
+        tasks.show(username='bob', txn_id='myId')
+
+        self.fake_generations.observe.assert_called_with('inventory:Avamar:bob', {'worked': True}, 7)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_incomplete(self, fake_vmware):
+        """``show`` returns the VMs it found, and says which vCenter was skipped"""
+        fake_vmware.show_avamar.return_value = ({'worked': True}, ['vc2'])
+
+        output = tasks.show(username='bob', txn_id='myId')
+        expected = {'content' : {'worked': True},
+                    'error': 'Results are incomplete; vCenter vc2 is unhealthy, try again later',
+                    'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_incomplete_not_observed(self, fake_vmware):
+        """``show`` does not record a partial result"""
+        fake_vmware.show_avamar.return_value = ({'worked': True}, ['vc2'])
+
+        tasks.show(username='bob', txn_id='myId')
+
+        self.assertFalse(self.fake_generations.observe.called)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_error_not_observed(self, fake_vmware):
+        """``show`` does not record anything when it fails"""
+        fake_vmware.show_avamar.side_effect = [ValueError("testing")]
+
+        tasks.show(username='bob', txn_id='myId')
+
+        self.assertFalse(self.fake_generations.observe.called)
+
+    @patch.object(tasks, 'ADMISSION')
+    @patch.object(tasks, 'vmware')
+    def test_create_bumps(self, fake_vmware, fake_ADMISSION):
+        """``create_ndmp`` bumps the generation of the user's NDMP inventory"""
+        tasks.create_ndmp(username='bob', machine_name='avamarBox', image='0.0.1',
+                          network='someLAN', ip_config={}, txn_id='myId')
+
+        self.fake_generations.bump.assert_called_with('inventory:AvamarNDMP:bob')
+
+    @patch.object(tasks, 'vmware')
+    def test_delete_bumps_on_error(self, fake_vmware):
+        """``delete`` bumps the generation even if deleting failed part way"""
+        fake_vmware.delete_avamar.side_effect = [ValueError("testing")]
+
+        tasks.delete(username='bob', machine_name='avamarBox', txn_id='myId')
+
+        self.fake_generations.bump.assert_called_with('inventory:Avamar:bob')
+
+    @patch.object(tasks, 'vmware')
+    def test_image_observes(self, fake_vmware):
+        """``image`` records the images it found"""
+        fake_vmware.list_images.return_value = ['19.4']
+
+        tasks.image(txn_id='myId')
+
+        self.fake_generations.observe.assert_called_with('images:Avamar', {'image': ['19.4']}, 7)
+
+    @patch.object(tasks, 'vmware')
+    def test_reap_expired_bumps(self, fake_vmware):
+        """``reap_expired`` bumps the generation of every owner it destroyed VMs for"""
+        fake_vmware.reap_expired.return_value = {'expired': {'bob': ['box1']}, 'warned': {}, 'dry_run': False}
+
+        tasks.reap_expired(dry_run=False, txn_id='myId')
+
+        self.assertEqual(self.fake_generations.bump.call_count, 2)
+
+    @patch.object(tasks, 'vmware')
+    def test_reap_expired_dry_run(self, fake_vmware):
+        """``reap_expired`` does not bump anything on a dry-run"""
+        fake_vmware.reap_expired.return_value = {'expired': {'bob': ['box1']}, 'warned': {}, 'dry_run': True}
+
+        tasks.reap_expired(dry_run=True, txn_id='myId')
+
+        self.assertFalse(self.fake_generations.bump.called)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,216 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the throttle.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from pyVmomi import vim
+
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.worker import throttle
+
+
+class TestThrottle(unittest.TestCase):
+    """A set of test cases for the Throttle object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state = SharedState(os.path.join(self.tmp_dir, 'throttle.json'))
+        self.throttle = throttle.Throttle(name='vcenter',
+                                          state=self.state,
+                                          rate=1,
+                                          burst=2,
+                                          heavy_rate=0.1,
+                                          heavy_burst=1,
+                                          failures=2,
+                                          reset=30,
+                                          max_wait=5)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    @patch.object(throttle.time, 'sleep')
+    def test_acquire_burst(self, fake_sleep):
+        """``Throttle.acquire`` does not block while there are tokens left"""
+        self.throttle.acquire()
+        self.throttle.acquire()
+
+        self.assertFalse(fake_sleep.called)
+
+    @patch.object(throttle.time, 'sleep')
+    def test_acquire_blocks(self, fake_sleep):
+        """``Throttle.acquire`` blocks once the tokens are used up"""
+        fake_sleep.side_effect = lambda x: self._rewind(x)
+        self.throttle.acquire()
+        self.throttle.acquire()
+        self.throttle.acquire()
+
+        self.assertTrue(fake_sleep.called)
+
+    def test_acquire_heavy(self):
+        """``Throttle.acquire`` gives heavy calls their own, smaller budget"""
+        self.throttle.acquire(heavy=True)
+
+        with self.assertRaises(throttle.circuit_breaker.Overloaded):
+            # It'd take 10 seconds to earn another token, and max_wait is 5
+            self.throttle.acquire(heavy=True)
+
+    def test_acquire_shared(self):
+        """``Throttle`` shares its budget with other throttles using the same state"""
+        other = throttle.Throttle(name='vcenter', state=self.state, rate=0.01, burst=2, heavy_rate=0.1,
+                                  heavy_burst=1, failures=2, reset=30, max_wait=5)
+        self.throttle.acquire()
+        self.throttle.acquire()
+
+        with self.assertRaises(throttle.circuit_breaker.Overloaded):
+            other.acquire()
+
+    def test_breaker_opens(self):
+        """``Throttle`` fails fast once enough calls in a row have failed"""
+        self.throttle.record(ok=False)
+        self.throttle.record(ok=False)
+
+        with self.assertRaises(throttle.circuit_breaker.Overloaded):
+            self.throttle.acquire()
+
+    def test_breaker_closes(self):
+        """``Throttle`` closes the breaker after a successful call"""
+        self.throttle.record(ok=False)
+        self.throttle.record(ok=True)
+        self.throttle.record(ok=False)
+
+        self.throttle.acquire()
+
+    @patch.object(throttle.time, 'time')
+    def test_breaker_half_open(self, fake_time):
+        """``Throttle`` tries calls again once the breaker has been open long enough"""
+        fake_time.return_value = 100
+        self.throttle.record(ok=False)
+        self.throttle.record(ok=False)
+        fake_time.return_value = 131
+
+        self.throttle.acquire()
+
+    def test_check(self):
+        """``Throttle.check`` raises Overloaded while the breaker is open"""
+        self.throttle.record(ok=False)
+        self.throttle.record(ok=False)
+
+        with self.assertRaises(throttle.circuit_breaker.Overloaded):
+            self.throttle.check()
+
+    def test_check_ok(self):
+        """``Throttle.check`` does nothing while the breaker is closed"""
+        self.throttle.check()
+
+    def test_install(self):
+        """``Throttle.install`` routes SOAP calls through the throttle"""
+        fake_vcenter = MagicMock()
+        invoke = fake_vcenter._conn._stub.InvokeMethod
+        invoke.side_effect = ConnectionError('testing')
+        self.throttle.install(fake_vcenter)
+        info = MagicMock()
+        info.name = 'RetrieveContents'
+
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                fake_vcenter._conn._stub.InvokeMethod(MagicMock(), info, [])
+
+        self.assertEqual(self.throttle.stats()['breaker']['failures'], 2)
+
+    def test_install_heavy(self):
+        """``Throttle.install`` takes a heavy token for expensive SOAP methods"""
+        fake_vcenter = MagicMock()
+        self.throttle.install(fake_vcenter)
+
+        fake_vcenter._conn._stub.InvokeMethod(MagicMock(), vim.ResourcePool.ImportVApp.info, [])
+
+        self.assertTrue(self.throttle.stats()['heavy']['tokens'] < 1)
+
+    def test_install_heavy_clone(self):
+        """``Throttle.install`` takes a heavy token for cloning a VM"""
+        fake_vcenter = MagicMock()
+        self.throttle.install(fake_vcenter)
+
+        fake_vcenter._conn._stub.InvokeMethod(MagicMock(), vim.VirtualMachine.Clone.info, [])
+
+        self.assertTrue(self.throttle.stats()['heavy']['tokens'] < 1)
+
+    def test_install_heavy_wsdl_name(self):
+        """``Throttle.install`` matches heavy methods on their WSDL name, not their pyVmomi name"""
+        fake_vcenter = MagicMock()
+        self.throttle.install(fake_vcenter)
+        info = MagicMock()
+        info.name = 'Clone'
+        info.wsdlName = 'CloneVM_Task'
+
+        fake_vcenter._conn._stub.InvokeMethod(MagicMock(), info, [])
+
+        self.assertTrue(self.throttle.stats()['heavy']['tokens'] < 1)
+
+    def test_install_destroy_not_heavy(self):
+        """``Throttle.install`` does not take a heavy token for destroying a VM, so batch deletes don't time out"""
+        fake_vcenter = MagicMock()
+        self.throttle.install(fake_vcenter)
+
+        for _ in range(3):
+            fake_vcenter._conn._stub.InvokeMethod(MagicMock(), vim.ManagedEntity.Destroy.info, [])
+
+        self.assertFalse('heavy' in self.throttle.stats())
+
+    def test_install_not_heavy(self):
+        """``Throttle.install`` does not take a heavy token for cheap SOAP methods"""
+        fake_vcenter = MagicMock()
+        self.throttle.install(fake_vcenter)
+
+        fake_vcenter._conn._stub.InvokeMethod(MagicMock(), vim.PropertyCollector.RetrieveContents.info, [])
+
+        self.assertFalse('heavy' in self.throttle.stats())
+
+    def test_install_accessor(self):
+        """``Throttle.install`` does not take a token for reading a property"""
+        fake_vcenter = MagicMock()
+        self.throttle.install(fake_vcenter)
+
+        for _ in range(10):
+            fake_vcenter._conn._stub.InvokeAccessor(MagicMock(), MagicMock())
+
+        self.assertFalse('normal' in self.throttle.stats())
+
+    def test_install_accessor_breaker(self):
+        """``Throttle.install`` still counts failed property reads towards the breaker"""
+        fake_vcenter = MagicMock()
+        fake_vcenter._conn._stub.InvokeAccessor.side_effect = ConnectionError('testing')
+        self.throttle.install(fake_vcenter)
+
+        with self.assertRaises(ConnectionError):
+            fake_vcenter._conn._stub.InvokeAccessor(MagicMock(), MagicMock())
+
+        self.assertEqual(self.throttle.stats()['breaker']['failures'], 1)
+
+    def test_install_fault(self):
+        """``Throttle.install`` does not count vSphere faults as vCenter being unhealthy"""
+        fake_vcenter = MagicMock()
+        fake_vcenter._conn._stub.InvokeMethod.side_effect = vim.fault.NotFound()
+        self.throttle.install(fake_vcenter)
+
+        with self.assertRaises(vim.fault.NotFound):
+            fake_vcenter._conn._stub.InvokeMethod(MagicMock(), MagicMock(), [])
+
+        self.assertEqual(self.throttle.stats()['breaker']['failures'], 0)
+
+    def _rewind(self, seconds):
+        """Simulate time passing, by backdating the buckets"""
+        with self.state.locked() as data:
+            for bucket in ('normal', 'heavy'):
+                if bucket in data['vcenter']:
+                    data['vcenter'][bucket]['updated'] -= seconds
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the upload.py module
+"""
+import io
+import os
+import gzip
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_avamar_api.lib.worker import upload
+
+
+class TestUpload(unittest.TestCase):
+    """A set of test cases for the upload.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ova_path = os.path.join(self.tmp_dir, 'AVE-1.0.0.ova')
+        self.disks = {'disk1.vmdk': b'a' * 1000, 'disk2.vmdk': b'b' * 3000}
+        with tarfile.open(self.ova_path, 'w') as tar:
+            for name, data in [('avamar.ovf', b'<xml/>')] + sorted(self.disks.items()):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        self.spec = MagicMock()
+        self.spec.fileItem = []
+        self.lease = MagicMock()
+        self.lease.info.deviceUrl = []
+        for index, name in enumerate(sorted(self.disks.keys())):
+            file_item = MagicMock()
+            file_item.path = name
+            file_item.deviceId = 'key{}'.format(index)
+            self.spec.fileItem.append(file_item)
+            device_url = MagicMock()
+            device_url.importKey = 'key{}'.format(index)
+            device_url.url = 'https://*/nfc/disk-{}.vmdk'.format(index)
+            self.lease.info.deviceUrl.append(device_url)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_vmdk_members(self):
+        """``_vmdk_members`` finds the offset and size of every VMDK in the OVA"""
+        output = upload._vmdk_members(self.ova_path)
+
+        with open(self.ova_path, 'rb') as the_file:
+            for name, (offset, size) in output.items():
+                the_file.seek(offset)
+                self.assertEqual(the_file.read(size), self.disks[name])
+
+    @patch.object(upload, 'CHUNK_SIZE', 1024)
+    def test_read_chunks(self):
+        """``_read_chunks`` reads a section of a file in aligned chunks"""
+        with open(self.ova_path, 'rb') as the_file:
+            offset, size = upload._vmdk_members(self.ova_path)['disk2.vmdk']
+            chunks = list(upload._read_chunks(the_file.fileno(), offset, size))
+
+        self.assertEqual(b''.join(chunks), self.disks['disk2.vmdk'])
+        # every chunk after the first one starts on a CHUNK_SIZE boundary
+        self.assertEqual((offset + len(chunks[0])) % 1024, 0)
+
+    @patch.object(upload.http.client, 'HTTPSConnection')
+    def test_upload_disks(self, fake_HTTPSConnection):
+        """``upload_disks`` uploads every disk, then completes the lease"""
+        fake_HTTPSConnection.return_value.getresponse.return_value.status = 200
+
+        upload.upload_disks(self.ova_path, self.spec, self.lease, 'esx1', MagicMock(), parallel=2, progress_interval=5)
+
+        sent = b''.join(x[0][0] for x in fake_HTTPSConnection.return_value.send.call_args_list)
+        self.assertEqual(len(sent), 4000)
+        self.assertTrue(self.lease.Complete.called)
+
+    @patch.object(upload.http.client, 'HTTPSConnection')
+    def test_upload_disks_host(self, fake_HTTPSConnection):
+        """``upload_disks`` fills in the ESXi host when the lease URL doesn't have one"""
+        fake_HTTPSConnection.return_value.getresponse.return_value.status = 200
+
+        upload.upload_disks(self.ova_path, self.spec, self.lease, 'esx1', MagicMock(), parallel=2, progress_interval=5)
+
+        self.assertEqual(fake_HTTPSConnection.call_args[0][0], 'esx1')
+
+    @patch.object(upload, 'CONN_OPTIONS', {})
+    @patch.object(upload.http.client, 'HTTPSConnection')
+    def test_upload_disks_no_blocksize(self, fake_HTTPSConnection):
+        """``upload_disks`` does not pass a blocksize when the interpreter doesn't support one"""
+        fake_HTTPSConnection.return_value.getresponse.return_value.status = 200
+
+        upload.upload_disks(self.ova_path, self.spec, self.lease, 'esx1', MagicMock(), parallel=2, progress_interval=5)
+
+        self.assertFalse('blocksize' in fake_HTTPSConnection.call_args[1])
+
+    @patch.object(upload.http.client, 'HTTPSConnection')
+    def test_upload_disks_error(self, fake_HTTPSConnection):
+        """``upload_disks`` aborts the lease if an upload fails"""
+        fake_HTTPSConnection.return_value.getresponse.return_value.status = 500
+
+        with self.assertRaises(RuntimeError):
+            upload.upload_disks(self.ova_path, self.spec, self.lease, 'esx1', MagicMock(), parallel=2, progress_interval=5)
+
+        self.assertTrue(self.lease.Abort.called)
+        self.assertFalse(self.lease.Complete.called)
+
+    def test_upload_disks_no_url(self):
+        """``upload_disks`` raises RuntimeError if the lease has no URL for a disk"""
+        self.lease.info.deviceUrl = []
+
+        with self.assertRaises(RuntimeError):
+            upload.upload_disks(self.ova_path, self.spec, self.lease, 'esx1', MagicMock(), parallel=2, progress_interval=5)
+
+    @patch.object(upload.http.client, 'HTTPSConnection')
+    def test_upload_disks_compressed(self, fake_HTTPSConnection):
+        """``upload_disks`` streams the disks out of a compressed OVA"""
+        fake_HTTPSConnection.return_value.getresponse.return_value.status = 200
+        gz_path = self.ova_path + '.gz'
+        with open(self.ova_path, 'rb') as the_file:
+            with open(gz_path, 'wb') as gz_file:
+                gz_file.write(gzip.compress(the_file.read()))
+
+        upload.upload_disks(gz_path, self.spec, self.lease, 'esx1', MagicMock(), parallel=2, progress_interval=5)
+
+        sent = b''.join(x[0][0] for x in fake_HTTPSConnection.return_value.send.call_args_list)
+        self.assertEqual(sent, self.disks['disk1.vmdk'] + self.disks['disk2.vmdk'])
+        self.assertTrue(self.lease.Complete.called)
+
+    def test_upload_disks_compressed_no_url(self):
+        """``upload_disks`` raises RuntimeError if the lease has no URL for a disk of a compressed OVA"""
+        self.lease.info.deviceUrl = []
+
+        with self.assertRaises(RuntimeError):
+            upload.upload_disks(self.ova_path + '.gz', self.spec, self.lease, 'esx1', MagicMock(), parallel=2, progress_interval=5)
+
+    def test_report_progress(self):
+        """``_report_progress`` updates the lease until the uploads are done"""
+        done = MagicMock()
+        done.wait.side_effect = [False, True]
+
+        upload._report_progress(self.lease, [50, 0], 200, done, 5, MagicMock())
+
+        self.lease.Progress.assert_called_with(25)
+
+    def test_stats(self):
+        """``UploadStats.report`` returns the throughput in MB/s"""
+        stats = upload.UploadStats()
+        stats.record(100 * 1024**2, 10)
+
+        output = stats.report()
+        expected = {'uploads': 1, 'bytes': 100 * 1024**2, 'last_mbps': 10.0, 'avg_mbps': 10.0}
+
+        self.assertEqual(output, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
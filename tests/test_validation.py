@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the validation.py module
+"""
+import unittest
+
+import ujson
+from flask import Flask
+from flask_classy import FlaskView
+from jsonschema import SchemaError
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from vlab_avamar_api.lib import validation
+from vlab_avamar_api.lib.auth import requires
+
+
+SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+          "type": "object",
+          "properties": {
+            "name": {"type": "string"},
+            "background": {"type": "boolean", "default": False},
+            "ip-config": {
+                "type": "object",
+                "properties": {
+                    "static-ip": {"type": "string"},
+                    "dns": {"type": "array", "default": ["192.168.1.1"]}
+                },
+                "required": ["static-ip"]
+            }
+          },
+          "required": ["name"]
+         }
+
+
+class TestCompileSchema(unittest.TestCase):
+    """A set of test cases for the ``compile_schema`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.validator = validation.compile_schema(SCHEMA)
+
+    def test_defaults(self):
+        """``compile_schema`` returns a validator that fills in defaults"""
+        body = {'name': 'foo'}
+        self.validator.validate(body)
+
+        self.assertEqual(body, {'name': 'foo', 'background': False})
+
+    def test_defaults_nested(self):
+        """``compile_schema`` returns a validator that fills in the defaults of nested objects"""
+        body = {'name': 'foo', 'ip-config': {'static-ip': '1.2.3.4'}}
+        self.validator.validate(body)
+
+        self.assertEqual(body['ip-config'], {'static-ip': '1.2.3.4', 'dns': ['192.168.1.1']})
+
+    def test_defaults_not_shared(self):
+        """``compile_schema`` gives each body its own copy of a default"""
+        body1 = {'name': 'foo', 'ip-config': {'static-ip': '1.2.3.4'}}
+        body2 = {'name': 'foo', 'ip-config': {'static-ip': '1.2.3.4'}}
+        self.validator.validate(body1)
+        self.validator.validate(body2)
+        body1['ip-config']['dns'].append('8.8.8.8')
+
+        self.assertEqual(body2['ip-config']['dns'], ['192.168.1.1'])
+
+    def test_supplied_values(self):
+        """``compile_schema`` returns a validator that keeps supplied values"""
+        body = {'name': 'foo', 'background': True}
+        self.validator.validate(body)
+
+        self.assertTrue(body['background'])
+
+    def test_schema_unchanged(self):
+        """``compile_schema`` does not modify the schema"""
+        self.assertEqual(list(SCHEMA['properties'].keys()), ['name', 'background', 'ip-config'])
+        self.assertFalse('default' in SCHEMA['properties']['name'])
+
+    def test_bad_schema(self):
+        """``compile_schema`` raises SchemaError for an invalid schema"""
+        with self.assertRaises(SchemaError):
+            validation.compile_schema({'type': 'not-a-type'})
+
+
+class FakeView(FlaskView):
+    route_base = '/fake'
+
+    @requires(verify=False, version=2)
+    @validation.validate_input(schema=SCHEMA)
+    def post(self, *args, **kwargs):
+        return ujson.dumps(kwargs['body'])
+
+
+class TestValidateInput(unittest.TestCase):
+    """A set of test cases for the ``validate_input`` decorator"""
+    @classmethod
+    def setUpClass(cls):
+        """Runs once for the whole test suite"""
+        cls.token = generate_v2_test_token(username='bob')
+
+    def setUp(self):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        FakeView.register(app)
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+
+    def test_body(self):
+        """``validate_input`` passes the body, with defaults, to the view"""
+        resp = self.app.post('/fake/', headers={'X-Auth': self.token}, json={'name': 'foo'})
+
+        self.assertEqual(ujson.loads(resp.data), {'name': 'foo', 'background': False})
+
+    def test_invalid(self):
+        """``validate_input`` returns an HTTP 400 when the body does not match the schema"""
+        resp = self.app.post('/fake/', headers={'X-Auth': self.token}, json={'name': 1})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_no_body(self):
+        """``validate_input`` returns an HTTP 400 when no body is sent"""
+        resp = self.app.post('/fake/', headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
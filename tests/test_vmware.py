@@ -2,14 +2,34 @@
 """
 A suite of tests for the functions in vmware.py
 """
+import os
+import time
+import shutil
+import tempfile
+import threading
 import unittest
 from unittest.mock import patch, MagicMock, PropertyMock
 
+from vlab_avamar_api.lib.state import SharedState
 from vlab_avamar_api.lib.worker import vmware
+from vlab_avamar_api.lib.worker.idle import IdleTracker
+from vlab_avamar_api.lib.worker.library import Library
 
 
 class TestVMware(unittest.TestCase):
     """A set of test cases for the vmware.py module"""
+    def setUp(self):
+        """Runs before every test case"""
+        vmware.MOREF_CACHE.invalidate()
+        vmware.SPECS.clear()
+        self.ip_config = {'static-ip': '1.2.3.4',
+                          'default-gateway': '1.2.3.1',
+                          'netmask': '255.255.255.0',
+                          'dns': ['1.2.3.2'],
+                          'domain': 'vlab.local'}
+        # Otherwise a session from a different test's fake vCenter gets reused
+        vmware.POOLS.clear()
+        vmware.THROTTLES.clear()
 
     @patch.object(vmware.virtual_machine, 'get_info')
     @patch.object(vmware, 'consume_task')
@@ -27,7 +47,7 @@ class TestVMware(unittest.TestCase):
                                                'configured': False,
                                                'generation': 1}}
 
-        output = vmware.show_avamar(username='alice')
+        output, _ = vmware.show_avamar(username='alice')
         expected = {'Avamar': {'meta': {'component': 'Avamar',
                                                              'created': 1234,
                                                              'version': '1.0',
@@ -35,67 +55,147 @@ class TestVMware(unittest.TestCase):
                                                              'generation': 1}}}
         self.assertEqual(output, expected)
 
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_object_properties')
     @patch.object(vmware.virtual_machine, 'power')
     @patch.object(vmware, 'consume_task')
     @patch.object(vmware, 'vCenter')
-    def test_delete_avamar(self, fake_vCenter, fake_consume_task, fake_power, fake_get_info):
-        """``delete_avamar`` returns None when everything works as expected"""
+    def test_delete_avamar(self, fake_vCenter, fake_consume_task, fake_power, fake_object_properties):
+        """``delete_avamar`` returns the names of the deleted VMs when everything works as expected"""
         fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'AvamarBox'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta': {'component': 'Avamar',
-                                               'created': 1234,
-                                               'version': '1.0',
-                                               'configured': False,
-                                               'generation': 1}}
+        fake_vm = vmware.vim.VirtualMachine('vm-1')
+        fake_vcenter = fake_vCenter.return_value.__enter__.return_value
+        fake_vcenter.content.searchIndex.FindChild.return_value = fake_vm
+        fake_object_properties.return_value = {fake_vm : {'config.annotation': '{"component": "Avamar"}'}}
 
-        output = vmware.delete_avamar(username='bob', machine_name='AvamarBox', logger=fake_logger)
-        expected = None
+        with patch.object(vmware.vim.VirtualMachine, 'Destroy_Task'):
+            output = vmware.delete_avamar(username='bob', machine_name='AvamarBox', logger=fake_logger)
+        expected = ['AvamarBox']
 
         self.assertEqual(output, expected)
+        self.assertTrue(fake_consume_task.called)
 
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_object_properties')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_avamar_many(self, fake_vCenter, fake_consume_task, fake_power, fake_object_properties):
+        """``delete_avamar`` destroys every VM in the supplied list"""
+        fake_logger = MagicMock()
+        vm1 = vmware.vim.VirtualMachine('vm-1')
+        vm2 = vmware.vim.VirtualMachine('vm-2')
+        fake_vcenter = fake_vCenter.return_value.__enter__.return_value
+        fake_vcenter.content.searchIndex.FindChild.side_effect = lambda entity, name: {'box1': vm1, 'box2': vm2}[name]
+        fake_object_properties.return_value = {vm1 : {'config.annotation': '{"component": "Avamar"}'},
+                                               vm2 : {'config.annotation': '{"component": "Avamar"}'}}
+
+        with patch.object(vmware.vim.VirtualMachine, 'Destroy_Task'):
+            vmware.delete_avamar(username='bob', machine_name=['box1', 'box2'], logger=fake_logger)
+
+        self.assertEqual(fake_consume_task.call_count, 2)
+
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2']))
+    @patch.object(vmware, '_object_properties')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_avamar_shards(self, fake_vCenter, fake_consume_task, fake_power, fake_object_properties):
+        """``delete_avamar`` destroys a batch of VMs that live on different vCenters"""
+        vm1 = vmware.vim.VirtualMachine('vm-1')
+        vm2 = vmware.vim.VirtualMachine('vm-2')
+        inventory = {'vc1': {'box1': vm1}, 'vc2': {'box2': vm2}}
+        fake_vCenter.side_effect = lambda host, user, password: MagicMock(**{
+            '__enter__.return_value.content.searchIndex.FindChild.side_effect': lambda entity, name: inventory[host].get(name)})
+        fake_object_properties.side_effect = lambda vcenter, vms, vimtype, props: {x: {'config.annotation': '{"component": "Avamar"}'} for x in vms}
+
+        with patch.object(vmware.vim.VirtualMachine, 'Destroy_Task'):
+            output = vmware.delete_avamar(username='bob', machine_name=['box1', 'box2'], logger=MagicMock())
+
+        self.assertEqual(output, ['box1', 'box2'])
+        self.assertEqual(fake_consume_task.call_count, 2)
+
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2']))
+    @patch.object(vmware, '_object_properties')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_avamar_shards_missing(self, fake_vCenter, fake_consume_task, fake_power, fake_object_properties):
+        """``delete_avamar`` destroys nothing when one name of the batch is on no vCenter"""
+        vm1 = vmware.vim.VirtualMachine('vm-1')
+        inventory = {'vc1': {'box1': vm1}, 'vc2': {}}
+        fake_vCenter.side_effect = lambda host, user, password: MagicMock(**{
+            '__enter__.return_value.content.searchIndex.FindChild.side_effect': lambda entity, name: inventory[host].get(name)})
+        fake_object_properties.side_effect = lambda vcenter, vms, vimtype, props: {x: {'config.annotation': '{"component": "Avamar"}'} for x in vms}
+
+        with self.assertRaises(ValueError):
+            vmware.delete_avamar(username='bob', machine_name=['box1', 'box2'], logger=MagicMock())
+
+        self.assertFalse(fake_consume_task.called)
+
+    @patch.object(vmware, '_object_properties')
     @patch.object(vmware.virtual_machine, 'power')
     @patch.object(vmware, 'consume_task')
     @patch.object(vmware, 'vCenter')
-    def test_delete_avamar_value_error(self, fake_vCenter, fake_consume_task, fake_power, fake_get_info):
+    def test_delete_avamar_background(self, fake_vCenter, fake_consume_task, fake_power, fake_object_properties):
+        """``delete_avamar`` does not destroy the VMs when ``background=True``"""
+        fake_logger = MagicMock()
+        fake_vm = vmware.vim.VirtualMachine('vm-1')
+        fake_vcenter = fake_vCenter.return_value.__enter__.return_value
+        fake_vcenter.content.searchIndex.FindChild.return_value = fake_vm
+        fake_object_properties.return_value = {fake_vm : {'config.annotation': '{"component": "Avamar"}'}}
+
+        vmware.delete_avamar(username='bob', machine_name='AvamarBox', logger=fake_logger, background=True)
+
+        self.assertFalse(fake_consume_task.called)
+
+    @patch.object(vmware, '_object_properties')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_avamar_value_error(self, fake_vCenter, fake_consume_task, fake_power, fake_object_properties):
         """``delete_avamar`` raises ValueError when unable to find requested vm for deletion"""
         fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'win10'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta': {'component': 'Avamar',
-                                               'created': 1234,
-                                               'version': '1.0',
-                                               'configured': False,
-                                               'generation': 1}}
+        fake_vcenter = fake_vCenter.return_value.__enter__.return_value
+        fake_vcenter.content.searchIndex.FindChild.return_value = None
 
         with self.assertRaises(ValueError):
             vmware.delete_avamar(username='bob', machine_name='myOtherAvamarBox', logger=fake_logger)
 
+    @patch.object(vmware, '_object_properties')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_delete_avamar_wrong_kind(self, fake_vCenter, fake_consume_task, fake_power, fake_object_properties):
+        """``delete_avamar`` raises ValueError when the VM is not the requested kind"""
+        fake_logger = MagicMock()
+        fake_vm = vmware.vim.VirtualMachine('vm-1')
+        fake_vcenter = fake_vCenter.return_value.__enter__.return_value
+        fake_vcenter.content.searchIndex.FindChild.return_value = fake_vm
+        fake_object_properties.return_value = {fake_vm : {'config.annotation': '{"component": "AvamarNDMP"}'}}
+
+        with self.assertRaises(ValueError):
+            vmware.delete_avamar(username='bob', machine_name='AvamarBox', logger=fake_logger)
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware, '_choose_placement', return_value=('localhost', 'ds1', 'esx1'))
     @patch.object(vmware.virtual_machine, 'add_vmdk')
     @patch.object(vmware, '_block_on_boot')
     @patch.object(vmware, '_configure_network')
     @patch.object(vmware.virtual_machine, 'set_meta')
     @patch.object(vmware, 'Ova')
     @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_deploy_ova')
     @patch.object(vmware, 'consume_task')
     @patch.object(vmware, 'vCenter')
-    def test_create_avamar(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info,
-                           fake_Ova, fake_set_meta, fake__configure_network, fake_block_on_boot, fake_add_vmdk):
+    def test_create_avamar(self, fake_vCenter, fake_consume_task, fake_deploy_ova, fake_get_info,
+                           fake_Ova, fake_set_meta, fake__configure_network, fake_block_on_boot, fake_add_vmdk,
+                           fake_choose_placement, fake_wait_for_ip, fake_list_networks):
         """``create_avamar`` returns a dictionary upon success"""
         fake_logger = MagicMock()
-        fake_deploy_from_ova.return_value.name = 'myAvamar'
+        fake_deploy_ova.return_value.name = 'myAvamar'
         fake_get_info.return_value = {'worked': True}
         fake_Ova.return_value.networks = ['someLAN']
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_list_networks.return_value = {'someLAN' : vmware.vim.Network(moId='1')}
         ip_config = {'static-ip': '1.2.3.4',
                          'default-gateway': '1.2.3.1',
                          'netmask': '255.255.255.0',
@@ -113,18 +213,221 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware, '_choose_placement', return_value=('localhost', 'ds1', 'esx1'))
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    @patch.object(vmware, '_block_on_boot')
+    @patch.object(vmware, '_configure_network')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_deploy_ova')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_create_avamar_boot_seconds(self, fake_vCenter, fake_consume_task, fake_deploy_ova, fake_get_info,
+                                        fake_Ova, fake_set_meta, fake__configure_network, fake_block_on_boot,
+                                        fake_add_vmdk, fake_choose_placement, fake_wait_for_ip, fake_list_networks):
+        """``create_avamar`` only times the boot up to when the VM reports its IP"""
+        clock = {'now': 1000.0}
+        def tick(seconds):
+            def advance(*args, **kwargs):
+                clock['now'] += seconds
+                return {'worked': True}
+            return advance
+        fake_set_meta.side_effect = tick(100)
+        fake_wait_for_ip.side_effect = tick(60)
+        fake_get_info.side_effect = tick(100)
+        fake_Ova.return_value.networks = ['someLAN']
+        fake_list_networks.return_value = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        with patch.object(vmware.time, 'time', side_effect=lambda: clock['now']):
+            vmware.create_avamar(username='alice',
+                                 machine_name='AvamarBox',
+                                 image='1.0.0',
+                                 network='someLAN',
+                                 ip_config={'static-ip': '1.2.3.4'},
+                                 logger=MagicMock())
+        meta_data = fake_set_meta.call_args[0][1]
+
+        self.assertEqual(meta_data['boot_seconds'], 60)
+        self.assertEqual(meta_data['create_seconds'], 160)
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, '_take_reset_snapshot')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware, '_choose_placement', return_value=('localhost', 'ds1', 'esx1'))
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    @patch.object(vmware, '_block_on_boot')
+    @patch.object(vmware, '_configure_network')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_deploy_ova')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_create_avamar_no_reset_snapshot(self, fake_vCenter, fake_consume_task, fake_deploy_ova, fake_get_info,
+                                             fake_Ova, fake_set_meta, fake__configure_network, fake_block_on_boot,
+                                             fake_add_vmdk, fake_choose_placement, fake_wait_for_ip, fake_take_reset_snapshot, fake_list_networks):
+        """``create_avamar`` does not take a reset snapshot by default"""
+        fake_Ova.return_value.networks = ['someLAN']
+        fake_list_networks.return_value = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_avamar(username='alice',
+                             machine_name='AvamarBox',
+                             image='1.0.0',
+                             network='someLAN',
+                             ip_config={'static-ip': '1.2.3.4'},
+                             logger=MagicMock())
+
+        self.assertFalse(fake_take_reset_snapshot.called)
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_RESET_SNAPSHOT=True))
+    @patch.object(vmware, '_take_reset_snapshot')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware, '_choose_placement', return_value=('localhost', 'ds1', 'esx1'))
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    @patch.object(vmware, '_block_on_boot')
+    @patch.object(vmware, '_configure_network')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_deploy_ova')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_create_avamar_reset_snapshot(self, fake_vCenter, fake_consume_task, fake_deploy_ova, fake_get_info,
+                                          fake_Ova, fake_set_meta, fake__configure_network, fake_block_on_boot,
+                                          fake_add_vmdk, fake_choose_placement, fake_wait_for_ip, fake_take_reset_snapshot, fake_list_networks):
+        """``create_avamar`` takes a reset snapshot when VLAB_AVAMAR_RESET_SNAPSHOT is enabled"""
+        fake_Ova.return_value.networks = ['someLAN']
+        fake_list_networks.return_value = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_avamar(username='alice',
+                             machine_name='AvamarBox',
+                             image='1.0.0',
+                             network='someLAN',
+                             ip_config={'static-ip': '1.2.3.4'},
+                             logger=MagicMock())
+
+        self.assertTrue(fake_take_reset_snapshot.called)
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, 'convert_name', return_value='AVE-1.0.0.ova.zst')
+    @patch.object(vmware.compressed, 'CompressedOva')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware, '_choose_placement', return_value=('localhost', 'ds1', 'esx1'))
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    @patch.object(vmware, '_block_on_boot')
+    @patch.object(vmware, '_configure_network')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_deploy_ova')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_create_avamar_compressed(self, fake_vCenter, fake_consume_task, fake_deploy_ova, fake_get_info,
+                                      fake_Ova, fake_set_meta, fake__configure_network, fake_block_on_boot, fake_add_vmdk,
+                                      fake_choose_placement, fake_wait_for_ip, fake_CompressedOva, fake_convert_name, fake_list_networks):
+        """``create_avamar`` reads the OVF descriptor of a compressed OVA without the Ova object"""
+        fake_deploy_ova.return_value.name = 'myAvamar'
+        fake_CompressedOva.return_value.networks = ['someLAN']
+        fake_list_networks.return_value = {'someLAN' : vmware.vim.Network(moId='1')}
+        ip_config = {'static-ip': '1.2.3.4',
+                     'default-gateway': '1.2.3.1',
+                     'netmask': '255.255.255.0',
+                     'dns': ['1.2.3.2'],
+                     'domain': 'vlab.local'}
+
+        vmware.create_avamar(username='alice',
+                             machine_name='AvamarBox',
+                             image='1.0.0',
+                             network='someLAN',
+                             ip_config=ip_config,
+                             logger=MagicMock())
+        _, the_kwargs = fake_deploy_ova.call_args
+
+        self.assertFalse(fake_Ova.called)
+        self.assertTrue(the_kwargs['ova_path'].endswith('AVE-1.0.0.ova.zst'))
+
+    @patch.object(vmware, '_find_template')
+    @patch.object(vmware, '_clone_template')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware, '_choose_placement', return_value=('localhost', 'ds1', 'esx1'))
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    @patch.object(vmware, '_block_on_boot')
+    @patch.object(vmware, '_configure_network')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_deploy_ova')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_create_avamar_library(self, fake_vCenter, fake_consume_task, fake_deploy_ova, fake_get_info,
+                                   fake_Ova, fake_set_meta, fake__configure_network, fake_block_on_boot, fake_add_vmdk,
+                                   fake_choose_placement, fake_wait_for_ip, fake_clone_template, fake_find_template):
+        """``create_avamar`` clones the library template of the image instead of uploading it, when there is one"""
+        fake_clone_template.return_value.name = 'myAvamar'
+
+        output = vmware.create_avamar(username='alice',
+                                      machine_name='AvamarBox',
+                                      image='1.0.0',
+                                      network='someLAN',
+                                      ip_config=self.ip_config,
+                                      logger=MagicMock())
+        _, the_kwargs = fake_clone_template.call_args
+
+        self.assertFalse(fake_deploy_ova.called)
+        self.assertEqual(the_kwargs['template'], fake_find_template.return_value)
+        self.assertTrue('myAvamar' in output)
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, '_find_template', return_value=None)
+    @patch.object(vmware, '_clone_template')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware, '_choose_placement', return_value=('localhost', 'ds1', 'esx1'))
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    @patch.object(vmware, '_block_on_boot')
+    @patch.object(vmware, '_configure_network')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_deploy_ova')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, 'vCenter')
+    def test_create_avamar_library_stale(self, fake_vCenter, fake_consume_task, fake_deploy_ova, fake_get_info,
+                                         fake_Ova, fake_set_meta, fake__configure_network, fake_block_on_boot, fake_add_vmdk,
+                                         fake_choose_placement, fake_wait_for_ip, fake_clone_template, fake_find_template, fake_list_networks):
+        """``create_avamar`` uploads the image when there's no current library template of it"""
+        fake_deploy_ova.return_value.name = 'myAvamar'
+        fake_Ova.return_value.networks = ['someLAN']
+        fake_list_networks.return_value = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_avamar(username='alice',
+                             machine_name='AvamarBox',
+                             image='1.0.0',
+                             network='someLAN',
+                             ip_config=self.ip_config,
+                             logger=MagicMock())
+
+        self.assertTrue(fake_deploy_ova.called)
+        self.assertFalse(fake_clone_template.called)
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, '_choose_placement', return_value=('localhost', 'ds1', 'esx1'))
     @patch.object(vmware, '_configure_network')
     @patch.object(vmware, 'Ova')
     @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_deploy_ova')
     @patch.object(vmware, 'consume_task')
     @patch.object(vmware, 'vCenter')
-    def test_create_avamar_invalid_network(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_configure_network):
+    def test_create_avamar_invalid_network(self, fake_vCenter, fake_consume_task, fake_deploy_ova, fake_get_info, fake_Ova,
+                                           fake_configure_network, fake_choose_placement, fake_list_networks):
         """``create_avamar`` raises ValueError if supplied with a non-existing network"""
         fake_logger = MagicMock()
         fake_get_info.return_value = {'worked': True}
         fake_Ova.return_value.networks = ['someLAN']
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_list_networks.return_value = {'someLAN' : vmware.vim.Network(moId='1')}
         ip_config = {'static-ip': '1.2.3.4',
                          'default-gateway': '1.2.3.1',
                          'netmask': '255.255.255.0',
@@ -139,6 +442,264 @@ class TestVMware(unittest.TestCase):
                                   ip_config=ip_config,
                                   logger=fake_logger)
 
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, 'PLACEMENTS', {'localhost': MagicMock()})
+    @patch.object(vmware, '_choose_placement', return_value=('localhost', 'ds1', 'esx1'))
+    @patch.object(vmware, 'Ova')
+    @patch.object(vmware, '_deploy_ova')
+    @patch.object(vmware, 'vCenter')
+    def test_create_avamar_placement_failed(self, fake_vCenter, fake_deploy_ova, fake_Ova, fake_choose_placement, fake_list_networks):
+        """``create_avamar`` records a failed deploy with the placement engine"""
+        fake_deploy_ova.side_effect = RuntimeError('testing')
+        fake_Ova.return_value.networks = ['someLAN']
+        fake_list_networks.return_value = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        with self.assertRaises(RuntimeError):
+            vmware.create_avamar(username='alice',
+                                 machine_name='AvamarBox',
+                                 image='1.0.0',
+                                 network='someLAN',
+                                 ip_config={},
+                                 logger=MagicMock())
+
+        vmware.PLACEMENTS['localhost'].started.assert_called_with('ds1', 'esx1')
+        vmware.PLACEMENTS['localhost'].finished.assert_called_with('ds1', 'esx1', None)
+
+    @patch.object(vmware, 'PLACEMENTS', {'localhost': MagicMock()})
+    @patch.object(vmware, '_retrieve_properties')
+    def test_refresh_placement(self, fake_retrieve_properties):
+        """``refresh_placement`` supplies the placement engine with datastore and host stats"""
+        datastore = vmware.vim.Datastore('datastore-1')
+        host = vmware.vim.HostSystem('host-1')
+        fake_retrieve_properties.return_value = [(datastore, {'name': 'ds1',
+                                                              'summary.freeSpace': 100,
+                                                              'summary.accessible': True}),
+                                                 (host, {'name': 'esx1',
+                                                         'datastore': [datastore],
+                                                         'runtime.inMaintenanceMode': False,
+                                                         'runtime.connectionState': 'connected',
+                                                         'summary.hardware.memorySize': 4 * 1024**3,
+                                                         'summary.quickStats.overallMemoryUsage': 1024})]
+
+        vmware.refresh_placement(MagicMock(), 'localhost')
+        datastores, hosts = vmware.PLACEMENTS['localhost'].update.call_args[0]
+
+        self.assertEqual(datastores, {'ds1': {'free': 100, 'accessible': True}})
+        self.assertEqual(hosts, {'esx1': {'free_mb': 3072, 'usable': True, 'datastores': ['ds1']}})
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, 'PLACEMENTS', {'localhost': MagicMock()})
+    @patch.object(vmware, 'refresh_placement')
+    @patch.object(vmware, 'vCenter')
+    def test_choose_placement_stale(self, fake_vCenter, fake_refresh_placement, fake_list_networks):
+        """``_choose_placement`` refreshes the stats if the background refresher fell behind"""
+        vmware.PLACEMENTS['localhost'].stale = True
+        vmware.PLACEMENTS['localhost'].choose.return_value = ('ds1', 'esx1')
+
+        vmware._choose_placement('alice', 'alice_frontend')
+
+        self.assertTrue(fake_refresh_placement.called)
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, 'PLACEMENTS', {'localhost': MagicMock()})
+    @patch.object(vmware, 'refresh_placement')
+    @patch.object(vmware, 'vCenter')
+    def test_choose_placement(self, fake_vCenter, fake_refresh_placement, fake_list_networks):
+        """``_choose_placement`` does not refresh the stats when they are fresh"""
+        vmware.PLACEMENTS['localhost'].stale = False
+        vmware.PLACEMENTS['localhost'].choose.return_value = ('ds1', 'esx1')
+
+        output = vmware._choose_placement('alice', 'alice_frontend')
+
+        self.assertFalse(fake_refresh_placement.called)
+        self.assertEqual(output, ('localhost', 'ds1', 'esx1'))
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2'], overrides={'alice': 'vc1'}))
+    @patch.object(vmware, 'PLACEMENTS', {'vc1': MagicMock(), 'vc2': MagicMock()})
+    @patch.object(vmware, 'vCenter')
+    def test_choose_placement_spill(self, fake_vCenter, fake_list_networks):
+        """``_choose_placement`` uses the next vCenter when the user's home vCenter is full"""
+        vmware.PLACEMENTS['vc1'].stale = False
+        vmware.PLACEMENTS['vc1'].choose.side_effect = RuntimeError('testing')
+        vmware.PLACEMENTS['vc2'].stale = False
+        vmware.PLACEMENTS['vc2'].choose.return_value = ('ds1', 'esx1')
+
+        output = vmware._choose_placement('alice', 'alice_frontend')
+
+        self.assertEqual(output, ('vc2', 'ds1', 'esx1'))
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2']))
+    @patch.object(vmware, 'PLACEMENTS', {'vc1': MagicMock(), 'vc2': MagicMock()})
+    @patch.object(vmware, 'vCenter')
+    def test_choose_placement_full(self, fake_vCenter, fake_list_networks):
+        """``_choose_placement`` raises RuntimeError when every vCenter is full"""
+        for placement in vmware.PLACEMENTS.values():
+            placement.stale = False
+            placement.choose.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            vmware._choose_placement('alice', 'alice_frontend')
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2'], overrides={'alice': 'vc1'}))
+    @patch.object(vmware, 'PLACEMENTS', {'vc1': MagicMock(), 'vc2': MagicMock()})
+    @patch.object(vmware, 'vCenter')
+    def test_choose_placement_no_folder(self, fake_vCenter, fake_list_networks):
+        """``_choose_placement`` skips a vCenter that does not have the user's folder"""
+        def get_by_name(host, name, vimtype):
+            if host == 'vc1' and vimtype == vmware.vim.Folder:
+                raise ValueError('Unable to locate object named {}'.format(name))
+            return MagicMock()
+        fake_vCenter.side_effect = lambda host, user, password: MagicMock(**{
+            '__enter__.return_value.get_by_name.side_effect': lambda name, vimtype: get_by_name(host, name, vimtype)})
+        fake_list_networks.return_value = {'alice_frontend': MagicMock()}
+        for placement in vmware.PLACEMENTS.values():
+            placement.stale = False
+            placement.choose.return_value = ('ds1', 'esx1')
+
+        output = vmware._choose_placement('alice', 'alice_frontend')
+
+        self.assertEqual(output, ('vc2', 'ds1', 'esx1'))
+        self.assertFalse(vmware.PLACEMENTS['vc1'].choose.called)
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2']))
+    @patch.object(vmware, 'PLACEMENTS', {'vc1': MagicMock(), 'vc2': MagicMock()})
+    @patch.object(vmware, 'vCenter')
+    def test_choose_placement_no_network(self, fake_vCenter, fake_list_networks):
+        """``_choose_placement`` raises ValueError when no vCenter has the user's network"""
+        fake_list_networks.return_value = {}
+        for placement in vmware.PLACEMENTS.values():
+            placement.stale = False
+            placement.choose.return_value = ('ds1', 'esx1')
+
+        with self.assertRaises(ValueError):
+            vmware._choose_placement('alice', 'alice_frontend')
+
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2']))
+    @patch.object(vmware, '_get_folder_vms')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, 'vCenter')
+    def test_show_avamar_shards(self, fake_vCenter, fake_get_info, fake_get_folder_vms):
+        """``show_avamar`` merges the VMs found on every vCenter"""
+        vm1 = MagicMock()
+        vm1.name = 'avamar1'
+        vm2 = MagicMock()
+        vm2.name = 'avamar2'
+        fake_get_folder_vms.side_effect = lambda vcenter, username: {'vc1': [vm1], 'vc2': [vm2]}[vcenter.host]
+        fake_vCenter.side_effect = lambda host, user, password: MagicMock(**{'__enter__.return_value.host': host})
+        fake_get_info.return_value = {'meta': {'component': 'Avamar', 'created': 1}}
+
+        output, unhealthy = vmware.show_avamar(username='alice')
+
+        self.assertEqual(set(output.keys()), {'avamar1', 'avamar2'})
+        self.assertEqual(unhealthy, [])
+
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2']))
+    @patch.object(vmware, '_get_folder_vms')
+    @patch.object(vmware, 'vCenter')
+    def test_show_avamar_no_folder(self, fake_vCenter, fake_get_folder_vms):
+        """``show_avamar`` raises ValueError if the user has no folder on any vCenter"""
+        fake_get_folder_vms.side_effect = ValueError('testing')
+
+        with self.assertRaises(ValueError):
+            vmware.show_avamar(username='alice')
+
+    @patch.object(vmware, '_throttle')
+    @patch.object(vmware, '_get_folder_vms')
+    def test_show_avamar_shed(self, fake_get_folder_vms, fake_throttle):
+        """``show_avamar`` fails fast while vCenter is unhealthy"""
+        fake_throttle.return_value.check.side_effect = vmware.Overloaded('testing')
+
+        with self.assertRaises(vmware.Overloaded):
+            vmware.show_avamar(username='alice')
+
+        self.assertFalse(fake_get_folder_vms.called)
+
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2']))
+    @patch.object(vmware, '_throttle')
+    @patch.object(vmware, '_get_folder_vms')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, 'vCenter')
+    def test_show_avamar_shed_one(self, fake_vCenter, fake_get_info, fake_get_folder_vms, fake_throttle):
+        """``show_avamar`` still returns the VMs on the healthy vCenters while one is unhealthy"""
+        vm1 = MagicMock()
+        vm1.name = 'avamar1'
+        vm2 = MagicMock()
+        vm2.name = 'avamar2'
+        fake_get_folder_vms.side_effect = lambda vcenter, username: {'vc1': [vm1], 'vc2': [vm2]}[vcenter.host]
+        fake_vCenter.side_effect = lambda host, user, password: MagicMock(**{'__enter__.return_value.host': host})
+        fake_get_info.return_value = {'meta': {'component': 'Avamar', 'created': 1}}
+        breakers = {'vc1': MagicMock(), 'vc2': MagicMock()}
+        breakers['vc1'].check.side_effect = vmware.Overloaded('testing')
+        breakers['vc2'].install.side_effect = lambda vcenter: vcenter
+        fake_throttle.side_effect = lambda server: breakers[server]
+
+        output, unhealthy = vmware.show_avamar(username='alice')
+
+        self.assertEqual(set(output.keys()), {'avamar2'})
+        self.assertEqual(unhealthy, ['vc1'])
+
+    @patch.object(vmware, 'RING', vmware.HashRing(['vc1', 'vc2'], overrides={'alice': 'vc1'}))
+    @patch.object(vmware, 'vCenter')
+    def test_on_owning_shard(self, fake_vCenter):
+        """``_on_owning_shard`` tries the next vCenter when the VM is not on the home vCenter"""
+        def func(server, vcenter):
+            if server == 'vc1':
+                raise ValueError('testing')
+            return server
+
+        output = vmware._on_owning_shard('alice', func)
+
+        self.assertEqual(output, 'vc2')
+
+    @patch.object(vmware.upload, 'upload_disks')
+    @patch.object(vmware.virtual_machine, 'power')
+    def test_deploy_ova(self, fake_power, fake_upload_disks):
+        """``_deploy_ova`` uploads to the supplied host, and powers on the new VM"""
+        fake_vcenter = MagicMock()
+        fake_ova = MagicMock()
+        fake_vcenter.ovf_manager.CreateImportSpec.return_value.error = []
+        fake_lease = fake_vcenter.resource_pools.__getitem__.return_value.ImportVApp.return_value
+        fake_lease.state = vmware.vim.HttpNfcLease.State.ready
+        vmware.MOREF_CACHE.put(fake_vcenter, vmware.vim.HostSystem, 'esx1', vmware.vim.HostSystem('host-1'))
+
+        the_vm = vmware._deploy_ova(fake_vcenter, fake_ova, '/images/AVE-1.0.0.ova', [], 'alice',
+                                    'AvamarBox', 'ds1', 'esx1', MagicMock())
+
+        self.assertTrue(the_vm is fake_lease.info.entity)
+        self.assertEqual(fake_upload_disks.call_args[0][3], 'esx1')
+        fake_power.assert_called_with(the_vm, state='on')
+
+    def test_deploy_ova_bad_name(self):
+        """``_deploy_ova`` raises ValueError if the machine name is not a valid hostname"""
+        with self.assertRaises(ValueError):
+            vmware._deploy_ova(MagicMock(), MagicMock(), '/images/AVE-1.0.0.ova', [], 'alice',
+                               'Avamar_Box', 'ds1', 'esx1', MagicMock())
+
+    def test_block_on_lease_error(self):
+        """``_block_on_lease`` raises RuntimeError if vCenter fails to create the lease"""
+        fake_lease = MagicMock()
+        fake_lease.state = vmware.vim.HttpNfcLease.State.error
+
+        with self.assertRaises(RuntimeError):
+            vmware._block_on_lease(fake_lease, timeout=300)
+
+    @patch.object(vmware.time, 'sleep')
+    def test_block_on_lease_timeout(self, fake_sleep):
+        """``_block_on_lease`` aborts the lease and raises RuntimeError if it never leaves initializing"""
+        fake_lease = MagicMock()
+        fake_lease.state = vmware.vim.HttpNfcLease.State.initializing
+        clock = iter(range(0, 1000, 60))
+
+        with patch.object(vmware.time, 'time', side_effect=lambda: next(clock)):
+            with self.assertRaises(RuntimeError):
+                vmware._block_on_lease(fake_lease, timeout=300)
+
+        self.assertTrue(fake_lease.Abort.called)
+
     @patch.object(vmware.os, 'listdir')
     def test_list_images(self, fake_listdir):
         """``list_images`` - Returns a list of available Avamar versions that can be deployed"""
@@ -150,6 +711,17 @@ class TestVMware(unittest.TestCase):
         # set() avoids ordering issue in test
         self.assertEqual(set(output), set(expected))
 
+    @patch.object(vmware.compressed, 'zstandard', None)
+    @patch.object(vmware.os, 'listdir')
+    def test_list_images_compressed(self, fake_listdir):
+        """``list_images`` - Lists compressed images once, and skips the ones it cannot read"""
+        fake_listdir.return_value = ['AVE-18.2.0.134.ova', 'AVE-18.2.0.134.ova.gz', 'AVE-19.1.0.38.ova.zst']
+
+        output = vmware.list_images()
+        expected = ['18.2.0.134']
+
+        self.assertEqual(output, expected)
+
     def test_convert_name(self):
         """``convert_name`` - defaults to converting to the OVA file name"""
         output = vmware.convert_name(name='1.0.0', kind='Avamar')
@@ -164,6 +736,39 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    def test_convert_name_to_version_compressed(self):
+        """``convert_name`` - can extract the version from the name of a compressed OVA"""
+        output = vmware.convert_name('AVE-19.1.0.38.ova.gz', kind='Avamar', to_version=True)
+        expected = '19.1.0.38'
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware.images.IMAGE_INDEX, 'check')
+    @patch.object(vmware, '_choose_placement')
+    def test_create_avamar_corrupt_image(self, fake_choose_placement, fake_check):
+        """``create_avamar`` refuses an image that failed verification, before placing the VM"""
+        fake_check.side_effect = ValueError('Image AVE-1.0.0.ova is corrupt')
+
+        with self.assertRaises(ValueError):
+            vmware.create_avamar(username='alice',
+                                 machine_name='AvamarBox',
+                                 image='1.0.0',
+                                 network='someLAN',
+                                 ip_config={},
+                                 logger=MagicMock())
+
+        self.assertFalse(fake_choose_placement.called)
+
+    @patch.object(vmware.os.path, 'exists')
+    def test_convert_name_compressed(self, fake_exists):
+        """``convert_name`` - picks a compressed OVA, when there is one"""
+        fake_exists.side_effect = lambda x: x.endswith('.gz')
+
+        output = vmware.convert_name(name='1.0.0', kind='Avamar')
+        expected = 'AVE-1.0.0.ova.gz'
+
+        self.assertEqual(output, expected)
+
     def test_convert_name_ndmp(self):
         """``convert_name`` - defaults to converting to the OVA file name"""
         output = vmware.convert_name(name='1.0.0', kind='AvamarNDMP')
@@ -189,10 +794,149 @@ class TestVMware(unittest.TestCase):
                          'dns': ['1.2.3.2'],
                          'domain': 'vlab.local'}
 
-        vmware._configure_network(the_vm, ip_config)
+        vmware._configure_network(MagicMock(), the_vm, ip_config)
 
         self.assertTrue(fake_consume_task.called)
 
+    @patch.object(vmware, 'consume_task')
+    def test_configure_network_no_block(self, fake_consume_task):
+        """``_configure_network`` can return without waiting on the customization"""
+        the_vm = MagicMock()
+        the_vm.name = 'myAvamarInstance'
+
+        task = vmware._configure_network(MagicMock(), the_vm, self.ip_config, block=False)
+
+        self.assertFalse(fake_consume_task.called)
+        self.assertTrue(task is the_vm.Customize.return_value)
+
+    @patch.object(vmware, 'consume_task')
+    def test_configure_network_overrides(self, fake_consume_task):
+        """``_configure_network`` sets the IP and hostname of the VM on a copy of the base spec"""
+        the_vm = MagicMock()
+        the_vm.name = 'myAvamarInstance'
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.customizationSpecManager.DoesCustomizationSpecExist.return_value = False
+
+        vmware._configure_network(fake_vcenter, the_vm, self.ip_config)
+        _, the_kwargs = the_vm.Customize.call_args
+        spec = the_kwargs['spec']
+        base = vmware._base_spec(fake_vcenter, 'vlab.local')
+
+        self.assertEqual(spec.nicSettingMap[0].adapter.ip.ipAddress, '1.2.3.4')
+        self.assertEqual(spec.identity.hostName.name, 'myAvamarInstance')
+        self.assertFalse(base.identity.hostName.name)
+
+    def test_base_spec_registers(self):
+        """``_base_spec`` stores a new spec in the CustomizationSpecManager"""
+        fake_vcenter = MagicMock()
+        manager = fake_vcenter.content.customizationSpecManager
+        manager.DoesCustomizationSpecExist.return_value = False
+
+        vmware._base_spec(fake_vcenter, 'vlab.local')
+
+        self.assertTrue(manager.CreateCustomizationSpec.called)
+
+    def test_base_spec_existing(self):
+        """``_base_spec`` uses the spec already stored in vCenter"""
+        fake_vcenter = MagicMock()
+        manager = fake_vcenter.content.customizationSpecManager
+        manager.DoesCustomizationSpecExist.return_value = True
+
+        output = vmware._base_spec(fake_vcenter, 'vlab.local')
+
+        self.assertTrue(output is manager.GetCustomizationSpec.return_value.spec)
+        self.assertFalse(manager.CreateCustomizationSpec.called)
+
+    def test_base_spec_cached(self):
+        """``_base_spec`` only asks vCenter about a domain once"""
+        fake_vcenter = MagicMock()
+        manager = fake_vcenter.content.customizationSpecManager
+        manager.DoesCustomizationSpecExist.return_value = False
+
+        vmware._base_spec(fake_vcenter, 'vlab.local')
+        vmware._base_spec(fake_vcenter, 'vlab.local')
+
+        self.assertEqual(manager.DoesCustomizationSpecExist.call_count, 1)
+
+    def test_base_spec_race(self):
+        """``_base_spec`` tolerates another worker storing the spec first"""
+        fake_vcenter = MagicMock()
+        manager = fake_vcenter.content.customizationSpecManager
+        manager.DoesCustomizationSpecExist.return_value = False
+        manager.CreateCustomizationSpec.side_effect = vmware.vim.fault.AlreadyExists(name='vlab-avamar-vlab.local')
+
+        output = vmware._base_spec(fake_vcenter, 'vlab.local')
+
+        self.assertTrue(isinstance(output, vmware.vim.vm.customization.Specification))
+
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    def test_add_vmdk(self, fake_add_vmdk, fake_consume_task):
+        """``_add_vmdk`` does not wait on the customization"""
+        vmware._add_vmdk(MagicMock(), MagicMock(), disk_size=250)
+
+        self.assertEqual(fake_add_vmdk.call_count, 1)
+        self.assertFalse(fake_consume_task.called)
+
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    def test_add_vmdk_busy(self, fake_add_vmdk, fake_consume_task):
+        """``_add_vmdk`` tries again after the customization, if vCenter says the VM is busy"""
+        fake_add_vmdk.side_effect = [vmware.vim.fault.TaskInProgress(), None]
+        customizing = MagicMock()
+
+        vmware._add_vmdk(MagicMock(), customizing, disk_size=250)
+
+        fake_consume_task.assert_called_with(customizing)
+        self.assertEqual(fake_add_vmdk.call_count, 2)
+
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    def test_add_vmdk_busy_task(self, fake_add_vmdk, fake_consume_task):
+        """``_add_vmdk`` tries again after the customization, if the reconfigure task failed because the VM is busy"""
+        fake_add_vmdk.side_effect = [RuntimeError('The operation is not allowed in the current state.'), None]
+        the_vm = MagicMock()
+        reconfigure = MagicMock()
+        reconfigure.info.descriptionId = 'VirtualMachine.reconfigure'
+        reconfigure.info.state = vmware.vim.TaskInfo.State.error
+        reconfigure.info.error = vmware.vim.fault.InvalidState()
+        the_vm.recentTask = [reconfigure]
+
+        vmware._add_vmdk(the_vm, MagicMock(), disk_size=250)
+
+        self.assertEqual(fake_add_vmdk.call_count, 2)
+
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    def test_add_vmdk_timeout(self, fake_add_vmdk, fake_consume_task):
+        """``_add_vmdk`` does not try again if waiting on the reconfigure timed out"""
+        fake_add_vmdk.side_effect = [RuntimeError('Timeout of 600 seconds exceeded for task'), None]
+        the_vm = MagicMock()
+        reconfigure = MagicMock()
+        reconfigure.info.descriptionId = 'VirtualMachine.reconfigure'
+        reconfigure.info.state = vmware.vim.TaskInfo.State.running
+        the_vm.recentTask = [reconfigure]
+
+        with self.assertRaises(RuntimeError):
+            vmware._add_vmdk(the_vm, MagicMock(), disk_size=250)
+
+        self.assertEqual(fake_add_vmdk.call_count, 1)
+
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'add_vmdk')
+    def test_add_vmdk_added_anyway(self, fake_add_vmdk, fake_consume_task):
+        """``_add_vmdk`` does not add a second disk if the first reconfigure finished after all"""
+        the_vm = MagicMock()
+        the_vm.config.hardware.device = [vmware.vim.vm.device.VirtualDisk()]
+        def busy(vm, disk_size):
+            vm.config.hardware.device = [vmware.vim.vm.device.VirtualDisk(), vmware.vim.vm.device.VirtualDisk()]
+            raise vmware.vim.fault.TaskInProgress()
+        fake_add_vmdk.side_effect = busy
+
+        vmware._add_vmdk(the_vm, MagicMock(), disk_size=250)
+
+        self.assertEqual(fake_add_vmdk.call_count, 1)
+
     @patch.object(vmware.time, 'sleep')
     def test_block_on_boot(self, fake_sleep):
         """``_block_on_boot`` waits for VMware Tools to be ready"""
@@ -207,6 +951,899 @@ class TestVMware(unittest.TestCase):
         self.assertEqual(2, fake_sleep.call_count)
 
 
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_show_fleet(self, fake_vCenter, fake_retrieve_properties):
+        """``show_fleet`` groups the Avamar machines by owner"""
+        folder = vmware.vim.Folder('group-v1')
+        fake_retrieve_properties.return_value = [
+            (folder, {'name': 'alice'}),
+            (vmware.vim.VirtualMachine('vm-1'), {'name': 'myAvamar',
+                                                 'parent': folder,
+                                                 'config.annotation': '{"component": "Avamar", "version": "19.2", "created": 1}',
+                                                 'runtime.powerState': 'poweredOn',
+                                                 'summary.storage.committed': 1024**3}),
+            (vmware.vim.VirtualMachine('vm-2'), {'name': 'myNDMP',
+                                                 'parent': folder,
+                                                 'config.annotation': '{"component": "AvamarNDMP", "version": "19.2", "created": 1}',
+                                                 'runtime.powerState': 'poweredOn',
+                                                 'summary.storage.committed': 1024**3}),
+        ]
+
+        output = vmware.show_fleet()
+        expected = {'machines': {'alice': {'myAvamar': {'version': '19.2',
+                                                        'state': 'poweredOn',
+                                                        'disk_gb': 1.0,
+                                                        'created': 1}}},
+                    'summary': {'total': 1,
+                                'disk_gb': 1.0,
+                                'owners': {'alice': 1},
+                                'versions': {'19.2': 1},
+                                'states': {'poweredOn': 1}}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_show_fleet_bad_notes(self, fake_vCenter, fake_retrieve_properties):
+        """``show_fleet`` ignores VMs without vLab meta data"""
+        fake_retrieve_properties.return_value = [
+            (vmware.vim.VirtualMachine('vm-1'), {'name': 'someVM', 'config.annotation': None}),
+        ]
+
+        output = vmware.show_fleet()
+
+        self.assertEqual(output['summary']['total'], 0)
+
+    def test_parse_meta(self):
+        """``_parse_meta`` returns an empty dictionary when the VM has no meta data"""
+        output = vmware._parse_meta('not json')
+        expected = {}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware, 'vmodl')
+    def test_retrieve_properties(self, fake_vmodl):
+        """``_retrieve_properties`` pages through all the results"""
+        fake_vcenter = MagicMock()
+        fake_prop = MagicMock()
+        fake_prop.name = 'name'
+        fake_prop.val = 'myAvamar'
+        page1 = MagicMock()
+        page1.objects = [MagicMock(obj='vm-1', propSet=[fake_prop])]
+        page1.token = 'more'
+        page2 = MagicMock()
+        page2.objects = [MagicMock(obj='vm-2', propSet=[fake_prop])]
+        page2.token = None
+        collector = fake_vcenter.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = page1
+        collector.ContinueRetrievePropertiesEx.return_value = page2
+
+        output = vmware._retrieve_properties(fake_vcenter, MagicMock(), {vmware.vim.VirtualMachine: ['name']})
+        expected = [('vm-1', {'name': 'myAvamar'}), ('vm-2', {'name': 'myAvamar'})]
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware, '_retrieve_properties')
+    def test_get_network(self, fake_retrieve_properties):
+        """``_get_network`` caches every network in vCenter upon a cache miss"""
+        fake_vcenter = MagicMock()
+        fake_retrieve_properties.return_value = [(vmware.vim.Network('network-1'), {'name': 'bob_lan'}),
+                                                 (vmware.vim.Network('network-2'), {'name': 'bob_wan'})]
+
+        vmware._get_network(fake_vcenter, 'bob_lan')
+        output = vmware.MOREF_CACHE.stats()['size']
+
+        self.assertEqual(output, 2)
+
+    @patch.object(vmware, '_retrieve_properties')
+    def test_get_network_value_error(self, fake_retrieve_properties):
+        """``_get_network`` raises ValueError when the network does not exist"""
+        fake_vcenter = MagicMock()
+        fake_retrieve_properties.return_value = []
+
+        with self.assertRaises(ValueError):
+            vmware._get_network(fake_vcenter, 'bob_lan')
+
+    @patch.object(vmware, '_retrieve_properties')
+    def test_get_network_new(self, fake_retrieve_properties):
+        """``_get_network`` finds a network created after the session first looked up the networks"""
+        fake_vcenter = MagicMock()
+        fake_retrieve_properties.return_value = [(vmware.vim.Network('network-1'), {'name': 'bob_lan'})]
+        vmware._get_network(fake_vcenter, 'bob_lan')
+        fake_retrieve_properties.return_value = [(vmware.vim.Network('network-1'), {'name': 'bob_lan'}),
+                                                 (vmware.vim.Network('network-2'), {'name': 'bob_new'})]
+
+        output = vmware._get_network(fake_vcenter, 'bob_new')
+
+        self.assertEqual(output, vmware.vim.Network('network-2'))
+
+    def test_get_folder_vms(self):
+        """``_get_folder_vms`` only searches vCenter for the folder once"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.return_value = vmware.vim.Folder('group-v1')
+
+        with patch.object(vmware.vim.Folder, 'childEntity', []):
+            vmware._get_folder_vms(fake_vcenter, 'bob')
+            vmware._get_folder_vms(fake_vcenter, 'bob')
+
+        self.assertEqual(fake_vcenter.get_by_name.call_count, 1)
+
+    def test_worker_stats(self):
+        """``worker_stats`` returns the MoRef cache counters"""
+        output = vmware.worker_stats()
+
+        self.assertTrue('moref_cache' in output)
+
+    def test_worker_stats_warm_up(self):
+        """``worker_stats`` returns how long the worker process took to warm up"""
+        output = vmware.worker_stats()
+
+        self.assertTrue('warm_up' in output)
+
+    @patch.object(vmware, '_list_networks')
+    @patch.object(vmware.os, 'listdir')
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, '_session')
+    def test_warm_up(self, fake_session, fake_retrieve_properties, fake_listdir, fake_list_networks):
+        """``warm_up`` caches the MoRefs of the user folders and networks"""
+        fake_vcenter = fake_session.return_value.__enter__.return_value
+        fake_list_networks.return_value = {'frontend': vmware.vim.Network('network-1')}
+        fake_retrieve_properties.return_value = [(vmware.vim.Folder('group-1'), {'name': 'alice'})]
+        fake_listdir.return_value = ['AVE-19.1.0.38.ova']
+        loader = MagicMock()
+
+        output = vmware.warm_up(timeout=5)
+        vmware.MOREF_CACHE.get(fake_vcenter, vmware.vim.Folder, 'alice', loader)
+        vmware.MOREF_CACHE.get(fake_vcenter, vmware.vim.Network, 'frontend', loader)
+
+        self.assertEqual(output['errors'], [])
+        self.assertEqual(output['status'], 'ok')
+        self.assertFalse(loader.called)
+
+    @patch.object(vmware.os, 'listdir')
+    @patch.object(vmware, '_session')
+    def test_warm_up_errors(self, fake_session, fake_listdir):
+        """``warm_up`` reports what it could not preload, instead of raising"""
+        fake_session.side_effect = RuntimeError('vCenter is down')
+        fake_listdir.side_effect = FileNotFoundError('No such directory')
+
+        output = vmware.warm_up(timeout=5)
+
+        self.assertEqual(len(output['errors']), len(vmware.RING.servers) + 2)
+        self.assertEqual(output['status'], 'failed')
+
+    @patch.object(vmware.os, 'listdir')
+    @patch.object(vmware, '_session')
+    def test_warm_up_timeout(self, fake_session, fake_listdir):
+        """``warm_up`` does not wait longer than the timeout"""
+        fake_session.side_effect = lambda server: time.sleep(1)
+        fake_listdir.return_value = []
+
+        output = vmware.warm_up(timeout=0.1)
+
+        self.assertEqual(output['errors'], ['Still warming up after 0.1 seconds'])
+        self.assertEqual(output['status'], 'timed out')
+
+    @patch.object(vmware.os, 'listdir')
+    @patch.object(vmware, '_session')
+    def test_warm_up_late(self, fake_session, fake_listdir):
+        """``warm_up`` records the warm up again once one that timed out finally ends"""
+        fake_session.side_effect = lambda server: time.sleep(0.3)
+        fake_listdir.return_value = []
+        records = []
+        finished = threading.Event()
+        def record(report):
+            records.append(report['status'])
+            if len(records) == 2:
+                finished.set()
+
+        vmware.warm_up(timeout=0.1, record=record)
+        finished.wait(5)
+
+        self.assertEqual(records[0], 'timed out')
+        self.assertEqual(len(records), 2)
+
+    def _ip_update(self, name, value):
+        """Make the UpdateSet that WaitForUpdatesEx returns when a property changes"""
+        change = MagicMock(op='assign', val=value)
+        change.name = name
+        obj_set = MagicMock(changeSet=[change])
+        return MagicMock(version='1', filterSet=[MagicMock(objectSet=[obj_set])])
+
+    def test_wait_for_ip(self):
+        """``_wait_for_ip`` returns once the guest reports the static IP"""
+        fake_vcenter = MagicMock()
+        collector = fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        nic = vmware.vim.vm.GuestInfo.NicInfo(ipAddress=['1.2.3.4', 'fe80::1'])
+        collector.WaitForUpdatesEx.side_effect = [self._ip_update('guest.net', []),
+                                                  None,
+                                                  self._ip_update('guest.net', [nic])]
+
+        output = vmware._wait_for_ip(fake_vcenter, vmware.vim.VirtualMachine('vm-1'), '1.2.3.4', timeout=5)
+
+        self.assertEqual(output, ['1.2.3.4'])
+        self.assertEqual(collector.WaitForUpdatesEx.call_count, 3)
+
+    def test_wait_for_ip_static(self):
+        """``_wait_for_ip`` keeps waiting while the guest only has a different IP"""
+        fake_vcenter = MagicMock()
+        collector = fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        collector.WaitForUpdatesEx.side_effect = [self._ip_update('guest.ipAddress', '192.168.1.50'),
+                                                  self._ip_update('guest.ipAddress', '1.2.3.4')]
+
+        output = vmware._wait_for_ip(fake_vcenter, vmware.vim.VirtualMachine('vm-1'), '1.2.3.4', timeout=5)
+
+        self.assertEqual(output, ['1.2.3.4'])
+
+    def test_wait_for_ip_any(self):
+        """``_wait_for_ip`` returns the first IP when no static IP is expected"""
+        fake_vcenter = MagicMock()
+        collector = fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        collector.WaitForUpdatesEx.side_effect = [self._ip_update('guest.ipAddress', '192.168.1.50')]
+
+        output = vmware._wait_for_ip(fake_vcenter, vmware.vim.VirtualMachine('vm-1'), None, timeout=5)
+
+        self.assertEqual(output, ['192.168.1.50'])
+
+    @patch.object(vmware, 'time')
+    def test_wait_for_ip_timeout(self, fake_time):
+        """``_wait_for_ip`` raises RuntimeError if the IP does not appear in time"""
+        fake_time.time.side_effect = [0, 0, 30, 61]
+        fake_vcenter = MagicMock()
+        collector = fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        collector.WaitForUpdatesEx.return_value = None
+
+        with self.assertRaises(RuntimeError):
+            vmware._wait_for_ip(fake_vcenter, vmware.vim.VirtualMachine('vm-1'), '1.2.3.4', timeout=60)
+
+    def test_wait_for_ip_cleanup(self):
+        """``_wait_for_ip`` destroys its PropertyCollector"""
+        fake_vcenter = MagicMock()
+        collector = fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        collector.WaitForUpdatesEx.side_effect = [self._ip_update('guest.ipAddress', '1.2.3.4')]
+
+        vmware._wait_for_ip(fake_vcenter, vmware.vim.VirtualMachine('vm-1'), '1.2.3.4', timeout=5)
+
+        self.assertTrue(collector.DestroyPropertyCollector.called)
+
+    def test_load_type(self):
+        """``_load_type`` looks up a pyVmomi type by its dotted name"""
+        output = vmware._load_type('vim.vm.customization.FixedIp')
+
+        self.assertTrue(output is vmware.vim.vm.customization.FixedIp)
+
+    def test_object_properties(self):
+        """``_object_properties`` maps each object to its properties"""
+        fake_vcenter = MagicMock()
+        fake_vm = vmware.vim.VirtualMachine('vm-1')
+        fake_prop = MagicMock()
+        fake_prop.name = 'config.annotation'
+        fake_prop.val = 'some notes'
+        fake_vcenter.content.propertyCollector.RetrieveContents.return_value = [MagicMock(obj=fake_vm, propSet=[fake_prop])]
+
+        output = vmware._object_properties(fake_vcenter, [fake_vm], vmware.vim.VirtualMachine, ['config.annotation'])
+        expected = {fake_vm: {'config.annotation': 'some notes'}}
+
+        self.assertEqual(output, expected)
+
+    def test_object_properties_no_objects(self):
+        """``_object_properties`` does not call vCenter when not supplied objects"""
+        fake_vcenter = MagicMock()
+
+        vmware._object_properties(fake_vcenter, [], vmware.vim.VirtualMachine, ['config.annotation'])
+
+        self.assertFalse(fake_vcenter.content.propertyCollector.RetrieveContents.called)
+
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_reset_avamar(self, fake_vCenter, fake_find_avamars, fake_consume_task, fake_power, fake_get_info):
+        """``reset_avamar`` reports how long the reset took, and how long creating took"""
+        fake_logger = MagicMock()
+        fake_vm = MagicMock()
+        fake_vm.name = 'myAvamar'
+        snapshot = MagicMock()
+        snapshot.name = vmware.RESET_SNAPSHOT
+        snapshot.description = '{"create_seconds": 900.0, "boot_seconds": 300.0}'
+        fake_vm.snapshot.rootSnapshotList = [snapshot]
+        fake_find_avamars.return_value = [fake_vm]
+        fake_get_info.return_value = {}
+
+        output = vmware.reset_avamar(username='bob', machine_name='myAvamar', logger=fake_logger)
+        timings = output['myAvamar']['timings']
+
+        self.assertEqual(timings['create_seconds'], 900.0)
+        self.assertTrue('reset_seconds' in timings)
+        self.assertTrue(snapshot.snapshot.RevertToSnapshot_Task.called)
+
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_reset_avamar_no_snapshot(self, fake_vCenter, fake_find_avamars):
+        """``reset_avamar`` raises ValueError if the VM has no reset snapshot"""
+        fake_logger = MagicMock()
+        fake_vm = MagicMock()
+        fake_vm.snapshot = None
+        fake_find_avamars.return_value = [fake_vm]
+
+        with self.assertRaises(ValueError):
+            vmware.reset_avamar(username='bob', machine_name='myAvamar', logger=fake_logger)
+
+    def test_find_snapshot(self):
+        """``_find_snapshot`` searches the whole snapshot tree"""
+        child = MagicMock()
+        child.name = 'findMe'
+        child.childSnapshotList = []
+        root = MagicMock()
+        root.name = 'someOtherSnapshot'
+        root.childSnapshotList = [child]
+
+        output = vmware._find_snapshot([root], 'findMe')
+
+        self.assertTrue(output is child)
+
+    def test_find_snapshot_none(self):
+        """``_find_snapshot`` returns None if there is no snapshot with the supplied name"""
+        output = vmware._find_snapshot([], 'findMe')
+
+        self.assertTrue(output is None)
+
+    @patch.object(vmware, 'consume_task')
+    def test_take_reset_snapshot(self, fake_consume_task):
+        """``_take_reset_snapshot`` records the create timings in the snapshot description"""
+        the_vm = MagicMock()
+
+        vmware._take_reset_snapshot(the_vm, {'create_seconds': 1.0})
+        _, the_kwargs = the_vm.CreateSnapshot_Task.call_args
+
+        self.assertEqual(vmware.ujson.loads(the_kwargs['description']), {'create_seconds': 1.0})
+        self.assertTrue(the_kwargs['memory'])
+
+    def _reaper_inventory(self, created, cpu=1000, state='poweredOn'):
+        """Make the output of ``_retrieve_properties`` for the reaper tests"""
+        folder = vmware.vim.Folder('group-v1')
+        annotation = '{"component": "Avamar", "created": %s}' % created
+        return [(folder, {'name': 'alice'}),
+                (vmware.vim.VirtualMachine('vm-1'), {'name': 'myAvamar',
+                                                     'parent': folder,
+                                                     'config.annotation': annotation,
+                                                     'runtime.powerState': state,
+                                                     'summary.quickStats.overallCpuUsage': cpu})]
+
+    def test_find_expired_ttl(self):
+        """``_find_expired`` reports VMs past the TTL"""
+        found = self._reaper_inventory(created=1)
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_TTL_HOURS=1)):
+            report, doomed = vmware._find_expired(found, now=7200, idle_seconds={})
+
+        self.assertEqual(report['expired'], {'alice': ['myAvamar']})
+        self.assertEqual(len(doomed), 1)
+
+    def test_find_expired_warned(self):
+        """``_find_expired`` warns owners of VMs that will soon be past the TTL"""
+        found = self._reaper_inventory(created=1)
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_TTL_HOURS=2)):
+            report, doomed = vmware._find_expired(found, now=3600, idle_seconds={})
+
+        self.assertEqual(report['warned'], {'alice': {'myAvamar': 7201}})
+        self.assertEqual(doomed, [])
+
+    def test_find_expired_idle(self):
+        """``_find_expired`` reports VMs that are idle for too long"""
+        found = self._reaper_inventory(created=1, state='poweredOff')
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_IDLE_HOURS=1)):
+            report, _ = vmware._find_expired(found, now=7200, idle_seconds={'vm-1': 3601})
+
+        self.assertEqual(report['expired'], {'alice': ['myAvamar']})
+
+    def test_find_expired_idle_warned(self):
+        """``_find_expired`` warns owners of VMs that will soon have been idle for too long"""
+        found = self._reaper_inventory(created=1, state='poweredOff')
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_IDLE_HOURS=2)):
+            report, doomed = vmware._find_expired(found, now=7200, idle_seconds={'vm-1': 3600})
+
+        self.assertEqual(report['warned'], {'alice': {'myAvamar': 10800}})
+        self.assertEqual(doomed, [])
+
+    def test_find_expired_busy(self):
+        """``_find_expired`` does not report VMs that are busy"""
+        found = self._reaper_inventory(created=1, cpu=5000)
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_IDLE_HOURS=1)):
+            report, _ = vmware._find_expired(found, now=7200, idle_seconds={})
+
+        self.assertEqual(report['expired'], {})
+
+    def test_idle_samples(self):
+        """``_idle_samples`` only counts a powered on VM as idle when its CPU is idle"""
+        busy = self._reaper_inventory(created=1, cpu=5000)
+        quiet = self._reaper_inventory(created=1, cpu=0)
+        off = self._reaper_inventory(created=1, cpu=5000, state='poweredOff')
+
+        output = [vmware._idle_samples(x)['vm-1'] for x in (busy, quiet, off)]
+
+        self.assertEqual(output, [False, True, True])
+
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_reap_expired_recently_busy(self, fake_vCenter, fake_retrieve_properties, fake_destroy_vms):
+        """``reap_expired`` does not destroy an old VM that was busy until recently"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        tracker = IdleTracker(state=SharedState(os.path.join(tmp_dir, 'idle.json')))
+        with patch.object(vmware, 'REAPER_IDLE', tracker):
+            with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_IDLE_HOURS=1)):
+                fake_retrieve_properties.return_value = self._reaper_inventory(created=1, cpu=5000)
+                with patch.object(vmware.time, 'time', return_value=999999):
+                    vmware.reap_expired(MagicMock(), dry_run=False)
+                fake_retrieve_properties.return_value = self._reaper_inventory(created=1, cpu=0)
+                with patch.object(vmware.time, 'time', return_value=999999 + 1800):
+                    output = vmware.reap_expired(MagicMock(), dry_run=False)
+
+        self.assertEqual(output['expired'], {})
+        self.assertTrue('myAvamar' in output['warned']['alice'])
+        self.assertFalse(fake_destroy_vms.call_args[0][0])
+
+    def test_find_expired_disabled(self):
+        """``_find_expired`` reports nothing when the TTL and idle policy are disabled"""
+        found = self._reaper_inventory(created=1)
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_TTL_HOURS=0, VLAB_AVAMAR_IDLE_HOURS=0)):
+            report, _ = vmware._find_expired(found, now=99999999, idle_seconds={'vm-1': 99999999})
+
+        self.assertEqual(report, {'expired': {}, 'warned': {}})
+
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_reap_expired_dry_run(self, fake_vCenter, fake_retrieve_properties, fake_destroy_vms):
+        """``reap_expired`` does not destroy VMs during a dry-run"""
+        fake_retrieve_properties.return_value = self._reaper_inventory(created=1)
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_TTL_HOURS=1)):
+            output = vmware.reap_expired(MagicMock(), dry_run=True)
+
+        self.assertFalse(fake_destroy_vms.called)
+        self.assertTrue(output['dry_run'])
+
+    @patch.object(vmware, '_destroy_vms')
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_reap_expired(self, fake_vCenter, fake_retrieve_properties, fake_destroy_vms):
+        """``reap_expired`` destroys the expired VMs"""
+        fake_retrieve_properties.return_value = self._reaper_inventory(created=1)
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_TTL_HOURS=1)):
+            vmware.reap_expired(MagicMock(), dry_run=False)
+
+        self.assertTrue(fake_destroy_vms.called)
+
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_get_folder_vms')
+    @patch.object(vmware, 'vCenter')
+    def test_show_avamar_expires(self, fake_vCenter, fake_get_folder_vms, fake_get_info):
+        """``show_avamar`` tells the owner when the reaper will destroy the VM"""
+        fake_vm = MagicMock()
+        fake_vm.name = 'myAvamar'
+        fake_get_folder_vms.return_value = [fake_vm]
+        fake_get_info.return_value = {'meta': {'component': 'Avamar', 'created': 100}}
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_TTL_HOURS=1)):
+            output, _ = vmware.show_avamar(username='alice')
+
+        self.assertEqual(output['myAvamar']['expires'], 3700)
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_LIBRARY=False))
+    def test_find_template_disabled(self):
+        """``_find_template`` returns None when the library is not enabled"""
+        fake_vcenter = MagicMock()
+
+        output = vmware._find_template(fake_vcenter, 'vc1', 'AVE-1.0.0.ova', 'ds1')
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_vcenter.content.searchIndex.FindChild.called)
+
+    @patch.object(vmware.images.IMAGE_INDEX, 'sha256', return_value='abc')
+    @patch.object(vmware.LIBRARY, 'current', return_value=True)
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_LIBRARY=True))
+    def test_find_template(self, fake_current, fake_sha256):
+        """``_find_template`` returns the template of the image on the datastore"""
+        fake_vcenter = MagicMock()
+        fake_template = vmware.vim.VirtualMachine('vm-1')
+        fake_vcenter.content.searchIndex.FindChild.return_value = fake_template
+
+        output = vmware._find_template(fake_vcenter, 'vc1', 'AVE-1.0.0.ova', 'ds1')
+        _, the_kwargs = fake_vcenter.content.searchIndex.FindChild.call_args
+
+        self.assertEqual(output, fake_template)
+        self.assertEqual(the_kwargs['name'], 'AVE-1.0.0-ds1')
+        fake_current.assert_called_with('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc')
+
+    @patch.object(vmware.images.IMAGE_INDEX, 'sha256', return_value='abc')
+    @patch.object(vmware.LIBRARY, 'current', return_value=False)
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_LIBRARY=True))
+    def test_find_template_stale(self, fake_current, fake_sha256):
+        """``_find_template`` returns None when the template is not of the current image"""
+        fake_vcenter = MagicMock()
+
+        output = vmware._find_template(fake_vcenter, 'vc1', 'AVE-1.0.0.ova', 'ds1')
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_vcenter.content.searchIndex.FindChild.called)
+
+    def test_library_folder_created(self):
+        """``_library_folder`` creates the folder of library templates when it does not exist"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = None
+
+        output = vmware._library_folder(fake_vcenter)
+        top_dir = fake_vcenter.get_vm_folder.return_value
+
+        self.assertEqual(output, top_dir.CreateFolder.return_value)
+
+    def test_template_name(self):
+        """``_template_name`` is a valid VM name, unique to the image and datastore"""
+        self.assertEqual(vmware._template_name('AVE-19.1.0.ova.zst', 'ds1'), 'AVE-19.1.0-ds1')
+        self.assertEqual(vmware._template_name('AVE-19.1.0.ova', 'my datastore_1'), 'AVE-19.1.0-my-datastore-1')
+
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, '_get_network')
+    @patch.object(vmware, '_deploy_targets')
+    def test_clone_template(self, fake_deploy_targets, fake_get_network, fake_consume_task):
+        """``_clone_template`` clones a powered on VM onto the datastore, connected to the network"""
+        fake_deploy_targets.return_value = (MagicMock(), vmware.vim.ResourcePool('resgroup-1'),
+                                            vmware.vim.Datastore('datastore-1'), vmware.vim.HostSystem('host-1'))
+        fake_get_network.return_value = vmware.vim.Network('network-1')
+        fake_template = MagicMock()
+        fake_template.config.hardware.device = [vmware.vim.vm.device.VirtualDisk(key=2000),
+                                                vmware.vim.vm.device.VirtualVmxnet3(key=4000)]
+
+        output = vmware._clone_template(vcenter=MagicMock(),
+                                        template=fake_template,
+                                        network='someLAN',
+                                        username='alice',
+                                        machine_name='AvamarBox',
+                                        datastore='ds1',
+                                        host='esx1')
+        _, the_kwargs = fake_template.CloneVM_Task.call_args
+        change = the_kwargs['spec'].config.deviceChange[0]
+
+        self.assertEqual(output, fake_consume_task.return_value)
+        self.assertTrue(the_kwargs['spec'].powerOn)
+        self.assertEqual(the_kwargs['name'], 'AvamarBox')
+        self.assertEqual(change.device.key, 4000)
+        self.assertEqual(change.device.backing.deviceName, 'someLAN')
+
+    def test_clone_template_bad_name(self):
+        """``_clone_template`` raises ValueError when the machine name is not a valid hostname"""
+        with self.assertRaises(ValueError):
+            vmware._clone_template(vcenter=MagicMock(),
+                                   template=MagicMock(),
+                                   network='someLAN',
+                                   username='alice',
+                                   machine_name='Avamar_Box',
+                                   datastore='ds1',
+                                   host='esx1')
+
+    @patch.object(vmware, 'MOREF_CACHE')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, '_upload_image')
+    def test_publish(self, fake_upload_image, fake_set_meta, fake_MOREF_CACHE):
+        """``_publish`` uploads the image powered off, records its SHA-256, and makes it a template"""
+        placement = vmware.PLACEMENTS[vmware.RING.servers[0]]
+        with patch.object(placement, 'choose', return_value=('ds1', 'esx1')):
+            with patch.object(type(placement), 'stale', new=False):
+                vmware._publish(MagicMock(), vmware.RING.servers[0], 'AVE-1.0.0.ova', 'abc', 'ds1', MagicMock())
+        _, the_kwargs = fake_upload_image.call_args
+        meta = fake_set_meta.call_args[0][1]
+
+        self.assertFalse(the_kwargs['power_on'])
+        self.assertEqual(the_kwargs['machine_name'], 'AVE-1.0.0-ds1')
+        self.assertEqual(meta['sha256'], 'abc')
+        self.assertTrue(fake_upload_image.return_value.MarkAsTemplate.called)
+
+    @patch.object(vmware, 'const', vmware.const._replace(INF_VCENTER_DATASTORES=['ds1', 'ds2']))
+    @patch.object(vmware, '_publish')
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, '_library_folder')
+    @patch.object(vmware, '_fan_out', side_effect=lambda func: {'vc1': func('vc1', MagicMock())})
+    @patch.object(vmware.images.IMAGE_INDEX, 'sha256', return_value='abc')
+    @patch.object(vmware, 'list_images', side_effect=[['1.0.0'], []])
+    def test_sync_library(self, fake_list_images, fake_sha256, fake_fan_out, fake_library_folder,
+                          fake_retrieve_properties, fake_publish):
+        """``sync_library`` publishes an image to the datastores that lack a current template of it"""
+        current = MagicMock()
+        stale = MagicMock()
+        fake_retrieve_properties.return_value = [(current, {'name': 'AVE-1.0.0-ds1', 'config.annotation': '{"sha256": "abc"}'}),
+                                                 (stale, {'name': 'AVE-1.0.0-ds2', 'config.annotation': '{"sha256": "old"}'})]
+        fake_library = Library(state=MagicMock())
+        fake_library._state.read.return_value = {}
+
+        with patch.object(vmware, 'LIBRARY', fake_library):
+            with patch.object(fake_library, 'report') as fake_report:
+                with patch.object(vmware, 'consume_task'):
+                    vmware.sync_library(MagicMock())
+        published = [x[0][4] for x in fake_publish.call_args_list]
+
+        self.assertEqual(published, ['ds2'])
+        self.assertTrue(stale.Destroy_Task.called)
+        self.assertFalse(current.Destroy_Task.called)
+        self.assertEqual(fake_report.call_args[0][0], {'AVE-1.0.0.ova': 'abc'})
+
+    @patch.object(vmware, 'const', vmware.const._replace(INF_VCENTER_DATASTORES=['ds1']))
+    @patch.object(vmware, '_publish', side_effect=RuntimeError('testing'))
+    @patch.object(vmware, '_retrieve_properties', return_value=[])
+    @patch.object(vmware, '_library_folder')
+    @patch.object(vmware, '_fan_out', side_effect=lambda func: {'vc1': func('vc1', MagicMock())})
+    @patch.object(vmware.images.IMAGE_INDEX, 'sha256', return_value='abc')
+    @patch.object(vmware, 'list_images', side_effect=[['1.0.0'], []])
+    def test_sync_library_failed(self, fake_list_images, fake_sha256, fake_fan_out, fake_library_folder,
+                                 fake_retrieve_properties, fake_publish):
+        """``sync_library`` records the images that failed to publish, and keeps going"""
+        fake_library = MagicMock()
+
+        with patch.object(vmware, 'LIBRARY', fake_library):
+            vmware.sync_library(MagicMock())
+
+        fake_library.finished.assert_called_with('vc1', 'AVE-1.0.0.ova', 'ds1', 'abc', error='testing')
+
+    @patch.object(vmware, '_publish')
+    @patch.object(vmware, '_retrieve_properties', return_value=[])
+    @patch.object(vmware, '_library_folder')
+    @patch.object(vmware, '_fan_out', side_effect=lambda func: {'vc1': func('vc1', MagicMock())})
+    @patch.object(vmware.images.IMAGE_INDEX, 'sha256', return_value=None)
+    @patch.object(vmware, 'list_images', side_effect=[['1.0.0'], []])
+    def test_sync_library_unverified(self, fake_list_images, fake_sha256, fake_fan_out, fake_library_folder,
+                                     fake_retrieve_properties, fake_publish):
+        """``sync_library`` does not publish images that have not passed verification"""
+        with patch.object(vmware, 'LIBRARY', MagicMock()):
+            vmware.sync_library(MagicMock())
+
+        self.assertFalse(fake_publish.called)
+
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_suspend_avamar(self, fake_vCenter, fake_find_avamars, fake_consume_task, fake_get_info):
+        """``suspend_avamar`` suspends a powered on VM"""
+        fake_vm = MagicMock()
+        fake_vm.name = 'myAvamar'
+        fake_vm.runtime.powerState = vmware.vim.VirtualMachinePowerState.poweredOn
+        fake_find_avamars.return_value = [fake_vm]
+
+        output = vmware.suspend_avamar(username='bob', machine_name='myAvamar', logger=MagicMock())
+
+        self.assertTrue(fake_vm.SuspendVM_Task.called)
+        self.assertEqual(output, {'myAvamar': fake_get_info.return_value})
+
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_suspend_avamar_suspended(self, fake_vCenter, fake_find_avamars, fake_consume_task, fake_get_info):
+        """``suspend_avamar`` does nothing to a VM that's already suspended"""
+        fake_vm = MagicMock()
+        fake_vm.runtime.powerState = vmware.vim.VirtualMachinePowerState.suspended
+        fake_find_avamars.return_value = [fake_vm]
+
+        vmware.suspend_avamar(username='bob', machine_name='myAvamar', logger=MagicMock())
+
+        self.assertFalse(fake_vm.SuspendVM_Task.called)
+
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_suspend_avamar_off(self, fake_vCenter, fake_find_avamars):
+        """``suspend_avamar`` raises ValueError if the VM is powered off"""
+        fake_vm = MagicMock()
+        fake_vm.runtime.powerState = vmware.vim.VirtualMachinePowerState.poweredOff
+        fake_find_avamars.return_value = [fake_vm]
+
+        with self.assertRaises(ValueError):
+            vmware.suspend_avamar(username='bob', machine_name='myAvamar', logger=MagicMock())
+
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_resume_avamar(self, fake_vCenter, fake_find_avamars, fake_power, fake_wait_for_ip, fake_get_info):
+        """``resume_avamar`` reports how long resuming took, next to how long the cold boot took"""
+        fake_vm = MagicMock()
+        fake_vm.name = 'myAvamar'
+        fake_vm.runtime.powerState = vmware.vim.VirtualMachinePowerState.suspended
+        snapshot = MagicMock()
+        snapshot.name = vmware.RESET_SNAPSHOT
+        snapshot.description = '{"create_seconds": 900.0, "boot_seconds": 300.0}'
+        fake_vm.snapshot.rootSnapshotList = [snapshot]
+        fake_find_avamars.return_value = [fake_vm]
+        fake_get_info.return_value = {}
+
+        output = vmware.resume_avamar(username='bob', machine_name='myAvamar', logger=MagicMock())
+        timings = output['myAvamar']['timings']
+
+        self.assertEqual(timings['boot_seconds'], 300.0)
+        self.assertTrue('resume_seconds' in timings)
+        fake_power.assert_called_with(fake_vm, state='on')
+        self.assertTrue(fake_wait_for_ip.called)
+
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_resume_avamar_no_snapshot(self, fake_vCenter, fake_find_avamars, fake_power, fake_wait_for_ip, fake_get_info):
+        """``resume_avamar`` still reports how long resuming took, when the VM has no reset snapshot"""
+        fake_vm = MagicMock()
+        fake_vm.name = 'myAvamar'
+        fake_vm.runtime.powerState = vmware.vim.VirtualMachinePowerState.suspended
+        fake_vm.snapshot = None
+        fake_find_avamars.return_value = [fake_vm]
+        fake_get_info.return_value = {}
+
+        output = vmware.resume_avamar(username='bob', machine_name='myAvamar', logger=MagicMock())
+
+        self.assertEqual(list(output['myAvamar']['timings'].keys()), ['resume_seconds'])
+
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_wait_for_ip')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_resume_avamar_meta_timings(self, fake_vCenter, fake_find_avamars, fake_power, fake_wait_for_ip, fake_get_info):
+        """``resume_avamar`` reads how long the cold boot took from the meta data, without a reset snapshot"""
+        fake_vm = MagicMock()
+        fake_vm.name = 'myAvamar'
+        fake_vm.runtime.powerState = vmware.vim.VirtualMachinePowerState.suspended
+        fake_vm.snapshot = None
+        fake_find_avamars.return_value = [fake_vm]
+        fake_get_info.return_value = {'meta': {'component': 'Avamar', 'create_seconds': 900.0, 'boot_seconds': 300.0}}
+
+        output = vmware.resume_avamar(username='bob', machine_name='myAvamar', logger=MagicMock())
+
+        self.assertEqual(output['myAvamar']['timings']['boot_seconds'], 300.0)
+
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_resume_avamar_not_suspended(self, fake_vCenter, fake_find_avamars):
+        """``resume_avamar`` raises ValueError if the VM is not suspended"""
+        fake_vm = MagicMock()
+        fake_vm.runtime.powerState = vmware.vim.VirtualMachinePowerState.poweredOn
+        fake_find_avamars.return_value = [fake_vm]
+
+        with self.assertRaises(ValueError):
+            vmware.resume_avamar(username='bob', machine_name='myAvamar', logger=MagicMock())
+
+    @patch.object(vmware.virtual_machine, 'power', return_value=False)
+    @patch.object(vmware, '_find_avamars')
+    @patch.object(vmware, 'vCenter')
+    def test_resume_avamar_failed(self, fake_vCenter, fake_find_avamars, fake_power):
+        """``resume_avamar`` raises RuntimeError if the VM fails to power on"""
+        fake_vm = MagicMock()
+        fake_vm.runtime.powerState = vmware.vim.VirtualMachinePowerState.suspended
+        fake_find_avamars.return_value = [fake_vm]
+
+        with self.assertRaises(RuntimeError):
+            vmware.resume_avamar(username='bob', machine_name='myAvamar', logger=MagicMock())
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_SUSPEND_IDLE_MINUTES=5))
+    @patch.object(vmware, 'IDLE')
+    @patch.object(vmware, '_suspend_vms')
+    @patch.object(vmware, '_net_usage', return_value={'vm-1': 1})
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_suspend_idle(self, fake_vCenter, fake_retrieve_properties, fake_net_usage, fake_suspend_vms, fake_IDLE):
+        """``suspend_idle`` suspends VMs that have been idle long enough"""
+        fake_retrieve_properties.return_value = self._reaper_inventory(created=1, cpu=10)
+        fake_IDLE.observe.return_value = {'vm-1': 600}
+
+        output = vmware.suspend_idle(MagicMock())
+        the_args, _ = fake_IDLE.observe.call_args
+
+        self.assertEqual(output['suspended'], {'alice': ['myAvamar']})
+        self.assertEqual(the_args[1], {'vm-1': True})
+        self.assertEqual(len(fake_suspend_vms.call_args[0][0]), 1)
+        self.assertTrue(fake_IDLE.forget.called)
+
+    @patch.object(vmware, 'const', vmware.const._replace(VLAB_AVAMAR_SUSPEND_IDLE_MINUTES=5))
+    @patch.object(vmware, 'IDLE')
+    @patch.object(vmware, '_suspend_vms')
+    @patch.object(vmware, '_net_usage', return_value={'vm-1': 1})
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_suspend_idle_not_yet(self, fake_vCenter, fake_retrieve_properties, fake_net_usage, fake_suspend_vms, fake_IDLE):
+        """``suspend_idle`` reports VMs that have not been idle for long enough, without suspending them"""
+        fake_retrieve_properties.return_value = self._reaper_inventory(created=1, cpu=10)
+        fake_IDLE.observe.return_value = {'vm-1': 60}
+
+        output = vmware.suspend_idle(MagicMock())
+
+        self.assertEqual(output['idle'], {'alice': {'myAvamar': 60}})
+        self.assertEqual(fake_suspend_vms.call_args[0][0], [])
+
+    @patch.object(vmware, 'IDLE')
+    @patch.object(vmware, '_suspend_vms')
+    @patch.object(vmware, '_net_usage', return_value={})
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_suspend_idle_busy_cpu(self, fake_vCenter, fake_retrieve_properties, fake_net_usage, fake_suspend_vms, fake_IDLE):
+        """``suspend_idle`` does not obtain the network stats of VMs with a busy CPU"""
+        fake_retrieve_properties.return_value = self._reaper_inventory(created=1, cpu=4000)
+        fake_IDLE.observe.return_value = {}
+
+        vmware.suspend_idle(MagicMock())
+        the_args, _ = fake_IDLE.observe.call_args
+
+        self.assertEqual(fake_net_usage.call_args[0][1], [])
+        self.assertEqual(the_args[1], {'vm-1': False})
+
+    @patch.object(vmware, 'IDLE')
+    @patch.object(vmware, '_suspend_vms')
+    @patch.object(vmware, '_net_usage', return_value={'vm-1': 500})
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_suspend_idle_busy_network(self, fake_vCenter, fake_retrieve_properties, fake_net_usage, fake_suspend_vms, fake_IDLE):
+        """``suspend_idle`` does not count a VM with an idle CPU, but a busy network, as idle"""
+        fake_retrieve_properties.return_value = self._reaper_inventory(created=1, cpu=10)
+        fake_IDLE.observe.return_value = {}
+
+        vmware.suspend_idle(MagicMock())
+        the_args, _ = fake_IDLE.observe.call_args
+
+        self.assertEqual(the_args[1], {'vm-1': False})
+
+    @patch.object(vmware, 'IDLE')
+    @patch.object(vmware, '_suspend_vms')
+    @patch.object(vmware, '_net_usage', return_value={})
+    @patch.object(vmware, '_retrieve_properties')
+    @patch.object(vmware, 'vCenter')
+    def test_suspend_idle_powered_off(self, fake_vCenter, fake_retrieve_properties, fake_net_usage, fake_suspend_vms, fake_IDLE):
+        """``suspend_idle`` ignores VMs that are not powered on"""
+        fake_retrieve_properties.return_value = self._reaper_inventory(created=1, cpu=0, state='suspended')
+        fake_IDLE.observe.return_value = {}
+
+        vmware.suspend_idle(MagicMock())
+        the_args, _ = fake_IDLE.observe.call_args
+
+        self.assertEqual(the_args[1], {})
+
+    def test_net_usage(self):
+        """``_net_usage`` returns the peak network usage of each VM, from one QueryPerf call"""
+        fake_vcenter = MagicMock()
+        counter = MagicMock()
+        counter.key = 143
+        counter.groupInfo.key = 'net'
+        counter.nameInfo.key = 'usage'
+        counter.rollupType = 'average'
+        fake_vcenter.content.perfManager.perfCounter = [MagicMock(), counter]
+        metric = MagicMock()
+        metric.entity = vmware.vim.VirtualMachine('vm-1')
+        metric.value = [MagicMock(value=[1, 5, 3])]
+        fake_vcenter.content.perfManager.QueryPerf.return_value = [metric]
+
+        output = vmware._net_usage(fake_vcenter, [vmware.vim.VirtualMachine('vm-1'), vmware.vim.VirtualMachine('vm-2')])
+        _, the_kwargs = fake_vcenter.content.perfManager.QueryPerf.call_args
+
+        self.assertEqual(output, {'vm-1': 5})
+        self.assertEqual(len(the_kwargs['querySpec']), 2)
+        self.assertEqual(fake_vcenter.content.perfManager.QueryPerf.call_count, 1)
+
+    def test_net_usage_no_vms(self):
+        """``_net_usage`` does not call vCenter when there are no VMs to obtain stats of"""
+        fake_vcenter = MagicMock()
+
+        output = vmware._net_usage(fake_vcenter, [])
+
+        self.assertEqual(output, {})
+        self.assertFalse(fake_vcenter.content.perfManager.QueryPerf.called)
+
+    def test_net_usage_no_counter(self):
+        """``_net_usage`` returns no stats when vCenter has no network usage counter"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.perfManager.perfCounter = []
+
+        output = vmware._net_usage(fake_vcenter, [vmware.vim.VirtualMachine('vm-1')])
+
+        self.assertEqual(output, {})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the warmup.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.worker import warmup
+
+
+class TestWarmUps(unittest.TestCase):
+    """A set of test cases for the WarmUps object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state = SharedState(os.path.join(self.tmp_dir, 'warmup.json'))
+        self.warm_ups = warmup.WarmUps(state=self.state, hostname='worker1')
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_report(self):
+        """``WarmUps.report`` is ready once every process has warmed up"""
+        self.warm_ups.record(os.getpid(), 2.5, [], 'ok')
+
+        output = self.warm_ups.report([os.getpid()])
+
+        self.assertTrue(output['ready'])
+
+    def test_report_seconds(self):
+        """``WarmUps.report`` returns the slowest warm up, as the time to warm"""
+        self.warm_ups.record(os.getpid(), 2.5, [], 'ok')
+        self.warm_ups.record(os.getppid(), 4.0, [], 'ok')
+
+        output = self.warm_ups.report([os.getpid(), os.getppid()])
+
+        self.assertEqual(output['seconds'], 4.0)
+
+    def test_report_warming(self):
+        """``WarmUps.report`` is not ready while a process is still warming up"""
+        self.warm_ups.record(os.getpid(), 2.5, [], 'ok')
+
+        output = self.warm_ups.report([os.getpid(), os.getppid()])
+
+        self.assertFalse(output['ready'])
+
+    def test_report_failed(self):
+        """``WarmUps.report`` is not ready when a process failed to warm up"""
+        self.warm_ups.record(os.getpid(), 2.5, ['Unable to preload vcenter1: doh'], 'failed')
+
+        output = self.warm_ups.report([os.getpid()])
+
+        self.assertFalse(output['ready'])
+        self.assertEqual(output['statuses'], {'failed': 1})
+
+    def test_report_timed_out(self):
+        """``WarmUps.report`` is not ready when a process timed out warming up"""
+        self.warm_ups.record(os.getpid(), 30, ['Still warming up after 30 seconds'], 'timed out')
+
+        output = self.warm_ups.report([os.getpid()])
+
+        self.assertFalse(output['ready'])
+        self.assertEqual(output['warm'], 0)
+
+    def test_report_no_processes(self):
+        """``WarmUps.report`` is not ready when the worker has no processes"""
+        output = self.warm_ups.report([])
+
+        self.assertFalse(output['ready'])
+
+    def test_report_errors(self):
+        """``WarmUps.report`` returns what the processes could not preload"""
+        self.warm_ups.record(os.getpid(), 2.5, ['Unable to preload vcenter1: doh'], 'ok')
+
+        output = self.warm_ups.report([os.getpid()])
+
+        self.assertEqual(output['errors'], ['Unable to preload vcenter1: doh'])
+
+    def test_other_hosts(self):
+        """``WarmUps.report`` ignores processes of other workers that share the state"""
+        other = warmup.WarmUps(state=self.state, hostname='worker2')
+        other.record(os.getpid(), 2.5, [], 'ok')
+
+        output = self.warm_ups.report([os.getpid()])
+
+        self.assertFalse(output['ready'])
+
+    def test_record_prunes(self):
+        """``WarmUps.record`` removes processes that no longer exist"""
+        with self.state.locked() as data:
+            data['worker1:999999999'] = {'seconds': 1, 'errors': [], 'finished': 0}
+        self.warm_ups.record(os.getpid(), 2.5, [], 'ok')
+
+        self.assertFalse('worker1:999999999' in self.state.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,31 @@
 # -*- coding: UTF-8 -*-
 from flask import Flask
-from celery import Celery
 
 from vlab_avamar_api.lib import const
-from vlab_avamar_api.lib.views import HealthView, AvamarView, AvamarNDMPView
+from vlab_avamar_api.lib.producer import PooledCelery
+from vlab_avamar_api.lib.readiness import readiness
+from vlab_avamar_api.lib.views import HealthView, ReadyView, MetricsView, AvamarView, AvamarNDMPView
 
 app = Flask(__name__)
-app.celery_app = Celery('avamar', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+app.celery_app = PooledCelery('avamar', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER,
+                              pool_size=const.VLAB_AVAMAR_BROKER_POOL,
+                              confirm=const.VLAB_AVAMAR_PUBLISH_CONFIRM)
 app.celery_app.conf.broker_heartbeat = 0 #https://github.com/celery/celery/issues/4895
+app.readiness = readiness(app.celery_app)
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    # Not running under uWSGI; the pool connects on first use
+    pass
+else:
+    # Each uWSGI worker gets its own connections, opened before it takes a request
+    postfork(app.celery_app.warm)
+    postfork(app.readiness.start)
 
 HealthView.register(app)
+ReadyView.register(app)
+MetricsView.register(app)
 AvamarView.register(app)
 AvamarNDMPView.register(app)
 
@@ -0,0 +1,181 @@
+# -*- coding: UTF-8 -*-
+"""
+Limits how many Avamar deploys run at once, both per user and for the whole
+service. Deploys beyond the limits wait in a queue that's served round-robin
+across users, so one user submitting dozens of deploys cannot starve everyone
+else.
+
+The API enqueues a deploy before sending the task, and the worker only starts
+the deploy once it's admitted. Both share the queue via a SharedState file.
+"""
+import os
+import time
+
+from vlab_avamar_api.lib import const
+from vlab_avamar_api.lib.state import SharedState
+
+
+class Admission(object):
+    """Per-user and global caps on in-flight deploys, with a fair queue.
+
+    :param state: Where the queue and in-flight deploys are stored
+    :type state: vlab_avamar_api.lib.state.SharedState
+
+    :param user_cap: How many deploys a single user can have running at once
+    :type user_cap: Integer
+
+    :param global_cap: How many deploys can be running at once, for all users
+    :type global_cap: Integer
+
+    :param lease: How many seconds before a running or queued deploy is presumed
+                  dead (i.e. the worker was killed), and removed.
+    :type lease: Integer
+    """
+    def __init__(self, state, user_cap, global_cap, lease):
+        self._state = state
+        self._user_cap = user_cap
+        self._global_cap = global_cap
+        self._lease = lease
+
+    def enqueue(self, username, task_id):
+        """Add a deploy to the queue.
+
+        :Returns: Integer - How many queued deploys are ahead of this one
+
+        :param username: The user creating the deploy
+        :type username: String
+
+        :param task_id: The ID of the Celery task that will perform the deploy
+        :type task_id: String
+        """
+        with self._state.locked() as data:
+            self._load(data, time.time())
+            self._add(data, username, task_id)
+            return self._position(data, task_id)
+
+    def admit(self, username, task_id):
+        """Try to start a deploy. A deploy is admitted when it's next in the
+        round-robin order, and neither cap has been reached.
+
+        :Returns: Boolean
+
+        :param username: The user creating the deploy
+        :type username: String
+
+        :param task_id: The ID of the Celery task performing the deploy
+        :type task_id: String
+        """
+        now = time.time()
+        with self._state.locked() as data:
+            self._load(data, now)
+            if task_id in data['running']:
+                # Celery redelivered a task that was already admitted
+                return True
+            # A task sent without going through the API (or whose entry expired)
+            self._add(data, username, task_id)
+            if self._next(data) != task_id:
+                return False
+            data['queued'].pop(task_id)
+            data['running'][task_id] = {'user': username, 'since': now}
+            # Round-robin; this user goes to the back of the line
+            data['order'].remove(username)
+            if any(x['user'] == username for x in data['queued'].values()):
+                data['order'].append(username)
+            return True
+
+    def position(self, task_id):
+        """Obtain where a deploy sits in the queue.
+
+        :Returns: Integer - How many queued deploys are ahead of it, or None if it's not queued
+
+        :param task_id: The ID of the Celery task that will perform the deploy
+        :type task_id: String
+        """
+        with self._state.locked() as data:
+            self._load(data, time.time())
+            if task_id not in data['queued']:
+                return None
+            return self._position(data, task_id)
+
+    def release(self, username, task_id):
+        """Record that a deploy has ended, or was never sent, freeing up its
+        slot or its place in the queue.
+
+        :Returns: None
+
+        :param username: The user that created the deploy
+        :type username: String
+
+        :param task_id: The ID of the Celery task that performed the deploy
+        :type task_id: String
+        """
+        with self._state.locked() as data:
+            self._load(data, time.time())
+            data['running'].pop(task_id, None)
+            data['queued'].pop(task_id, None)
+            if not any(x['user'] == username for x in data['queued'].values()):
+                data['order'] = [x for x in data['order'] if x != username]
+
+    def stats(self):
+        """Obtain how many deploys are running and queued, per user.
+
+        :Returns: Dictionary
+        """
+        data = self._state.read()
+        stats = {'running': {}, 'queued': {}}
+        for kind in stats.keys():
+            for deploy in data.get(kind, {}).values():
+                stats[kind][deploy['user']] = stats[kind].get(deploy['user'], 0) + 1
+        return stats
+
+    def _load(self, data, now):
+        """Fill in an empty state, and remove deploys that outlived the lease"""
+        data.setdefault('running', {})
+        data.setdefault('queued', {})
+        data.setdefault('order', [])
+        for kind in ('running', 'queued'):
+            expired = [x for x, y in data[kind].items() if now - y['since'] > self._lease]
+            for task_id in expired:
+                data[kind].pop(task_id)
+        waiting = {x['user'] for x in data['queued'].values()}
+        data['order'] = [x for x in data['order'] if x in waiting]
+
+    def _add(self, data, username, task_id):
+        if task_id in data['queued'] or task_id in data['running']:
+            return
+        data['queued'][task_id] = {'user': username, 'since': time.time()}
+        if username not in data['order']:
+            data['order'].append(username)
+
+    def _schedule(self, data):
+        """The order queued deploys will be admitted in, ignoring the per-user cap"""
+        per_user = {}
+        for task_id, deploy in sorted(data['queued'].items(), key=lambda x: x[1]['since']):
+            per_user.setdefault(deploy['user'], []).append(task_id)
+        schedule = []
+        for index in range(max([len(x) for x in per_user.values()] + [0])):
+            for user in data['order']:
+                if index < len(per_user.get(user, [])):
+                    schedule.append(per_user[user][index])
+        return schedule
+
+    def _next(self, data):
+        """The deploy that's allowed to start now, if any"""
+        if len(data['running']) >= self._global_cap:
+            return None
+        running = {}
+        for deploy in data['running'].values():
+            running[deploy['user']] = running.get(deploy['user'], 0) + 1
+        for task_id in self._schedule(data):
+            if running.get(data['queued'][task_id]['user'], 0) < self._user_cap:
+                return task_id
+        return None
+
+    def _position(self, data, task_id):
+        return self._schedule(data).index(task_id)
+
+
+ADMISSION = Admission(state=SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, 'vlab-avamar-admission.json')),
+                      user_cap=const.VLAB_AVAMAR_MAX_USER_DEPLOYS,
+                      global_cap=const.VLAB_AVAMAR_MAX_DEPLOYS,
+                      lease=const.VLAB_AVAMAR_DEPLOY_LEASE)
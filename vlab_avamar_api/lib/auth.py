@@ -0,0 +1,140 @@
+# -*- coding: UTF-8 -*-
+"""
+A drop-in for the ``requires`` decorator from vlab_api_common that remembers
+tokens it has already checked.
+
+Clients poll the task end points, so the same token is sent over and over.
+Decoding it means checking the signature, and when ``verify`` is True, an HTTP
+call to the auth server. The claims of a token that passed those checks are
+cached (keyed by a hash of the token, so the token itself is not kept) until
+the token expires.
+"""
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask_classy import request
+from vlab_api_common import http_auth
+
+from vlab_avamar_api.lib import const
+
+
+class TokenCache(object):
+    """A bounded LRU of the claims of tokens that were decoded and checked.
+
+    :param size: How many tokens to remember. Zero disables the cache.
+    :type size: Integer
+    """
+    def __init__(self, size):
+        self._size = size
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, serialized_token):
+        """Obtain the claims of a token, if it's cached and not expired.
+
+        :Returns: Tuple - (claims, verified), or (None, False) on a miss
+
+        :param serialized_token: The encoded token, from the X-Auth header
+        :type serialized_token: String
+        """
+        key = _key(serialized_token)
+        now = time.time()
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None or entry[0] <= now:
+                self._tokens.pop(key, None)
+                self.misses += 1
+                return None, False
+            self._tokens.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1]), entry[2]
+
+    def put(self, serialized_token, claims, verified):
+        """Remember the claims of a token, until the token expires.
+
+        :Returns: None
+
+        :param serialized_token: The encoded token, from the X-Auth header
+        :type serialized_token: String
+
+        :param claims: The decoded token
+        :type claims: Dictionary
+
+        :param verified: Set to True if the auth server said the token is valid
+        :type verified: Boolean
+        """
+        if not self._size:
+            return
+        key = _key(serialized_token)
+        with self._lock:
+            self._tokens[key] = (claims.get('exp', 0), dict(claims), verified)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self._size:
+                self._tokens.popitem(last=False)
+
+    def clear(self):
+        """Forget every token.
+
+        :Returns: None
+        """
+        with self._lock:
+            self._tokens.clear()
+
+
+def requires(username=None, memberOf=None, version=http_auth.const.AUTH_TOKEN_VERSION, verify=True):
+    """Just like ``vlab_api_common.requires``, but tokens that were already
+    decoded (and verified) are taken from ``TOKENS``.
+
+    :Returns: Function
+    """
+    def real_decorator(func):
+        @wraps(func)
+        def remember(*args, **kwargs):
+            # Whether the cached token was verified, or None if it was not cached
+            was_verified = kwargs.pop('cached', None)
+            verified = kwargs.get('verified', False)
+            serialized_token = request.headers.get('X-Auth')
+            if serialized_token and (was_verified is None or verified and not was_verified):
+                TOKENS.put(serialized_token, kwargs['token'], verified)
+            return func(*args, **kwargs)
+
+        checked = http_auth.requires(username=username, memberOf=memberOf, version=version, verify=verify)(remember)
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            serialized_token = request.headers.get('X-Auth')
+            if kwargs.get('token', None) is None and serialized_token:
+                claims, verified = TOKENS.get(serialized_token)
+                if claims is not None and _same_client(claims):
+                    kwargs['token'] = claims
+                    kwargs['cached'] = verified
+                    if verified:
+                        kwargs['verified'] = True
+            return checked(*args, **kwargs)
+        return inner
+    return real_decorator
+
+
+def _same_client(claims):
+    """The client IP check that ``get_token_from_header`` does for v2 tokens"""
+    if claims.get('version') != 2:
+        return True
+    try:
+        client_ip = request.headers.getlist("X-Forwarded-For")[-1]
+    except IndexError:
+        client_ip = request.remote_addr
+    return client_ip == claims['client_ip']
+
+
+def _key(serialized_token):
+    if isinstance(serialized_token, str):
+        serialized_token = serialized_token.encode()
+    return hashlib.sha256(serialized_token).digest()
+
+
+TOKENS = TokenCache(size=const.VLAB_AVAMAR_TOKEN_CACHE)
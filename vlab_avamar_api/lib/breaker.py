@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+"""
+Reads the circuit breaker the workers keep for each vCenter server. This lives
+outside the worker package so the API can check the breakers without importing
+the worker (and pyVmomi along with it).
+"""
+import time
+
+
+# The name of the SharedState file, within VLAB_AVAMAR_STATE_DIR, of every throttle
+STATE_FILE = 'vlab-avamar-throttle.json'
+
+
+class Overloaded(RuntimeError):
+    """vCenter is shedding load, i.e. its circuit breaker is open, or its rate
+    limit is too busy to take another call. Try again later."""
+
+
+def open_for(breaker, failures, reset, now):
+    """Find how many more seconds a circuit breaker stays open.
+
+    :Returns: Float - Zero if the breaker is closed
+
+    :param breaker: The breaker of one vCenter server, as stored in the SharedState
+    :type breaker: Dictionary
+
+    :param failures: How many consecutive failures open the breaker
+    :type failures: Integer
+
+    :param reset: How many seconds the breaker stays open before calls are tried again
+    :type reset: Integer
+
+    :param now: The current time, as a Unix timestamp
+    :type now: Float
+    """
+    if breaker.get('failures', 0) < failures or not breaker.get('opened'):
+        return 0
+    return max(0, breaker['opened'] + reset - now)
+
+
+def check(state, name, failures, reset):
+    """Fail fast if the circuit breaker of a vCenter server is open.
+
+    :Returns: None
+
+    :Raises: Overloaded
+
+    :param state: Where the workers store the breakers
+    :type state: vlab_avamar_api.lib.state.SharedState
+
+    :param name: The vCenter server
+    :type name: String
+
+    :param failures: How many consecutive failures open the breaker
+    :type failures: Integer
+
+    :param reset: How many seconds the breaker stays open before calls are tried again
+    :type reset: Integer
+    """
+    breaker = state.read().get(name, {}).get('breaker', {})
+    remaining = open_for(breaker, failures, reset, time.time())
+    if remaining:
+        raise Overloaded('vCenter {} is unhealthy; try again in {} seconds'.format(name, int(remaining) + 1))
@@ -24,6 +24,60 @@ DEFINED = OrderedDict([
             ('VLAB_URL', environ.get('VLAB_URL', 'https://localhost')),
             ('VLAB_AVAMAR_IMAGES_DIR', environ.get('VLAB_AVAMAR_IMAGES_DIR', '/images')),
             ('VLAB_VERIFY_TOKEN', environ.get('VLAB_VERIFY_TOKEN', False)),
+            ('VLAB_AVAMAR_MOREF_TTL', int(environ.get('VLAB_AVAMAR_MOREF_TTL', 600))),
+            ('VLAB_AVAMAR_DELETE_PARALLEL', int(environ.get('VLAB_AVAMAR_DELETE_PARALLEL', 4))),
+            ('VLAB_AVAMAR_TTL_HOURS', int(environ.get('VLAB_AVAMAR_TTL_HOURS', 0))),
+            ('VLAB_AVAMAR_IDLE_HOURS', int(environ.get('VLAB_AVAMAR_IDLE_HOURS', 0))),
+            ('VLAB_AVAMAR_IDLE_CPU_MHZ', int(environ.get('VLAB_AVAMAR_IDLE_CPU_MHZ', 100))),
+            ('VLAB_AVAMAR_REAPER_WARN_HOURS', int(environ.get('VLAB_AVAMAR_REAPER_WARN_HOURS', 24))),
+            ('VLAB_AVAMAR_REAPER_INTERVAL', int(environ.get('VLAB_AVAMAR_REAPER_INTERVAL', 3600))),
+            ('VLAB_AVAMAR_REAPER_DRY_RUN', environ.get('VLAB_AVAMAR_REAPER_DRY_RUN', 'true').lower() == 'true'),
+            ('VLAB_AVAMAR_ADMINS', [x for x in environ.get('VLAB_AVAMAR_ADMINS', '').split(',') if x]),
+            ('INF_VCENTER_DATASTORES', environ.get('INF_VCENTER_DATASTORES', environ.get('INF_VCENTER_DATASTORE', 'VM-Storage')).split(',')),
+            ('INF_VCENTER_HOSTS', [x for x in environ.get('INF_VCENTER_HOSTS', '').split(',') if x]),
+            ('VLAB_AVAMAR_PLACEMENT_REFRESH', int(environ.get('VLAB_AVAMAR_PLACEMENT_REFRESH', 60))),
+            ('INF_VCENTER_SERVERS', environ.get('INF_VCENTER_SERVERS', environ.get('INF_VCENTER_SERVER', 'localhost')).split(',')),
+            ('VLAB_AVAMAR_SHARD_WEIGHTS', dict(x.split('=') for x in environ.get('VLAB_AVAMAR_SHARD_WEIGHTS', '').split(',') if x)),
+            ('VLAB_AVAMAR_SHARD_OVERRIDES', dict(x.split('=') for x in environ.get('VLAB_AVAMAR_SHARD_OVERRIDES', '').split(',') if x)),
+            ('VLAB_AVAMAR_SESSION_POOL', int(environ.get('VLAB_AVAMAR_SESSION_POOL', 4))),
+            ('VLAB_AVAMAR_SESSION_IDLE', int(environ.get('VLAB_AVAMAR_SESSION_IDLE', 600))),
+            ('VLAB_AVAMAR_STATE_DIR', environ.get('VLAB_AVAMAR_STATE_DIR', '/tmp')),
+            ('VLAB_AVAMAR_CALL_RATE', float(environ.get('VLAB_AVAMAR_CALL_RATE', 20))),
+            ('VLAB_AVAMAR_CALL_BURST', int(environ.get('VLAB_AVAMAR_CALL_BURST', 80))),
+            ('VLAB_AVAMAR_HEAVY_RATE', float(environ.get('VLAB_AVAMAR_HEAVY_RATE', 0.2))),
+            ('VLAB_AVAMAR_HEAVY_BURST', int(environ.get('VLAB_AVAMAR_HEAVY_BURST', 4))),
+            ('VLAB_AVAMAR_THROTTLE_WAIT', int(environ.get('VLAB_AVAMAR_THROTTLE_WAIT', 120))),
+            ('VLAB_AVAMAR_BREAKER_FAILURES', int(environ.get('VLAB_AVAMAR_BREAKER_FAILURES', 5))),
+            ('VLAB_AVAMAR_BREAKER_RESET', int(environ.get('VLAB_AVAMAR_BREAKER_RESET', 30))),
+            ('VLAB_AVAMAR_MAX_USER_DEPLOYS', int(environ.get('VLAB_AVAMAR_MAX_USER_DEPLOYS', 2))),
+            ('VLAB_AVAMAR_MAX_DEPLOYS', int(environ.get('VLAB_AVAMAR_MAX_DEPLOYS', 10))),
+            ('VLAB_AVAMAR_ADMIT_RETRY', int(environ.get('VLAB_AVAMAR_ADMIT_RETRY', 15))),
+            ('VLAB_AVAMAR_DEPLOY_LEASE', int(environ.get('VLAB_AVAMAR_DEPLOY_LEASE', 7200))),
+            ('VLAB_AVAMAR_UPLOAD_PARALLEL', int(environ.get('VLAB_AVAMAR_UPLOAD_PARALLEL', 4))),
+            ('VLAB_AVAMAR_LEASE_PROGRESS', int(environ.get('VLAB_AVAMAR_LEASE_PROGRESS', 5))),
+            ('VLAB_AVAMAR_LEASE_TIMEOUT', int(environ.get('VLAB_AVAMAR_LEASE_TIMEOUT', 300))),
+            ('VLAB_AVAMAR_BROKER_POOL', int(environ.get('VLAB_AVAMAR_BROKER_POOL', 1))),
+            ('VLAB_AVAMAR_TOKEN_CACHE', int(environ.get('VLAB_AVAMAR_TOKEN_CACHE', 1024))),
+            ('VLAB_AVAMAR_ETAG_TTL', int(environ.get('VLAB_AVAMAR_ETAG_TTL', 60))),
+            ('VLAB_AVAMAR_READY_INTERVAL', int(environ.get('VLAB_AVAMAR_READY_INTERVAL', 15))),
+            ('VLAB_AVAMAR_IP_TIMEOUT', int(environ.get('VLAB_AVAMAR_IP_TIMEOUT', 600))),
+            ('VLAB_AVAMAR_WARM_TIMEOUT', int(environ.get('VLAB_AVAMAR_WARM_TIMEOUT', 30))),
+            ('VLAB_AVAMAR_PROFILE_SAMPLE', float(environ.get('VLAB_AVAMAR_PROFILE_SAMPLE', 0))),
+            ('VLAB_AVAMAR_PROFILE_INTERVAL', float(environ.get('VLAB_AVAMAR_PROFILE_INTERVAL', 10))),
+            ('VLAB_AVAMAR_PROFILE_DIR', environ.get('VLAB_AVAMAR_PROFILE_DIR', '/tmp/vlab-avamar-profiles')),
+            ('VLAB_AVAMAR_PROFILE_KEEP', int(environ.get('VLAB_AVAMAR_PROFILE_KEEP', 200))),
+            ('VLAB_AVAMAR_VERIFY_INTERVAL', int(environ.get('VLAB_AVAMAR_VERIFY_INTERVAL', 3600))),
+            ('VLAB_AVAMAR_VERIFY_PARALLEL', int(environ.get('VLAB_AVAMAR_VERIFY_PARALLEL', 2))),
+            ('VLAB_AVAMAR_LIBRARY', environ.get('VLAB_AVAMAR_LIBRARY', 'false').lower() == 'true'),
+            ('VLAB_AVAMAR_LIBRARY_FOLDER', environ.get('VLAB_AVAMAR_LIBRARY_FOLDER', 'vlab-avamar-library')),
+            ('VLAB_AVAMAR_LIBRARY_NETWORK', environ.get('VLAB_AVAMAR_LIBRARY_NETWORK', 'VM Network')),
+            ('VLAB_AVAMAR_LIBRARY_INTERVAL', int(environ.get('VLAB_AVAMAR_LIBRARY_INTERVAL', 3600))),
+            ('VLAB_AVAMAR_SUSPEND_IDLE_MINUTES', int(environ.get('VLAB_AVAMAR_SUSPEND_IDLE_MINUTES', 0))),
+            ('VLAB_AVAMAR_SUSPEND_INTERVAL', int(environ.get('VLAB_AVAMAR_SUSPEND_INTERVAL', 300))),
+            ('VLAB_AVAMAR_IDLE_NET_KBPS', int(environ.get('VLAB_AVAMAR_IDLE_NET_KBPS', 10))),
+            ('VLAB_AVAMAR_PUBLISH_CONFIRM', environ.get('VLAB_AVAMAR_PUBLISH_CONFIRM', 'false').lower() == 'true'),
+            # Costs a file the size of the VM's RAM, plus a delta disk that grows with every guest write
+            ('VLAB_AVAMAR_RESET_SNAPSHOT', environ.get('VLAB_AVAMAR_RESET_SNAPSHOT', 'false').lower() == 'true'),
           ])
 
 Constants = namedtuple('Constants', list(DEFINED.keys()))
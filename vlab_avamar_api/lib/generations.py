@@ -0,0 +1,122 @@
+# -*- coding: UTF-8 -*-
+"""
+Tracks whether a user's inventory, or the image catalog, might have changed
+since a client last fetched it, so the API can answer a conditional GET with an
+HTTP 304 instead of sending a task to the worker.
+
+The worker records a digest of what each ``show`` and ``image`` task returned,
+and every task that changes an inventory (create, delete, reset, reap) bumps
+its generation, which discards the digest. The digest is the ETag. Changes made
+outside of vLab (like a VM getting a new DHCP address) are not seen by either,
+so a digest is only trusted for ``ttl`` seconds after it was recorded.
+"""
+import os
+import time
+import hashlib
+
+import ujson
+
+from vlab_avamar_api.lib import const
+from vlab_avamar_api.lib.state import SharedState
+
+
+class Generations(object):
+    """Per-key generation counters and content digests.
+
+    :param state: Where the counters and digests are stored
+    :type state: vlab_avamar_api.lib.state.SharedState
+
+    :param ttl: How many seconds a recorded digest can be used as an ETag
+    :type ttl: Integer
+    """
+    def __init__(self, state, ttl):
+        self._state = state
+        self._ttl = ttl
+
+    def generation(self, key):
+        """Obtain how many times a key has been bumped.
+
+        :Returns: Integer
+
+        :param key: Identifies the inventory or catalog; see ``inventory_key`` and ``images_key``
+        :type key: String
+        """
+        return self._state.read().get(key, {}).get('generation', 0)
+
+    def bump(self, key):
+        """Record that the content of a key changed.
+
+        :Returns: None
+
+        :param key: Identifies the inventory or catalog; see ``inventory_key`` and ``images_key``
+        :type key: String
+        """
+        with self._state.locked() as data:
+            record = data.setdefault(key, {'generation': 0})
+            record['generation'] += 1
+            record['digest'] = None
+
+    def observe(self, key, content, generation):
+        """Record what a task found, unless the key was bumped while the task ran.
+
+        :Returns: None
+
+        :param key: Identifies the inventory or catalog; see ``inventory_key`` and ``images_key``
+        :type key: String
+
+        :param content: What the task returned to the client
+        :type content: Dictionary or List
+
+        :param generation: The generation of the key when the task started
+        :type generation: Integer
+        """
+        digest = hashlib.sha1(ujson.dumps(content, sort_keys=True).encode()).hexdigest()
+        with self._state.locked() as data:
+            record = data.setdefault(key, {'generation': 0})
+            if record['generation'] != generation:
+                return
+            record['digest'] = digest
+            record['checked'] = time.time()
+
+    def etag(self, key):
+        """Obtain the ETag of a key's content.
+
+        :Returns: Tuple - (ETag, fresh). The ETag is None when the content is unknown.
+
+        :param key: Identifies the inventory or catalog; see ``inventory_key`` and ``images_key``
+        :type key: String
+        """
+        record = self._state.read().get(key, {})
+        digest = record.get('digest')
+        if digest is None:
+            return None, False
+        return digest, time.time() - record.get('checked', 0) < self._ttl
+
+
+def inventory_key(kind, username):
+    """The key for the Avamar machines of one kind that a user owns.
+
+    :Returns: String
+
+    :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
+    :type kind: String
+
+    :param username: The user who owns the machines
+    :type username: String
+    """
+    return 'inventory:{}:{}'.format(kind, username)
+
+
+def images_key(kind):
+    """The key for the images of one kind of Avamar machine.
+
+    :Returns: String
+
+    :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
+    :type kind: String
+    """
+    return 'images:{}'.format(kind)
+
+
+GENERATIONS = Generations(state=SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, 'vlab-avamar-generations.json')),
+                          ttl=const.VLAB_AVAMAR_ETAG_TTL)
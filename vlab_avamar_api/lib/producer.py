@@ -0,0 +1,139 @@
+# -*- coding: UTF-8 -*-
+"""
+Keeps the API's connections to the message broker open and ready, so sending
+a task is a single publish instead of a TCP + AMQP handshake, opening a channel
+and declaring the reply queue.
+
+Celery already publishes through a pool of producers, but fills it lazily. And
+uWSGI forks its workers from the master, so a connection opened before the fork
+would be shared by every worker. The pool is reset and warmed in each worker
+after it forks (see ``app.py``), and every publish is timed.
+"""
+import time
+import bisect
+import threading
+
+from kombu import pools
+from celery import Celery
+from vlab_api_common import get_logger
+
+from vlab_avamar_api.lib import const
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_AVAMAR_LOG_LEVEL)
+# Upper bounds, in seconds, of the publish latency histogram
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float('inf'))
+
+
+class PublishMetrics(object):
+    """Thread-safe publish latency stats, per task name"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = {}
+
+    def record(self, name, seconds, failed=False):
+        """Add one publish to the stats.
+
+        :Returns: None
+
+        :param name: The name of the task that was sent
+        :type name: String
+
+        :param seconds: How long the publish took
+        :type seconds: Float
+
+        :param failed: Set to True if the publish raised an error
+        :type failed: Boolean
+        """
+        with self._lock:
+            stats = self._tasks.get(name)
+            if stats is None:
+                stats = self._tasks[name] = {'count': 0, 'errors': 0, 'seconds': 0.0, 'max': 0.0,
+                                             'buckets': [0] * len(BUCKETS)}
+            stats['count'] += 1
+            stats['errors'] += int(failed)
+            stats['seconds'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def snapshot(self):
+        """Obtain the stats collected so far.
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            snapshot = {}
+            for name, stats in self._tasks.items():
+                snapshot[name] = {'count': stats['count'],
+                                  'errors': stats['errors'],
+                                  'mean_ms': round(stats['seconds'] / stats['count'] * 1000, 3),
+                                  'max_ms': round(stats['max'] * 1000, 3),
+                                  # Cumulative, like a Prometheus histogram
+                                  'buckets_ms': {_label(x): sum(stats['buckets'][:i + 1]) for i, x in enumerate(BUCKETS)}}
+            return snapshot
+
+
+class PooledCelery(Celery):
+    """A Celery app that keeps warm connections to the broker, and times each publish.
+
+    :param pool_size: How many connections to the broker to keep open
+    :type pool_size: Integer
+
+    :param confirm: Set to True to have the broker confirm each publish, so
+                    ``send_task`` only returns once the task is stored.
+    :type confirm: Boolean
+    """
+    def __init__(self, *args, pool_size=1, confirm=False, **kwargs):
+        super(PooledCelery, self).__init__(*args, **kwargs)
+        self.conf.broker_pool_limit = pool_size
+        if confirm:
+            self.conf.broker_transport_options = {'confirm_publish': True}
+        self.publish_metrics = PublishMetrics()
+
+    def send_task(self, name, args=None, kwargs=None, **options):
+        """Send a task by name, recording how long the publish took"""
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super(PooledCelery, self).send_task(name, args, kwargs, **options)
+            failed = False
+            return result
+        finally:
+            self.publish_metrics.record(name, time.perf_counter() - started, failed=failed)
+
+    def warm(self):
+        """Discard any connections inherited from a parent process, and open
+        ``pool_size`` new ones, each with the reply queue already declared.
+
+        A broker that's down is logged rather than raised, so the process still
+        starts; the pool connects on first use instead.
+
+        :Returns: None
+        """
+        # Drop, rather than close, what was inherited; closing it would also
+        # close the parent process's connections
+        pools.connections.clear()
+        pools.producers.clear()
+        self._after_fork()
+        started = time.perf_counter()
+        producers = []
+        try:
+            for _ in range(self.conf.broker_pool_limit):
+                producer = self.producer_pool.acquire(block=True)
+                producers.append(producer)
+                producer.connection.ensure_connection(max_retries=1)
+                self.backend.on_task_call(producer, None)
+        except Exception as doh:
+            logger.error('Unable to warm broker connections: %s', doh)
+        else:
+            logger.info('Opened %s connection(s) to the broker in %.3f seconds',
+                        len(producers), time.perf_counter() - started)
+        finally:
+            for producer in producers:
+                producer.release()
+
+
+def _label(bound):
+    if bound == float('inf'):
+        return '+Inf'
+    return '{:g}'.format(bound * 1000)
@@ -0,0 +1,136 @@
+# -*- coding: UTF-8 -*-
+"""
+Checks whether the service can actually do work: the message broker accepts
+connections, at least one worker has warmed up, and no vCenter has its circuit
+breaker open. The checks run in a background thread, so the readiness probe
+only ever reads the latest results and never waits on the network.
+"""
+import os
+import time
+import threading
+
+from vlab_api_common import get_logger
+
+from vlab_avamar_api.lib import const, breaker
+from vlab_avamar_api.lib.state import SharedState
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_AVAMAR_LOG_LEVEL)
+CHECKS = ('broker', 'workers', 'vcenter')
+
+
+class Readiness(object):
+    """Periodically checks the dependencies of the API, and caches the results.
+
+    :param celery_app: The app used to send tasks to the workers
+    :type celery_app: celery.Celery
+
+    :param interval: How many seconds between checks
+    :type interval: Integer
+
+    :param throttle_state: Where the workers keep the circuit breaker of each vCenter
+    :type throttle_state: vlab_avamar_api.lib.state.SharedState
+    """
+    def __init__(self, celery_app, interval, throttle_state):
+        self._celery_app = celery_app
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._results = {}
+        self._thread = None
+        self._pid = None
+        self._throttle_state = throttle_state
+
+    def start(self):
+        """Start checking in the background, unless already started by this process.
+
+        :Returns: None
+        """
+        with self._lock:
+            # A thread started before a fork does not exist in the child
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='vlab-avamar-readiness', daemon=True)
+            self._thread.start()
+
+    def report(self):
+        """Obtain the latest results. Checks that have not run yet, or whose
+        result is too old (i.e. the background thread is stuck) are not ready.
+
+        :Returns: Dictionary
+        """
+        self.start()
+        now = time.time()
+        with self._lock:
+            results = {x: dict(y) for x, y in self._results.items()}
+        for name in CHECKS:
+            result = results.setdefault(name, {'ok': False, 'detail': 'Not checked yet'})
+            if result.get('checked') and now - result['checked'] > self._interval * 3:
+                result['ok'] = False
+                result['detail'] = 'Last checked {} seconds ago'.format(int(now - result['checked']))
+        return {'ready': all(x['ok'] for x in results.values()), 'checks': results}
+
+    def check(self):
+        """Run every check once, and save the results.
+
+        :Returns: None
+        """
+        for name in CHECKS:
+            started = time.time()
+            try:
+                detail = getattr(self, '_check_{}'.format(name))()
+                ok = True
+            except Exception as doh:
+                detail = '{}'.format(doh)
+                ok = False
+            result = {'ok': ok, 'detail': detail, 'checked': time.time(),
+                      'took_ms': round((time.time() - started) * 1000, 1)}
+            with self._lock:
+                self._results[name] = result
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as doh:
+                logger.exception('Readiness check failed: %s', doh)
+            time.sleep(self._interval)
+
+    def _check_broker(self):
+        with self._celery_app.connection_for_write() as conn:
+            conn.ensure_connection(max_retries=1, timeout=5)
+        return 'Connected'
+
+    def _check_workers(self):
+        replies = self._celery_app.control.broadcast('warm_up_status', reply=True, timeout=2)
+        if not replies:
+            raise RuntimeError('No workers answered')
+        statuses = [y for x in replies for y in x.values()]
+        warm = [x for x in statuses if isinstance(x, dict) and x.get('ready')]
+        if not warm:
+            # A warm up that failed or timed out leaves the worker cold
+            errors = sorted({y for x in statuses if isinstance(x, dict) for y in x.get('errors', [])})
+            error = '{} worker(s) answered, but none have warmed up'.format(len(statuses))
+            raise RuntimeError('; '.join([error] + errors))
+        return '{} of {} worker(s) warmed up in at most {} seconds'.format(len(warm), len(statuses),
+                                                                            max(x['seconds'] for x in warm))
+
+    def _check_vcenter(self):
+        for server in const.INF_VCENTER_SERVERS:
+            breaker.check(self._throttle_state, server,
+                          failures=const.VLAB_AVAMAR_BREAKER_FAILURES,
+                          reset=const.VLAB_AVAMAR_BREAKER_RESET)
+        return 'No circuit breakers are open'
+
+
+def readiness(celery_app):
+    """Create the readiness checker of the API.
+
+    :Returns: Readiness
+
+    :param celery_app: The app used to send tasks to the workers
+    :type celery_app: celery.Celery
+    """
+    return Readiness(celery_app=celery_app,
+                     interval=const.VLAB_AVAMAR_READY_INTERVAL,
+                     throttle_state=SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, breaker.STATE_FILE)))
@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+"""
+A small JSON document that every process on the host can safely read and update,
+so counters like rate limits are shared between uWSGI and Celery worker processes
+instead of each process having its own copy.
+"""
+import os
+import fcntl
+from contextlib import contextmanager
+
+import ujson
+
+
+class SharedState(object):
+    """A JSON file guarded by an exclusive ``flock``.
+
+    :param path: The file to store the state in. Created if it does not exist.
+    :type path: String
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def locked(self):
+        """Obtain the state for the duration of a ``with`` statement. Changes to
+        the yielded dictionary are saved when the ``with`` block exits without error.
+
+        :Returns: Dictionary
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            with os.fdopen(os.dup(fd), 'r+') as the_file:
+                raw = the_file.read()
+                try:
+                    data = ujson.loads(raw) if raw else {}
+                except ValueError:
+                    # A process died mid-write; start over instead of wedging everyone
+                    data = {}
+                yield data
+                the_file.seek(0)
+                the_file.truncate()
+                the_file.write(ujson.dumps(data))
+        finally:
+            # Closing the last descriptor releases the lock
+            os.close(fd)
+
+    def read(self):
+        """Obtain a snapshot of the state, without holding the lock.
+
+        :Returns: Dictionary
+        """
+        try:
+            with open(self.path) as the_file:
+                return ujson.loads(the_file.read() or '{}')
+        except (OSError, ValueError):
+            return {}
@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+"""
+A drop-in for the ``validate_input`` decorator from vlab_api_common.
+
+The upstream decorator calls ``jsonschema.validate`` on every request, which
+checks the schema itself, and builds a new validator for it, each time. This
+one does that once, when the view is defined, and fills in the ``default`` of
+any property the body leaves out, so the views don't need their own copy of
+the defaults.
+"""
+from copy import deepcopy
+from functools import wraps
+
+import ujson
+from flask_classy import request
+from jsonschema import Draft4Validator, ValidationError, draft4_format_checker, validators
+from vlab_api_common import get_logger
+
+from vlab_avamar_api.lib import const
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_AVAMAR_LOG_LEVEL)
+
+
+def _set_defaults(validator, properties, instance, schema):
+    if validator.is_type(instance, 'object'):
+        for name, subschema in properties.items():
+            if 'default' in subschema and name not in instance:
+                instance[name] = deepcopy(subschema['default'])
+    for error in Draft4Validator.VALIDATORS['properties'](validator, properties, instance, schema):
+        yield error
+
+
+DefaultingValidator = validators.extend(Draft4Validator, {'properties': _set_defaults})
+
+
+def compile_schema(schema):
+    """Build a validator that also fills in defaults, once, for a JSON schema.
+
+    :Returns: DefaultingValidator
+
+    :Raises: jsonschema.SchemaError
+
+    :param schema: The JSON schema to validate against
+    :type schema: Dictionary
+    """
+    Draft4Validator.check_schema(schema)
+    return DefaultingValidator(schema, format_checker=draft4_format_checker)
+
+
+def validate_input(schema):
+    """Just like ``vlab_api_common.validate_input``, but the schema is compiled
+    once, and the body passed via the keyword ``body`` has its defaults filled in.
+
+    :Returns: Function
+
+    :param schema: The JSON schema the content-body must conform to
+    :type schema: Dictionary
+    """
+    validator = compile_schema(schema)
+    def real_decorator(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            resp = {'user' : kwargs['token']['username']}
+            body = request.get_json()
+            if body is None:
+                resp['error'] = 'No JSON content body sent in HTTP request'
+                return ujson.dumps(resp), 400
+            try:
+                validator.validate(body)
+            except ValidationError as doh:
+                logger.error(doh)
+                resp['error'] = 'Input does not match schema.\nInput: {}\nSchema: {}'.format(body, schema)
+                return ujson.dumps(resp), 400
+            kwargs['body'] = body
+            return func(*args, **kwargs)
+        return inner
+    return real_decorator
@@ -1,3 +1,4 @@
 # -*- coding: UTF-8 -*-
-from .healthcheck import HealthView
+from .healthcheck import HealthView, ReadyView
+from .metrics import MetricsView
 from .avamar import AvamarView, AvamarNDMPView
@@ -2,14 +2,20 @@
 """
 Defines the RESTful API for managing instances of Avamar
 """
+import uuid
+
 import ujson
 from flask import current_app
 from flask_classy import request, route, Response
 from vlab_inf_common.views import MachineView
-from vlab_api_common import describe, get_logger, requires, validate_input
+from vlab_api_common import describe, get_logger
 
 
 from vlab_avamar_api.lib import const
+from vlab_avamar_api.lib.auth import requires
+from vlab_avamar_api.lib.validation import validate_input
+from vlab_avamar_api.lib.admission import ADMISSION
+from vlab_avamar_api.lib.generations import GENERATIONS, inventory_key, images_key
 
 
 logger = get_logger(__name__, loglevel=const.VLAB_AVAMAR_LOG_LEVEL)
@@ -75,9 +81,50 @@ class AvamarView(MachineView):
                      "type": "object",
                      "properties": {
                         "name": {
-                            "description": "The name of the Avamar instance to destroy",
+                            "description": "The name of the Avamar instance(s) to destroy",
+                            "oneOf": [
+                                {"type": "string"},
+                                {"type": "array", "items": {"type": "string"}, "minItems": 1}
+                            ]
+                        },
+                        "background": {
+                            "description": "Respond once the instance(s) are found, and finish destroying them in the background",
+                            "type": "boolean",
+                            "default": False
+                        }
+                     },
+                     "required": ["name"]
+                    }
+    RESET_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                    "description": "Revert an Avamar instance to how it was right after being created",
+                    "type": "object",
+                    "properties": {
+                        "name": {
+                            "description": "The name of the Avamar instance to reset",
                             "type": "string"
                         }
+                    },
+                    "required": ["name"]
+                   }
+    SUSPEND_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                      "description": "Suspend an Avamar instance, so it stops using host memory until resumed",
+                      "type": "object",
+                      "properties": {
+                          "name": {
+                              "description": "The name of the Avamar instance to suspend",
+                              "type": "string"
+                          }
+                      },
+                      "required": ["name"]
+                     }
+    RESUME_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                     "description": "Resume a suspended Avamar instance",
+                     "type": "object",
+                     "properties": {
+                         "name": {
+                             "description": "The name of the Avamar instance to resume",
+                             "type": "string"
+                         }
                      },
                      "required": ["name"]
                     }
@@ -87,20 +134,41 @@ class AvamarView(MachineView):
     IMAGES_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
                      "description": "View available versions of Avamar that can be created"
                     }
+    REAPER_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                     "description": "Admin only - View the instances the reaper would destroy, or warn the owners about"
+                    }
+    FLEET_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                    "description": "Admin only - View every Avamar instance owned by every user"
+                   }
 
 
+    @route('/task', methods=["GET"])
+    @route('/task/<tid>', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    def handle_task(self, *args, **kwargs):
+        """End point for checking the status of Celery tasks. Clients poll it,
+        so this checks the token via the cache before the inherited ``requires``."""
+        return super(AvamarView, self).handle_task(*args, **kwargs)
+
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
     @describe(post=POST_SCHEMA, delete=DELETE_SCHEMA, get=GET_SCHEMA)
     def get(self, *args, **kwargs):
         """Display the Avamar instances you own"""
         username = kwargs['token']['username']
+        etag, fresh = GENERATIONS.etag(inventory_key(self.RESOURCE, username))
+        if fresh and request.if_none_match.contains(etag):
+            return _not_modified(etag)
         resp_data = {'user' : username}
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
-        task = current_app.celery_app.send_task('avamar.show_{}'.format(self.TASK_SUFFIX), [username, txn_id])
+        task = current_app.celery_app.send_task('avamar.show_{}'.format(self.TASK_SUFFIX), [username, txn_id],
+                                                headers=_task_headers())
         resp_data['content'] = {'task-id': task.id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
         resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        if etag:
+            # If the task finds something different, the next request won't match
+            resp.set_etag(etag)
         return resp
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
@@ -113,15 +181,25 @@ class AvamarView(MachineView):
         body = kwargs['body']
         machine_name = body['name']
         image = body['image']
-        # Set the defaults for the ip-config defined by the POST_SCHEMA
-        ip_config = {'default-gateway': '192.168.1.1',
-                     'netmask': '255.255.255.0',
-                     'dns': ['192.168.1.1.'],
-                     'domain': "vlab.local"}
-        ip_config.update(body['ip-config'])
+        # validate_input fills in the defaults defined by the POST_SCHEMA
+        ip_config = body['ip-config']
         network = '{}_{}'.format(username, body['network'])
-        task = current_app.celery_app.send_task('avamar.create_{}'.format(self.TASK_SUFFIX), [username, machine_name, image, network, ip_config, txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        # Queue the deploy before sending it, so the worker cannot see the task first
+        task_id = str(uuid.uuid4())
+        position = ADMISSION.enqueue(username, task_id)
+        try:
+            task = current_app.celery_app.send_task('avamar.create_{}'.format(self.TASK_SUFFIX),
+                                                    [username, machine_name, image, network, ip_config, txn_id],
+                                                    task_id=task_id, headers=_task_headers())
+        except Exception as doh:
+            # Otherwise the deploy that never got sent holds its place in line until the lease expires
+            ADMISSION.release(username, task_id)
+            logger.error('Unable to send deploy task %s: %s', task_id, doh)
+            resp_data['error'] = 'Unable to queue the deploy, please try again later'
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 503
+            return resp
+        resp_data['content'] = {'task-id': task.id, 'queue-position': position}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
         resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
@@ -135,7 +213,73 @@ class AvamarView(MachineView):
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
         machine_name = kwargs['body']['name']
-        task = current_app.celery_app.send_task('avamar.delete_{}'.format(self.TASK_SUFFIX), [username, machine_name, txn_id])
+        background = kwargs['body']['background']
+        task = current_app.celery_app.send_task('avamar.delete_{}'.format(self.TASK_SUFFIX), [username, machine_name, txn_id, background],
+                                                headers=_task_headers())
+        resp_data['content'] = {'task-id': task.id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        return resp
+
+    @route('/reset', methods=["POST"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=RESET_SCHEMA)
+    @describe(post=RESET_SCHEMA)
+    def reset(self, *args, **kwargs):
+        """Revert an Avamar machine to how it was right after being created.
+
+        Only works when VLAB_AVAMAR_RESET_SNAPSHOT is enabled, because that's
+        what makes ``create`` take the snapshot a reset reverts to.
+        """
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        if not const.VLAB_AVAMAR_RESET_SNAPSHOT:
+            # Without the snapshot from create, the task would only fail
+            resp_data['error'] = 'Reset is disabled on this server; delete and create the machine again instead'
+            resp = Response(ujson.dumps(resp_data))
+            resp.status_code = 400
+            return resp
+        machine_name = kwargs['body']['name']
+        task = current_app.celery_app.send_task('avamar.reset_{}'.format(self.TASK_SUFFIX), [username, machine_name, txn_id],
+                                                headers=_task_headers())
+        resp_data['content'] = {'task-id': task.id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        return resp
+
+    @route('/suspend', methods=["POST"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=SUSPEND_SCHEMA)
+    @describe(post=SUSPEND_SCHEMA)
+    def suspend(self, *args, **kwargs):
+        """Suspend an Avamar machine, so it stops using host memory until resumed"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        machine_name = kwargs['body']['name']
+        task = current_app.celery_app.send_task('avamar.suspend_{}'.format(self.TASK_SUFFIX), [username, machine_name, txn_id],
+                                                headers=_task_headers())
+        resp_data['content'] = {'task-id': task.id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        return resp
+
+    @route('/resume', methods=["POST"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=RESUME_SCHEMA)
+    @describe(post=RESUME_SCHEMA)
+    def resume(self, *args, **kwargs):
+        """Resume a suspended Avamar machine"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        machine_name = kwargs['body']['name']
+        task = current_app.celery_app.send_task('avamar.resume_{}'.format(self.TASK_SUFFIX), [username, machine_name, txn_id],
+                                                headers=_task_headers())
         resp_data['content'] = {'task-id': task.id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
@@ -148,9 +292,48 @@ class AvamarView(MachineView):
     def image(self, *args, **kwargs):
         """Show available versions of Avamar that can be deployed"""
         username = kwargs['token']['username']
+        etag, fresh = GENERATIONS.etag(images_key(self.RESOURCE))
+        if fresh and request.if_none_match.contains(etag):
+            return _not_modified(etag)
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
-        task = current_app.celery_app.send_task('avamar.image_{}'.format(self.TASK_SUFFIX), [txn_id])
+        task = current_app.celery_app.send_task('avamar.image_{}'.format(self.TASK_SUFFIX), [txn_id],
+                                                headers=_task_headers())
+        resp_data['content'] = {'task-id': task.id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        if etag:
+            resp.set_etag(etag)
+        return resp
+
+    @route('/fleet', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @requires(username=const.VLAB_AVAMAR_ADMINS, version=None, verify=False)
+    @describe(get=FLEET_SCHEMA)
+    def fleet(self, *args, **kwargs):
+        """Admin only - Show every Avamar instance, grouped by owner"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        task = current_app.celery_app.send_task('avamar.fleet_{}'.format(self.TASK_SUFFIX), [txn_id],
+                                                headers=_task_headers())
+        resp_data['content'] = {'task-id': task.id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        return resp
+
+    @route('/reaper', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @requires(username=const.VLAB_AVAMAR_ADMINS, version=None, verify=False)
+    @describe(get=REAPER_SCHEMA)
+    def reaper(self, *args, **kwargs):
+        """Admin only - A dry-run report of what the reaper would destroy"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        task = current_app.celery_app.send_task('avamar.reap_expired', [True, txn_id], headers=_task_headers())
         resp_data['content'] = {'task-id': task.id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
@@ -162,3 +345,17 @@ class AvamarNDMPView(AvamarView):
     route_base = '/api/2/inf/avamar/ndmp-accelerator'
     RESOURCE = 'AvamarNDMP'
     TASK_SUFFIX = 'ndmp'
+
+
+def _task_headers():
+    """Ask the worker to profile the task, when the client sent an ``X-Profile`` header"""
+    if request.headers.get('X-Profile', '').lower() in ('1', 'true', 'yes'):
+        return {'vlab_profile': True}
+    return {}
+
+
+def _not_modified(etag):
+    """Tell the client that what it fetched last time is still current, without sending a task"""
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    return resp
@@ -2,12 +2,35 @@
 """
 Enables Health checks for the power API
 """
-import pkg_resources
+try:
+    from importlib import metadata
+except ImportError:
+    # Python < 3.8
+    metadata = None
+    import pkg_resources
 
 import ujson
+from flask import current_app
 from flask_classy import FlaskView, Response
 
 
+def _resolve_version():
+    """Find the installed version of this package, or 'unknown' if it's not installed"""
+    if metadata is None:
+        try:
+            return pkg_resources.get_distribution('vlab-avamar-api').version
+        except pkg_resources.DistributionNotFound:
+            return 'unknown'
+    try:
+        return metadata.version('vlab-avamar-api')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+# Resolved once; the load balancer hits the healthcheck constantly
+VERSION = _resolve_version()
+
+
 class HealthView(FlaskView):
     """
     Simple end point to test if the service is alive
@@ -19,8 +42,26 @@ class HealthView(FlaskView):
         """End point for health checks"""
         resp = {}
         status = 200
-        resp['version'] = pkg_resources.get_distribution('vlab-avamar-api').version
+        resp['version'] = VERSION
         response = Response(ujson.dumps(resp))
         response.status_code = status
         response.headers['Content-Type'] = 'application/json'
         return response
+
+
+class ReadyView(FlaskView):
+    """
+    End point to test if the service can do work, i.e. the broker, workers and
+    vCenter are all OK. The checks run in the background; this only reports them.
+    """
+    route_base = '/api/1/inf/avamar/ready'
+    trailing_slash = False
+
+    def get(self):
+        """End point for readiness checks"""
+        resp = current_app.readiness.report()
+        resp['version'] = VERSION
+        response = Response(ujson.dumps(resp))
+        response.status_code = 200 if resp['ready'] else 503
+        response.headers['Content-Type'] = 'application/json'
+        return response
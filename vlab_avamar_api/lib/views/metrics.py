@@ -0,0 +1,27 @@
+# -*- coding: UTF-8 -*-
+"""
+Exposes how long it takes the API to publish tasks to the message broker
+"""
+import os
+
+import ujson
+from flask import current_app
+from flask_classy import FlaskView, Response
+
+
+class MetricsView(FlaskView):
+    """
+    End point for the publish latency of the API process that answers the request.
+    Under uWSGI, each worker process keeps its own stats.
+    """
+    route_base = '/api/1/inf/avamar/metrics'
+    trailing_slash = False
+
+    def get(self):
+        """End point for metrics"""
+        resp = {'pid': os.getpid(),
+                'publish': current_app.celery_app.publish_metrics.snapshot()}
+        response = Response(ujson.dumps(resp))
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        return response
@@ -0,0 +1,151 @@
+# -*- coding: UTF-8 -*-
+"""
+A worker-level cache of vCenter Managed Object References (MoRefs).
+
+Looking up a folder or network by name via ``vlab_inf_common`` walks the vCenter
+inventory. The MoRef ID of those objects rarely changes, so caching it turns the
+lookup into a dictionary hit. MoRef IDs are only unique within one vCenter, so
+entries are also keyed by the vCenter server.
+"""
+import time
+import threading
+
+from pyVmomi import vmodl
+
+
+class MoRefCache(object):
+    """Maps the category and name of a vCenter object to its MoRef ID.
+
+    Only the type and MoRef ID are stored. Cache hits are bound to the session
+    of the supplied vCenter connection, so an entry outlives the session that
+    originally looked it up.
+
+    :param ttl: How many seconds an entry remains valid.
+    :type ttl: Integer
+    """
+    def __init__(self, ttl):
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, vcenter, vimtype, name, loader):
+        """Obtain an object from vCenter, only calling ``loader`` on a cache miss.
+
+        :Returns: pyVmomi.VmomiSupport.ManagedObject
+
+        :param vcenter: An established connection to vCenter
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param vimtype: The category of object, like vim.Folder
+        :type vimtype: pyVmomi.VmomiSupport.LazyType
+
+        :param name: The name of the object
+        :type name: String
+
+        :param loader: Called with no arguments to find the object on a cache miss.
+        :type loader: Function
+        """
+        with self._lock:
+            entry = self._entries.get((_server(vcenter), vimtype, name))
+            if entry and entry[2] > time.time():
+                self._hits += 1
+                the_type, moid, _ = entry
+                return the_type(moid, _stub(vcenter))
+            self._misses += 1
+        found = loader()
+        self.put(vcenter, vimtype, name, found)
+        return found
+
+    def put(self, vcenter, vimtype, name, obj):
+        """Add/replace an object in the cache.
+
+        :Returns: None
+
+        :param vcenter: The connection to the vCenter that the object belongs to
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param vimtype: The category of object, like vim.Folder
+        :type vimtype: pyVmomi.VmomiSupport.LazyType
+
+        :param name: The name of the object
+        :type name: String
+
+        :param obj: The object to cache
+        :type obj: pyVmomi.VmomiSupport.ManagedObject
+        """
+        # A vim.Network can really be a DistributedVirtualPortgroup, so keep the
+        # concrete type for rebinding the MoRef later.
+        with self._lock:
+            self._entries[(_server(vcenter), vimtype, name)] = (type(obj), obj._moId, time.time() + self._ttl)
+
+    def invalidate(self, vimtype=None, name=None):
+        """Remove entries from the cache, for every vCenter server. Supplying no
+        params clears the whole cache.
+
+        :Returns: None
+
+        :param vimtype: Only remove entries of this category
+        :type vimtype: pyVmomi.VmomiSupport.LazyType
+
+        :param name: Only remove the entry with this name
+        :type name: String
+        """
+        with self._lock:
+            doomed = [x for x in self._entries if (vimtype is None or x[1] == vimtype) and (name is None or x[2] == name)]
+            for key in doomed:
+                del self._entries[key]
+            self._invalidations += len(doomed)
+
+    def call(self, vcenter, vimtype, name, loader, func):
+        """Run ``func`` against a cached object. If vCenter says the object no
+        longer exists, the entry is invalidated and ``func`` is tried once more
+        with a freshly looked up object.
+
+        :Returns: Whatever ``func`` returns
+
+        :param vcenter: An established connection to vCenter
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param vimtype: The category of object, like vim.Folder
+        :type vimtype: pyVmomi.VmomiSupport.LazyType
+
+        :param name: The name of the object
+        :type name: String
+
+        :param loader: Called with no arguments to find the object on a cache miss.
+        :type loader: Function
+
+        :param func: Called with the cached object as the only argument.
+        :type func: Function
+        """
+        try:
+            return func(self.get(vcenter, vimtype, name, loader))
+        except vmodl.fault.ManagedObjectNotFound:
+            self.invalidate(vimtype, name)
+            return func(self.get(vcenter, vimtype, name, loader))
+
+    def stats(self):
+        """Obtain the hit-rate counters of the cache.
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {'hits': self._hits,
+                    'misses': self._misses,
+                    'invalidations': self._invalidations,
+                    'hit_rate': round(self._hits / lookups, 3) if lookups else 0.0,
+                    'size': len(self._entries)}
+
+
+def _stub(vcenter):
+    """The SOAP stub of the supplied vCenter session"""
+    return vcenter._conn._stub
+
+
+def _server(vcenter):
+    """The host:port of the vCenter server the session is connected to"""
+    return _stub(vcenter).host
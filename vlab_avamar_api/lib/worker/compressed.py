@@ -0,0 +1,212 @@
+# -*- coding: UTF-8 -*-
+"""
+Reads OVAs that are compressed with zstd (``.ova.zst``) or gzip (``.ova.gz``),
+without ever writing an uncompressed copy to disk.
+
+A compressed OVA can only be read from start to end, so its disks are uploaded
+one at a time, in the order they appear in the tarball. To keep the upload
+busy, a background thread reads and decompresses the image while the upload
+sends whatever was already decompressed. Both zstd and zlib release the GIL
+while decompressing, so the two really do overlap.
+
+The ``zstandard`` package is optional; without it, ``.ova.zst`` images are
+not listed, and cannot be deployed.
+"""
+import gzip
+import queue
+import tarfile
+import threading
+
+from vlab_inf_common.vmware import Ova
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# The compressions supported, in the order they're preferred when an image
+# exists in more than one of them.
+SUFFIXES = ('.zst', '.gz')
+READ_SIZE = 8 * 1024 * 1024
+# How many chunks can be decompressed ahead of the upload
+PIPELINE_DEPTH = 4
+
+
+class CompressedOva(object):
+    """The OVF descriptor of a compressed OVA. Stands in for ``vlab_inf_common.vmware.Ova``,
+    which can only read uncompressed OVAs. Only the start of the image is
+    decompressed, because the descriptor is the first file in an OVA.
+
+    :Raises: RuntimeError
+
+    :param ova_path: The local file path of the compressed OVA
+    :type ova_path: String
+    """
+    def __init__(self, ova_path):
+        self._ovf = None
+        with DecompressedStream(ova_path, [0]) as stream:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                for member in tar:
+                    if member.name.endswith('.ovf'):
+                        self._ovf = tar.extractfile(member).read().decode()
+                        break
+        if self._ovf is None:
+            raise RuntimeError('No OVF descriptor found in {}'.format(ova_path))
+
+    @property
+    def ovf(self):
+        """Return the XML that describes the OVA"""
+        return self._ovf
+
+    # Parsed out of the descriptor the same way, whether compressed or not
+    networks = Ova.networks
+
+    def close(self):
+        """For API parity with ``Ova``; the image is already closed."""
+        pass
+
+
+class DecompressedStream(object):
+    """A file-like object of the decompressed content of an image. The image is
+    read and decompressed by a background thread, up to ``depth`` chunks ahead
+    of the caller. An uncompressed image is just read ahead.
+
+    :param path: The local file path of the image
+    :type path: String
+
+    :param read: Counts how many bytes of the image have been read, at index 0
+    :type read: List
+
+    :param depth: How many chunks to decompress ahead of the caller
+    :type depth: Integer
+
+    :param digest: Optionally, updated with the bytes of the image as they're read
+    :type digest: hashlib.sha256
+    """
+    def __init__(self, path, read, depth=PIPELINE_DEPTH, digest=None):
+        # Opened here, so a missing image fails the caller right away
+        self._file = open(path, 'rb')
+        try:
+            self._reader = _decompressor(path, _Counted(self._file, read, digest))
+        except Exception:
+            self._file.close()
+            raise
+        self._chunks = queue.Queue(maxsize=depth)
+        self._closed = threading.Event()
+        self._buffer = memoryview(b'')
+        self._done = False
+        self._thread = threading.Thread(target=self._run, name='decompress', daemon=True)
+        self._thread.start()
+
+    def read(self, amount=-1):
+        """Obtain up to ``amount`` decompressed bytes; all of them when negative.
+
+        :Returns: Bytes - Empty once the image is exhausted
+
+        :param amount: How many bytes to read
+        :type amount: Integer
+        """
+        parts = []
+        wanted = amount if amount >= 0 else float('inf')
+        while wanted > 0:
+            if not self._buffer:
+                if self._done:
+                    break
+                chunk = self._chunks.get()
+                if isinstance(chunk, Exception):
+                    self._done = True
+                    raise chunk
+                if not chunk:
+                    self._done = True
+                    break
+                self._buffer = memoryview(chunk)
+            part = self._buffer[:wanted]
+            self._buffer = self._buffer[len(part):]
+            parts.append(part)
+            wanted -= len(part)
+        return b''.join(parts)
+
+    def close(self):
+        """Stop decompressing, and close the image.
+
+        :Returns: None
+        """
+        self._closed.set()
+        # Unblock the thread, if it's waiting for room in the queue
+        while True:
+            try:
+                self._chunks.get_nowait()
+            except queue.Empty:
+                break
+        self._thread.join()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, the_traceback):
+        self.close()
+
+    def _run(self):
+        try:
+            while not self._closed.is_set():
+                chunk = self._reader.read(READ_SIZE)
+                self._chunks.put(chunk)
+                if not chunk:
+                    return
+        except Exception as doh:
+            self._chunks.put(doh)
+
+
+class _Counted(object):
+    """Counts the bytes read from a file, so progress can be reported"""
+    def __init__(self, the_file, read, digest=None):
+        self._file = the_file
+        self._read = read
+        self._digest = digest
+
+    def read(self, amount=-1):
+        data = self._file.read(amount)
+        self._read[0] += len(data)
+        if self._digest is not None:
+            self._digest.update(data)
+        return data
+
+
+def compression(path):
+    """Obtain the compression of an image, based on its name.
+
+    :Returns: String or None - One of ``SUFFIXES``, or None if not compressed
+
+    :param path: The name, or path, of the image
+    :type path: String
+    """
+    for suffix in SUFFIXES:
+        if path.endswith('.ova' + suffix):
+            return suffix
+    return None
+
+
+def readable(path):
+    """Whether this worker can read an image. Zstd images need the optional
+    ``zstandard`` package.
+
+    :Returns: Boolean
+
+    :param path: The name, or path, of the image
+    :type path: String
+    """
+    return compression(path) != '.zst' or zstandard is not None
+
+
+def _decompressor(path, source):
+    """Wrap a file object of an image, so reads return decompressed data"""
+    suffix = compression(path)
+    if suffix == '.gz':
+        return gzip.GzipFile(fileobj=source, mode='rb')
+    if suffix == '.zst':
+        if zstandard is None:
+            raise RuntimeError('Unable to read {}; the zstandard package is not installed'.format(path))
+        return zstandard.ZstdDecompressor().stream_reader(source, read_size=READ_SIZE, read_across_frames=True)
+    return source
@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+"""
+Tracks how long each Avamar server and NDMP accelerator has looked idle, across
+runs of the idle policies (see ``vmware.suspend_idle`` and ``vmware.reap_expired``).
+
+One sample of the CPU and network usage of a VM says little; a backup that's
+waiting on a client looks idle for a few minutes at a time. So a VM is only
+suspended once every sample taken over ``VLAB_AVAMAR_SUSPEND_IDLE_MINUTES`` says
+it's idle. Any busy sample restarts the clock.
+"""
+import os
+
+from vlab_avamar_api.lib import const
+from vlab_avamar_api.lib.state import SharedState
+
+
+class IdleTracker(object):
+    """When each VM was first seen idle, without being busy since.
+
+    :param state: Where the tracking is stored
+    :type state: vlab_avamar_api.lib.state.SharedState
+    """
+    def __init__(self, state):
+        self._state = state
+
+    def observe(self, server, samples, now):
+        """Record which VMs on a vCenter are idle right now. VMs that are busy,
+        or are no longer sampled (e.g. deleted or powered off), are forgotten.
+
+        :Returns: Dictionary - How many seconds each idle VM has been idle, by MoRef ID
+
+        :param server: The vCenter the VMs are on
+        :type server: String
+
+        :param samples: Whether each VM is idle right now, by MoRef ID
+        :type samples: Dictionary
+
+        :param now: The current EPOC timestamp
+        :type now: Float
+        """
+        with self._state.locked() as data:
+            since = {x: y for x, y in data.get(server, {}).items() if samples.get(x)}
+            for moid, idle in samples.items():
+                if idle:
+                    since.setdefault(moid, now)
+            data[server] = since
+            return {x: now - y for x, y in since.items()}
+
+    def forget(self, server, moids):
+        """Restart the clock of VMs, i.e. once they're suspended.
+
+        :Returns: None
+
+        :param server: The vCenter the VMs are on
+        :type server: String
+
+        :param moids: The MoRef IDs of the VMs
+        :type moids: List
+        """
+        with self._state.locked() as data:
+            since = data.get(server, {})
+            for moid in moids:
+                since.pop(moid, None)
+
+
+IDLE = IdleTracker(state=SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, 'vlab-avamar-idle.json')))
+# Kept apart from IDLE, which restarts the clock of the VMs it suspends
+REAPER_IDLE = IdleTracker(state=SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, 'vlab-avamar-reaper-idle.json')))
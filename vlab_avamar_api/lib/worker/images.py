@@ -0,0 +1,230 @@
+# -*- coding: UTF-8 -*-
+"""
+An index of the images in ``VLAB_AVAMAR_IMAGES_DIR``, by their SHA-256.
+
+A corrupt, or partially copied, OVA otherwise isn't noticed until a deploy is
+10+ minutes into uploading it. Every image is read once, end to end, and
+verified:
+
+- The tarball must be complete; a truncated copy fails to read
+- There must be an OVF descriptor
+- Every file listed in the manifest (the ``.mf`` file) must match its checksum
+
+While the image is read, a background thread hashes the raw bytes of the file
+(which is the SHA-256 that identifies the image) while the caller checksums the
+files within it, so the hashing is spread across threads. The result is saved,
+along with the size and mtime of the image, so an image is only read again if
+it changes. Images with the same SHA-256 are reported as duplicates.
+"""
+import os
+import re
+import time
+import hashlib
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+from vlab_avamar_api.lib import const
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.worker import compressed
+
+
+MANIFEST_LINE = re.compile(r'^(SHA1|SHA256|SHA512)\((.+)\)\s*=\s*([0-9a-fA-F]+)\s*$')
+
+
+class ImageIndex(object):
+    """The SHA-256, and verification result, of every image.
+
+    :param state: Where the index is stored
+    :type state: vlab_avamar_api.lib.state.SharedState
+
+    :param directory: Where the images are
+    :type directory: String
+
+    :param parallel: How many images to verify at once
+    :type parallel: Integer
+    """
+    def __init__(self, state, directory, parallel):
+        self._state = state
+        self._directory = directory
+        self._parallel = parallel
+
+    def refresh(self, logger):
+        """Verify the images that are new, or changed since they were verified,
+        and forget about images that were removed.
+
+        :Returns: Dictionary
+
+        :param logger: An object for logging messages
+        :type logger: logging.LoggerAdapter
+        """
+        found = {x: _stat(os.path.join(self._directory, x)) for x in os.listdir(self._directory) if _is_image(x)}
+        found = {x: y for x, y in found.items() if y is not None}
+        with self._state.locked() as data:
+            for name in [x for x in data.keys() if x not in found]:
+                del data[name]
+            stale = [x for x, y in found.items() if _changed(data.get(x), y)]
+        logger.info('Verifying %s of %s images', len(stale), len(found))
+        verified = []
+        with ThreadPoolExecutor(max_workers=max(1, self._parallel)) as executor:
+            for name, entry in zip(stale, executor.map(self._verify, stale)):
+                if entry is None:
+                    # Probably still being copied; checked again next time
+                    logger.info('Image %s changed while it was verified', name)
+                    continue
+                if entry['error']:
+                    logger.error('Image %s failed verification: %s', name, entry['error'])
+                else:
+                    logger.info('Verified image %s in %s seconds', name, entry['seconds'])
+                with self._state.locked() as data:
+                    data[name] = entry
+                verified.append(name)
+        report = self.report()
+        for names in report['duplicates']:
+            logger.warning('Images are duplicates of each other: %s', ', '.join(names))
+        report['verified'] = verified
+        return report
+
+    def check(self, name):
+        """Refuse an image that failed verification. Images that have not been
+        verified yet, or that changed since, are allowed.
+
+        :Returns: None
+
+        :Raises: ValueError
+
+        :param name: The file name of the image
+        :type name: String
+        """
+        entry = self._state.read().get(name)
+        if entry is None or not entry['error']:
+            return
+        if _changed(entry, _stat(os.path.join(self._directory, name))):
+            return
+        raise ValueError('Image {} is corrupt: {}'.format(name, entry['error']))
+
+    def sha256(self, name):
+        """Obtain the SHA-256 of an image, if it passed verification and has
+        not changed since.
+
+        :Returns: String or None
+
+        :param name: The file name of the image
+        :type name: String
+        """
+        entry = self._state.read().get(name)
+        if entry is None or entry['error']:
+            return None
+        if _changed(entry, _stat(os.path.join(self._directory, name))):
+            return None
+        return entry['sha256']
+
+    def report(self):
+        """Summarize the index, without verifying anything.
+
+        :Returns: Dictionary
+        """
+        data = self._state.read()
+        by_digest = {}
+        for name, entry in sorted(data.items()):
+            if entry['sha256']:
+                by_digest.setdefault(entry['sha256'], []).append(name)
+        return {'images': {x: {'sha256': y['sha256'], 'error': y['error'], 'verified': y['verified']}
+                           for x, y in data.items()},
+                'failed': sorted(x for x, y in data.items() if y['error']),
+                'duplicates': [x for x in by_digest.values() if len(x) > 1]}
+
+    def _verify(self, name):
+        """Read an image end to end, returning what goes in the index. None if
+        the image changed while it was read."""
+        path = os.path.join(self._directory, name)
+        started = time.time()
+        before = _stat(path)
+        digest = hashlib.sha256()
+        try:
+            with compressed.DecompressedStream(path, [0], digest=digest) as stream:
+                error = _check_tarball(stream)
+                # The tarball can end before the file does, i.e. padding
+                while stream.read(compressed.READ_SIZE):
+                    pass
+        except Exception as doh:
+            error = '{}'.format(doh) or doh.__class__.__name__
+        after = _stat(path)
+        if after is None or after != before:
+            return None
+        return {'size': after[0],
+                'mtime': after[1],
+                'sha256': None if error else digest.hexdigest(),
+                'error': error,
+                'verified': time.time(),
+                'seconds': round(time.time() - started, 1)}
+
+
+def _check_tarball(stream):
+    """Checksum the files of an OVA against its manifest.
+
+    :Returns: String or None - What's wrong with the OVA, if anything
+    """
+    manifest = {}
+    seen = {}
+    has_ovf = False
+    with tarfile.open(fileobj=stream, mode='r|', bufsize=compressed.READ_SIZE) as tar:
+        for member in tar:
+            the_file = tar.extractfile(member)
+            if the_file is None:
+                continue
+            if member.name.endswith('.mf'):
+                manifest = _parse_manifest(the_file.read().decode())
+                continue
+            has_ovf = has_ovf or member.name.endswith('.ovf')
+            # The manifest usually comes before the files it lists, but not always
+            algorithm = manifest.get(member.name, ('sha256', None))[0]
+            hasher = hashlib.new(algorithm)
+            for chunk in iter(lambda: the_file.read(compressed.READ_SIZE), b''):
+                hasher.update(chunk)
+            seen[member.name] = (algorithm, hasher.hexdigest())
+    if not has_ovf:
+        return 'No OVF descriptor found'
+    for name, (algorithm, expected) in sorted(manifest.items()):
+        if name not in seen:
+            return 'The manifest lists {}, but it is not in the OVA'.format(name)
+        if seen[name][0] == algorithm and seen[name][1] != expected:
+            return 'The checksum of {} does not match the manifest'.format(name)
+    return None
+
+
+def _parse_manifest(text):
+    """Map each file in an OVA manifest to its (algorithm, checksum)"""
+    manifest = {}
+    for line in text.splitlines():
+        match = MANIFEST_LINE.match(line.strip())
+        if match:
+            algorithm, name, checksum = match.groups()
+            manifest[name] = (algorithm.lower(), checksum.lower())
+    return manifest
+
+
+def _is_image(name):
+    """Whether a file in the images directory is an image this worker can read"""
+    suffixes = ('.ova',) + tuple('.ova' + x for x in compressed.SUFFIXES)
+    return name.endswith(suffixes) and compressed.readable(name)
+
+
+def _stat(path):
+    """The size and mtime of a file, or None if it's gone"""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return [info.st_size, info.st_mtime_ns]
+
+
+def _changed(entry, stat):
+    """Whether an image differs from when its index entry was made"""
+    if entry is None or stat is None:
+        return True
+    return [entry['size'], entry['mtime']] != stat
+
+
+IMAGE_INDEX = ImageIndex(state=SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, 'vlab-avamar-images.json')),
+                         directory=const.VLAB_AVAMAR_IMAGES_DIR,
+                         parallel=const.VLAB_AVAMAR_VERIFY_PARALLEL)
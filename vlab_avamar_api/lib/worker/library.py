@@ -0,0 +1,149 @@
+# -*- coding: UTF-8 -*-
+"""
+Tracks which images have been published as template VMs, on which vCenter
+and datastore, so ``create_avamar`` can clone a datastore-local copy of the
+image instead of uploading the OVA (see ``vmware.sync_library``).
+
+A template is only current while the image it was published from still has the
+same SHA-256 in the image index. A template that's out of date is "stale" until
+the next sync republishes it, and ``create_avamar`` uploads the OVA instead.
+"""
+import os
+import time
+
+from vlab_avamar_api.lib import const
+from vlab_avamar_api.lib.state import SharedState
+
+
+class Library(object):
+    """The sync status of every image, on every vCenter and datastore.
+
+    :param state: Where the sync status is stored
+    :type state: vlab_avamar_api.lib.state.SharedState
+    """
+    def __init__(self, state):
+        self._state = state
+
+    def started(self, server, image, datastore, sha256):
+        """Record that an image is being published.
+
+        :Returns: None
+
+        :param server: The vCenter the image is published to
+        :type server: String
+
+        :param image: The file name of the image
+        :type image: String
+
+        :param datastore: The datastore the template is stored on
+        :type datastore: String
+
+        :param sha256: The SHA-256 of the image being published
+        :type sha256: String
+        """
+        with self._state.locked() as data:
+            data.setdefault(image, {})[location(server, datastore)] = {'status': 'syncing',
+                                                                       'sha256': sha256,
+                                                                       'started': time.time(),
+                                                                       'error': None}
+
+    def finished(self, server, image, datastore, sha256, error=None):
+        """Record that an image was published, or failed to be.
+
+        :Returns: None
+
+        :param server: The vCenter the image is published to
+        :type server: String
+
+        :param image: The file name of the image
+        :type image: String
+
+        :param datastore: The datastore the template is stored on
+        :type datastore: String
+
+        :param sha256: The SHA-256 of the image that was published
+        :type sha256: String
+
+        :param error: Why the image could not be published
+        :type error: String
+        """
+        with self._state.locked() as data:
+            entry = data.setdefault(image, {}).setdefault(location(server, datastore), {'started': time.time()})
+            entry['status'] = 'failed' if error else 'synced'
+            entry['error'] = error
+            entry['finished'] = time.time()
+            if not error:
+                entry['sha256'] = sha256
+
+    def current(self, server, image, datastore, sha256):
+        """Whether a datastore has a template of exactly this image.
+
+        :Returns: Boolean
+
+        :param server: The vCenter to deploy on
+        :type server: String
+
+        :param image: The file name of the image
+        :type image: String
+
+        :param datastore: The datastore the new VM goes on
+        :type datastore: String
+
+        :param sha256: The SHA-256 the image has now
+        :type sha256: String
+        """
+        entry = self._state.read().get(image, {}).get(location(server, datastore), {})
+        return sha256 is not None and _status(entry, sha256) == 'current'
+
+    def report(self, images, locations):
+        """Summarize how far along the sync is, and which images are stale.
+
+        :Returns: Dictionary
+
+        :param images: The SHA-256 of every image, by file name; None if not verified
+        :type images: Dictionary
+
+        :param locations: Every vCenter and datastore the images go to; see ``location``
+        :type locations: List
+        """
+        data = self._state.read()
+        progress = {'total': len(images) * len(locations), 'current': 0, 'syncing': 0, 'failed': 0}
+        found = {}
+        for image, sha256 in sorted(images.items()):
+            statuses = {x: _status(data.get(image, {}).get(x), sha256) for x in locations}
+            for status in statuses.values():
+                if status in progress:
+                    progress[status] += 1
+            found[image] = {'sha256': sha256,
+                            'stale': any(x != 'current' for x in statuses.values()),
+                            'locations': statuses}
+        progress['percent'] = round(100 * progress['current'] / progress['total'], 1) if progress['total'] else 100.0
+        return {'progress': progress, 'images': found}
+
+
+def location(server, datastore):
+    """Identifies a datastore on a vCenter.
+
+    :Returns: String
+
+    :param server: The vCenter server
+    :type server: String
+
+    :param datastore: The name of the datastore
+    :type datastore: String
+    """
+    return '{}:{}'.format(server, datastore)
+
+
+def _status(entry, sha256):
+    """One of current, stale, missing, syncing or failed"""
+    if not entry:
+        return 'missing'
+    if entry['status'] in ('syncing', 'failed'):
+        return entry['status']
+    if sha256 is not None and entry.get('sha256') == sha256:
+        return 'current'
+    return 'stale'
+
+
+LIBRARY = Library(state=SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, 'vlab-avamar-library.json')))
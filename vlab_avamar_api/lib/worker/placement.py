@@ -0,0 +1,197 @@
+# -*- coding: UTF-8 -*-
+"""
+Picks which datastore and ESXi host a new Avamar VM is deployed to, so that
+concurrent deploys spread their upload I/O across storage instead of piling
+onto a single datastore.
+"""
+import time
+import uuid
+import threading
+from collections import Counter
+
+
+class Placement(object):
+    """Scores the configured datastores and hosts.
+
+    Datastores are scored on free space, the number of in-flight deploys and
+    how fast recent deploys were (seconds per GB uploaded). Hosts are scored on
+    free memory and in-flight deploys. The capacity stats are supplied via
+    ``update``, which the worker calls periodically in the background.
+
+    In-flight deploys are recorded in shared state, so every worker process on
+    the host sees the deploys the others have running. Each one expires after
+    ``lease`` seconds, so a worker that dies mid-deploy cannot hold it forever.
+
+    :param datastores: The names of the datastores new VMs can be deployed to
+    :type datastores: List
+
+    :param hosts: The names of the ESXi hosts new VMs can run on. An empty list
+                  means any host that can access the chosen datastore.
+    :type hosts: List
+
+    :param max_age: How many seconds before the capacity stats are stale
+    :type max_age: Integer
+
+    :param state: Where the in-flight deploys are recorded
+    :type state: vlab_avamar_api.lib.state.SharedState
+
+    :param name: The vCenter server the datastores and hosts belong to
+    :type name: String
+
+    :param lease: How many seconds before an in-flight deploy is forgotten
+    :type lease: Integer
+    """
+    # How much weight the latest deploy has in the seconds-per-GB average
+    LATENCY_WEIGHT = 0.3
+
+    def __init__(self, datastores, hosts, max_age, state, name, lease):
+        self._datastores = datastores
+        self._hosts = hosts
+        self._max_age = max_age
+        self._state = state
+        self._name = name
+        self._lease = lease
+        self._lock = threading.Lock()
+        self._datastore_stats = {}
+        self._host_stats = {}
+        self._latency = {}
+        # The reservations this process holds, by (datastore, host)
+        self._mine = {}
+        self._refreshed = 0
+
+    def update(self, datastores, hosts):
+        """Replace the capacity stats of the datastores and hosts.
+
+        :Returns: None
+
+        :param datastores: Maps a datastore name to a dictionary with the keys
+                           ``free`` (bytes) and ``accessible`` (boolean).
+        :type datastores: Dictionary
+
+        :param hosts: Maps a host name to a dictionary with the keys ``free_mb``,
+                      ``usable`` (boolean) and ``datastores`` (list of names).
+        :type hosts: Dictionary
+        """
+        with self._lock:
+            self._datastore_stats = {x: y for x, y in datastores.items() if x in self._datastores}
+            if self._hosts:
+                hosts = {x: y for x, y in hosts.items() if x in self._hosts}
+            self._host_stats = hosts
+            self._refreshed = time.time()
+
+    @property
+    def stale(self):
+        """True when the capacity stats are too old to be trusted"""
+        return (time.time() - self._refreshed) > self._max_age
+
+    def choose(self):
+        """Pick the best datastore, and host, for a new VM.
+
+        :Returns: Tuple (datastore name, host name)
+
+        :Raises: RuntimeError
+        """
+        inflight, host_inflight = self._inflight()
+        with self._lock:
+            scores = self._datastore_scores(inflight)
+            if not scores:
+                raise RuntimeError('No accessible datastore in {}'.format(self._datastores))
+            datastore = max(scores, key=scores.get)
+            host = self._choose_host(datastore, host_inflight)
+        return datastore, host
+
+    def started(self, datastore, host):
+        """Record that a deploy to a datastore and host has begun.
+
+        :Returns: None
+
+        :param datastore: The name of the datastore
+        :type datastore: String
+
+        :param host: The name of the host
+        :type host: String
+        """
+        reservation = uuid.uuid4().hex
+        with self._state.locked() as data:
+            reservations = self._load(data, time.time())
+            reservations[reservation] = {'datastore': datastore,
+                                         'host': host,
+                                         'expires': time.time() + self._lease}
+        with self._lock:
+            self._mine.setdefault((datastore, host), []).append(reservation)
+
+    def finished(self, datastore, host, seconds_per_gb=None):
+        """Record that a deploy has ended.
+
+        :Returns: None
+
+        :param datastore: The name of the datastore
+        :type datastore: String
+
+        :param host: The name of the host
+        :type host: String
+
+        :param seconds_per_gb: How fast the upload was. Supply None if the deploy failed.
+        :type seconds_per_gb: Float
+        """
+        with self._lock:
+            mine = self._mine.get((datastore, host))
+            reservation = mine.pop() if mine else None
+        with self._state.locked() as data:
+            reservations = self._load(data, time.time())
+            reservations.pop(reservation, None)
+        with self._lock:
+            if seconds_per_gb is not None:
+                previous = self._latency.get(datastore, seconds_per_gb)
+                self._latency[datastore] = (self.LATENCY_WEIGHT * seconds_per_gb) + ((1 - self.LATENCY_WEIGHT) * previous)
+
+    def report(self):
+        """Obtain the current scores, for metrics/debugging.
+
+        :Returns: Dictionary
+        """
+        inflight, _ = self._inflight()
+        with self._lock:
+            return {'datastores': self._datastore_scores(inflight),
+                    'inflight': dict(inflight),
+                    'seconds_per_gb': dict(self._latency),
+                    'age': round(time.time() - self._refreshed, 1)}
+
+    def _load(self, data, now):
+        """Obtain this server's reservations, minus the expired ones"""
+        reservations = data.setdefault(self._name, {})
+        for reservation, info in list(reservations.items()):
+            if info['expires'] < now:
+                reservations.pop(reservation)
+        return reservations
+
+    def _inflight(self):
+        """Count the unexpired reservations, by datastore and by host"""
+        now = time.time()
+        inflight = Counter()
+        host_inflight = Counter()
+        for info in self._state.read().get(self._name, {}).values():
+            if info['expires'] >= now:
+                inflight[info['datastore']] += 1
+                host_inflight[info['host']] += 1
+        return inflight, host_inflight
+
+    def _datastore_scores(self, inflight):
+        """Must hold the lock before calling"""
+        fastest = min(self._latency.values()) if self._latency else None
+        scores = {}
+        for name, stats in self._datastore_stats.items():
+            if not stats['accessible']:
+                continue
+            free_gb = stats['free'] / 1024**3
+            # Datastores without any deploy history are treated like the fastest one
+            slowness = self._latency.get(name, fastest) / fastest if fastest else 1
+            scores[name] = round(free_gb / ((1 + inflight[name]) * slowness), 2)
+        return scores
+
+    def _choose_host(self, datastore, host_inflight):
+        """Must hold the lock before calling"""
+        candidates = {x: y for x, y in self._host_stats.items() if y['usable'] and datastore in y['datastores']}
+        if not candidates:
+            raise RuntimeError('No usable host can access datastore {}'.format(datastore))
+        return max(candidates, key=lambda x: candidates[x]['free_mb'] / (1 + host_inflight[x]))
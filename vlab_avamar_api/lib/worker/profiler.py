@@ -0,0 +1,196 @@
+# -*- coding: UTF-8 -*-
+"""
+Profiles individual tasks, so a slow ``show`` or ``create`` can be explained
+after the fact.
+
+A task is profiled when the API request that sent it had an ``X-Profile``
+header, or when it's randomly sampled (``VLAB_AVAMAR_PROFILE_SAMPLE`` percent
+of tasks). While the task runs, a background thread samples the stack of the
+thread running it. Nothing is traced, so the task itself runs at full speed.
+
+Each sample is attributed to one of:
+
+- ``vcenter`` - Waiting on the network, i.e. a SOAP call to vCenter, or an upload to ESXi
+- ``serialization`` - Encoding or parsing SOAP messages, or JSON
+- ``waiting`` - Blocked on other threads, like the parallel disk uploads
+- ``local`` - Everything else; CPU spent in the worker, and time.sleep
+
+A busy task holds the GIL, so the sampler wakes late. Each sample therefore
+counts for the time since the previous one, rather than the interval.
+
+The profile is saved as JSON, named after the ``txn_id`` of the request. The
+``stacks`` are in the "collapsed" format that flame graph tools read, with the
+milliseconds spent in each stack as the count.
+"""
+import os
+import re
+import sys
+import time
+import random
+import threading
+from collections import Counter
+
+import ujson
+
+
+CATEGORIES = ('vcenter', 'serialization', 'waiting', 'local')
+IO_MODULES = ('socket', 'ssl', 'http.client', 'selectors', 'select')
+WAITING_MODULES = ('threading', 'queue', 'concurrent.futures')
+SERIALIZATION_MODULES = ('pyVmomi.SoapAdapter', 'pyVmomi.VmomiSupport', 'xml', 'json', 'kombu.serialization')
+
+
+class TaskProfile(object):
+    """Samples the stack of the calling thread, until stopped.
+
+    :param task_name: The name of the task being profiled, like avamar.show_server
+    :type task_name: String
+
+    :param task_id: The ID of the task being profiled
+    :type task_id: String
+
+    :param txn_id: The ID of the API request that sent the task
+    :type txn_id: String
+
+    :param interval: How many seconds between samples
+    :type interval: Float
+    """
+    def __init__(self, task_name, task_id, txn_id, interval):
+        self.task_name = task_name
+        self.task_id = task_id
+        self.txn_id = txn_id
+        self._interval = interval
+        self._thread_id = threading.get_ident()
+        self._done = threading.Event()
+        self._sampler = None
+        self._stacks = Counter()
+        self._categories = Counter()
+        self._samples = 0
+        self._started = None
+        self._cpu_started = None
+        self._last_sample = None
+
+    def start(self):
+        """Begin sampling. Must be called by the thread that runs the task.
+
+        :Returns: TaskProfile
+        """
+        self._started = time.perf_counter()
+        self._cpu_started = time.thread_time()
+        self._last_sample = self._started
+        self._sampler = threading.Thread(target=self._run, name='task-profiler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        """Stop sampling. Must be called by the thread that runs the task.
+
+        :Returns: Dictionary - The profile
+        """
+        wall = time.perf_counter() - self._started
+        cpu = time.thread_time() - self._cpu_started
+        self._done.set()
+        self._sampler.join()
+        sampled = sum(self._categories.values())
+        # Scale to the wall time, which also covers the time after the last sample
+        breakdown = {x: round(wall * self._categories[x] / sampled, 4) if sampled else 0.0 for x in CATEGORIES}
+        return {'task': self.task_name,
+                'task_id': self.task_id,
+                'txn_id': self.txn_id,
+                'wall_seconds': round(wall, 4),
+                'cpu_seconds': round(cpu, 4),
+                'interval_ms': round(self._interval * 1000, 2),
+                'samples': self._samples,
+                'seconds': breakdown,
+                'stacks': {x: round(y * 1000, 1) for x, y in self._stacks.most_common()}}
+
+    def sample(self):
+        """Record the current stack of the profiled thread.
+
+        :Returns: None
+        """
+        now = time.perf_counter()
+        weight = now - self._last_sample
+        self._last_sample = now
+        frame = sys._current_frames().get(self._thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame)
+            frame = frame.f_back
+        if not stack:
+            return
+        self._samples += 1
+        self._categories[_category(stack)] += weight
+        self._stacks[';'.join(_label(x) for x in reversed(stack))] += weight
+
+    def _run(self):
+        while not self._done.wait(self._interval):
+            self.sample()
+
+
+def wanted(request, sample):
+    """Decide if a task should be profiled.
+
+    :Returns: Boolean
+
+    :param request: The context of the task, i.e. ``task.request``
+    :type request: celery.app.task.Context
+
+    :param sample: The percent of tasks to profile, even when not asked to
+    :type sample: Float
+    """
+    if request.get('vlab_profile', False):
+        return True
+    return random.random() * 100 < sample
+
+
+def save(profile, directory, keep):
+    """Write a profile to disk, and remove the oldest ones beyond ``keep``.
+
+    :Returns: String - The path to the saved profile
+
+    :param profile: The output from ``TaskProfile.stop``
+    :type profile: Dictionary
+
+    :param directory: Where to save profiles
+    :type directory: String
+
+    :param keep: How many profiles to keep. Zero keeps every profile.
+    :type keep: Integer
+    """
+    os.makedirs(directory, exist_ok=True)
+    # The txn_id comes from a header the client sets
+    txn_id = re.sub(r'[^A-Za-z0-9_.\-]', '_', profile['txn_id'])[:64]
+    path = os.path.join(directory, '{}-{}.json'.format(txn_id, profile['task_id']))
+    with open(path, 'w') as the_file:
+        the_file.write(ujson.dumps(profile, indent=2))
+    if keep:
+        saved = [os.path.join(directory, x) for x in os.listdir(directory) if x.endswith('.json')]
+        saved.sort(key=os.path.getmtime)
+        for doomed in saved[:-keep]:
+            os.remove(doomed)
+    return path
+
+
+def _category(stack):
+    """Decide what a sampled stack was doing. The stack is innermost frame first."""
+    module = _module(stack[0])
+    if _within(module, IO_MODULES):
+        return 'vcenter'
+    if _within(module, WAITING_MODULES):
+        return 'waiting'
+    if any(_within(_module(x), SERIALIZATION_MODULES) for x in stack):
+        return 'serialization'
+    return 'local'
+
+
+def _within(module, packages):
+    """Whether a module is one of the packages, or inside one of them"""
+    return any(module == x or module.startswith(x + '.') for x in packages)
+
+
+def _module(frame):
+    return frame.f_globals.get('__name__', '')
+
+
+def _label(frame):
+    return '{}:{}'.format(_module(frame), frame.f_code.co_name)
@@ -0,0 +1,174 @@
+# -*- coding: UTF-8 -*-
+"""
+Spreads users across several vCenter servers (shards), so that no single
+vCenter task queue limits how fast Avamar VMs can be deployed.
+"""
+import time
+import bisect
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from vlab_avamar_api.lib.breaker import Overloaded
+
+
+class HashRing(object):
+    """Maps a username to a vCenter server via consistent hashing, so adding or
+    removing a server only moves the users on the neighboring parts of the ring.
+
+    :param servers: The vCenter servers to shard across
+    :type servers: List
+
+    :param weights: Maps a server to its relative capacity; a server with a weight
+                    of 2 gets twice as many users as a server with a weight of 1.
+                    Servers not in the mapping have a weight of 1.
+    :type weights: Dictionary
+
+    :param overrides: Pins a username to a specific server, regardless of the hash.
+    :type overrides: Dictionary
+    """
+    # How many points on the ring each unit of weight gets
+    VNODES = 64
+
+    def __init__(self, servers, weights=None, overrides=None):
+        if not servers:
+            raise ValueError('Must supply at least one vCenter server')
+        weights = weights if weights else {}
+        self._servers = list(servers)
+        self._overrides = {x: y for x, y in (overrides or {}).items() if y in self._servers}
+        ring = []
+        for server in self._servers:
+            for vnode in range(self.VNODES * int(weights.get(server, 1))):
+                ring.append((_hash('{}-{}'.format(server, vnode)), server))
+        ring.sort()
+        self._keys = [x[0] for x in ring]
+        self._ring = [x[1] for x in ring]
+
+    @property
+    def servers(self):
+        """All the vCenter servers on the ring"""
+        return list(self._servers)
+
+    def get(self, username):
+        """Obtain the home vCenter server of a user.
+
+        :Returns: String
+
+        :param username: The name of the user
+        :type username: String
+        """
+        return self.candidates(username)[0]
+
+    def candidates(self, username):
+        """Obtain every vCenter server, in the order a user's VMs should be placed
+        on them. The first is the user's home server; the rest are the next
+        servers clockwise on the ring, for when the home server is out of capacity.
+
+        :Returns: List
+
+        :param username: The name of the user
+        :type username: String
+        """
+        found = []
+        if username in self._overrides:
+            found.append(self._overrides[username])
+        start = bisect.bisect(self._keys, _hash(username))
+        for index in range(len(self._ring)):
+            server = self._ring[(start + index) % len(self._ring)]
+            if server not in found:
+                found.append(server)
+                if len(found) == len(self._servers):
+                    break
+        return found
+
+
+class SessionPool(object):
+    """Reuses established vCenter sessions, instead of logging into vCenter for
+    every task.
+
+    :param factory: Called with no arguments to create a new vCenter object
+    :type factory: Function
+
+    :param size: The max number of idle sessions to keep
+    :type size: Integer
+
+    :param max_idle: How many seconds a session can sit idle before it's closed,
+                     instead of letting vCenter time it out.
+    :type max_idle: Integer
+    """
+    def __init__(self, factory, size, max_idle):
+        self._factory = factory
+        self._size = size
+        self._max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+
+    @contextmanager
+    def session(self):
+        """Check out a session for the duration of a ``with`` statement. Sessions
+        are only returned to the pool if no unexpected error occurred.
+
+        :Returns: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        vcenter = self._checkout()
+        try:
+            yield vcenter
+        except (ValueError, Overloaded):
+            # User error, or shedding load; nothing wrong with the session
+            self._checkin(vcenter)
+            raise
+        except Exception:
+            _close(vcenter)
+            raise
+        else:
+            self._checkin(vcenter)
+
+    def stats(self):
+        """Obtain counters about session reuse.
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            return {'idle': len(self._idle), 'created': self._created, 'reused': self._reused}
+
+    def _checkout(self):
+        expired = []
+        vcenter = None
+        with self._lock:
+            while self._idle:
+                candidate, idle_since = self._idle.pop()
+                if time.time() - idle_since > self._max_idle:
+                    expired.append(candidate)
+                else:
+                    vcenter = candidate
+                    self._reused += 1
+                    break
+            if vcenter is None:
+                self._created += 1
+        for stale in expired:
+            _close(stale)
+        if vcenter is None:
+            vcenter = self._factory().__enter__()
+        return vcenter
+
+    def _checkin(self, vcenter):
+        with self._lock:
+            if len(self._idle) < self._size:
+                self._idle.append((vcenter, time.time()))
+                return
+        _close(vcenter)
+
+
+def _hash(value):
+    """A hash that's stable across processes, unlike the built-in ``hash``"""
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+
+def _close(vcenter):
+    """Logout of vCenter, ignoring errors from a session that's already dead"""
+    try:
+        vcenter.__exit__(None, None, None)
+    except Exception:
+        pass
@@ -2,13 +2,94 @@
 """
 Entry point logic for available backend worker tasks
 """
+import os
+import inspect
+
 from celery import Celery
-from vlab_api_common import get_task_logger
+from celery.signals import worker_process_init, task_prerun, task_postrun
+from celery.worker.control import inspect_command
+from vlab_api_common import get_logger, get_task_logger
 
 from vlab_avamar_api.lib import const
-from vlab_avamar_api.lib.worker import vmware
+from vlab_avamar_api.lib.admission import ADMISSION
+from vlab_avamar_api.lib.breaker import Overloaded
+from vlab_avamar_api.lib.generations import GENERATIONS, inventory_key, images_key
+from vlab_avamar_api.lib.worker import vmware, profiler
+from vlab_avamar_api.lib.worker.images import IMAGE_INDEX
+from vlab_avamar_api.lib.worker.warmup import WARM_UPS
 
 app = Celery('avamar', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+app.conf.beat_schedule = {'reap-expired': {'task': 'avamar.reap_expired',
+                                           'schedule': const.VLAB_AVAMAR_REAPER_INTERVAL,
+                                           'args': [const.VLAB_AVAMAR_REAPER_DRY_RUN, 'celery-beat']},
+                          'verify-images': {'task': 'avamar.verify_images',
+                                            'schedule': const.VLAB_AVAMAR_VERIFY_INTERVAL,
+                                            'args': ['celery-beat']}}
+if const.VLAB_AVAMAR_SUSPEND_IDLE_MINUTES:
+    app.conf.beat_schedule['suspend-idle'] = {'task': 'avamar.suspend_idle',
+                                              'schedule': const.VLAB_AVAMAR_SUSPEND_INTERVAL,
+                                              'args': ['celery-beat']}
+if const.VLAB_AVAMAR_LIBRARY:
+    app.conf.beat_schedule['sync-library'] = {'task': 'avamar.sync_library',
+                                              'schedule': const.VLAB_AVAMAR_LIBRARY_INTERVAL,
+                                              'args': ['celery-beat']}
+# A worker process isn't given tasks until worker_process_init returns, and is
+# restarted if that takes longer than this.
+app.conf.worker_proc_alive_timeout = const.VLAB_AVAMAR_WARM_TIMEOUT + 10
+log = get_logger(__name__, loglevel=const.VLAB_AVAMAR_LOG_LEVEL)
+# The tasks this worker process is profiling, by task ID
+PROFILES = {}
+
+
+@worker_process_init.connect
+def warm_up(**kwargs):
+    """Each worker process logs into vCenter, and looks up what tasks commonly
+    need, before it's given any tasks"""
+    pid = os.getpid()
+    vmware.warm_up(timeout=const.VLAB_AVAMAR_WARM_TIMEOUT,
+                   record=lambda x: WARM_UPS.record(pid, x['seconds'], x['errors'], x['status']))
+
+
+@inspect_command()
+def warm_up_status(state):
+    """Whether every process of this worker has warmed up; used by the API's readiness probe"""
+    return WARM_UPS.report(state.consumer.pool.info.get('processes', []))
+
+
+@worker_process_init.connect
+def start_placement_refresher(**kwargs):
+    """Each worker process scores datastores/hosts using its own background thread"""
+    vmware.start_placement_refresher()
+
+
+@task_prerun.connect
+def start_profile(task_id=None, task=None, args=(), kwargs=None, **extra):
+    """Profile the task, if the API request asked for it, or the task was sampled"""
+    if not profiler.wanted(task.request, const.VLAB_AVAMAR_PROFILE_SAMPLE):
+        return
+    try:
+        txn_id = inspect.signature(task.run).bind_partial(*args, **(kwargs or {})).arguments.get('txn_id', 'noId')
+    except TypeError:
+        txn_id = 'noId'
+    PROFILES[task_id] = profiler.TaskProfile(task_name=task.name,
+                                             task_id=task_id,
+                                             txn_id=txn_id,
+                                             interval=const.VLAB_AVAMAR_PROFILE_INTERVAL / 1000).start()
+
+
+@task_postrun.connect
+def stop_profile(task_id=None, **extra):
+    """Save the profile of a task, so it can be found by the txn_id"""
+    profile = PROFILES.pop(task_id, None)
+    if profile is None:
+        return
+    result = profile.stop()
+    try:
+        path = profiler.save(result, const.VLAB_AVAMAR_PROFILE_DIR, const.VLAB_AVAMAR_PROFILE_KEEP)
+    except OSError as doh:
+        log.error('Unable to save profile of task %s: %s', task_id, doh)
+    else:
+        log.info('Profiled task %s (txn_id %s) in %s: %s', task_id, result['txn_id'], path, result['seconds'])
 
 
 @app.task(name='avamar.show_server', bind=True)
@@ -26,14 +107,21 @@ def show(self, username, txn_id):
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
+    key = inventory_key('Avamar', username)
+    generation = GENERATIONS.generation(key)
     try:
-        info = vmware.show_avamar(username)
-    except ValueError as doh:
+        info, unhealthy = vmware.show_avamar(username)
+    except (ValueError, Overloaded) as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
     else:
         logger.info('Task complete')
         resp['content'] = info
+        if unhealthy:
+            resp['error'] = _incomplete(unhealthy)
+        else:
+            # Never cache a partial answer; the ETag would hide the missing VMs
+            GENERATIONS.observe(key, info, generation)
     return resp
 
 
@@ -64,17 +152,21 @@ def create(self, username, machine_name, image, network, ip_config, txn_id):
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
+    _admit(self, username, logger)
     try:
         resp['content'] = vmware.create_avamar(username, machine_name, image, network, ip_config, logger)
-    except ValueError as doh:
+    except (ValueError, Overloaded) as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    finally:
+        ADMISSION.release(username, self.request.id)
+        GENERATIONS.bump(inventory_key('Avamar', username))
     logger.info('Task complete')
     return resp
 
 
 @app.task(name='avamar.delete_server', bind=True)
-def delete(self, username, machine_name, txn_id):
+def delete(self, username, machine_name, txn_id, background=False):
     """Destroy an instance of Avamar
 
     :Returns: Dictionary
@@ -82,6 +174,135 @@ def delete(self, username, machine_name, txn_id):
     :param username: The name of the user who wants to delete an instance of Avamar
     :type username: String
 
+    :param machine_name: The name of the instance of Avamar. Supply a list to delete several at once.
+    :type machine_name: String or List
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+
+    :param background: Return once the instances are found, and destroy them via the ``avamar.reap`` task.
+    :type background: Boolean
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        names = vmware.delete_avamar(username, machine_name, logger, background=background)
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        if background:
+            reaper = reap.delay(username, names, 'Avamar', txn_id)
+            resp['content'] = {'reaper': reaper.id}
+        logger.info('Task complete')
+    finally:
+        GENERATIONS.bump(inventory_key('Avamar', username))
+    return resp
+
+
+@app.task(name='avamar.reap', bind=True)
+def reap(self, username, machine_names, kind, txn_id):
+    """Finish destroying the instances of a ``background`` delete.
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who owns the instances
+    :type username: String
+
+    :param machine_names: The names of the instances to destroy
+    :type machine_names: List
+
+    :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
+    :type kind: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        vmware.delete_avamar(username, machine_names, logger, kind=kind)
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        logger.info('Task complete')
+    finally:
+        GENERATIONS.bump(inventory_key(kind, username))
+    return resp
+
+
+@app.task(name='avamar.reset_server', bind=True)
+def reset(self, username, machine_name, txn_id):
+    """Revert an instance of Avamar to how it was right after being created
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who wants to reset an instance of Avamar
+    :type username: String
+
+    :param machine_name: The name of the instance of Avamar
+    :type machine_name: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.reset_avamar(username, machine_name, logger)
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        logger.info('Task complete')
+    finally:
+        GENERATIONS.bump(inventory_key('Avamar', username))
+    return resp
+
+
+@app.task(name='avamar.suspend_server', bind=True)
+def suspend(self, username, machine_name, txn_id):
+    """Suspend an instance of Avamar, so it stops using host memory until it is resumed
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who owns the instance of Avamar
+    :type username: String
+
+    :param machine_name: The name of the instance of Avamar
+    :type machine_name: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.suspend_avamar(username, machine_name, logger)
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        logger.info('Task complete')
+    finally:
+        GENERATIONS.bump(inventory_key('Avamar', username))
+    return resp
+
+
+@app.task(name='avamar.resume_server', bind=True)
+def resume(self, username, machine_name, txn_id):
+    """Resume an instance of Avamar that was suspended
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who owns the instance of Avamar
+    :type username: String
+
     :param machine_name: The name of the instance of Avamar
     :type machine_name: String
 
@@ -92,12 +313,14 @@ def delete(self, username, machine_name, txn_id):
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
     try:
-        vmware.delete_avamar(username, machine_name, logger)
-    except ValueError as doh:
+        resp['content'] = vmware.resume_avamar(username, machine_name, logger)
+    except (ValueError, Overloaded) as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
     else:
         logger.info('Task complete')
+    finally:
+        GENERATIONS.bump(inventory_key('Avamar', username))
     return resp
 
 
@@ -113,11 +336,154 @@ def image(self, txn_id):
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
+    key = images_key('Avamar')
+    generation = GENERATIONS.generation(key)
     resp['content'] = {'image': vmware.list_images()}
+    GENERATIONS.observe(key, resp['content'], generation)
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='avamar.fleet_server', bind=True)
+def fleet(self, txn_id):
+    """Obtain every Avamar server owned by every user, grouped by owner, with
+    aggregate stats about the whole fleet.
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.show_fleet()
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        logger.info('Task complete')
+    return resp
+
+
+@app.task(name='avamar.reap_expired', bind=True)
+def reap_expired(self, dry_run, txn_id):
+    """Destroy the Avamar servers and NDMP accelerators that are past their TTL,
+    or have been idle for too long. Ran periodically via Celery beat.
+
+    :Returns: Dictionary
+
+    :param dry_run: Set to True to only report on what would be destroyed
+    :type dry_run: Boolean
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.reap_expired(logger, dry_run=dry_run)
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        if not dry_run:
+            for owner in resp['content']['expired'].keys():
+                GENERATIONS.bump(inventory_key('Avamar', owner))
+                GENERATIONS.bump(inventory_key('AvamarNDMP', owner))
+        logger.info('Task complete')
+    return resp
+
+
+@app.task(name='avamar.suspend_idle', bind=True)
+def suspend_idle(self, txn_id):
+    """Suspend the Avamar servers and NDMP accelerators that have been idle for
+    too long. Ran periodically via Celery beat.
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    resp['content'] = vmware.suspend_idle(logger)
+    for owner in resp['content']['suspended'].keys():
+        GENERATIONS.bump(inventory_key('Avamar', owner))
+        GENERATIONS.bump(inventory_key('AvamarNDMP', owner))
     logger.info('Task complete')
     return resp
 
 
+@app.task(name='avamar.stats', bind=True)
+def stats(self, txn_id):
+    """Obtain performance counters, like the MoRef cache hit-rate, from the
+    worker process that runs this task.
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    resp['content'] = vmware.worker_stats()
+    resp['content']['admission'] = ADMISSION.stats()
+    resp['content']['images'] = IMAGE_INDEX.report()
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='avamar.verify_images', bind=True)
+def verify_images(self, txn_id):
+    """Checksum the images that are new, or changed, so a create never uploads a
+    corrupt image. Ran periodically via Celery beat.
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = IMAGE_INDEX.refresh(logger)
+    except OSError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        logger.info('Task complete')
+    return resp
+
+
+@app.task(name='avamar.sync_library', bind=True)
+def sync_library(self, txn_id):
+    """Publish the images as template VMs on every datastore, so a create
+    clones the image instead of uploading it. Ran periodically via Celery beat.
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.sync_library(logger)
+    except OSError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        logger.info('Task complete')
+    return resp
+
+
 @app.task(name='avamar.show_ndmp', bind=True)
 def show_ndmp(self, username, txn_id):
     """Obtain basic information about Avamar NDMP Accelerators.
@@ -133,14 +499,21 @@ def show_ndmp(self, username, txn_id):
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
+    key = inventory_key('AvamarNDMP', username)
+    generation = GENERATIONS.generation(key)
     try:
-        info = vmware.show_avamar(username, kind='AvamarNDMP')
-    except ValueError as doh:
+        info, unhealthy = vmware.show_avamar(username, kind='AvamarNDMP')
+    except (ValueError, Overloaded) as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
     else:
         logger.info('Task complete')
         resp['content'] = info
+        if unhealthy:
+            resp['error'] = _incomplete(unhealthy)
+        else:
+            # Never cache a partial answer; the ETag would hide the missing VMs
+            GENERATIONS.observe(key, info, generation)
     return resp
 
 
@@ -171,17 +544,21 @@ def create_ndmp(self, username, machine_name, image, network, ip_config, txn_id)
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
+    _admit(self, username, logger)
     try:
         resp['content'] = vmware.create_avamar(username, machine_name, image, network, ip_config, logger, kind='AvamarNDMP')
-    except ValueError as doh:
+    except (ValueError, Overloaded) as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    finally:
+        ADMISSION.release(username, self.request.id)
+        GENERATIONS.bump(inventory_key('AvamarNDMP', username))
     logger.info('Task complete')
     return resp
 
 
 @app.task(name='avamar.delete_ndmp', bind=True)
-def delete_ndmp(self, username, machine_name, txn_id):
+def delete_ndmp(self, username, machine_name, txn_id, background=False):
     """Destroy an Avamar NDMP Accelerator
 
     :Returns: Dictionary
@@ -189,6 +566,42 @@ def delete_ndmp(self, username, machine_name, txn_id):
     :param username: The name of the user who wants to delete an Avamar NDMP Accelerator.
     :type username: String
 
+    :param machine_name: The name of the Avamar NDMP Accelerator. Supply a list to delete several at once.
+    :type machine_name: String or List
+
+    :param txn_id: A unique string supplied by the client to track the call through logs.
+    :type txn_id: String
+
+    :param background: Return once the accelerators are found, and destroy them via the ``avamar.reap`` task.
+    :type background: Boolean
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        names = vmware.delete_avamar(username, machine_name, logger, kind='AvamarNDMP', background=background)
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        if background:
+            reaper = reap.delay(username, names, 'AvamarNDMP', txn_id)
+            resp['content'] = {'reaper': reaper.id}
+        logger.info('Task complete')
+    finally:
+        GENERATIONS.bump(inventory_key('AvamarNDMP', username))
+    return resp
+
+
+@app.task(name='avamar.reset_ndmp', bind=True)
+def reset_ndmp(self, username, machine_name, txn_id):
+    """Revert an Avamar NDMP Accelerator to how it was right after being created
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who wants to reset an Avamar NDMP Accelerator.
+    :type username: String
+
     :param machine_name: The name of the Avamar NDMP Accelerator.
     :type machine_name: String
 
@@ -199,12 +612,74 @@ def delete_ndmp(self, username, machine_name, txn_id):
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
     try:
-        vmware.delete_avamar(username, machine_name, logger, kind='AvamarNDMP')
-    except ValueError as doh:
+        resp['content'] = vmware.reset_avamar(username, machine_name, logger, kind='AvamarNDMP')
+    except (ValueError, Overloaded) as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
     else:
         logger.info('Task complete')
+    finally:
+        GENERATIONS.bump(inventory_key('AvamarNDMP', username))
+    return resp
+
+
+@app.task(name='avamar.suspend_ndmp', bind=True)
+def suspend_ndmp(self, username, machine_name, txn_id):
+    """Suspend an Avamar NDMP Accelerator, so it stops using host memory until it is resumed
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who owns the Avamar NDMP Accelerator
+    :type username: String
+
+    :param machine_name: The name of the Avamar NDMP Accelerator
+    :type machine_name: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.suspend_avamar(username, machine_name, logger, kind='AvamarNDMP')
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        logger.info('Task complete')
+    finally:
+        GENERATIONS.bump(inventory_key('AvamarNDMP', username))
+    return resp
+
+
+@app.task(name='avamar.resume_ndmp', bind=True)
+def resume_ndmp(self, username, machine_name, txn_id):
+    """Resume an Avamar NDMP Accelerator that was suspended
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who owns the Avamar NDMP Accelerator
+    :type username: String
+
+    :param machine_name: The name of the Avamar NDMP Accelerator
+    :type machine_name: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.resume_avamar(username, machine_name, logger, kind='AvamarNDMP')
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        logger.info('Task complete')
+    finally:
+        GENERATIONS.bump(inventory_key('AvamarNDMP', username))
     return resp
 
 
@@ -221,6 +696,66 @@ def image_ndmp(self, txn_id):
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
+    key = images_key('AvamarNDMP')
+    generation = GENERATIONS.generation(key)
     resp['content'] = {'image': vmware.list_images(kind='AvamarNDMP')}
+    GENERATIONS.observe(key, resp['content'], generation)
     logger.info('Task complete')
     return resp
+
+
+@app.task(name='avamar.fleet_ndmp', bind=True)
+def fleet_ndmp(self, txn_id):
+    """Obtain every Avamar NDMP Accelerator owned by every user, grouped by owner,
+    with aggregate stats about the whole fleet.
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_AVAMAR_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.show_fleet(kind='AvamarNDMP')
+    except (ValueError, Overloaded) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        logger.info('Task complete')
+    return resp
+
+
+def _admit(task, username, logger):
+    """Block a deploy until admission control lets it start. Instead of holding
+    onto a worker while waiting, the task is retried later.
+
+    :Returns: None
+
+    :Raises: celery.exceptions.Retry
+
+    :param task: The bound Celery task performing the deploy
+    :type task: celery.app.task.Task
+
+    :param username: The user creating the deploy
+    :type username: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    if not ADMISSION.admit(username, task.request.id):
+        position = ADMISSION.position(task.request.id)
+        logger.info('Waiting to be admitted; %s deploys ahead in the queue', position)
+        raise task.retry(countdown=const.VLAB_AVAMAR_ADMIT_RETRY, max_retries=None)
+
+
+def _incomplete(unhealthy):
+    """Explain why a show task only returned some of the user's VMs.
+
+    :Returns: String
+
+    :param unhealthy: The vCenter servers that were skipped
+    :type unhealthy: List
+    """
+    return 'Results are incomplete; vCenter {} is unhealthy, try again later'.format(', '.join(unhealthy))
@@ -0,0 +1,177 @@
+# -*- coding: UTF-8 -*-
+"""
+Rate limits, and circuit-breaks, the SOAP calls made to vCenter. The budget is
+shared by every worker process on the host, so one busy task cannot starve vCenter
+for everyone else.
+"""
+import time
+
+from pyVmomi import vmodl
+
+from vlab_avamar_api.lib import breaker as circuit_breaker
+
+
+# SOAP methods that make vCenter do a lot of work, and get their own smaller budget.
+# These are the WSDL names; pyVmomi calls CloneVM_Task just ``Clone``. Destroy_Task
+# is left out: deletes and reaps come in batches, which the heavy budget can't
+# serve within VLAB_AVAMAR_THROTTLE_WAIT.
+HEAVY_METHODS = frozenset(['ImportVApp', 'CloneVM_Task'])
+
+
+class Throttle(object):
+    """A pair of token buckets (normal and heavy calls) plus a circuit breaker
+    for one vCenter server, stored in a SharedState.
+
+    :param name: The vCenter server being protected
+    :type name: String
+
+    :param state: Where the buckets and breaker are stored
+    :type state: vlab_avamar_api.lib.state.SharedState
+
+    :param rate: How many calls per second are allowed
+    :type rate: Float
+
+    :param burst: How many calls can be made at once after being idle
+    :type burst: Integer
+
+    :param heavy_rate: How many heavy calls per second are allowed
+    :type heavy_rate: Float
+
+    :param heavy_burst: How many heavy calls can be made at once after being idle
+    :type heavy_burst: Integer
+
+    :param failures: How many consecutive failures open the circuit breaker
+    :type failures: Integer
+
+    :param reset: How many seconds the breaker stays open before calls are tried again
+    :type reset: Integer
+
+    :param max_wait: How many seconds a call can wait for a token before giving up
+    :type max_wait: Integer
+    """
+    def __init__(self, name, state, rate, burst, heavy_rate, heavy_burst, failures, reset, max_wait):
+        self._name = name
+        self._state = state
+        self._buckets = {'normal': (rate, burst), 'heavy': (heavy_rate, heavy_burst)}
+        self._failures = failures
+        self._reset = reset
+        self._max_wait = max_wait
+        # Avoids taking the lock after every successful call when nothing has failed
+        self._saw_failures = False
+
+    def check(self):
+        """Fail fast if the circuit breaker is open.
+
+        :Returns: None
+
+        :Raises: vlab_avamar_api.lib.breaker.Overloaded
+        """
+        circuit_breaker.check(self._state, self._name, self._failures, self._reset)
+
+    def acquire(self, heavy=False):
+        """Block until the call is allowed by the rate limit.
+
+        :Returns: None
+
+        :Raises: vlab_avamar_api.lib.breaker.Overloaded
+
+        :param heavy: Set to True to also take a token from the heavy budget
+        :type heavy: Boolean
+        """
+        kinds = ['normal', 'heavy'] if heavy else ['normal']
+        give_up = time.time() + self._max_wait
+        while True:
+            now = time.time()
+            with self._state.locked() as data:
+                mine = data.setdefault(self._name, {})
+                breaker = mine.setdefault('breaker', {'failures': 0, 'opened': 0})
+                self._saw_failures = breaker['failures'] > 0
+                if self._open_for(breaker, now):
+                    raise circuit_breaker.Overloaded('vCenter {} is unhealthy; circuit breaker is open'.format(self._name))
+                wait = 0
+                for kind in kinds:
+                    wait = max(wait, self._refill(mine, kind, now))
+                if not wait:
+                    for kind in kinds:
+                        mine[kind]['tokens'] -= 1
+                    return
+            if now + wait > give_up:
+                raise circuit_breaker.Overloaded('vCenter {} is busy; timed out waiting on its rate limit'.format(self._name))
+            time.sleep(wait)
+
+    def record(self, ok):
+        """Update the circuit breaker with the outcome of a call.
+
+        :Returns: None
+
+        :param ok: Set to False if vCenter failed to handle the call
+        :type ok: Boolean
+        """
+        if ok and not self._saw_failures:
+            return
+        with self._state.locked() as data:
+            breaker = data.setdefault(self._name, {}).setdefault('breaker', {'failures': 0, 'opened': 0})
+            if ok:
+                breaker['failures'] = 0
+                breaker['opened'] = 0
+            else:
+                breaker['failures'] += 1
+                if breaker['failures'] >= self._failures:
+                    breaker['opened'] = time.time()
+            self._saw_failures = breaker['failures'] > 0
+
+    def install(self, vcenter):
+        """Route every SOAP call of a vCenter session through the throttle.
+
+        :Returns: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param vcenter: An established connection to vCenter
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        stub = vcenter._conn._stub
+        stub.InvokeMethod = self._wrap(stub.InvokeMethod, lambda mo, info, args: info.wsdlName in HEAVY_METHODS)
+        # Reading a lazy property of a pyVmomi object is an accessor call, and a single
+        # get_info makes dozens of them. They're cheap for vCenter, so they only feed
+        # the breaker; taking a token for each would cost a flock and a state rewrite.
+        stub.InvokeAccessor = self._wrap(stub.InvokeAccessor, None)
+        return vcenter
+
+    def stats(self):
+        """Obtain the current tokens and breaker state.
+
+        :Returns: Dictionary
+        """
+        return self._state.read().get(self._name, {})
+
+    def _wrap(self, func, is_heavy):
+        """Set ``is_heavy`` to None to exempt the calls from the rate limit"""
+        def wrapped(*args):
+            if is_heavy is not None:
+                self.acquire(heavy=is_heavy(*args))
+            try:
+                result = func(*args)
+            except vmodl.MethodFault:
+                # vCenter handled the call; it just said no (e.g. NotFound)
+                self.record(ok=True)
+                raise
+            except Exception:
+                self.record(ok=False)
+                raise
+            self.record(ok=True)
+            return result
+        return wrapped
+
+    def _refill(self, mine, kind, now):
+        """Add the tokens earned since the last call, and return how many seconds
+        until a token is available (zero if one is available now)."""
+        rate, burst = self._buckets[kind]
+        bucket = mine.setdefault(kind, {'tokens': burst, 'updated': now})
+        bucket['tokens'] = min(burst, bucket['tokens'] + (now - bucket['updated']) * rate)
+        bucket['updated'] = now
+        if bucket['tokens'] >= 1:
+            return 0
+        return (1 - bucket['tokens']) / rate
+
+    def _open_for(self, breaker, now):
+        """How many more seconds the breaker is open for; zero if closed"""
+        return circuit_breaker.open_for(breaker, self._failures, self._reset, now)
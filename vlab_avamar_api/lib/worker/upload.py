@@ -0,0 +1,253 @@
+# -*- coding: UTF-8 -*-
+"""
+Uploads the disks of an OVA to vCenter concurrently.
+
+``Ova.deploy`` from vlab_inf_common uploads one disk at a time, reading it out
+of the tarball in 8KB blocks through ``tarfile``. Here each VMDK is read straight
+from its offset within the OVA with large, aligned ``pread`` calls, and every
+disk gets its own HTTP connection to the lease URL.
+
+Compressed OVAs can't be read at an offset, so their disks are streamed out of
+the decompressor one after another instead (see ``compressed``).
+"""
+import os
+import sys
+import time
+import tarfile
+import threading
+import http.client
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vmodl
+from vlab_inf_common.ssl_context import get_context
+
+from vlab_avamar_api.lib.worker import compressed
+
+
+# Big reads keep the disk busy; aligned reads avoid straddling pages
+CHUNK_SIZE = 8 * 1024 * 1024
+# HTTPConnection only takes a blocksize from Python 3.7
+CONN_OPTIONS = {'blocksize': CHUNK_SIZE} if sys.version_info >= (3, 7) else {}
+
+
+class UploadStats(object):
+    """Tracks how fast this worker process uploads OVAs"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._uploads = 0
+        self._bytes = 0
+        self._seconds = 0.0
+        self._last_mbps = 0.0
+
+    def record(self, sent, seconds):
+        """Add a finished upload to the stats.
+
+        :Returns: None
+
+        :param sent: How many bytes were uploaded
+        :type sent: Integer
+
+        :param seconds: How long the upload took
+        :type seconds: Float
+        """
+        with self._lock:
+            self._uploads += 1
+            self._bytes += sent
+            self._seconds += seconds
+            self._last_mbps = _mbps(sent, seconds)
+
+    def report(self):
+        """Obtain the upload throughput, in megabytes per second.
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            return {'uploads': self._uploads,
+                    'bytes': self._bytes,
+                    'last_mbps': self._last_mbps,
+                    'avg_mbps': _mbps(self._bytes, self._seconds)}
+
+
+STATS = UploadStats()
+
+
+def upload_disks(ova_path, spec, lease, host, logger, parallel, progress_interval):
+    """Upload every disk of an OVA to an HttpNfcLease, then complete the lease.
+    The lease is aborted if any upload fails.
+
+    :Returns: None
+
+    :param ova_path: The local file path of the OVA
+    :type ova_path: String
+
+    :param spec: The import spec the lease was created with
+    :type spec: vim.OvfManager.CreateImportSpecResult
+
+    :param lease: A lease that's in the ready state
+    :type lease: vim.HttpNfcLease
+
+    :param host: The ESXi host to upload to, when the lease URL doesn't say
+    :type host: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param parallel: The max number of disks to upload at once, for uncompressed OVAs
+    :type parallel: Integer
+
+    :param progress_interval: How many seconds between updates of the lease progress
+    :type progress_interval: Integer
+    """
+    urls = {x.importKey: x.url for x in lease.info.deviceUrl}
+    if compressed.compression(ova_path):
+        # Progress is how much of the image was read; the disk sizes are unknown until reached
+        targets = {}
+        for file_item in spec.fileItem:
+            targets[file_item.path] = _device_url(urls, file_item, host)
+        sent = [0]
+        total = os.path.getsize(ova_path)
+        transfer = lambda: _upload_compressed(ova_path, targets, sent)
+    else:
+        members = _vmdk_members(ova_path)
+        uploads = []
+        for file_item in spec.fileItem:
+            if file_item.path not in members:
+                continue
+            offset, size = members[file_item.path]
+            uploads.append((_device_url(urls, file_item, host), offset, size))
+        total = sum(x[2] for x in uploads)
+        sent = [0] * len(uploads)
+        transfer = lambda: _upload_members(ova_path, uploads, sent, parallel)
+    done = threading.Event()
+    reporter = threading.Thread(target=_report_progress,
+                                args=(lease, sent, total, done, progress_interval, logger),
+                                daemon=True)
+    started = time.time()
+    reporter.start()
+    try:
+        disks, uploaded = transfer()
+        done.set()
+        reporter.join()
+        lease.Progress(100)
+        lease.Complete()
+    except vmodl.MethodFault as doh:
+        done.set()
+        lease.Abort(doh)
+        raise
+    except Exception as doh:
+        done.set()
+        lease.Abort(vmodl.fault.SystemError(reason=str(doh)))
+        raise
+    seconds = time.time() - started
+    STATS.record(uploaded, seconds)
+    logger.info('Uploaded %s disks (%s MB) in %s seconds; %s MB/s',
+                disks, round(uploaded / 1024**2), round(seconds, 1), _mbps(uploaded, seconds))
+
+
+def _device_url(urls, file_item, host):
+    """Find where to upload a file of the OVA to"""
+    url = urls.get(file_item.deviceId)
+    if url is None:
+        raise RuntimeError('Failed to find deviceUrl for file {}'.format(file_item.path))
+    return url.replace('*', host)
+
+
+def _upload_members(ova_path, uploads, sent, parallel):
+    """Upload the disks of an uncompressed OVA concurrently.
+
+    :Returns: Tuple - (disks uploaded, bytes uploaded)
+    """
+    with open(ova_path, 'rb') as the_file:
+        fd = the_file.fileno()
+        with ThreadPoolExecutor(max_workers=max(1, min(len(uploads), parallel))) as executor:
+            futures = [executor.submit(_upload, url, size, _read_chunks(fd, offset, size), sent, index)
+                       for index, (url, offset, size) in enumerate(uploads)]
+            for future in futures:
+                future.result()
+    return len(uploads), sum(x[2] for x in uploads)
+
+
+def _upload_compressed(ova_path, targets, read):
+    """Upload the disks of a compressed OVA one at a time, in the order they're
+    stored, while the image is decompressed in the background.
+
+    :Returns: Tuple - (disks uploaded, bytes uploaded)
+    """
+    disks = 0
+    uploaded = 0
+    with compressed.DecompressedStream(ova_path, read) as stream:
+        with tarfile.open(fileobj=stream, mode='r|', bufsize=CHUNK_SIZE) as tar:
+            for member in tar:
+                url = targets.get(member.name)
+                if url is None or not member.name.endswith('.vmdk'):
+                    continue
+                vmdk = tar.extractfile(member)
+                _upload(url, member.size, iter(lambda: vmdk.read(CHUNK_SIZE), b''), [0], 0)
+                disks += 1
+                uploaded += member.size
+    return disks, uploaded
+
+
+def _vmdk_members(ova_path):
+    """Find where each VMDK lives within the OVA tarball.
+
+    :Returns: Dictionary mapping the name of the VMDK to a (offset, size) tuple
+    """
+    with tarfile.open(ova_path) as tar:
+        return {x.name: (x.offset_data, x.size) for x in tar.getmembers() if x.name.endswith('.vmdk')}
+
+
+def _read_chunks(fd, offset, size):
+    """Yield a section of a file in large chunks that are aligned to CHUNK_SIZE"""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, size, os.POSIX_FADV_SEQUENTIAL)
+    end = offset + size
+    while offset < end:
+        amount = min(CHUNK_SIZE - (offset % CHUNK_SIZE), end - offset)
+        chunk = os.pread(fd, amount, offset)
+        if not chunk:
+            raise RuntimeError('OVA is truncated; expected {} more bytes'.format(end - offset))
+        offset += len(chunk)
+        yield chunk
+
+
+def _upload(url, size, chunks, sent, index):
+    """Stream one VMDK to its lease URL over a dedicated connection"""
+    parsed = urlparse(url)
+    conn = http.client.HTTPSConnection(parsed.hostname, parsed.port, context=get_context(), **CONN_OPTIONS)
+    try:
+        conn.putrequest('POST', parsed.path)
+        conn.putheader('Content-Length', str(size))
+        conn.putheader('Content-Type', 'application/x-vnd.vmware-streamVmdk')
+        conn.endheaders()
+        for chunk in chunks:
+            conn.send(chunk)
+            sent[index] += len(chunk)
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status >= 300:
+            raise RuntimeError('Upload to {} failed: HTTP {} {}'.format(url, resp.status, resp.reason))
+    finally:
+        conn.close()
+
+
+def _report_progress(lease, sent, total, done, interval, logger):
+    """Keep the lease alive by reporting progress, until the uploads are done"""
+    while not done.wait(interval):
+        percent = int(100 * sum(sent) / total) if total else 100
+        try:
+            lease.Progress(min(percent, 99))
+        except vmodl.fault.ManagedObjectNotFound:
+            # Race between the upload completing, and reporting progress
+            return
+        except Exception as doh:
+            logger.error('Failed to update lease progress: %s', doh)
+            return
+        logger.debug('Upload is %s%% complete', percent)
+
+
+def _mbps(sent, seconds):
+    if not seconds:
+        return 0.0
+    return round(sent / 1024**2 / seconds, 1)
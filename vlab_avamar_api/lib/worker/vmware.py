@@ -1,16 +1,77 @@
 # -*- coding: UTF-8 -*-
 """Business logic for backend worker tasks"""
+import re
+import copy
 import time
 import os.path
+import threading
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+import ujson
+from pyVmomi import vmodl
+from vlab_api_common import get_logger
 from vlab_inf_common.vmware import vCenter, Ova, vim, virtual_machine, consume_task
 
 from vlab_avamar_api.lib import const
+from vlab_avamar_api.lib.state import SharedState
+from vlab_avamar_api.lib.breaker import STATE_FILE as THROTTLE_STATE_FILE, Overloaded
+from vlab_avamar_api.lib.worker import upload, compressed, images
+from vlab_avamar_api.lib.worker.cache import MoRefCache
+from vlab_avamar_api.lib.worker.idle import IDLE, REAPER_IDLE
+from vlab_avamar_api.lib.worker.library import LIBRARY, location
+from vlab_avamar_api.lib.worker.placement import Placement
+from vlab_avamar_api.lib.worker.sharding import HashRing, SessionPool
+from vlab_avamar_api.lib.worker.throttle import Throttle
+
+
+log = get_logger(__name__, loglevel=const.VLAB_AVAMAR_LOG_LEVEL)
+MOREF_CACHE = MoRefCache(ttl=const.VLAB_AVAMAR_MOREF_TTL)
+RING = HashRing(servers=const.INF_VCENTER_SERVERS,
+                weights=const.VLAB_AVAMAR_SHARD_WEIGHTS,
+                overrides=const.VLAB_AVAMAR_SHARD_OVERRIDES)
+# One session pool per vCenter server, created on first use
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+# Shared by every worker process on the host
+THROTTLE_STATE = SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, THROTTLE_STATE_FILE))
+PLACEMENT_STATE = SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, 'vlab-avamar-placement.json'))
+# One throttle per vCenter server, created on first use
+THROTTLES = {}
+# Stats older than two refresh intervals mean the background refresher is dead/stuck
+PLACEMENTS = {x: Placement(datastores=const.INF_VCENTER_DATASTORES,
+                           hosts=const.INF_VCENTER_HOSTS,
+                           max_age=const.VLAB_AVAMAR_PLACEMENT_REFRESH * 2,
+                           state=PLACEMENT_STATE,
+                           name=x,
+                           lease=const.VLAB_AVAMAR_DEPLOY_LEASE) for x in RING.servers}
+# Base guest customization specs, by vCenter server and domain; see ``_base_spec``
+SPECS = {}
+SPECS_LOCK = threading.Lock()
+# How long this worker process took to warm up; see ``warm_up``
+WARM_UP = {'seconds': None, 'errors': [], 'status': None}
+# pyVmomi only builds a type the first time it's used
+WARM_TYPES = ('vim.Folder', 'vim.VirtualMachine', 'vim.Datastore', 'vim.HostSystem', 'vim.Network',
+              'vim.ResourcePool', 'vim.HttpNfcLease', 'vim.view.ContainerView', 'vim.vm.SnapshotTree',
+              'vim.OvfManager.CreateImportSpecParams', 'vim.OvfManager.NetworkMapping',
+              'vim.vm.customization.Specification', 'vim.vm.customization.AdapterMapping',
+              'vim.vm.customization.IPSettings', 'vim.vm.customization.GlobalIPSettings',
+              'vim.vm.customization.LinuxPrep', 'vim.vm.customization.FixedIp', 'vim.vm.customization.FixedName',
+              'vmodl.query.PropertyCollector.FilterSpec', 'vmodl.query.PropertyCollector.ObjectSpec',
+              'vmodl.query.PropertyCollector.PropertySpec', 'vmodl.query.PropertyCollector.TraversalSpec',
+              'vmodl.query.PropertyCollector.RetrieveOptions')
+RESET_SNAPSHOT = 'vlab-reset'
+HOSTNAME_REGEX = r'^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
 
 
 def show_avamar(username, kind='Avamar'):
-    """Obtain basic information about Avamar
+    """Obtain basic information about Avamar. A vCenter whose circuit breaker is
+    open is skipped instead of queried, so the VMs on the healthy vCenters are
+    still returned.
 
-    :Returns: Dictionary
+    :Returns: Tuple (Dictionary of VMs, List of the vCenter servers that were skipped)
+
+    :Raises: ValueError, vlab_avamar_api.lib.breaker.Overloaded
 
     :param username: The user requesting info about their Avamar machines.
     :type username: String
@@ -18,50 +79,243 @@ def show_avamar(username, kind='Avamar'):
     :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
     :type kind: String
     """
-    info = {}
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        avamar_vms = {}
-        for vm in folder.childEntity:
+    # Shed load instead of piling more onto a vCenter that's already struggling
+    unhealthy = {}
+    for server in RING.servers:
+        try:
+            _throttle(server).check()
+        except Overloaded as doh:
+            unhealthy[server] = doh
+
+    def show(server, vcenter):
+        try:
+            vms = _get_folder_vms(vcenter, username)
+        except ValueError as doh:
+            # The user has no folder on this shard
+            return doh
+        found = {}
+        for vm in vms:
             info = virtual_machine.get_info(vcenter, vm, username)
             if info['meta']['component'] == kind:
-                avamar_vms[vm.name] = info
-    return avamar_vms
+                if const.VLAB_AVAMAR_TTL_HOURS and info['meta']['created']:
+                    # Lets owners know when the reaper will destroy the VM
+                    info['expires'] = info['meta']['created'] + const.VLAB_AVAMAR_TTL_HOURS * 3600
+                found[vm.name] = info
+        return found
+
+    results = _fan_out(show, servers=[x for x in RING.servers if x not in unhealthy])
+    errors = [x for x in results.values() if isinstance(x, ValueError)]
+    if len(errors) == len(results):
+        # Nothing was found; an unhealthy vCenter might have the user's VMs
+        raise (list(unhealthy.values()) + errors)[0]
+    avamar_vms = {}
+    for found in results.values():
+        if not isinstance(found, ValueError):
+            avamar_vms.update(found)
+    return avamar_vms, sorted(unhealthy.keys())
+
+
+def show_fleet(kind='Avamar'):
+    """Obtain every Avamar machine deployed for every user, along with some
+    aggregate stats about the whole fleet.
+
+    All the data is obtained via a single PropertyCollector query against the
+    top-level vLab directory of each vCenter; this avoids walking each user's folder.
+
+    :Returns: Dictionary
+
+    :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
+    :type kind: String
+    """
+    properties = {vim.VirtualMachine : ['name', 'parent', 'config.annotation',
+                                        'runtime.powerState', 'summary.storage.committed'],
+                  vim.Folder : ['name']}
+    def retrieve(server, vcenter):
+        top_dir = vcenter.get_vm_folder(const.INF_VCENTER_TOP_LVL_DIR)
+        return _retrieve_properties(vcenter, top_dir, properties)
+
+    fleet = {'machines': {}, 'summary': {'total': 0, 'disk_gb': 0, 'owners': {}, 'versions': {}, 'states': {}}}
+    summary = fleet['summary']
+    for found in _fan_out(retrieve).values():
+        # MoRef IDs are only unique within one vCenter
+        folders = {x._moId : y['name'] for x, y in found if isinstance(x, vim.Folder)}
+        for the_vm, props in found:
+            if not isinstance(the_vm, vim.VirtualMachine):
+                continue
+            meta = _parse_meta(props.get('config.annotation'))
+            if meta.get('component') != kind:
+                continue
+            parent = props.get('parent')
+            owner = folders.get(parent._moId, 'Unknown') if parent else 'Unknown'
+            version = meta.get('version', 'Unknown')
+            state = props.get('runtime.powerState', 'Unknown')
+            disk_gb = round(props.get('summary.storage.committed', 0) / 1024**3, 2)
+            fleet['machines'].setdefault(owner, {})[props['name']] = {'version': version,
+                                                                      'state': state,
+                                                                      'disk_gb': disk_gb,
+                                                                      'created': meta.get('created', 0)}
+            summary['total'] += 1
+            summary['disk_gb'] += disk_gb
+            summary['owners'][owner] = summary['owners'].get(owner, 0) + 1
+            summary['versions'][version] = summary['versions'].get(version, 0) + 1
+            summary['states'][state] = summary['states'].get(state, 0) + 1
+    summary['disk_gb'] = round(summary['disk_gb'], 2)
+    return fleet
+
+
+def reap_expired(logger, dry_run=True):
+    """Find every Avamar server and NDMP accelerator that's past the TTL or has
+    been idle too long, and destroy them. How long a VM has been idle is tracked
+    across runs, so a VM is only idle for ``VLAB_AVAMAR_IDLE_HOURS`` if every run
+    in that time found it idle.
+
+    :Returns: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param dry_run: Set to False to actually destroy the VMs; otherwise only report on them.
+    :type dry_run: Boolean
+    """
+    properties = {vim.VirtualMachine : ['name', 'parent', 'config.annotation', 'runtime.powerState',
+                                        'summary.quickStats.overallCpuUsage'],
+                  vim.Folder : ['name']}
+    now = time.time()
+
+    def reap(server, vcenter):
+        top_dir = vcenter.get_vm_folder(const.INF_VCENTER_TOP_LVL_DIR)
+        found = _retrieve_properties(vcenter, top_dir, properties)
+        idle_seconds = {}
+        if const.VLAB_AVAMAR_IDLE_HOURS:
+            idle_seconds = REAPER_IDLE.observe(server, _idle_samples(found), now)
+        shard_report, doomed = _find_expired(found, now, idle_seconds)
+        for owner, machines in shard_report['warned'].items():
+            for name, expires in machines.items():
+                logger.warning('%s owned by %s will be destroyed at %s', name, owner, time.ctime(expires))
+        for owner, machines in shard_report['expired'].items():
+            logger.info('%s %s owned by %s: %s', 'Would destroy' if dry_run else 'Destroying', len(machines), owner, machines)
+        if not dry_run:
+            _destroy_vms(doomed, logger)
+        return shard_report
+
+    report = {'expired': {}, 'warned': {}}
+    for shard_report in _fan_out(reap).values():
+        for owner, machines in shard_report['expired'].items():
+            report['expired'].setdefault(owner, []).extend(machines)
+        for owner, machines in shard_report['warned'].items():
+            report['warned'].setdefault(owner, {}).update(machines)
+    report['dry_run'] = dry_run
+    return report
+
 
+def suspend_idle(logger):
+    """Suspend every Avamar server and NDMP accelerator that's been idle for
+    ``VLAB_AVAMAR_SUSPEND_IDLE_MINUTES``, so it stops using host memory. A VM is
+    idle while its CPU usage is at most ``VLAB_AVAMAR_IDLE_CPU_MHZ`` and its
+    network usage is at most ``VLAB_AVAMAR_IDLE_NET_KBPS``.
 
-def delete_avamar(username, machine_name, logger, kind='Avamar'):
+    :Returns: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    properties = {vim.VirtualMachine : ['name', 'parent', 'config.annotation', 'runtime.powerState',
+                                        'summary.quickStats.overallCpuUsage'],
+                  vim.Folder : ['name']}
+    idle_for = const.VLAB_AVAMAR_SUSPEND_IDLE_MINUTES * 60
+    now = time.time()
+
+    def check(server, vcenter):
+        top_dir = vcenter.get_vm_folder(const.INF_VCENTER_TOP_LVL_DIR)
+        found = _retrieve_properties(vcenter, top_dir, properties)
+        folders = {x._moId : y['name'] for x, y in found if isinstance(x, vim.Folder)}
+        running = {}
+        quiet = []
+        for the_vm, props in found:
+            if not isinstance(the_vm, vim.VirtualMachine):
+                continue
+            if _parse_meta(props.get('config.annotation')).get('component') not in ('Avamar', 'AvamarNDMP'):
+                continue
+            if props.get('runtime.powerState') != vim.VirtualMachinePowerState.poweredOn:
+                continue
+            running[the_vm] = props
+            if props.get('summary.quickStats.overallCpuUsage', 0) <= const.VLAB_AVAMAR_IDLE_CPU_MHZ:
+                quiet.append(the_vm)
+        # Only the VMs with an idle CPU are worth asking about their network;
+        # the rest, and VMs without network stats, are busy
+        network = _net_usage(vcenter, quiet)
+        samples = {x._moId : network.get(x._moId, float('inf')) <= const.VLAB_AVAMAR_IDLE_NET_KBPS
+                   for x in running.keys()}
+        seconds = IDLE.observe(server, samples, now)
+        report = {'suspended': {}, 'idle': {}}
+        doomed = []
+        for the_vm, props in running.items():
+            if the_vm._moId not in seconds:
+                continue
+            parent = props.get('parent')
+            owner = folders.get(parent._moId, 'Unknown') if parent else 'Unknown'
+            if seconds[the_vm._moId] >= idle_for:
+                report['suspended'].setdefault(owner, []).append(props['name'])
+                doomed.append(the_vm)
+            else:
+                report['idle'].setdefault(owner, {})[props['name']] = round(seconds[the_vm._moId])
+        for owner, machines in report['suspended'].items():
+            logger.info('Suspending %s idle VMs owned by %s: %s', len(machines), owner, machines)
+        _suspend_vms(doomed, logger)
+        IDLE.forget(server, [x._moId for x in doomed])
+        return report
+
+    report = {'suspended': {}, 'idle': {}}
+    for shard_report in _fan_out(check).values():
+        for owner, machines in shard_report['suspended'].items():
+            report['suspended'].setdefault(owner, []).extend(machines)
+        for owner, machines in shard_report['idle'].items():
+            report['idle'].setdefault(owner, {}).update(machines)
+    return report
+
+
+def delete_avamar(username, machine_name, logger, kind='Avamar', background=False):
     """Unregister and destroy a user's Avamar
 
-    :Returns: None
+    :Returns: List
 
     :param username: The user who wants to delete their jumpbox
     :type username: String
 
-    :param machine_name: The name of the VM to delete
-    :type machine_name: String
+    :param machine_name: The name of the VM to delete. Supply a list to delete several VMs at once.
+    :type machine_name: String or List
 
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
 
     :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
     :type kind: String
+
+    :param background: Only verify the VMs exist, and let the caller destroy them
+                       later (i.e. via the ``avamar.reap`` task).
+    :type background: Boolean
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == machine_name:
-                info = virtual_machine.get_info(vcenter, entity, username)
-                if info['meta']['component'] == kind:
-                    logger.debug('powering off VM')
-                    virtual_machine.power(entity, state='off')
-                    delete_task = entity.Destroy_Task()
-                    logger.debug('blocking while VM is being destroyed')
-                    consume_task(delete_task)
-                    break
-        else:
-            raise ValueError('No {} named {} found'.format(kind, machine_name))
+    names = [machine_name] if isinstance(machine_name, str) else machine_name
+    # One user's VMs can be spread across shards, so every name is looked up
+    # before anything is destroyed; a typo shouldn't leave half a batch deleted.
+    with ExitStack() as sessions:
+        found = {}
+        for server in RING.candidates(username):
+            missing = [x for x in names if x not in found]
+            if not missing:
+                break
+            vcenter = sessions.enter_context(_session(server))
+            try:
+                found.update(_locate_avamars(vcenter, username, missing, kind))
+            except ValueError:
+                # The user has no folder on this shard
+                continue
+        missing = sorted(set(names) - set(found))
+        if missing:
+            raise ValueError('No {} named {} found'.format(kind, ', '.join(missing)))
+        if not background:
+            _destroy_vms(list(found.values()), logger)
+    return sorted(set(names))
 
 
 def create_avamar(username, machine_name, image, network, ip_config, logger, kind='Avamar'):
@@ -90,26 +344,46 @@ def create_avamar(username, machine_name, image, network, ip_config, logger, kin
     :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
     :type kind: String
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER,
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        image_name = convert_name(image, kind)
-        logger.info('Deploying %s server named % running %s', kind, machine_name, image_name)
-        ova = Ova(os.path.join(const.VLAB_AVAMAR_IMAGES_DIR, image_name))
-        try:
-            network_map = vim.OvfManager.NetworkMapping()
-            network_map.name = ova.networks[0]
+    started = time.time()
+    image_name = convert_name(image, kind)
+    # Fail before spending 10+ minutes uploading a corrupt image
+    images.IMAGE_INDEX.check(image_name)
+    server, datastore, host = _choose_placement(username, network)
+    placement = PLACEMENTS[server]
+    with _session(server) as vcenter:
+        logger.info('Deploying %s server named %s running %s', kind, machine_name, image_name)
+        logger.info('Placing %s on vCenter %s, datastore %s and host %s', machine_name, server, datastore, host)
+        template = _find_template(vcenter, server, image_name, datastore)
+        if template is not None:
+            logger.info('Cloning the library template of %s', image_name)
+            placement.started(datastore, host)
             try:
-                network_map.network = vcenter.networks[network]
-            except KeyError:
-                raise ValueError('No such network named {}'.format(network))
-            the_vm = virtual_machine.deploy_from_ova(vcenter=vcenter,
-                                                     ova=ova,
-                                                     network_map=[network_map],
-                                                     username=username,
-                                                     machine_name=machine_name,
-                                                     logger=logger)
-        finally:
-            ova.close()
+                the_vm = _clone_template(vcenter=vcenter,
+                                         template=template,
+                                         network=network,
+                                         username=username,
+                                         machine_name=machine_name,
+                                         datastore=datastore,
+                                         host=host)
+            except vmodl.fault.ManagedObjectNotFound:
+                MOREF_CACHE.invalidate(vim.VirtualMachine, _template_name(image_name, datastore))
+                MOREF_CACHE.invalidate(vim.Network, network)
+                MOREF_CACHE.invalidate(vim.Datastore, datastore)
+                MOREF_CACHE.invalidate(vim.HostSystem, host)
+                raise
+            finally:
+                # Cloning says nothing about how fast uploads to the datastore are
+                placement.finished(datastore, host, None)
+        else:
+            the_vm = _upload_image(vcenter=vcenter,
+                                   placement=placement,
+                                   image_name=image_name,
+                                   network=network,
+                                   username=username,
+                                   machine_name=machine_name,
+                                   datastore=datastore,
+                                   host=host,
+                                   logger=logger)
         logger.info('Blocking while VM boots')
         # For whatever reason, we have to power on the machine before vSphere
         # will recognize that VMware Tools is installed. From that point, we
@@ -118,36 +392,184 @@ def create_avamar(username, machine_name, image, network, ip_config, logger, kin
         logger.info("Powering Off VM")
         virtual_machine.power(the_vm, state='off')
         logger.info("Configuring Network")
-        _configure_network(the_vm, ip_config)
+        customizing = _configure_network(vcenter, the_vm, ip_config, block=False)
         if kind == 'Avamar':
             logger.info("Adding VMDK")
-            virtual_machine.add_vmdk(the_vm, disk_size=250) #GB
-        logger.info("Powering on VM")
-        virtual_machine.power(the_vm, state='on')
+            _add_vmdk(the_vm, customizing, disk_size=250) #GB
+        consume_task(customizing)
         meta_data = {'component' : kind,
                      'created' : time.time(),
                      'version' : image,
                      'configured' : True,
                      'generation' : 1}
         virtual_machine.set_meta(the_vm, meta_data)
-        info = virtual_machine.get_info(vcenter, the_vm, username, ensure_ip=True)
+        logger.info("Powering on VM")
+        booted = time.time()
+        virtual_machine.power(the_vm, state='on')
+        _wait_for_ip(vcenter, the_vm, ip_config.get('static-ip'), const.VLAB_AVAMAR_IP_TIMEOUT)
+        # The VM has booted once it reports its IP; nothing after this counts
+        boot_seconds = round(time.time() - booted, 1)
+        logger.info('VM reported its IP {} seconds after powering on'.format(boot_seconds))
+        timings = {'create_seconds': round(time.time() - started, 1),
+                   'boot_seconds': boot_seconds}
+        # Lets ``resume_avamar`` compare against the cold boot
+        meta_data.update(timings)
+        virtual_machine.set_meta(the_vm, meta_data)
+        if const.VLAB_AVAMAR_RESET_SNAPSHOT:
+            logger.info("Taking snapshot for fast resets")
+            _take_reset_snapshot(the_vm, timings)
+        info = virtual_machine.get_info(vcenter, the_vm, username)
         return  {the_vm.name: info}
 
 
+def reset_avamar(username, machine_name, logger, kind='Avamar'):
+    """Revert an Avamar to the snapshot taken right after it was created.
+    This is much faster than deleting and creating the same version again.
+    The snapshot is only taken when VLAB_AVAMAR_RESET_SNAPSHOT is enabled.
+
+    :Returns: Dictionary
+
+    :Raises: ValueError
+
+    :param username: The user who owns the Avamar
+    :type username: String
+
+    :param machine_name: The name of the VM to reset
+    :type machine_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
+    :type kind: String
+    """
+    def reset(server, vcenter):
+        the_vm = _find_avamars(vcenter, username, [machine_name], kind)[0]
+        snapshot = None
+        if the_vm.snapshot:
+            snapshot = _find_snapshot(the_vm.snapshot.rootSnapshotList, RESET_SNAPSHOT)
+        if snapshot is None:
+            error = '{} {} has no reset snapshot. Delete and create it again instead.'.format(kind, machine_name)
+            if not const.VLAB_AVAMAR_RESET_SNAPSHOT:
+                error = '{} {} has no reset snapshot; they are not taken on this server. Delete and create it again instead.'.format(kind, machine_name)
+            raise ValueError(error)
+        started = time.time()
+        logger.info('Reverting to snapshot %s', RESET_SNAPSHOT)
+        consume_task(snapshot.snapshot.RevertToSnapshot_Task())
+        # The snapshot includes memory, so this is a noop unless the VM was
+        # powered off when the snapshot was taken.
+        virtual_machine.power(the_vm, state='on')
+        timings = _parse_meta(snapshot.description)
+        timings['reset_seconds'] = round(time.time() - started, 1)
+        logger.info('Reset took %s seconds; creating took %s seconds',
+                    timings['reset_seconds'], timings.get('create_seconds', 'unknown'))
+        info = virtual_machine.get_info(vcenter, the_vm, username)
+        info['timings'] = timings
+        return {the_vm.name: info}
+
+    return _on_owning_shard(username, reset)
+
+
+def suspend_avamar(username, machine_name, logger, kind='Avamar'):
+    """Suspend an Avamar, so it stops using host memory until it's resumed.
+
+    :Returns: Dictionary
+
+    :Raises: ValueError
+
+    :param username: The user who owns the Avamar
+    :type username: String
+
+    :param machine_name: The name of the VM to suspend
+    :type machine_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
+    :type kind: String
+    """
+    def suspend(server, vcenter):
+        the_vm = _find_avamars(vcenter, username, [machine_name], kind)[0]
+        power_state = the_vm.runtime.powerState
+        if power_state == vim.VirtualMachinePowerState.poweredOff:
+            raise ValueError('{} {} is powered off, so there is nothing to suspend'.format(kind, machine_name))
+        if power_state == vim.VirtualMachinePowerState.poweredOn:
+            started = time.time()
+            _suspend_vms([the_vm], logger)
+            logger.info('Suspending took %s seconds', round(time.time() - started, 1))
+        info = virtual_machine.get_info(vcenter, the_vm, username)
+        return {the_vm.name: info}
+
+    return _on_owning_shard(username, suspend)
+
+
+def resume_avamar(username, machine_name, logger, kind='Avamar'):
+    """Resume a suspended Avamar. The time until the guest reports an IP again
+    is reported, next to how long the first (cold) boot took.
+
+    :Returns: Dictionary
+
+    :Raises: ValueError, RuntimeError
+
+    :param username: The user who owns the Avamar
+    :type username: String
+
+    :param machine_name: The name of the VM to resume
+    :type machine_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
+    :type kind: String
+    """
+    def resume(server, vcenter):
+        the_vm = _find_avamars(vcenter, username, [machine_name], kind)[0]
+        if the_vm.runtime.powerState != vim.VirtualMachinePowerState.suspended:
+            raise ValueError('{} {} is not suspended'.format(kind, machine_name))
+        started = time.time()
+        logger.info('Resuming %s', machine_name)
+        if not virtual_machine.power(the_vm, state='on'):
+            raise RuntimeError('Unable to resume {} {}'.format(kind, machine_name))
+        _wait_for_ip(vcenter, the_vm, None, const.VLAB_AVAMAR_IP_TIMEOUT)
+        resume_seconds = round(time.time() - started, 1)
+        info = virtual_machine.get_info(vcenter, the_vm, username)
+        # The timings of the create are kept in the meta data; older VMs only
+        # have them in the description of the reset snapshot
+        meta = info.get('meta', {})
+        timings = {x: meta[x] for x in ('create_seconds', 'boot_seconds') if x in meta}
+        if not timings and the_vm.snapshot:
+            snapshot = _find_snapshot(the_vm.snapshot.rootSnapshotList, RESET_SNAPSHOT)
+            if snapshot is not None:
+                timings = _parse_meta(snapshot.description)
+        timings['resume_seconds'] = resume_seconds
+        logger.info('Resume took %s seconds; the cold boot took %s seconds',
+                    timings['resume_seconds'], timings.get('boot_seconds', 'unknown'))
+        info['timings'] = timings
+        return {the_vm.name: info}
+
+    return _on_owning_shard(username, resume)
+
+
 def list_images(kind='Avamar'):
-    """Obtain a list of available versions of Avamar that can be created
+    """Obtain a list of available versions of Avamar that can be created. An
+    image can be an OVA, or an OVA compressed with zstd or gzip.
 
     :Returns: List
     """
     prefix = _kind_to_prefix(kind)
     images = os.listdir(const.VLAB_AVAMAR_IMAGES_DIR)
-    images = [convert_name(x, kind, to_version=True) for x in images if x.startswith(prefix)]
-    return images
+    images = [convert_name(x, kind, to_version=True) for x in images if x.startswith(prefix) and compressed.readable(x)]
+    # The same version might be stored compressed and uncompressed
+    return list(dict.fromkeys(images))
 
 
 def convert_name(name, kind, to_version=False):
     """This function centralizes converting between the name of the OVA, and the
-    version of software it contains.
+    version of software it contains. When converting to the name of the OVA, a
+    compressed image is picked over an uncompressed one, because it's less to
+    read off the disk.
 
     :param name: The thing to covert
     :type name: String
@@ -157,9 +579,14 @@ def convert_name(name, kind, to_version=False):
     """
     prefix = _kind_to_prefix(kind)
     if to_version:
-        return name.split('-')[-1].replace('.ova', '')
+        return name.split('-')[-1].split('.ova')[0]
     else:
-        return '{}-{}.ova'.format(prefix, name)
+        ova_name = '{}-{}.ova'.format(prefix, name)
+        for suffix in compressed.SUFFIXES:
+            candidate = ova_name + suffix
+            if compressed.readable(candidate) and os.path.exists(os.path.join(const.VLAB_AVAMAR_IMAGES_DIR, candidate)):
+                return candidate
+        return ova_name
 
 
 def _kind_to_prefix(kind):
@@ -170,31 +597,1338 @@ def _kind_to_prefix(kind):
     return prefix
 
 
-def _configure_network(the_vm, ip_config):
-    # Boilerplate...
-    adaptermap = vim.vm.customization.AdapterMapping()
-    globalip = vim.vm.customization.GlobalIPSettings()
-    adaptermap.adapter = vim.vm.customization.IPSettings()
-    # Configure IP & DNS
-    adaptermap.adapter.ip = vim.vm.customization.FixedIp()
-    adaptermap.adapter.ip.ipAddress = ip_config['static-ip']
-    adaptermap.adapter.subnetMask = ip_config['netmask']
-    adaptermap.adapter.gateway = ip_config['default-gateway']
-    globalip.dnsServerList = ip_config['dns']
-    adaptermap.adapter.dnsDomain = ip_config['domain']
-    ident = vim.vm.customization.LinuxPrep()
-    ident.domain = ip_config['domain']
-    ident.hostName = vim.vm.customization.FixedName()
-    ident.hostName.name = the_vm.name
-    # Create the configuration spec
-    spec = vim.vm.customization.Specification()
-    spec.nicSettingMap = [adaptermap]
-    spec.globalIPSettings = globalip
-    spec.identity = ident
-    task = the_vm.Customize(spec=spec)
+def worker_stats():
+    """Obtain performance counters from this worker process.
+
+    :Returns: Dictionary
+    """
+    return {'moref_cache': MOREF_CACHE.stats(),
+            'placement': {x: y.report() for x, y in PLACEMENTS.items()},
+            'sessions': {x: y.stats() for x, y in POOLS.items()},
+            'throttle': {x: y.stats() for x, y in THROTTLES.items()},
+            'upload': upload.STATS.report(),
+            'warm_up': dict(WARM_UP)}
+
+
+def sync_library(logger):
+    """Publish every verified image as a template VM, on every datastore of
+    every vCenter, so ``create_avamar`` can clone the image instead of
+    uploading it. A template is only (re)published when it's missing, or was
+    made from an image with a different SHA-256; unverified images are skipped.
+
+    :Returns: Dictionary - The sync progress, and which images are stale
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    wanted = {}
+    for kind in ('Avamar', 'AvamarNDMP'):
+        for version in list_images(kind):
+            image_name = convert_name(version, kind)
+            wanted[image_name] = images.IMAGE_INDEX.sha256(image_name)
+
+    def sync(server, vcenter):
+        folder = _library_folder(vcenter)
+        published = {}
+        for the_vm, props in _retrieve_properties(vcenter, folder, {vim.VirtualMachine: ['name', 'config.annotation']}):
+            published[props['name']] = (the_vm, _parse_meta(props.get('config.annotation')))
+        for image_name, sha256 in sorted(wanted.items()):
+            if sha256 is None:
+                continue
+            for datastore in const.INF_VCENTER_DATASTORES:
+                name = _template_name(image_name, datastore)
+                the_vm, meta = published.get(name, (None, {}))
+                if meta.get('sha256') == sha256:
+                    if not LIBRARY.current(server, image_name, datastore, sha256):
+                        LIBRARY.finished(server, image_name, datastore, sha256)
+                    continue
+                logger.info('Publishing %s to datastore %s on %s', image_name, datastore, server)
+                LIBRARY.started(server, image_name, datastore, sha256)
+                error = None
+                try:
+                    if the_vm is not None:
+                        MOREF_CACHE.invalidate(vim.VirtualMachine, name)
+                        consume_task(the_vm.Destroy_Task())
+                    _publish(vcenter, server, image_name, sha256, datastore, logger)
+                except (vmodl.MethodFault, RuntimeError, OSError, ValueError) as doh:
+                    error = '{}'.format(getattr(doh, 'msg', None) or doh) or doh.__class__.__name__
+                    logger.error('Unable to publish %s to datastore %s on %s: %s', image_name, datastore, server, error)
+                LIBRARY.finished(server, image_name, datastore, sha256, error=error)
+
+    _fan_out(sync)
+    locations = [location(x, y) for x in RING.servers for y in const.INF_VCENTER_DATASTORES]
+    return LIBRARY.report(wanted, locations)
+
+
+def refresh_placement(vcenter, server):
+    """Update the capacity stats that the placement engine scores datastores
+    and hosts with. Every datastore and host is obtained in one PropertyCollector call.
+
+    :Returns: None
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param server: The vCenter server (shard) the connection is for
+    :type server: String
+    """
+    properties = {vim.Datastore: ['name', 'summary.freeSpace', 'summary.accessible'],
+                  vim.HostSystem: ['name', 'datastore', 'runtime.inMaintenanceMode',
+                                   'runtime.connectionState', 'summary.hardware.memorySize',
+                                   'summary.quickStats.overallMemoryUsage']}
+    found = _retrieve_properties(vcenter, vcenter.content.rootFolder, properties)
+    datastores = {}
+    datastore_names = {}
+    for obj, props in found:
+        if isinstance(obj, vim.Datastore):
+            MOREF_CACHE.put(vcenter, vim.Datastore, props['name'], obj)
+            datastore_names[obj._moId] = props['name']
+            datastores[props['name']] = {'free': props.get('summary.freeSpace', 0),
+                                         'accessible': props.get('summary.accessible', False)}
+    hosts = {}
+    for obj, props in found:
+        if isinstance(obj, vim.HostSystem):
+            MOREF_CACHE.put(vcenter, vim.HostSystem, props['name'], obj)
+            usable = props.get('runtime.connectionState') == 'connected' and not props.get('runtime.inMaintenanceMode', True)
+            memory_mb = props.get('summary.hardware.memorySize', 0) / 1024**2
+            hosts[props['name']] = {'free_mb': memory_mb - props.get('summary.quickStats.overallMemoryUsage', 0),
+                                    'usable': usable,
+                                    'datastores': [datastore_names.get(x._moId) for x in props.get('datastore', [])]}
+    PLACEMENTS[server].update(datastores, hosts)
+
+
+def start_placement_refresher():
+    """Keep the placement stats fresh via a background thread, so deploys
+    never have to wait on vCenter to score datastores and hosts.
+
+    :Returns: threading.Thread
+    """
+    def refresher():
+        while True:
+            for server in RING.servers:
+                try:
+                    with _session(server) as vcenter:
+                        refresh_placement(vcenter, server)
+                except Exception as doh:
+                    log.error('Unable to refresh placement stats of %s: %s', server, doh)
+            time.sleep(const.VLAB_AVAMAR_PLACEMENT_REFRESH)
+    thread = threading.Thread(target=refresher, name='placement-refresher', daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_up(timeout, record=None):
+    """Do the work that the first task of a new worker process would otherwise
+    pay for: building the pyVmomi types, logging into every vCenter, looking up
+    the MoRefs of the user folders and networks, and listing the images. Whatever
+    is still running after ``timeout`` seconds finishes in the background.
+
+    The status of the warm up is "ok", "failed" if anything could not be preloaded,
+    or "timed out" if it's still running.
+
+    :Returns: Dictionary - How many seconds it took, anything that could not be preloaded, and the status
+
+    :param timeout: How many seconds to wait for the warm up to finish
+    :type timeout: Integer
+
+    :param record: Called with the same dictionary that's returned. If the warm up
+                   timed out, it's called again once the warm up finally ends.
+    :type record: Function
+    """
+    started = time.time()
+    errors = []
+    lock = threading.Lock()
+    progress = {'done': False, 'late': False}
+
+    def preload(server):
+        try:
+            with _session(server) as vcenter:
+                top_dir = vcenter.get_vm_folder(const.INF_VCENTER_TOP_LVL_DIR)
+                for folder, props in _retrieve_properties(vcenter, top_dir, {vim.Folder: ['name']}):
+                    MOREF_CACHE.put(vcenter, vim.Folder, props['name'], folder)
+                for name, network in _list_networks(vcenter).items():
+                    MOREF_CACHE.put(vcenter, vim.Network, name, network)
+        except Exception as doh:
+            errors.append('Unable to preload {}: {}'.format(server, doh))
+
+    def finish(timed_out):
+        """Must hold the lock before calling"""
+        WARM_UP['seconds'] = round(time.time() - started, 3)
+        WARM_UP['errors'] = list(errors)
+        if timed_out:
+            WARM_UP['status'] = 'timed out'
+            WARM_UP['errors'].append('Still warming up after {} seconds'.format(timeout))
+        else:
+            WARM_UP['status'] = 'failed' if errors else 'ok'
+        log.info('Warm up %s after %s seconds', WARM_UP['status'], WARM_UP['seconds'])
+        for error in WARM_UP['errors']:
+            log.error(error)
+        if record is not None:
+            record(dict(WARM_UP))
+        return dict(WARM_UP)
+
+    def run():
+        try:
+            for name in WARM_TYPES:
+                _load_type(name)
+            for kind in ('Avamar', 'AvamarNDMP'):
+                try:
+                    list_images(kind)
+                except OSError as doh:
+                    errors.append('Unable to list images: {}'.format(doh))
+            servers = RING.servers
+            with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+                list(executor.map(preload, servers))
+        finally:
+            with lock:
+                progress['done'] = True
+                if progress['late']:
+                    # Otherwise the worker would say it's still warming up, forever
+                    finish(timed_out=False)
+
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    thread.join(timeout)
+    with lock:
+        progress['late'] = not progress['done']
+        return finish(timed_out=progress['late'])
+
+
+def _load_type(name):
+    """Make pyVmomi build a type, like ``vim.vm.ConfigSpec``, by looking it up"""
+    module, *parts = name.split('.')
+    obj = {'vim': vim, 'vmodl': vmodl}[module]
+    for part in parts:
+        obj = getattr(obj, part)
+    return obj
+
+
+def _choose_placement(username, network):
+    """Pick the vCenter, datastore and host for a new VM. The user's home vCenter
+    is used unless it's out of capacity, in which case the next vCenter on the
+    hash ring is tried. A vCenter without the user's folder or network is skipped,
+    because the deploy would only fail there. The stats are only refreshed inline
+    if the background refresher has fallen behind.
+
+    :Returns: Tuple (server, datastore name, host name)
+
+    :Raises: ValueError, RuntimeError
+
+    :param username: The user creating the new VM
+    :type username: String
+
+    :param network: The name of the network the new VM connects to
+    :type network: String
+    """
+    error = None
+    missing = None
+    for server in RING.candidates(username):
+        placement = PLACEMENTS[server]
+        try:
+            with _session(server) as vcenter:
+                _check_targets(vcenter, username, network)
+                if placement.stale:
+                    refresh_placement(vcenter, server)
+            datastore, host = placement.choose()
+        except ValueError as doh:
+            log.warning('Unable to place a VM for %s on %s: %s', username, server, doh)
+            missing = missing or doh
+        except RuntimeError as doh:
+            log.warning('Unable to place a VM on %s: %s', server, doh)
+            error = error or doh
+        else:
+            return server, datastore, host
+    if error:
+        # Being out of capacity is the more useful thing to report
+        raise error
+    raise ValueError('No vCenter has both a folder for {} and a network named {}: {}'.format(username, network, missing))
+
+
+def _check_targets(vcenter, username, network):
+    """Make sure a vCenter has the user's folder and network, via the MoRef cache.
+
+    :Returns: None
+
+    :Raises: ValueError
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The name of the user's folder
+    :type username: String
+
+    :param network: The name of the network
+    :type network: String
+    """
+    MOREF_CACHE.get(vcenter, vim.Folder, username, lambda: vcenter.get_by_name(name=username, vimtype=vim.Folder))
+    _get_network(vcenter, network)
+
+
+def _session(server):
+    """Check out a pooled session to a vCenter server, for use in a ``with`` statement.
+
+    :Returns: contextmanager
+
+    :param server: The vCenter server to connect to
+    :type server: String
+    """
+    with POOLS_LOCK:
+        pool = POOLS.get(server)
+        if pool is None:
+            factory = lambda: _throttle(server).install(vCenter(host=server, user=const.INF_VCENTER_USER,
+                                                                password=const.INF_VCENTER_PASSWORD))
+            pool = SessionPool(factory=factory,
+                               size=const.VLAB_AVAMAR_SESSION_POOL,
+                               max_idle=const.VLAB_AVAMAR_SESSION_IDLE)
+            POOLS[server] = pool
+    return pool.session()
+
+
+def _throttle(server):
+    """Obtain the rate limiter and circuit breaker of a vCenter server.
+
+    :Returns: vlab_avamar_api.lib.worker.throttle.Throttle
+
+    :param server: The vCenter server
+    :type server: String
+    """
+    with POOLS_LOCK:
+        throttle = THROTTLES.get(server)
+        if throttle is None:
+            throttle = Throttle(name=server,
+                                state=THROTTLE_STATE,
+                                rate=const.VLAB_AVAMAR_CALL_RATE,
+                                burst=const.VLAB_AVAMAR_CALL_BURST,
+                                heavy_rate=const.VLAB_AVAMAR_HEAVY_RATE,
+                                heavy_burst=const.VLAB_AVAMAR_HEAVY_BURST,
+                                failures=const.VLAB_AVAMAR_BREAKER_FAILURES,
+                                reset=const.VLAB_AVAMAR_BREAKER_RESET,
+                                max_wait=const.VLAB_AVAMAR_THROTTLE_WAIT)
+            THROTTLES[server] = throttle
+    return throttle
+
+
+def _fan_out(func, servers=None):
+    """Call ``func(server, vcenter)`` for every vCenter server concurrently.
+
+    :Returns: Dictionary mapping each server to what ``func`` returned
+
+    :param func: The work to perform against each vCenter
+    :type func: Function
+
+    :param servers: Only call ``func`` for these vCenter servers. Default is all of them.
+    :type servers: List
+    """
+    def run(server):
+        with _session(server) as vcenter:
+            return func(server, vcenter)
+
+    servers = RING.servers if servers is None else servers
+    if not servers:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        return dict(zip(servers, executor.map(run, servers)))
+
+
+def _on_owning_shard(username, func):
+    """Call ``func(server, vcenter)`` against the user's vCenter servers, in hash
+    ring order, until one does not raise ValueError. A user's VMs can live off
+    their home vCenter if it was out of capacity when the VM was created, or the
+    ring has changed since.
+
+    :Returns: Whatever ``func`` returns
+
+    :Raises: ValueError
+
+    :param username: The user who owns the VMs
+    :type username: String
+
+    :param func: The work to perform against the vCenter that has the user's VMs
+    :type func: Function
+    """
+    error = None
+    for server in RING.candidates(username):
+        try:
+            with _session(server) as vcenter:
+                return func(server, vcenter)
+        except ValueError as doh:
+            error = error or doh
+    raise error
+
+
+def _upload_image(vcenter, placement, image_name, network, username, machine_name, datastore, host, logger, power_on=True):
+    """Create a VM by uploading an image from ``VLAB_AVAMAR_IMAGES_DIR``.
+
+    :Returns: vim.VirtualMachine
+
+    :Raises: ValueError, RuntimeError
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param placement: Tracks the deploys to, and upload speed of, each datastore and host
+    :type placement: vlab_avamar_api.lib.worker.placement.Placement
+
+    :param image_name: The file name of the image
+    :type image_name: String
+
+    :param network: The name of the network to connect the new VM to
+    :type network: String
+
+    :param username: The name of the folder to put the new VM in
+    :type username: String
+
+    :param machine_name: The unique name to give the new VM
+    :type machine_name: String
+
+    :param datastore: The name of the datastore to deploy to
+    :type datastore: String
+
+    :param host: The name of the ESXi host to deploy to
+    :type host: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param power_on: Set to False to leave the new VM powered off
+    :type power_on: Boolean
+    """
+    ova_path = os.path.join(const.VLAB_AVAMAR_IMAGES_DIR, image_name)
+    if compressed.compression(ova_path):
+        ova = compressed.CompressedOva(ova_path)
+    else:
+        ova = Ova(ova_path)
+    try:
+        network_map = vim.OvfManager.NetworkMapping()
+        network_map.name = ova.networks[0]
+        network_map.network = _get_network(vcenter, network)
+        placement.started(datastore, host)
+        seconds_per_gb = None
+        try:
+            uploading = time.time()
+            the_vm = _deploy_ova(vcenter=vcenter,
+                                 ova=ova,
+                                 ova_path=ova_path,
+                                 network_map=[network_map],
+                                 username=username,
+                                 machine_name=machine_name,
+                                 datastore=datastore,
+                                 host=host,
+                                 logger=logger,
+                                 power_on=power_on)
+            seconds_per_gb = _seconds_per_gb(ova_path, time.time() - uploading)
+        except vmodl.fault.ManagedObjectNotFound:
+            # Something was deleted/recreated since we cached it
+            MOREF_CACHE.invalidate(vim.Network, network)
+            MOREF_CACHE.invalidate(vim.Datastore, datastore)
+            MOREF_CACHE.invalidate(vim.HostSystem, host)
+            raise
+        finally:
+            placement.finished(datastore, host, seconds_per_gb)
+    finally:
+        ova.close()
+    return the_vm
+
+
+def _deploy_ova(vcenter, ova, ova_path, network_map, username, machine_name, datastore, host, logger, power_on=True):
+    """Upload an OVA to create a new VM. Unlike ``virtual_machine.deploy_from_ova``
+    the caller picks the datastore and host, the objects are looked up via the
+    MoRef cache instead of walking vCenter, and the disks are uploaded concurrently.
+
+    :Returns: vim.VirtualMachine
+
+    :Raises: ValueError, RuntimeError
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova: The OVA to deploy
+    :type ova: vlab_inf_common.vmware.ova.Ova
+
+    :param ova_path: The file path to the OVA
+    :type ova_path: String
+
+    :param network_map: The mapping of networks defined in the OVA to what's in vCenter
+    :type network_map: List of vim.OvfManager.NetworkMapping
+
+    :param username: The name of the user deploying a new VM
+    :type username: String
+
+    :param machine_name: The unique name to give the new VM
+    :type machine_name: String
+
+    :param datastore: The name of the datastore to deploy to
+    :type datastore: String
+
+    :param host: The name of the ESXi host to deploy to
+    :type host: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param power_on: Set to False to leave the new VM powered off
+    :type power_on: Boolean
+    """
+    folder, resource_pool, the_datastore, the_host = _deploy_targets(vcenter, username, machine_name, datastore, host)
+    spec_params = vim.OvfManager.CreateImportSpecParams(entityName=machine_name,
+                                                        diskProvisioning='thin',
+                                                        networkMapping=network_map,
+                                                        hostSystem=the_host)
+    spec = vcenter.ovf_manager.CreateImportSpec(ovfDescriptor=ova.ovf,
+                                                resourcePool=resource_pool,
+                                                datastore=the_datastore,
+                                                cisp=spec_params)
+    if spec.error:
+        raise RuntimeError('Unable to deploy OVA: {}'.format(spec.error[0].msg))
+    lease = resource_pool.ImportVApp(spec.importSpec, folder=folder, host=the_host)
+    _block_on_lease(lease, const.VLAB_AVAMAR_LEASE_TIMEOUT)
+    # The lease is gone once the upload completes, so grab the VM first
+    the_vm = lease.info.entity
+    logger.debug('Uploading OVA')
+    upload.upload_disks(ova_path, spec, lease, host, logger,
+                        parallel=const.VLAB_AVAMAR_UPLOAD_PARALLEL,
+                        progress_interval=const.VLAB_AVAMAR_LEASE_PROGRESS)
+    logger.debug('OVA deployed successfully')
+    if power_on:
+        virtual_machine.power(the_vm, state='on')
+    return the_vm
+
+
+def _deploy_targets(vcenter, username, machine_name, datastore, host):
+    """Look up where a new VM goes, via the MoRef cache.
+
+    :Returns: Tuple - (vim.Folder, vim.ResourcePool, vim.Datastore, vim.HostSystem)
+
+    :Raises: ValueError
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The name of the folder to put the new VM in
+    :type username: String
+
+    :param machine_name: The unique name to give the new VM
+    :type machine_name: String
+
+    :param datastore: The name of the datastore to deploy to
+    :type datastore: String
+
+    :param host: The name of the ESXi host to deploy to
+    :type host: String
+    """
+    if not re.match(HOSTNAME_REGEX, machine_name):
+        error = 'Invalid machine name. Names can only contain characters a-z, A-Z, 0-9, periods (".") and dashes ("-"). Supplied: {}'.format(machine_name)
+        raise ValueError(error)
+    folder = MOREF_CACHE.get(vcenter, vim.Folder, username,
+                             lambda: vcenter.get_by_name(name=username, vimtype=vim.Folder))
+    resource_pool = MOREF_CACHE.get(vcenter, vim.ResourcePool, const.INF_VCENTER_RESORUCE_POOL,
+                                    lambda: vcenter.resource_pools[const.INF_VCENTER_RESORUCE_POOL])
+    the_datastore = MOREF_CACHE.get(vcenter, vim.Datastore, datastore,
+                                    lambda: vcenter.get_by_name(name=datastore, vimtype=vim.Datastore))
+    the_host = MOREF_CACHE.get(vcenter, vim.HostSystem, host,
+                               lambda: vcenter.host_systems[host])
+    return folder, resource_pool, the_datastore, the_host
+
+
+def _clone_template(vcenter, template, network, username, machine_name, datastore, host):
+    """Create a VM by cloning a library template. The template is already on
+    the datastore, so nothing is uploaded.
+
+    :Returns: vim.VirtualMachine
+
+    :Raises: ValueError, RuntimeError
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param template: The template VM of the image
+    :type template: vim.VirtualMachine
+
+    :param network: The name of the network to connect the new VM to
+    :type network: String
+
+    :param username: The name of the user deploying a new VM
+    :type username: String
+
+    :param machine_name: The unique name to give the new VM
+    :type machine_name: String
+
+    :param datastore: The name of the datastore to deploy to
+    :type datastore: String
+
+    :param host: The name of the ESXi host to deploy to
+    :type host: String
+    """
+    folder, resource_pool, the_datastore, the_host = _deploy_targets(vcenter, username, machine_name, datastore, host)
+    the_network = _get_network(vcenter, network)
+    changes = []
+    for device in template.config.hardware.device:
+        if isinstance(device, vim.vm.device.VirtualEthernetCard):
+            device.backing = _nic_backing(the_network, network)
+            device.connectable = vim.vm.device.VirtualDevice.ConnectInfo(startConnected=True,
+                                                                         allowGuestControl=True,
+                                                                         connected=True)
+            changes.append(vim.vm.device.VirtualDeviceSpec(operation=vim.vm.device.VirtualDeviceSpec.Operation.edit,
+                                                           device=device))
+            break
+    location = vim.vm.RelocateSpec(datastore=the_datastore, host=the_host, pool=resource_pool)
+    spec = vim.vm.CloneSpec(location=location, config=vim.vm.ConfigSpec(deviceChange=changes),
+                            powerOn=True, template=False)
+    # A full clone of a big image can outlast the default timeout of consume_task
+    return consume_task(template.CloneVM_Task(folder=folder, name=machine_name, spec=spec),
+                        timeout=const.VLAB_AVAMAR_DEPLOY_LEASE)
+
+
+def _nic_backing(the_network, name):
+    """Connect a NIC to a standard or distributed portgroup"""
+    if isinstance(the_network, vim.dvs.DistributedVirtualPortgroup):
+        port = vim.dvs.PortConnection(portgroupKey=the_network.key,
+                                      switchUuid=the_network.config.distributedVirtualSwitch.uuid)
+        return vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo(port=port)
+    return vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(network=the_network, deviceName=name)
+
+
+def _find_template(vcenter, server, image_name, datastore):
+    """Obtain the library template of an image on a datastore, if it's current.
+
+    :Returns: vim.VirtualMachine or None
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param server: The vCenter server (shard) the connection is for
+    :type server: String
+
+    :param image_name: The file name of the image
+    :type image_name: String
+
+    :param datastore: The datastore the new VM goes on
+    :type datastore: String
+    """
+    if not const.VLAB_AVAMAR_LIBRARY:
+        return None
+    if not LIBRARY.current(server, image_name, datastore, images.IMAGE_INDEX.sha256(image_name)):
+        return None
+    name = _template_name(image_name, datastore)
+    search_index = vcenter.content.searchIndex
+    return MOREF_CACHE.call(vcenter, vim.Folder, const.VLAB_AVAMAR_LIBRARY_FOLDER,
+                            lambda: _load_library_folder(vcenter),
+                            lambda folder: search_index.FindChild(entity=folder, name=name))
+
+
+def _library_folder(vcenter):
+    """Obtain the folder the library templates are stored in.
+
+    :Returns: vim.Folder
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    return MOREF_CACHE.get(vcenter, vim.Folder, const.VLAB_AVAMAR_LIBRARY_FOLDER,
+                           lambda: _load_library_folder(vcenter))
+
+
+def _load_library_folder(vcenter):
+    """Look up the library folder, creating it if it does not exist yet"""
+    top_dir = vcenter.get_vm_folder(const.INF_VCENTER_TOP_LVL_DIR)
+    folder = vcenter.content.searchIndex.FindChild(entity=top_dir, name=const.VLAB_AVAMAR_LIBRARY_FOLDER)
+    if folder is None:
+        folder = top_dir.CreateFolder(const.VLAB_AVAMAR_LIBRARY_FOLDER)
+    return folder
+
+
+def _template_name(image_name, datastore):
+    """The name of the library template of an image, on a datastore.
+
+    :Returns: String
+
+    :param image_name: The file name of the image
+    :type image_name: String
+
+    :param datastore: The name of the datastore
+    :type datastore: String
+    """
+    name = '{}-{}'.format(image_name.split('.ova')[0], datastore)
+    return re.sub(r'[^A-Za-z0-9.\-]', '-', name)[:80]
+
+
+def _publish(vcenter, server, image_name, sha256, datastore, logger):
+    """Upload an image to a datastore, and turn it into a library template.
+
+    :Returns: vim.VirtualMachine
+
+    :Raises: RuntimeError
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param server: The vCenter server (shard) the connection is for
+    :type server: String
+
+    :param image_name: The file name of the image
+    :type image_name: String
+
+    :param sha256: The SHA-256 of the image
+    :type sha256: String
+
+    :param datastore: The datastore to publish the image to
+    :type datastore: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    placement = PLACEMENTS[server]
+    if placement.stale:
+        refresh_placement(vcenter, server)
+    # Any usable host will do; the template is never powered on
+    host = placement.choose()[1]
+    name = _template_name(image_name, datastore)
+    the_vm = _upload_image(vcenter=vcenter,
+                           placement=placement,
+                           image_name=image_name,
+                           network=const.VLAB_AVAMAR_LIBRARY_NETWORK,
+                           username=const.VLAB_AVAMAR_LIBRARY_FOLDER,
+                           machine_name=name,
+                           datastore=datastore,
+                           host=host,
+                           logger=logger,
+                           power_on=False)
+    meta_data = {'component' : 'library',
+                 'created' : time.time(),
+                 'version' : image_name,
+                 'configured' : False,
+                 'generation' : 1,
+                 'sha256' : sha256,
+                 'datastore' : datastore}
+    virtual_machine.set_meta(the_vm, meta_data)
+    the_vm.MarkAsTemplate()
+    MOREF_CACHE.put(vcenter, vim.VirtualMachine, name, the_vm)
+    return the_vm
+
+
+def _block_on_lease(lease, timeout):
+    """Wait for an import lease to become ready.
+
+    :Returns: None
+
+    :Raises: RuntimeError
+
+    :param lease: The lease returned by ImportVApp
+    :type lease: vim.HttpNfcLease
+
+    :param timeout: How many seconds to wait before aborting the lease
+    :type timeout: Integer
+    """
+    deadline = time.time() + timeout
+    while lease.state == vim.HttpNfcLease.State.initializing:
+        if time.time() > deadline:
+            # Otherwise vCenter keeps the half made VM around until the lease expires
+            lease.Abort(vmodl.fault.SystemError(reason='Lease not ready after {} seconds'.format(timeout)))
+            raise RuntimeError('Unable to deploy OVA: lease not ready after {} seconds'.format(timeout))
+        time.sleep(1)
+    if lease.state == vim.HttpNfcLease.State.error:
+        raise RuntimeError('Unable to deploy OVA: {}'.format(lease.error.msg))
+
+
+def _seconds_per_gb(ova_path, seconds):
+    """How fast an upload was; None if the size of the OVA is unknown"""
+    try:
+        size_gb = os.path.getsize(ova_path) / 1024**3
+    except OSError:
+        return None
+    if not size_gb:
+        return None
+    return seconds / size_gb
+
+
+def _get_folder_vms(vcenter, username):
+    """Obtain all the VMs within a user's folder
+
+    :Returns: List
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The name of the user who owns the folder
+    :type username: String
+    """
+    loader = lambda: vcenter.get_by_name(name=username, vimtype=vim.Folder)
+    return MOREF_CACHE.call(vcenter, vim.Folder, username, loader, lambda x: list(x.childEntity))
+
+
+def _get_network(vcenter, network):
+    """Obtain a network by name. A cache miss caches every network, because
+    vCenter has to be walked to find just one anyways.
+
+    :Returns: vim.Network
+
+    :Raises: ValueError
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param network: The name of the network
+    :type network: String
+    """
+    def loader():
+        networks = _list_networks(vcenter)
+        for name, the_network in networks.items():
+            MOREF_CACHE.put(vcenter, vim.Network, name, the_network)
+        try:
+            return networks[network]
+        except KeyError:
+            raise ValueError('No such network named {}'.format(network))
+    return MOREF_CACHE.get(vcenter, vim.Network, network, loader)
+
+
+def _list_networks(vcenter):
+    """Map the name of every network in vCenter to the network. Unlike
+    ``vCenter.networks`` the result is not kept on the session, so a pooled
+    session still sees the networks created after it first looked.
+
+    :Returns: Dictionary
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    found = _retrieve_properties(vcenter, vcenter.content.rootFolder, {vim.Network: ['name']})
+    return {props['name']: the_network for the_network, props in found}
+
+
+def _find_expired(found, now, idle_seconds):
+    """Decide which VMs the reaper should destroy, and which owners to warn.
+
+    :Returns: Tuple (Dictionary, List)
+
+    :param found: The output from ``_retrieve_properties``
+    :type found: List
+
+    :param now: The current EPOC timestamp
+    :type now: Float
+
+    :param idle_seconds: How long each idle VM has been idle, by MoRef ID
+    :type idle_seconds: Dictionary
+    """
+    ttl = const.VLAB_AVAMAR_TTL_HOURS * 3600
+    idle = const.VLAB_AVAMAR_IDLE_HOURS * 3600
+    warn = const.VLAB_AVAMAR_REAPER_WARN_HOURS * 3600
+    folders = {x._moId : y['name'] for x, y in found if isinstance(x, vim.Folder)}
+    report = {'expired': {}, 'warned': {}}
+    doomed = []
+    for the_vm, props in found:
+        if not isinstance(the_vm, vim.VirtualMachine):
+            continue
+        meta = _parse_meta(props.get('config.annotation'))
+        if meta.get('component') not in ('Avamar', 'AvamarNDMP') or not meta.get('created'):
+            continue
+        expires = []
+        if ttl:
+            expires.append(meta['created'] + ttl)
+        if idle and the_vm._moId in idle_seconds:
+            # Assuming it stays idle
+            expires.append(now + idle - idle_seconds[the_vm._moId])
+        if not expires:
+            continue
+        parent = props.get('parent')
+        owner = folders.get(parent._moId, 'Unknown') if parent else 'Unknown'
+        if min(expires) < now:
+            report['expired'].setdefault(owner, []).append(props['name'])
+            doomed.append(the_vm)
+        elif min(expires) < now + warn:
+            report['warned'].setdefault(owner, {})[props['name']] = min(expires)
+    return report, doomed
+
+
+def _idle_samples(found):
+    """Decide which Avamar VMs look idle right now, for the reaper. A VM that's
+    not powered on counts as idle.
+
+    :Returns: Dictionary - Whether each VM is idle, by MoRef ID
+
+    :param found: The output from ``_retrieve_properties``
+    :type found: List
+    """
+    samples = {}
+    for the_vm, props in found:
+        if not isinstance(the_vm, vim.VirtualMachine):
+            continue
+        if _parse_meta(props.get('config.annotation')).get('component') not in ('Avamar', 'AvamarNDMP'):
+            continue
+        powered_on = props.get('runtime.powerState') == vim.VirtualMachinePowerState.poweredOn
+        cpu = props.get('summary.quickStats.overallCpuUsage', 0)
+        samples[the_vm._moId] = (not powered_on) or cpu <= const.VLAB_AVAMAR_IDLE_CPU_MHZ
+    return samples
+
+
+def _find_avamars(vcenter, username, names, kind):
+    """Lookup VMs by name via the vCenter SearchIndex, instead of walking every
+    VM in the user's folder.
+
+    :Returns: List
+
+    :Raises: ValueError
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The user who owns the VMs
+    :type username: String
+
+    :param names: The names of the VMs to find
+    :type names: List
+
+    :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
+    :type kind: String
+    """
+    vms = _locate_avamars(vcenter, username, names, kind)
+    for name in set(names):
+        if name not in vms:
+            raise ValueError('No {} named {} found'.format(kind, name))
+    return list(vms.values())
+
+
+def _locate_avamars(vcenter, username, names, kind):
+    """Like ``_find_avamars``, but the VMs not found on this vCenter are left out
+    instead of raising.
+
+    :Returns: Dictionary - Maps the name of each VM found to the VM
+
+    :Raises: ValueError - If the user has no folder on this vCenter
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The user who owns the VMs
+    :type username: String
+
+    :param names: The names of the VMs to find
+    :type names: List
+
+    :param kind: The type of Avamar machine (i.e. a normal server or an ndmp accelerator).
+    :type kind: String
+    """
+    search_index = vcenter.content.searchIndex
+    loader = lambda: vcenter.get_by_name(name=username, vimtype=vim.Folder)
+    vms = {}
+    for name in set(names):
+        the_vm = MOREF_CACHE.call(vcenter, vim.Folder, username, loader,
+                                  lambda folder: search_index.FindChild(entity=folder, name=name))
+        if the_vm is not None:
+            vms[name] = the_vm
+    if not vms:
+        return {}
+    annotations = _object_properties(vcenter, list(vms.values()), vim.VirtualMachine, ['config.annotation'])
+    located = {}
+    for name, the_vm in vms.items():
+        annotation = annotations.get(the_vm, {}).get('config.annotation')
+        if _parse_meta(annotation).get('component') == kind:
+            located[name] = the_vm
+    return located
+
+
+def _destroy_vms(vms, logger):
+    """Power off and destroy VMs concurrently, bounded by VLAB_AVAMAR_DELETE_PARALLEL.
+
+    :Returns: None
+
+    :param vms: The virtual machines to destroy
+    :type vms: List
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    def destroy(the_vm):
+        logger.debug('powering off VM %s', the_vm._moId)
+        virtual_machine.power(the_vm, state='off')
+        delete_task = the_vm.Destroy_Task()
+        logger.debug('blocking while VM %s is being destroyed', the_vm._moId)
+        consume_task(delete_task)
+
+    with ThreadPoolExecutor(max_workers=const.VLAB_AVAMAR_DELETE_PARALLEL) as executor:
+        # list() so any exception gets raised to the caller
+        list(executor.map(destroy, vms))
+
+
+def _suspend_vms(vms, logger):
+    """Suspend VMs concurrently, bounded by VLAB_AVAMAR_DELETE_PARALLEL.
+
+    :Returns: None
+
+    :param vms: The virtual machines to suspend
+    :type vms: List
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    def suspend(the_vm):
+        logger.debug('suspending VM %s', the_vm._moId)
+        consume_task(the_vm.SuspendVM_Task())
+
+    with ThreadPoolExecutor(max_workers=const.VLAB_AVAMAR_DELETE_PARALLEL) as executor:
+        # list() so any exception gets raised to the caller
+        list(executor.map(suspend, vms))
+
+
+def _net_usage(vcenter, vms):
+    """Obtain the peak network usage of VMs since the idle policy last ran, in
+    one PerformanceManager call. Network usage is not a property of a VM, so
+    the PropertyCollector cannot supply it.
+
+    :Returns: Dictionary - KBps by MoRef ID; VMs without stats are left out
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param vms: The virtual machines to obtain stats of
+    :type vms: List
+    """
+    if not vms:
+        return {}
+    perf_manager = vcenter.content.perfManager
+    counter = None
+    for info in perf_manager.perfCounter:
+        if (info.groupInfo.key, info.nameInfo.key, info.rollupType) == ('net', 'usage', 'average'):
+            counter = info.key
+            break
+    if counter is None:
+        return {}
+    # Real-time stats are sampled every 20 seconds, and kept for an hour
+    samples = max(1, min(const.VLAB_AVAMAR_SUSPEND_INTERVAL // 20, 180))
+    metric = vim.PerformanceManager.MetricId(counterId=counter, instance='')
+    specs = [vim.PerformanceManager.QuerySpec(entity=x, metricId=[metric], intervalId=20, maxSample=samples)
+             for x in vms]
+    usage = {}
+    for found in perf_manager.QueryPerf(querySpec=specs) or []:
+        values = [y for x in found.value for y in x.value]
+        if values:
+            usage[found.entity._moId] = max(values)
+    return usage
+
+
+def _object_properties(vcenter, objects, vimtype, paths):
+    """Obtain specific properties of a known set of objects in a single
+    PropertyCollector call.
+
+    :Returns: Dictionary
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param objects: The objects to obtain properties of
+    :type objects: List
+
+    :param vimtype: The category of the objects, like vim.VirtualMachine
+    :type vimtype: pyVmomi.VmomiSupport.LazyType
+
+    :param paths: The property paths to collect
+    :type paths: List
+    """
+    if not objects:
+        return {}
+    obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=x) for x in objects]
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vimtype, pathSet=paths)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=obj_specs, propSet=[prop_spec])
+    found = vcenter.content.propertyCollector.RetrieveContents([filter_spec])
+    return {x.obj: {y.name: y.val for y in x.propSet} for x in found}
+
+
+def _take_reset_snapshot(the_vm, timings):
+    """Snapshot a new VM, including memory, so ``reset_avamar`` can revert to it
+    without having to boot the VM. The timings of the create are recorded in the
+    description of the snapshot.
+
+    This is not free: the memory is written to the datastore as a file as large
+    as the VM's RAM, and every block the guest writes afterwards goes to a delta
+    disk that grows until the VM is deleted or reset.
+
+    :Returns: None
+
+    :param the_vm: The newly created virtual machine
+    :type the_vm: vim.VirtualMachine
+
+    :param timings: How long it took to create and boot the VM
+    :type timings: Dictionary
+    """
+    task = the_vm.CreateSnapshot_Task(name=RESET_SNAPSHOT,
+                                      description=ujson.dumps(timings),
+                                      memory=True,
+                                      quiesce=False)
     consume_task(task)
 
 
+def _find_snapshot(snapshots, name):
+    """Recursively search a snapshot tree for a snapshot by name
+
+    :Returns: vim.vm.SnapshotTree or None
+
+    :param snapshots: The snapshot tree to search
+    :type snapshots: List
+
+    :param name: The name of the snapshot
+    :type name: String
+    """
+    for snapshot in snapshots:
+        if snapshot.name == name:
+            return snapshot
+        found = _find_snapshot(snapshot.childSnapshotList, name)
+        if found:
+            return found
+    return None
+
+
+def _parse_meta(annotation):
+    """Convert the notes on a VM into the vLab meta data.
+
+    :Returns: Dictionary
+
+    :param annotation: The value of ``config.annotation`` for a VM
+    :type annotation: String
+    """
+    try:
+        return ujson.loads(annotation)
+    except (ValueError, TypeError):
+        # ValueError -> VM created, but notes not updated
+        # TypeError  -> VM failed to be created; notes are None
+        return {}
+
+
+def _retrieve_properties(vcenter, container, properties):
+    """Obtain specific properties of every object under a container in a single
+    PropertyCollector call (plus paging), instead of one round trip per property.
+
+    :Returns: List of (ManagedObject, Dictionary) tuples
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param container: The folder to search recursively under
+    :type container: vim.Folder
+
+    :param properties: A mapping of vimtype to the property paths to collect
+    :type properties: Dictionary
+    """
+    content = vcenter.content
+    view = content.viewManager.CreateContainerView(container=container,
+                                                   type=list(properties.keys()),
+                                                   recursive=True)
+    try:
+        traversal = vmodl.query.PropertyCollector.TraversalSpec(name='traverseView',
+                                                                path='view',
+                                                                skip=False,
+                                                                type=vim.view.ContainerView)
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
+        prop_specs = [vmodl.query.PropertyCollector.PropertySpec(type=x, pathSet=y) for x, y in properties.items()]
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=prop_specs)
+        collector = content.propertyCollector
+        result = collector.RetrievePropertiesEx([filter_spec], vmodl.query.PropertyCollector.RetrieveOptions())
+        found = []
+        while result:
+            for obj in result.objects:
+                found.append((obj.obj, {x.name: x.val for x in obj.propSet}))
+            if not result.token:
+                break
+            result = collector.ContinueRetrievePropertiesEx(result.token)
+    finally:
+        view.DestroyView()
+    return found
+
+
+def _configure_network(vcenter, the_vm, ip_config, block=True):
+    """Customize the network and hostname of a powered off VM.
+
+    :Returns: vim.Task
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The virtual machine to customize
+    :type the_vm: vim.VirtualMachine
+
+    :param ip_config: The IPv4 network configuration for the VM
+    :type ip_config: Dictionary
+
+    :param block: Set to False to return without waiting on the customization task
+    :type block: Boolean
+    """
+    spec = copy.deepcopy(_base_spec(vcenter, ip_config['domain']))
+    adapter = spec.nicSettingMap[0].adapter
+    adapter.ip.ipAddress = ip_config['static-ip']
+    adapter.subnetMask = ip_config['netmask']
+    adapter.gateway = ip_config['default-gateway']
+    spec.globalIPSettings.dnsServerList = ip_config['dns']
+    spec.identity.hostName.name = the_vm.name
+    task = the_vm.Customize(spec=spec)
+    if block:
+        consume_task(task)
+    return task
+
+
+def _base_spec(vcenter, domain):
+    """Obtain the guest customization spec that every VM in a domain starts from.
+    The spec is stored in the CustomizationSpecManager of vCenter the first time
+    it's needed, so every worker (and admins) can find it, and it's cached by the
+    worker after that.
+
+    :Returns: vim.vm.customization.Specification - Do not modify; it's shared
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param domain: The DNS domain of the VMs
+    :type domain: String
+    """
+    key = (vcenter._conn._stub.host, domain)
+    with SPECS_LOCK:
+        spec = SPECS.get(key)
+    if spec is not None:
+        return spec
+    name = 'vlab-avamar-{}'.format(domain)[:80]
+    manager = vcenter.content.customizationSpecManager
+    if manager.DoesCustomizationSpecExist(name=name):
+        spec = manager.GetCustomizationSpec(name=name).spec
+    else:
+        adapter = vim.vm.customization.IPSettings(ip=vim.vm.customization.FixedIp(), dnsDomain=domain)
+        hostname = vim.vm.customization.FixedName()
+        spec = vim.vm.customization.Specification(nicSettingMap=[vim.vm.customization.AdapterMapping(adapter=adapter)],
+                                                  globalIPSettings=vim.vm.customization.GlobalIPSettings(),
+                                                  identity=vim.vm.customization.LinuxPrep(domain=domain, hostName=hostname))
+        info = vim.CustomizationSpecInfo(name=name, type='Linux',
+                                         description='The base spec of vLab Avamar VMs; the IP and hostname are set per VM')
+        try:
+            manager.CreateCustomizationSpec(item=vim.CustomizationSpecItem(info=info, spec=spec))
+        except vim.fault.AlreadyExists:
+            # Another worker beat us to it
+            pass
+    with SPECS_LOCK:
+        SPECS[key] = spec
+    return spec
+
+
+def _add_vmdk(the_vm, customizing, disk_size):
+    """Add a disk to a VM while its guest customization runs. If vCenter will
+    not reconfigure the VM until the customization is done, wait and try again.
+
+    :Returns: None
+
+    :Raises: RuntimeError
+
+    :param the_vm: The virtual machine to add a disk to
+    :type the_vm: vim.VirtualMachine
+
+    :param customizing: The customization task of the VM
+    :type customizing: vim.Task
+
+    :param disk_size: The number of GB to make the disk
+    :type disk_size: Integer
+    """
+    disks = _disk_count(the_vm)
+    try:
+        virtual_machine.add_vmdk(the_vm, disk_size=disk_size)
+    except (vim.fault.TaskInProgress, vim.fault.InvalidState) as doh:
+        reason = doh
+    except RuntimeError:
+        # Also raised when waiting on the reconfigure times out. That reconfigure
+        # can still finish, so only a failed one is safe to try again.
+        reason = _reconfigure_fault(the_vm)
+        if not isinstance(reason, (vim.fault.TaskInProgress, vim.fault.InvalidState)):
+            raise
+    else:
+        return
+    log.info('Adding a disk to %s after its customization finishes: %s', the_vm.name, reason)
+    consume_task(customizing)
+    if _disk_count(the_vm) > disks:
+        log.info('Disk was added to %s after all', the_vm.name)
+        return
+    virtual_machine.add_vmdk(the_vm, disk_size=disk_size)
+
+
+def _disk_count(the_vm):
+    """How many virtual disks a VM has"""
+    return len([x for x in the_vm.config.hardware.device if isinstance(x, vim.vm.device.VirtualDisk)])
+
+
+def _reconfigure_fault(the_vm):
+    """Why the latest reconfigure of a VM failed.
+
+    ``consume_task`` only raises the message of a failed task, so the fault is
+    looked up from the VM's recent tasks.
+
+    :Returns: vmodl.MethodFault, or None if the latest reconfigure did not fail
+
+    :param the_vm: The virtual machine that was reconfigured
+    :type the_vm: vim.VirtualMachine
+    """
+    reconfigures = [x for x in the_vm.recentTask if x.info.descriptionId == 'VirtualMachine.reconfigure']
+    if not reconfigures:
+        return None
+    latest = max(reconfigures, key=lambda x: x.info.queueTime)
+    if latest.info.state != vim.TaskInfo.State.error:
+        return None
+    return latest.info.error
+
+
+def _wait_for_ip(vcenter, the_vm, static_ip, timeout):
+    """Block until the guest reports an IP. Instead of polling, vCenter is asked
+    to send the ``guest.net`` and ``guest.ipAddress`` properties whenever they
+    change, via ``WaitForUpdatesEx`` on a PropertyCollector of our own.
+
+    :Returns: List - The IPs the guest reported
+
+    :Raises: RuntimeError
+
+    :param vcenter: An established connection to vCenter
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The virtual machine to wait on
+    :type the_vm: vim.VirtualMachine
+
+    :param static_ip: Wait for this IP, i.e. not a DHCP address from before the
+                      network was customized. None means any IP.
+    :type static_ip: String
+
+    :param timeout: How many seconds to wait on the IP
+    :type timeout: Integer
+    """
+    started = time.time()
+    collector = vcenter.content.propertyCollector.CreatePropertyCollector()
+    try:
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=the_vm, skip=False)
+        prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine,
+                                                               pathSet=['guest.net', 'guest.ipAddress'])
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+        collector.CreateFilter(filter_spec, partialUpdates=False)
+        reported = {}
+        version = ''
+        while True:
+            remaining = timeout - (time.time() - started)
+            if remaining <= 0:
+                raise RuntimeError('Unable to obtain an IP within {} seconds'.format(timeout))
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=max(1, min(int(remaining), 60)))
+            update = collector.WaitForUpdatesEx(version, options)
+            if update is None:
+                # Nothing changed within maxWaitSeconds
+                continue
+            version = update.version
+            for filter_set in update.filterSet:
+                for obj_set in filter_set.objectSet:
+                    for change in obj_set.changeSet:
+                        reported[change.name] = _reported_ips(change.name, change.val)
+            ips = [x for y in reported.values() for x in y if not x.startswith('fe80::')]
+            if (static_ip in ips) if static_ip else ips:
+                return ips
+    finally:
+        collector.DestroyPropertyCollector()
+
+
+def _reported_ips(name, value):
+    """The IPs within an update of ``guest.net`` or ``guest.ipAddress``"""
+    if not value:
+        return []
+    if name == 'guest.ipAddress':
+        return [value]
+    return [x for nic in value for x in (nic.ipAddress or [])]
+
+
 def _block_on_boot(the_vm):
     ready = the_vm.guest.toolsStatus == vim.vm.GuestInfo.ToolsStatus.toolsOk
     while not ready:
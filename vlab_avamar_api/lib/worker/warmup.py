@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+"""
+Keeps track of which worker processes have warmed up.
+
+Each worker process logs into vCenter and looks up what tasks commonly need
+before it takes any tasks (see ``vmware.warm_up``), and records how long that
+took, and whether it worked, here. The main worker process answers the
+``warm_up_status`` control command from this record, so the API only reports
+ready once there's a worker whose processes have all warmed up without error.
+"""
+import os
+import time
+import socket
+
+from vlab_avamar_api.lib import const
+from vlab_avamar_api.lib.state import SharedState
+
+
+class WarmUps(object):
+    """How long each worker process took to warm up.
+
+    :param state: Where the warm up of every worker process is stored
+    :type state: vlab_avamar_api.lib.state.SharedState
+
+    :param hostname: Identifies this worker, because workers on different hosts
+                     can share the state, and reuse the same PIDs.
+    :type hostname: String
+    """
+    def __init__(self, state, hostname):
+        self._state = state
+        self._hostname = hostname
+
+    def record(self, pid, seconds, errors, status):
+        """Save the warm up of a worker process. Records of processes on this host
+        that no longer exist are removed.
+
+        :Returns: None
+
+        :param pid: The worker process that warmed up
+        :type pid: Integer
+
+        :param seconds: How long the warm up took
+        :type seconds: Float
+
+        :param errors: Whatever could not be preloaded
+        :type errors: List
+
+        :param status: Either "ok", "failed" or "timed out"
+        :type status: String
+        """
+        with self._state.locked() as data:
+            prefix = '{}:'.format(self._hostname)
+            for key in [x for x in data.keys() if x.startswith(prefix)]:
+                if not _running(int(key.split(':')[-1])):
+                    del data[key]
+            data[self._key(pid)] = {'seconds': seconds, 'errors': errors, 'status': status, 'finished': time.time()}
+
+    def report(self, pids):
+        """Summarize the warm up of a worker's processes.
+
+        :Returns: Dictionary
+
+        :param pids: The worker processes to summarize
+        :type pids: List
+        """
+        data = self._state.read()
+        found = [data[self._key(x)] for x in pids if self._key(x) in data]
+        # A process that failed, or timed out, warming up is not warm
+        warm = [x for x in found if x.get('status') == 'ok']
+        statuses = {}
+        for process in found:
+            statuses[process.get('status')] = statuses.get(process.get('status'), 0) + 1
+        return {'ready': bool(pids) and len(warm) == len(pids),
+                'processes': len(pids),
+                'warm': len(warm),
+                'statuses': statuses,
+                'seconds': max([x['seconds'] for x in warm], default=None),
+                'errors': sorted({y for x in found for y in x['errors']})}
+
+    def _key(self, pid):
+        return '{}:{}'.format(self._hostname, pid)
+
+
+def _running(pid):
+    """Whether a process exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It exists, but is owned by a different user
+        return True
+    return True
+
+
+WARM_UPS = WarmUps(state=SharedState(os.path.join(const.VLAB_AVAMAR_STATE_DIR, 'vlab-avamar-warmup.json')),
+                   hostname=socket.gethostname())